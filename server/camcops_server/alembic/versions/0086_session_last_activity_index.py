@@ -0,0 +1,75 @@
+"""
+camcops_server/alembic/versions/0086_session_last_activity_index.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+DATABASE REVISION SCRIPT
+
+session_last_activity_index
+
+Revision ID: 0086
+Revises: 0085
+Creation date: 2026-10-17 09:00:00.000000
+
+"""
+
+# =============================================================================
+# Imports
+# =============================================================================
+
+from alembic import op
+
+
+# =============================================================================
+# Revision identifiers, used by Alembic.
+# =============================================================================
+
+revision = "0086"
+down_revision = "0085"
+branch_labels = None
+depends_on = None
+
+
+# =============================================================================
+# The upgrade/downgrade steps
+# =============================================================================
+
+
+def upgrade():
+    with op.batch_alter_table(
+        "_security_webviewer_sessions", schema=None
+    ) as batch_op:
+        batch_op.create_index(
+            batch_op.f("ix__security_webviewer_sessions_last_activity_utc"),
+            ["last_activity_utc"],
+            unique=False,
+        )
+
+
+def downgrade():
+    with op.batch_alter_table(
+        "_security_webviewer_sessions", schema=None
+    ) as batch_op:
+        batch_op.drop_index(
+            batch_op.f("ix__security_webviewer_sessions_last_activity_utc")
+        )
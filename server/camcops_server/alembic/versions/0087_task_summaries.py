@@ -0,0 +1,150 @@
+"""
+camcops_server/alembic/versions/0087_task_summaries.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+DATABASE REVISION SCRIPT
+
+task_summaries
+
+Revision ID: 0087
+Revises: 0086
+Creation date: 2026-10-17 12:00:00.000000
+
+"""
+
+# =============================================================================
+# Imports
+# =============================================================================
+
+from alembic import op
+import sqlalchemy as sa
+
+from camcops_server.cc_modules.cc_sqla_coltypes import (
+    SemanticVersionColType,
+)
+
+
+# =============================================================================
+# Revision identifiers, used by Alembic.
+# =============================================================================
+
+revision = "0087"
+down_revision = "0086"
+branch_labels = None
+depends_on = None
+
+
+# =============================================================================
+# The upgrade/downgrade steps
+# =============================================================================
+
+
+# noinspection PyPep8,PyTypeChecker
+def upgrade():
+    op.create_table(
+        "_task_summaries",
+        sa.Column(
+            "summary_entry_pk",
+            sa.Integer(),
+            autoincrement=True,
+            nullable=False,
+            comment="Arbitrary primary key of this summary entry",
+        ),
+        sa.Column(
+            "task_table_name",
+            sa.String(length=128),
+            nullable=False,
+            comment="Table name of the task's base table",
+        ),
+        sa.Column(
+            "task_pk",
+            sa.Integer(),
+            nullable=False,
+            comment="Server primary key of the task",
+        ),
+        sa.Column(
+            "summary_name",
+            sa.String(length=128),
+            nullable=False,
+            comment="Name of the summary (as a column name)",
+        ),
+        sa.Column(
+            "value_number",
+            sa.Float(),
+            nullable=True,
+            comment="Value, if numeric or Boolean (for aggregation)",
+        ),
+        sa.Column(
+            "value_json",
+            sa.UnicodeText(),
+            nullable=True,
+            comment="Value, as JSON",
+        ),
+        sa.Column(
+            "language",
+            sa.String(length=6),
+            nullable=True,
+            comment="Language of the value, if text (which may be "
+            "translated); NULL for values that don't depend on language",
+        ),
+        sa.Column(
+            "camcops_version",
+            SemanticVersionColType(length=147),
+            nullable=False,
+            comment="CamCOPS server version that calculated the summary",
+        ),
+        sa.Column(
+            "computed_at_utc",
+            sa.DateTime(),
+            nullable=False,
+            comment="When the summary was calculated",
+        ),
+        sa.PrimaryKeyConstraint(
+            "summary_entry_pk", name=op.f("pk__task_summaries")
+        ),
+        mysql_charset="utf8mb4 COLLATE utf8mb4_unicode_ci",
+        mysql_engine="InnoDB",
+        mysql_row_format="DYNAMIC",
+    )
+    with op.batch_alter_table("_task_summaries", schema=None) as batch_op:
+        batch_op.create_index(
+            batch_op.f("ix__task_summaries_summary_name"),
+            ["summary_name"],
+            unique=False,
+        )
+        batch_op.create_index(
+            batch_op.f("ix__task_summaries_task_pk"),
+            ["task_pk"],
+            unique=False,
+        )
+        batch_op.create_index(
+            batch_op.f("ix__task_summaries_task_table_name"),
+            ["task_table_name"],
+            unique=False,
+        )
+
+
+# noinspection PyPep8,PyTypeChecker
+def downgrade():
+    op.drop_table("_task_summaries")
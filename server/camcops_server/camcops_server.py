@@ -79,6 +79,10 @@ from camcops_server.cc_modules.cc_constants import (
     DEFAULT_FLOWER_ADDRESS,
     DEFAULT_FLOWER_PORT,
 )
+from camcops_server.cc_modules.cc_importtime import (
+    DEFAULT_IMPORTTIME_MODULE,
+    DEFAULT_IMPORTTIME_TOP_N,
+)
 from camcops_server.cc_modules.cc_pythonversion import (
     assert_minimum_python_version,
 )
@@ -273,6 +277,10 @@ def _merge_camcops_db(
     default_group_name: Optional[str],
     groupnum_map: Dict[int, int],
     whichidnum_map: Dict[int, int],
+    bulk: bool,
+    bulk_chunk_size: int,
+    bulk_workers: int,
+    checkpoint_dir: Optional[str],
 ) -> None:
     import camcops_server.camcops_server_core as core  # noqa: F401
 
@@ -294,6 +302,10 @@ def _merge_camcops_db(
         default_group_name=default_group_name,
         groupnum_map=groupnum_map,
         whichidnum_map=whichidnum_map,
+        bulk=bulk,
+        bulk_chunk_size=bulk_chunk_size,
+        bulk_workers=bulk_workers,
+        checkpoint_dir=checkpoint_dir,
     )
 
 
@@ -309,12 +321,38 @@ def _get_all_ddl(dialect_name: str = SqlaDialectName.MYSQL) -> str:
     return get_all_ddl(dialect_name=dialect_name)
 
 
-def _reindex(cfg: CamcopsConfig) -> None:
+def _reindex(
+    cfg: CamcopsConfig,
+    processes: int = 1,
+    batch_size: int = 1000,
+    checkpoint_dir: str = None,
+    resume: bool = False,
+) -> None:
+    import camcops_server.camcops_server_core as core
+
+    # ... delayed import; import side effects
+
+    core.reindex(
+        cfg=cfg,
+        processes=processes,
+        batch_size=batch_size,
+        checkpoint_dir=checkpoint_dir,
+        resume=resume,
+    )
+
+
+def _rebuild_task_summaries(
+    task_types: List[str] = None,
+    stale_only: bool = False,
+    batch_size: int = 500,
+) -> None:
     import camcops_server.camcops_server_core as core
 
     # ... delayed import; import side effects
 
-    core.reindex(cfg=cfg)
+    core.rebuild_task_summaries(
+        task_types=task_types, stale_only=stale_only, batch_size=batch_size
+    )
 
 
 def _check_index(cfg: CamcopsConfig, show_all_bad: bool = False) -> bool:
@@ -512,6 +550,19 @@ def _serve_gunicorn() -> None:
     )
 
 
+# -----------------------------------------------------------------------------
+# Preprocessing
+# -----------------------------------------------------------------------------
+
+
+def _build_data_snapshot() -> None:
+    import camcops_server.camcops_server_core as core
+
+    # ... delayed import; import side effects
+
+    core.build_data_snapshot()
+
+
 # -----------------------------------------------------------------------------
 # Celery etc.
 # -----------------------------------------------------------------------------
@@ -543,6 +594,14 @@ def _launch_celery_flower(
     core.launch_celery_flower(address=address, port=port)
 
 
+def _launch_cache_server() -> None:
+    import camcops_server.camcops_server_core as core
+
+    # ... delayed import; import side effects
+
+    core.launch_cache_server()
+
+
 def _housekeeping() -> None:
     from camcops_server.cc_modules.celery import housekeeping  # delayed import
 
@@ -576,6 +635,16 @@ def _list_tasks() -> None:
     core.print_tasklist()
 
 
+def _dev_import_times(module: str, top_n: int) -> None:
+    # Deliberately doesn't import camcops_server_core; we measure the import
+    # in a new interpreter.
+    from camcops_server.cc_modules.cc_importtime import (  # delayed import
+        print_import_times,
+    )
+
+    print_import_times(module=module, top_n=top_n)
+
+
 # =============================================================================
 # Command-line processor
 # =============================================================================
@@ -1040,6 +1109,32 @@ def camcops_main() -> int:
         help="Map to convert group numbers, in the format "
         "'from_a:to_a,from_b:to_b,...', where all values are integers.",
     )
+    mergedb_parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Faster merge: after merging other tables record by record, "
+        "copy tables of tablet records (tasks, etc.) in bulk, committing "
+        "as it goes",
+    )
+    mergedb_parser.add_argument(
+        "--bulk_chunk_size",
+        type=int,
+        default=1000,
+        help="With --bulk: number of rows per INSERT and COMMIT",
+    )
+    mergedb_parser.add_argument(
+        "--bulk_workers",
+        type=int,
+        default=1,
+        help="With --bulk: number of tables to copy at once",
+    )
+    mergedb_parser.add_argument(
+        "--checkpoint_dir",
+        type=str,
+        default=None,
+        help="With --bulk: directory in which to record progress. If the "
+        "merge is interrupted, run the same command again to resume it.",
+    )
     mergedb_parser.set_defaults(
         func=lambda args: _merge_camcops_db(
             src=args.src,
@@ -1053,6 +1148,10 @@ def camcops_main() -> int:
             default_group_name=args.default_group_name,
             whichidnum_map=args.whichidnum_map,
             groupnum_map=args.groupnum_map,
+            bulk=args.bulk,
+            bulk_chunk_size=args.bulk_chunk_size,
+            bulk_workers=args.bulk_workers,
+            checkpoint_dir=args.checkpoint_dir,
         )
     )
     # WATCH OUT. There appears to be a bug somewhere in the way that the
@@ -1115,8 +1214,71 @@ def camcops_main() -> int:
 
     # Rebuild server indexes
     reindex_parser = add_sub(subparsers, "reindex", help="Recreate task index")
+    reindex_parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of worker processes to share task tables between "
+        "(not for SQLite)",
+    )
+    reindex_parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1000,
+        help="Number of tasks to read, and index entries to write, at once",
+    )
+    reindex_parser.add_argument(
+        "--checkpoint_dir",
+        type=str,
+        default=None,
+        help="Directory in which to record progress for each task table, so "
+        "that an interrupted reindex can be resumed",
+    )
+    reindex_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume an interrupted reindex from the checkpoints in "
+        "--checkpoint_dir, rather than starting again",
+    )
     reindex_parser.set_defaults(
-        func=lambda args: _reindex(cfg=get_default_config_from_os_env())
+        func=lambda args: _reindex(
+            cfg=get_default_config_from_os_env(),
+            processes=args.processes,
+            batch_size=args.batch_size,
+            checkpoint_dir=args.checkpoint_dir,
+            resume=args.resume,
+        )
+    )
+
+    rebuild_summaries_parser = add_sub(
+        subparsers,
+        "rebuild_task_summaries",
+        help="Recalculate the stored task summaries (e.g. after an upgrade)",
+    )
+    rebuild_summaries_parser.add_argument(
+        "--task_types",
+        type=str,
+        nargs="*",
+        default=None,
+        help="Task base table names to restrict to (if none: all tasks)",
+    )
+    rebuild_summaries_parser.add_argument(
+        "--stale_only",
+        action="store_true",
+        help="Only do tasks without summaries stored by this server version",
+    )
+    rebuild_summaries_parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=500,
+        help="Number of tasks to do at once",
+    )
+    rebuild_summaries_parser.set_defaults(
+        func=lambda args: _rebuild_task_summaries(
+            task_types=args.task_types,
+            stale_only=args.stale_only,
+            batch_size=args.batch_size,
+        )
     )
 
     check_index_parser = add_sub(
@@ -1379,6 +1541,16 @@ def camcops_main() -> int:
         )
     )
 
+    build_data_snapshot_parser = add_sub(
+        subparsers,
+        "build_data_snapshot",
+        help="Build (or rebuild) precompiled snapshots of the extra strings "
+        "and SNOMED-CT XML files, in the config's DATA_SNAPSHOT_DIR",
+    )
+    build_data_snapshot_parser.set_defaults(
+        func=lambda args: _build_data_snapshot()
+    )
+
     # -------------------------------------------------------------------------
     # Celery options
     # -------------------------------------------------------------------------
@@ -1427,6 +1599,15 @@ def camcops_main() -> int:
         )
     )
 
+    # Launch shared cache server
+    cache_server_parser = add_sub(
+        subparsers,
+        "launch_cache_server",
+        help="Launch shared cache server, for the 'unix_socket' shared "
+        "cache backend",
+    )
+    cache_server_parser.set_defaults(func=lambda args: _launch_cache_server())
+
     # Housekeeping task
     housekeeping_parser = add_sub(
         subparsers,
@@ -1464,6 +1645,30 @@ def camcops_main() -> int:
     )
     list_tasks_parser.set_defaults(func=lambda args: _list_tasks())
 
+    # Measure import (startup) time
+    dev_import_times_parser = add_sub(
+        subparsers,
+        "dev_import_times",
+        config_mandatory=None,
+        help="Measure how long it takes to import CamCOPS (i.e. the startup "
+        "time of the server and command-line tools), and show the slowest "
+        "modules.",
+    )
+    dev_import_times_parser.add_argument(
+        "--module",
+        default=DEFAULT_IMPORTTIME_MODULE,
+        help="Python module whose import to time",
+    )
+    dev_import_times_parser.add_argument(
+        "--top",
+        type=nonnegative_int,
+        default=DEFAULT_IMPORTTIME_TOP_N,
+        help="Number of modules to show",
+    )
+    dev_import_times_parser.set_defaults(
+        func=lambda args: _dev_import_times(module=args.module, top_n=args.top)
+    )
+
     # -------------------------------------------------------------------------
     # OK; parser built; now parse the arguments
     # -------------------------------------------------------------------------
@@ -94,6 +94,9 @@ import camcops_server.cc_modules.client_api  # noqa: E402, F401
 
 # ... import side effects (register unit test)
 
+from camcops_server.cc_modules.cc_cacheserver import (  # noqa: E402
+    serve_unix_socket_cache,
+)
 from camcops_server.cc_modules.cc_config import (  # noqa: E402
     CamcopsConfig,
     get_config_filename_from_os_env,
@@ -101,8 +104,10 @@ from camcops_server.cc_modules.cc_config import (  # noqa: E402
 )
 from camcops_server.cc_modules.cc_constants import (  # noqa: E402
     ConfigDefaults,
+    ConfigParamSite,
     DEFAULT_FLOWER_ADDRESS,
     DEFAULT_FLOWER_PORT,
+    SharedCacheBackendNames,
     USER_NAME_FOR_SYSTEM,
 )
 from camcops_server.cc_modules.cc_exception import (  # noqa: E402
@@ -118,13 +123,25 @@ from camcops_server.cc_modules.cc_request import (  # noqa: E402
     command_line_request_context,
     camcops_pyramid_configurator_context,
 )
+from camcops_server.cc_modules.cc_snomed import (  # noqa: E402
+    load_snomed_concepts_from_xml,
+)
 from camcops_server.cc_modules.cc_string import (  # noqa: E402
     all_extra_strings_as_dicts,
+    get_extra_string_filenames,
+    load_extra_string_files,
 )
 from camcops_server.cc_modules.cc_task import Task  # noqa: E402
 from camcops_server.cc_modules.cc_taskindex import (  # noqa: E402
     check_indexes,
-    reindex_everything,
+)
+from camcops_server.cc_modules.cc_taskindexrebuild import (  # noqa: E402
+    DEFAULT_REINDEX_BATCH_SIZE,
+    reindex_everything_in_bulk,
+)
+from camcops_server.cc_modules.cc_tasksummary import (  # noqa: E402
+    DEFAULT_SUMMARY_REBUILD_BATCH_SIZE,
+    rebuild_task_summaries as rebuild_stored_task_summaries,
 )
 
 # noinspection PyUnresolvedReferences
@@ -205,6 +222,10 @@ def precache() -> None:
     caches.)
     """
     log.info("Prepopulating caches")
+    # Matplotlib is imported lazily, but must be configured (by cc_plot) once,
+    # before any threads might import it. Delayed import:
+    import camcops_server.cc_modules.cc_plot  # noqa: F401
+
     config_filename = get_config_filename_from_os_env()
     config = get_default_config_from_os_env()
     _ = all_extra_strings_as_dicts(config_filename)
@@ -215,6 +236,32 @@ def precache() -> None:
         _ = req.get_export_recipients(all_recipients=True)
 
 
+def build_data_snapshot() -> None:
+    """
+    Builds (or rebuilds) snapshots of the extra strings and SNOMED-CT XML
+    files; see :mod:`camcops_server.cc_modules.cc_snapshot`.
+    """
+    config = get_default_config_from_os_env()
+    if not config.data_snapshot_dir:
+        raise ValueError(
+            f"No {ConfigParamSite.DATA_SNAPSHOT_DIR} specified in config"
+        )
+    load_extra_string_files(
+        get_extra_string_filenames(config),
+        snapshot_dir=config.data_snapshot_dir,
+        rebuild=True,
+    )
+    for filename in (
+        config.snomed_task_xml_filename,
+        config.snomed_icd9_xml_filename,
+        config.snomed_icd10_xml_filename,
+    ):
+        if filename:
+            load_snomed_concepts_from_xml(
+                filename, snapshot_dir=config.data_snapshot_dir, rebuild=True
+            )
+
+
 # =============================================================================
 # WSGI entry point
 # =============================================================================
@@ -855,16 +902,56 @@ def show_database_schema(
         subprocess.check_call(cmd)
 
 
-def reindex(cfg: CamcopsConfig) -> None:
+def reindex(
+    cfg: CamcopsConfig,
+    processes: int = 1,
+    batch_size: int = DEFAULT_REINDEX_BATCH_SIZE,
+    checkpoint_dir: str = None,
+    resume: bool = False,
+) -> None:
     """
     Drops and regenerates the server task index.
 
     Args:
         cfg: a :class:`camcops_server.cc_modules.cc_config.CamcopsConfig`
+        processes: number of worker processes for the task index
+        batch_size: number of tasks to index at once
+        checkpoint_dir: directory in which to record progress per task table
+        resume: resume from the checkpoints in ``checkpoint_dir``?
     """
     ensure_database_is_ok()
     with cfg.get_dbsession_context() as dbsession:
-        reindex_everything(dbsession)
+        reindex_everything_in_bulk(
+            dbsession,
+            processes=processes,
+            batch_size=batch_size,
+            checkpoint_dir=checkpoint_dir,
+            resume=resume,
+        )
+
+
+def rebuild_task_summaries(
+    task_types: List[str] = None,
+    stale_only: bool = False,
+    batch_size: int = DEFAULT_SUMMARY_REBUILD_BATCH_SIZE,
+) -> None:
+    """
+    Recalculates the stored task summaries.
+
+    Args:
+        task_types: task base table names to restrict to (default all)
+        stale_only: only do tasks whose summaries aren't from this version?
+        batch_size: number of tasks to do at once
+    """
+    ensure_database_is_ok()
+    with command_line_request_context() as req:
+        n_tasks = rebuild_stored_task_summaries(
+            req,
+            tablenames=task_types,
+            stale_only=stale_only,
+            batch_size=batch_size,
+        )
+    log.info("Stored summaries for {} tasks", n_tasks)
 
 
 def check_index(cfg: CamcopsConfig, show_all_bad: bool = False) -> bool:
@@ -993,6 +1080,21 @@ def launch_celery_flower(
     nice_call(cmdargs, cleanup_timeout=cleanup_timeout_s)
 
 
+def launch_cache_server() -> None:
+    """
+    Launch the shared cache server, for the ``unix_socket`` shared cache
+    backend.
+    """
+    config = get_default_config_from_os_env()
+    if config.shared_cache_backend != SharedCacheBackendNames.UNIX_SOCKET:
+        log.warning(
+            "Config has {} = {!r}, so CamCOPS won't use this cache server",
+            ConfigParamSite.SHARED_CACHE_BACKEND,
+            config.shared_cache_backend,
+        )
+    serve_unix_socket_cache(config.shared_cache_location)
+
+
 # =============================================================================
 # Development and testing
 # =============================================================================
@@ -101,6 +101,7 @@ from camcops_server.cc_modules.cc_taskindex import (
     PatientIdNumIndexEntry,
     TaskIndexEntry,
 )
+from camcops_server.cc_modules.cc_tasksummary import TaskSummaryEntry
 from camcops_server.cc_modules.cc_user import (
     SecurityAccountLockout,
     SecurityLoginFailure,
@@ -182,6 +183,7 @@ RESERVED_TABLE_NAMES = [
     TaskIndexEntry.__tablename__,
     TaskSchedule.__tablename__,
     TaskScheduleItem.__tablename__,
+    TaskSummaryEntry.__tablename__,
     User.__tablename__,
     UserGroupMembership.__tablename__,
 ]
@@ -107,6 +107,30 @@ Crash using type-hinted functions under Python 3.5 with dogpile.cache==0.6.4:
 
   - there should be no calls to cache_region_static.delete
 
+4. SHARED CACHE
+
+- Later: a second, optional region for things that come from the database,
+  configured by ``SHARED_CACHE_BACKEND``. If the backend is shared between
+  processes (a file, :mod:`camcops_server.cc_modules.cc_cacheserver`, Redis,
+  memcached), so is the cache, and writes by one process invalidate it for
+  all.
+
+- The static region stays per-process. Its contents come from the config and
+  code, so don't go stale, and often aren't picklable (e.g. classes).
+
+- A shared cache region is attached to each request's database session (see
+  :meth:`camcops_server.cc_modules.cc_request.CamcopsRequest.get_bare_dbsession`),
+  and used via :func:`shared_cache_get_or_create`. Sessions without one (the
+  default) don't cache.
+
+- Each cached value is invalidated when a session that has written objects of
+  the classes it depends on (see :func:`register_shared_cache_dependency`)
+  commits. Until then, that session bypasses the cache, so it sees its own
+  changes. Bulk updates (``query.update()`` etc.) aren't noticed; the
+  ``SHARED_CACHE_EXPIRY_S`` timeout limits the damage.
+
+- Values must be picklable plain data, not ORM objects.
+
 """  # noqa
 
 
@@ -114,8 +138,22 @@ Crash using type-hinted functions under Python 3.5 with dogpile.cache==0.6.4:
 # Imports; logging
 # =============================================================================
 
+import logging
+from typing import Any, Callable, Dict, Optional, Set
+
 from cardinal_pythonlib.dogpile_cache import kw_fkg_allowing_type_hints as fkg
-from dogpile.cache import make_region
+from cardinal_pythonlib.logs import BraceStyleAdapter
+from dogpile.cache import make_region, register_backend
+from dogpile.cache.region import CacheRegion
+from sqlalchemy.event.api import listens_for
+from sqlalchemy.orm.session import Session as SqlASession
+
+from camcops_server.cc_modules.cc_constants import SharedCacheBackendNames
+from camcops_server.cc_modules.cc_version_string import (
+    CAMCOPS_SERVER_VERSION_STRING,
+)
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
 
 
 # =============================================================================
@@ -131,5 +169,171 @@ cache_region_static.configure(
 # Can now use:
 # @cache_region_static.cache_on_arguments(function_key_generator=fkg)
 
+
+# =============================================================================
+# The shared cache: for things from the database.
+# =============================================================================
+
+UNIX_SOCKET_DOGPILE_BACKEND = "camcops.unix_socket"
+register_backend(
+    UNIX_SOCKET_DOGPILE_BACKEND,
+    "camcops_server.cc_modules.cc_cacheserver",
+    "UnixSocketCacheBackend",
+)
+
+DOGPILE_BACKENDS = {
+    SharedCacheBackendNames.MEMORY: "dogpile.cache.memory",
+    SharedCacheBackendNames.FILE: "dogpile.cache.dbm",
+    SharedCacheBackendNames.UNIX_SOCKET: UNIX_SOCKET_DOGPILE_BACKEND,
+}
+
+# Different server versions may store different things under the same name:
+SHARED_CACHE_KEY_PREFIX = f"camcops:{CAMCOPS_SERVER_VERSION_STRING}:"
+
+SESSION_INFO_SHARED_CACHE = "camcops_shared_cache"
+SESSION_INFO_STALE_KEYS = "camcops_stale_cache_keys"
+
+
+class SharedCacheKeys:
+    """
+    Keys of things in the shared cache.
+    """
+
+    DATABASE_TITLE = "database_title"
+    GROUP_VISIBILITY = "group_visibility"
+    IDNUM_DEFINITIONS = "idnum_definitions"
+
+
+_KEYS_BY_CLASS = {}  # type: Dict[type, Set[str]]
+
+
+def make_shared_cache_region(
+    backend: str, location: str = "", expiry_s: int = None
+) -> Optional[CacheRegion]:
+    """
+    Makes a shared cache region.
+
+    Args:
+        backend:
+            one of the :class:`SharedCacheBackendNames` values, or the name of
+            any other dogpile.cache backend (e.g. ``dogpile.cache.redis``)
+        location:
+            filename (``file`` backend), socket path (``unix_socket``), or URL
+            (other backends, e.g. ``redis://localhost:6379/0``)
+        expiry_s:
+            how long values last, in seconds; ``None`` or 0 for ever
+
+    Returns:
+        a :class:`dogpile.cache.region.CacheRegion`, or ``None`` if the
+        backend is ``none``.
+    """
+    if not backend or backend == SharedCacheBackendNames.NONE:
+        return None
+    dogpile_backend = DOGPILE_BACKENDS.get(backend, backend)
+    if "." not in dogpile_backend:
+        raise ValueError(f"Unknown shared cache backend: {backend!r}")
+    if dogpile_backend == DOGPILE_BACKENDS[SharedCacheBackendNames.FILE]:
+        arguments = {"filename": location}
+    elif dogpile_backend == UNIX_SOCKET_DOGPILE_BACKEND:
+        arguments = {"path": location}
+    elif location:
+        arguments = {"url": location}
+    else:
+        arguments = {}
+    if dogpile_backend != DOGPILE_BACKENDS[SharedCacheBackendNames.MEMORY]:
+        if not location:
+            raise ValueError(
+                f"Shared cache backend {backend!r} needs a location"
+            )
+    region = make_region(key_mangler=lambda key: SHARED_CACHE_KEY_PREFIX + key)
+    region.configure(
+        backend=dogpile_backend,
+        expiration_time=expiry_s or None,
+        arguments=arguments,
+    )
+    log.debug(
+        "Shared cache: backend {!r}, location {!r}", dogpile_backend, location
+    )
+    return region
+
+
+def register_shared_cache_dependency(cls: type, *keys: str) -> None:
+    """
+    Declares that the shared cache values with the keys given are derived
+    from objects of class ``cls``, so must be invalidated when any are
+    inserted, updated or deleted.
+    """
+    _KEYS_BY_CLASS.setdefault(cls, set()).update(keys)
+
+
+def get_shared_cache(dbsession: SqlASession) -> Optional[CacheRegion]:
+    """
+    Returns the shared cache region attached to a session, if any.
+    """
+    return dbsession.info.get(SESSION_INFO_SHARED_CACHE)
+
+
+def _note_stale_keys(dbsession: SqlASession) -> Set[str]:
+    """
+    Records (in the session) the keys that changes in this session, whether
+    flushed or not, make stale. Returns them all.
+    """
+    stale = dbsession.info.setdefault(
+        SESSION_INFO_STALE_KEYS, set()
+    )  # type: Set[str]
+    for objects in (dbsession.new, dbsession.dirty, dbsession.deleted):
+        for obj in objects:
+            stale.update(_KEYS_BY_CLASS.get(type(obj), ()))
+    return stale
+
+
+def shared_cache_get_or_create(
+    dbsession: SqlASession, key: str, creator: Callable[[], Any]
+) -> Any:
+    """
+    Fetches a value from the session's shared cache, or creates it with
+    ``creator()`` (and caches it).
+
+    If the session has no shared cache, or has changed what the value depends
+    on, just returns ``creator()``.
+    """
+    region = get_shared_cache(dbsession)
+    if region is None or key in _note_stale_keys(dbsession):
+        return creator()
+    return region.get_or_create(key, creator)
+
+
+# noinspection PyUnusedLocal
+@listens_for(SqlASession, "before_flush")
+def _shared_cache_before_flush(
+    session: SqlASession, flush_context: Any, instances: Any
+) -> None:
+    if SESSION_INFO_SHARED_CACHE in session.info:
+        _note_stale_keys(session)
+
+
+@listens_for(SqlASession, "after_commit")
+def _shared_cache_after_commit(session: SqlASession) -> None:
+    stale = session.info.pop(SESSION_INFO_STALE_KEYS, None)
+    region = get_shared_cache(session)
+    if stale and region is not None:
+        log.debug("Invalidating shared cache keys: {!r}", stale)
+        region.delete_multi(list(stale))
+
+
+@listens_for(SqlASession, "after_rollback")
+def _shared_cache_after_rollback(session: SqlASession) -> None:
+    # Nothing was written, so nothing to invalidate.
+    session.info.pop(SESSION_INFO_STALE_KEYS, None)
+
+
 # https://stackoverflow.com/questions/44834/can-someone-explain-all-in-python
-__all__ = ["cache_region_static", "fkg"]  # prevents "Unused import statement"
+__all__ = [
+    "cache_region_static",
+    "fkg",
+    "get_shared_cache",
+    "make_shared_cache_region",
+    "register_shared_cache_dependency",
+    "shared_cache_get_or_create",
+    "SharedCacheKeys",
+]  # prevents "Unused import statement"
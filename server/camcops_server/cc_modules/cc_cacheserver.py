@@ -0,0 +1,366 @@
+"""
+camcops_server/cc_modules/cc_cacheserver.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**A simple cache server, listening on a Unix domain socket, and a
+dogpile.cache backend to talk to it.**
+
+This lets all CamCOPS processes on one machine (web server processes, Celery
+workers) share a cache without needing Redis or memcached. Run the server with
+``camcops_server launch_cache_server``.
+
+- Messages are a 4-byte (big-endian) length followed by that many bytes of
+  JSON. Cached values are pickled by the client, and are opaque (base-64
+  encoded) bytes to the server, which never unpickles anything.
+- The socket is created readable/writable only by the user running the
+  server; anyone who can use the socket can read and write the cache.
+- The server keeps nothing on disk, and doesn't expire anything; dogpile.cache
+  handles expiry itself.
+- If the server isn't running, the client logs a warning and behaves as an
+  empty cache; it doesn't stop CamCOPS working.
+
+"""
+
+import base64
+import json
+import logging
+import os
+import pickle
+import socket
+import socketserver
+import stat
+import struct
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+from cardinal_pythonlib.logs import BraceStyleAdapter
+from dogpile.cache.api import CacheBackend, NO_VALUE
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+
+# =============================================================================
+# Constants
+# =============================================================================
+
+LENGTH_FORMAT = ">I"  # 4-byte unsigned big-endian integer
+LENGTH_SIZE = struct.calcsize(LENGTH_FORMAT)
+MAX_MESSAGE_SIZE = 256 * 1024 * 1024  # bytes
+DEFAULT_SOCKET_TIMEOUT_S = 5.0
+
+
+class CacheOp:
+    """
+    Operations understood by the cache server.
+    """
+
+    GET = "get"
+    SET = "set"
+    DELETE = "delete"
+    CLEAR = "clear"
+
+
+class CacheMsg:
+    """
+    Keys in cache server messages.
+    """
+
+    OP = "op"
+    KEYS = "keys"
+    VALUES = "values"
+    ERROR = "error"
+
+
+# =============================================================================
+# Messages
+# =============================================================================
+
+
+def _encode(value: Optional[bytes]) -> Optional[str]:
+    return None if value is None else base64.b64encode(value).decode("ascii")
+
+
+def _decode(value: Optional[str]) -> Optional[bytes]:
+    return None if value is None else base64.b64decode(value)
+
+
+def _recv_exactly(sock: socket.socket, n: int) -> bytes:
+    """
+    Reads exactly ``n`` bytes, or raises :exc:`ConnectionError` if the other
+    end closes the connection first.
+    """
+    chunks = []  # type: List[bytes]
+    remaining = n
+    while remaining > 0:
+        chunk = sock.recv(remaining)
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def send_message(sock: socket.socket, msg: Dict[str, Any]) -> None:
+    """
+    Sends a message (a JSON-serializable dictionary).
+    """
+    data = json.dumps(msg).encode("utf-8")
+    sock.sendall(struct.pack(LENGTH_FORMAT, len(data)) + data)
+
+
+def recv_message(sock: socket.socket) -> Dict[str, Any]:
+    """
+    Receives a message, as sent by :func:`send_message`.
+    """
+    (length,) = struct.unpack(LENGTH_FORMAT, _recv_exactly(sock, LENGTH_SIZE))
+    if length > MAX_MESSAGE_SIZE:
+        raise ValueError(f"Cache message too long ({length} bytes)")
+    return json.loads(_recv_exactly(sock, length).decode("utf-8"))
+
+
+# =============================================================================
+# Server
+# =============================================================================
+
+
+class CacheStore(object):
+    """
+    Thread-safe in-memory store of bytes values.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._data = {}  # type: Dict[str, bytes]
+
+    def handle(self, msg: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Carries out the operation requested by a message, and returns the
+        reply.
+        """
+        op = msg.get(CacheMsg.OP)
+        keys = msg.get(CacheMsg.KEYS, [])  # type: List[str]
+        with self._lock:
+            if op == CacheOp.GET:
+                return {
+                    CacheMsg.VALUES: [_encode(self._data.get(k)) for k in keys]
+                }
+            elif op == CacheOp.SET:
+                values = msg.get(CacheMsg.VALUES, [])  # type: List[str]
+                for k, v in zip(keys, values):
+                    self._data[k] = _decode(v)
+            elif op == CacheOp.DELETE:
+                for k in keys:
+                    self._data.pop(k, None)
+            elif op == CacheOp.CLEAR:
+                self._data.clear()
+            else:
+                return {CacheMsg.ERROR: f"Unknown operation: {op!r}"}
+        return {}
+
+
+class CacheRequestHandler(socketserver.BaseRequestHandler):
+    """
+    Handles one client connection, which may send many messages.
+    """
+
+    def setup(self) -> None:
+        server = self.server  # type: UnixSocketCacheServer
+        with server.connections_lock:
+            server.connections.add(self.request)
+
+    def finish(self) -> None:
+        server = self.server  # type: UnixSocketCacheServer
+        with server.connections_lock:
+            server.connections.discard(self.request)
+
+    def handle(self) -> None:
+        server = self.server  # type: UnixSocketCacheServer
+        while True:
+            try:
+                msg = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            except ValueError as e:
+                log.warning("Bad cache message: {}", e)
+                return
+            send_message(self.request, server.store.handle(msg))
+
+
+class UnixSocketCacheServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Cache server, with a thread per client connection.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path: str) -> None:
+        if os.path.exists(path):
+            if not stat.S_ISSOCK(os.stat(path).st_mode):
+                raise ValueError(f"{path!r} exists and is not a socket")
+            os.remove(path)  # left over from a previous run
+        self.path = path
+        self.store = CacheStore()
+        self.connections = set()  # type: Set[socket.socket]
+        self.connections_lock = threading.Lock()
+        old_umask = os.umask(0o177)  # socket is user read/write only
+        try:
+            super().__init__(path, CacheRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def server_close(self) -> None:
+        super().server_close()
+        # Disconnect clients, as if we had exited:
+        with self.connections_lock:
+            for sock in self.connections:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def serve_unix_socket_cache(path: str) -> None:
+    """
+    Runs a cache server on the Unix domain socket given, until interrupted.
+    """
+    if not path:
+        raise ValueError("No socket path specified for the cache server")
+    with UnixSocketCacheServer(path) as server:
+        log.info("Cache server listening on {!r}", path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    log.info("Cache server stopped")
+
+
+# =============================================================================
+# Client (dogpile.cache backend)
+# =============================================================================
+
+
+class UnixSocketCacheBackend(CacheBackend):
+    """
+    dogpile.cache backend that uses a :class:`UnixSocketCacheServer`.
+
+    Arguments:
+
+    - ``path``: the server's socket
+    - ``socket_timeout``: timeout in seconds for talking to the server
+    """
+
+    def __init__(self, arguments: Dict[str, Any]) -> None:
+        self.path = arguments["path"]
+        self.socket_timeout = arguments.get(
+            "socket_timeout", DEFAULT_SOCKET_TIMEOUT_S
+        )
+        self._lock = threading.Lock()
+        self._sock = None  # type: Optional[socket.socket]
+        self._pid = None  # type: Optional[int]
+
+    def _connect(self) -> socket.socket:
+        if self._sock is not None and self._pid == os.getpid():
+            return self._sock
+        # New, or forked since we connected; don't share a socket with our
+        # parent process.
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.socket_timeout)
+        sock.connect(self.path)
+        self._sock = sock
+        self._pid = os.getpid()
+        return sock
+
+    def _disconnect(self) -> None:
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+
+    def _request(self, msg: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Sends a message and returns the reply, or ``None`` if the server
+        can't be reached. Retries once with a new connection, in case the
+        server has restarted.
+        """
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    sock = self._connect()
+                    send_message(sock, msg)
+                    reply = recv_message(sock)
+                    if CacheMsg.ERROR in reply:
+                        raise ValueError(reply[CacheMsg.ERROR])
+                    return reply
+                except (ConnectionError, OSError) as e:
+                    self._disconnect()
+                    if attempt:
+                        log.warning(
+                            "Cache server at {!r} unavailable: {}",
+                            self.path,
+                            e,
+                        )
+        return None
+
+    def get(self, key: str) -> Any:
+        return self.get_multi([key])[0]
+
+    def get_multi(self, keys: List[str]) -> List[Any]:
+        reply = self._request({CacheMsg.OP: CacheOp.GET, CacheMsg.KEYS: keys})
+        if reply is None:
+            return [NO_VALUE] * len(keys)
+        results = []  # type: List[Any]
+        for value in reply[CacheMsg.VALUES]:
+            if value is None:
+                results.append(NO_VALUE)
+            else:
+                results.append(pickle.loads(_decode(value)))
+        return results
+
+    def set(self, key: str, value: Any) -> None:
+        self.set_multi({key: value})
+
+    def set_multi(self, mapping: Dict[str, Any]) -> None:
+        keys = list(mapping.keys())
+        self._request(
+            {
+                CacheMsg.OP: CacheOp.SET,
+                CacheMsg.KEYS: keys,
+                CacheMsg.VALUES: [
+                    _encode(pickle.dumps(mapping[k], pickle.HIGHEST_PROTOCOL))
+                    for k in keys
+                ],
+            }
+        )
+
+    def delete(self, key: str) -> None:
+        self.delete_multi([key])
+
+    def delete_multi(self, keys: List[str]) -> None:
+        self._request({CacheMsg.OP: CacheOp.DELETE, CacheMsg.KEYS: keys})
@@ -96,6 +96,9 @@ class TabletParam(object):
     DUE_FROM = "due_from"  # C->S; new in v2.4.0
     EMAIL = "email"  # C->S; new in v2.4.0
     ERROR = "error"  # S->C
+    EXTRA_STRINGS_DELETED = "extra_strings_deleted"  # S->C, JSON; v2.4.22
+    EXTRA_STRINGS_REPLY_TYPE = "extra_strings_reply_type"  # S->C; v2.4.22
+    EXTRA_STRINGS_VERSION = "extra_strings_version"  # B; new in v2.4.22
     FIELDS = "fields"  # B
     FINALIZING = "finalizing"
     # ... C->S, in JSON and upload_entire_database, v2.3.0; synonym for
@@ -160,6 +163,17 @@ class ExtraStringFieldNames(object):
     VALUE = "value"
 
 
+class ExtraStringsReplyType(object):
+    """
+    Types of reply to the ``get_extra_strings`` operation, for clients that
+    send the version of the extra strings they have.
+    """
+
+    FULL = "full"  # all strings
+    DELTA = "delta"  # strings changed since the client's version
+    NOT_MODIFIED = "not_modified"  # no strings; the client's are up to date
+
+
 class AllowedTablesFieldNames(object):
     """
     To match ``allowedservertable.cpp`` on the tablet
@@ -389,6 +403,72 @@ class ServerRecord(object):
         )
 
 
+class ServerRecordIndex(object):
+    """
+    Prefetched server records for a single table/device, indexed for fast
+    lookup during upload.
+
+    Built once per table (see :func:`get_server_live_records`), this gives
+    O(1) lookup of records by client PK and O(1) tracking of which server
+    records have been accounted for by the upload, rather than a linear scan
+    per uploaded row.
+    """
+
+    def __init__(self, records: Iterable[ServerRecord]) -> None:
+        """
+        Args:
+            records:
+                all relevant :class:`ServerRecord` objects for this table and
+                device (e.g. those that are current in the ``NOW`` era)
+        """
+        self.records = list(records)
+        self._by_client_pk = {}  # type: Dict[Any, ServerRecord]
+        for r in self.records:
+            # If there are duplicates (there shouldn't be), the first wins, as
+            # it used to with a linear scan.
+            self._by_client_pk.setdefault(r.client_pk, r)
+        self._server_pks_uploaded = set()  # type: Set[int]
+
+    def __repr__(self) -> str:
+        return (
+            f"<{self.__class__.__name__}: {len(self.records)} records, "
+            f"{len(self._server_pks_uploaded)} uploaded>"
+        )
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def get(self, client_pk: Any) -> ServerRecord:
+        """
+        Returns the :class:`ServerRecord` for the given client PK, or a
+        :class:`ServerRecord` indicating that the record does not exist on the
+        server.
+        """
+        serverrec = self._by_client_pk.get(client_pk)
+        if serverrec is None:
+            return ServerRecord(client_pk, False)
+        return serverrec
+
+    def note_uploaded(self, server_pk: Optional[int]) -> None:
+        """
+        Notes that an existing server record (by server PK) was matched by
+        a record that the client uploaded.
+        """
+        if server_pk is not None:
+            self._server_pks_uploaded.add(server_pk)
+
+    def server_pks_not_uploaded(self) -> List[int]:
+        """
+        Returns the server PKs of all records not matched by an upload (via
+        :meth:`note_uploaded`), in the original record order. These are the
+        records that the client has deleted.
+        """
+        uploaded = self._server_pks_uploaded
+        return [
+            r.server_pk for r in self.records if r.server_pk not in uploaded
+        ]
+
+
 class UploadRecordResult(object):
     """
     Represents the result of uploading a record.
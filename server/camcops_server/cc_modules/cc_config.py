@@ -104,6 +104,7 @@ from cardinal_pythonlib.sqlalchemy.schema import get_table_names
 from cardinal_pythonlib.sqlalchemy.session import get_safe_url_from_engine
 from cardinal_pythonlib.wsgi.reverse_proxied_mw import ReverseProxiedMiddleware
 import celery.schedules
+from dogpile.cache.region import CacheRegion
 from sqlalchemy.engine import create_engine
 from sqlalchemy.engine.base import Engine
 from sqlalchemy.orm import sessionmaker
@@ -117,7 +118,11 @@ from camcops_server.cc_modules.cc_baseconstants import (
     LINUX_DEFAULT_MATPLOTLIB_CACHE_DIR,
     ON_READTHEDOCS,
 )
-from camcops_server.cc_modules.cc_cache import cache_region_static, fkg
+from camcops_server.cc_modules.cc_cache import (
+    cache_region_static,
+    fkg,
+    make_shared_cache_region,
+)
 from camcops_server.cc_modules.cc_constants import (
     CONFIG_FILE_EXPORT_SECTION,
     CONFIG_FILE_SERVER_SECTION,
@@ -130,6 +135,7 @@ from camcops_server.cc_modules.cc_constants import (
     ConfigParamSite,
     DockerConstants,
     MfaMethod,
+    SharedCacheBackendNames,
     SmsBackendNames,
 )
 from camcops_server.cc_modules.cc_exportrecipientinfo import (
@@ -345,6 +351,7 @@ def get_demo_config(for_docker: bool = False) -> str:
 
 {ConfigParamSite.DB_URL} = {cd.demo_db_url}
 {ConfigParamSite.DB_ECHO} = {cd.DB_ECHO}
+{ConfigParamSite.TASK_FETCH_THREADS} = {cd.TASK_FETCH_THREADS}
 
 # -----------------------------------------------------------------------------
 # URLs and paths
@@ -361,8 +368,10 @@ def get_demo_config(for_docker: bool = False) -> str:
 {ConfigParamSite.SNOMED_TASK_XML_FILENAME} =
 {ConfigParamSite.SNOMED_ICD9_XML_FILENAME} =
 {ConfigParamSite.SNOMED_ICD10_XML_FILENAME} =
+{ConfigParamSite.DATA_SNAPSHOT_DIR} =
 
 {ConfigParamSite.WKHTMLTOPDF_FILENAME} =
+{ConfigParamSite.PDF_WORKERS} = {cd.PDF_WORKERS}
 
 # -----------------------------------------------------------------------------
 # Server geographical location
@@ -379,6 +388,7 @@ def get_demo_config(for_docker: bool = False) -> str:
 {ConfigParamSite.SESSION_COOKIE_SECRET} = camcops_autogenerated_secret_{session_cookie_secret}
 {ConfigParamSite.SESSION_TIMEOUT_MINUTES} = {cd.SESSION_TIMEOUT_MINUTES}
 {ConfigParamSite.SESSION_CHECK_USER_IP} = {cd.SESSION_CHECK_USER_IP}
+{ConfigParamSite.SESSION_ACTIVITY_FLUSH_INTERVAL_S} = {cd.SESSION_ACTIVITY_FLUSH_INTERVAL_S}
 {ConfigParamSite.PASSWORD_CHANGE_FREQUENCY_DAYS} = {cd.PASSWORD_CHANGE_FREQUENCY_DAYS}
 {ConfigParamSite.LOCKOUT_THRESHOLD} = {cd.LOCKOUT_THRESHOLD}
 {ConfigParamSite.LOCKOUT_DURATION_INCREMENT_MINUTES} = {cd.LOCKOUT_DURATION_INCREMENT_MINUTES}
@@ -395,6 +405,22 @@ def get_demo_config(for_docker: bool = False) -> str:
 {ConfigParamSite.TRACKER_FILENAME_SPEC} = CamCOPS_{{patient}}_{{now}}_tracker.{{filetype}}
 {ConfigParamSite.CTV_FILENAME_SPEC} = CamCOPS_{{patient}}_{{now}}_clinicaltextview.{{filetype}}
 
+# -----------------------------------------------------------------------------
+# Tracker plots
+# -----------------------------------------------------------------------------
+
+{ConfigParamSite.TRACKER_PLOT_CACHE_ENTRIES} = {cd.TRACKER_PLOT_CACHE_ENTRIES}
+{ConfigParamSite.TRACKER_PLOT_CACHE_DIR} =
+{ConfigParamSite.TRACKER_PLOT_PROCESSES} = {cd.TRACKER_PLOT_PROCESSES}
+
+# -----------------------------------------------------------------------------
+# Shared cache
+# -----------------------------------------------------------------------------
+
+{ConfigParamSite.SHARED_CACHE_BACKEND} = {cd.SHARED_CACHE_BACKEND}
+{ConfigParamSite.SHARED_CACHE_LOCATION} =
+{ConfigParamSite.SHARED_CACHE_EXPIRY_S} = {cd.SHARED_CACHE_EXPIRY_S}
+
 # -----------------------------------------------------------------------------
 # E-mail options
 # -----------------------------------------------------------------------------
@@ -1283,6 +1309,9 @@ class CamcopsConfig(object):
         self.db_url = parser.get(s, cs.DB_URL)
         # ... no default: will fail if not provided
         self.db_echo = _get_bool(s, cs.DB_ECHO, cd.DB_ECHO)
+        self.task_fetch_threads = _get_int(
+            s, cs.TASK_FETCH_THREADS, cd.TASK_FETCH_THREADS
+        )
         self.client_api_loglevel = get_config_parameter_loglevel(
             parser, s, cs.CLIENT_API_LOGLEVEL, cd.CLIENT_API_LOGLEVEL
         )
@@ -1405,6 +1434,18 @@ class CamcopsConfig(object):
         self.session_check_user_ip = _get_bool(
             s, cs.SESSION_CHECK_USER_IP, cd.SESSION_CHECK_USER_IP
         )
+        self.session_activity_flush_interval_s = _get_int(
+            s,
+            cs.SESSION_ACTIVITY_FLUSH_INTERVAL_S,
+            cd.SESSION_ACTIVITY_FLUSH_INTERVAL_S,
+        )
+        self.shared_cache_backend = _get_str(
+            s, cs.SHARED_CACHE_BACKEND, cd.SHARED_CACHE_BACKEND
+        )
+        self.shared_cache_expiry_s = _get_int(
+            s, cs.SHARED_CACHE_EXPIRY_S, cd.SHARED_CACHE_EXPIRY_S
+        )
+        self.shared_cache_location = _get_str(s, cs.SHARED_CACHE_LOCATION, "")
         sms_label = _get_str(s, cs.SMS_BACKEND, cd.SMS_BACKEND)
         sms_config = self._read_sms_config(parser, sms_label)
         self.sms_backend = get_sms_backend(sms_label, sms_config)
@@ -1417,9 +1458,19 @@ class CamcopsConfig(object):
         self.snomed_icd10_xml_filename = _get_str(
             s, cs.SNOMED_ICD10_XML_FILENAME
         )
+        self.data_snapshot_dir = _get_str(s, cs.DATA_SNAPSHOT_DIR, "")
 
         self.task_filename_spec = _get_str(s, cs.TASK_FILENAME_SPEC)
         self.tracker_filename_spec = _get_str(s, cs.TRACKER_FILENAME_SPEC)
+        self.tracker_plot_cache_dir = _get_str(
+            s, cs.TRACKER_PLOT_CACHE_DIR, ""
+        )
+        self.tracker_plot_cache_entries = _get_int(
+            s, cs.TRACKER_PLOT_CACHE_ENTRIES, cd.TRACKER_PLOT_CACHE_ENTRIES
+        )
+        self.tracker_plot_processes = _get_int(
+            s, cs.TRACKER_PLOT_PROCESSES, cd.TRACKER_PLOT_PROCESSES
+        )
 
         self.user_download_dir = _get_str(s, cs.USER_DOWNLOAD_DIR, "")
         self.user_download_file_lifetime_min = _get_int(
@@ -1437,6 +1488,7 @@ class CamcopsConfig(object):
         logging.getLogger().setLevel(self.webview_loglevel)  # root logger
         # ... MUTABLE GLOBAL STATE (if relatively unimportant); todo: fix
         self.wkhtmltopdf_filename = _get_str(s, cs.WKHTMLTOPDF_FILENAME)
+        self.pdf_workers = _get_int(s, cs.PDF_WORKERS, cd.PDF_WORKERS)
 
         # More validity checks for the main section:
         if not self.patient_spec_if_anonymous:
@@ -1634,6 +1686,8 @@ class CamcopsConfig(object):
         # Other attributes
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
         self._sqla_engine = None
+        self._shared_cache_region = None  # type: Optional[CacheRegion]
+        self._shared_cache_region_made = False
 
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
         # Docker checks
@@ -1725,6 +1779,25 @@ class CamcopsConfig(object):
                 filespec=self.user_download_dir,
                 permit_tmp=True,
             )
+            warn_if_not_within_docker_dir(
+                param_name=ConfigParamSite.TRACKER_PLOT_CACHE_DIR,
+                filespec=self.tracker_plot_cache_dir,
+                permit_tmp=True,
+            )
+            warn_if_not_within_docker_dir(
+                param_name=ConfigParamSite.DATA_SNAPSHOT_DIR,
+                filespec=self.data_snapshot_dir,
+                permit_tmp=True,
+            )
+            if self.shared_cache_backend in (
+                SharedCacheBackendNames.FILE,
+                SharedCacheBackendNames.UNIX_SOCKET,
+            ):
+                warn_if_not_within_docker_dir(
+                    param_name=ConfigParamSite.SHARED_CACHE_LOCATION,
+                    filespec=self.shared_cache_location,
+                    permit_tmp=True,
+                )
             warn_if_not_within_docker_dir(
                 param_name=ConfigParamExportGeneral.CELERY_BEAT_SCHEDULE_DATABASE,  # noqa
                 filespec=self.celery_beat_schedule_database,
@@ -1785,6 +1858,21 @@ class CamcopsConfig(object):
         engine = self.get_sqla_engine()
         return get_table_names(engine=engine)
 
+    def get_shared_cache_region(self) -> Optional[CacheRegion]:
+        """
+        Returns the dogpile.cache region for the shared cache (for things from
+        the database), or ``None`` if there isn't one. Like the engine, we
+        make one per process.
+        """
+        if not self._shared_cache_region_made:
+            self._shared_cache_region = make_shared_cache_region(
+                backend=self.shared_cache_backend,
+                location=self.shared_cache_location,
+                expiry_s=self.shared_cache_expiry_s,
+            )
+            self._shared_cache_region_made = True
+        return self._shared_cache_region
+
     def get_dbsession_raw(self) -> SqlASession:
         """
         Returns a raw SQLAlchemy Session.
@@ -1873,7 +1961,9 @@ class CamcopsConfig(object):
         """
         if not self.snomed_task_xml_filename:
             return {}
-        return get_all_task_snomed_concepts(self.snomed_task_xml_filename)
+        return get_all_task_snomed_concepts(
+            self.snomed_task_xml_filename, snapshot_dir=self.data_snapshot_dir
+        )
 
     def get_icd9cm_snomed_concepts(self) -> Dict[str, List[SnomedConcept]]:
         """
@@ -1884,7 +1974,9 @@ class CamcopsConfig(object):
         """
         if not self.snomed_icd9_xml_filename:
             return {}
-        return get_icd9_snomed_concepts_from_xml(self.snomed_icd9_xml_filename)
+        return get_icd9_snomed_concepts_from_xml(
+            self.snomed_icd9_xml_filename, snapshot_dir=self.data_snapshot_dir
+        )
 
     def get_icd10_snomed_concepts(self) -> Dict[str, List[SnomedConcept]]:
         """
@@ -1897,7 +1989,8 @@ class CamcopsConfig(object):
         if not self.snomed_icd10_xml_filename:
             return {}
         return get_icd10_snomed_concepts_from_xml(
-            self.snomed_icd10_xml_filename
+            self.snomed_icd10_xml_filename,
+            snapshot_dir=self.data_snapshot_dir,
         )
 
     # -------------------------------------------------------------------------
@@ -1960,6 +2053,59 @@ class CamcopsConfig(object):
         # ".lock" is appended automatically by the lockfile package
         return os.path.join(self.export_lockdir, filename)
 
+    def get_export_lockfilename_recipient_db_task_class(
+        self, recipient_name: str, basetable: str
+    ) -> str:
+        """
+        Returns a full path to a lockfile suitable for locking for the export
+        of one task class, as part of a whole-database export (run via the
+        backend) to a particular export recipient.
+
+        Args:
+            recipient_name: name of the recipient
+            basetable: task base table name
+
+        Returns:
+            a filename
+        """
+        filename = f"camcops_export_db_{recipient_name}_task_{basetable}"
+        # ".lock" is appended automatically by the lockfile package
+        return os.path.join(self.export_lockdir, filename)
+
+    def get_export_lockfilename_recipient_db_shared_rows(
+        self, recipient_name: str
+    ) -> str:
+        """
+        Returns a full path to a lockfile held while writing rows that several
+        task classes may share (e.g. patients) during a whole-database export
+        (run via the backend) to a particular export recipient.
+
+        Args:
+            recipient_name: name of the recipient
+
+        Returns:
+            a filename
+        """
+        filename = f"camcops_export_db_{recipient_name}_shared_rows"
+        # ".lock" is appended automatically by the lockfile package
+        return os.path.join(self.export_lockdir, filename)
+
+    def get_export_db_checkpoint_dir(self, recipient_name: str) -> str:
+        """
+        Returns a full path to a directory used to record the progress of a
+        whole-database export to a particular export recipient, so that an
+        interrupted export can be resumed. It lives in the export lock
+        directory, which we know we can write to.
+
+        Args:
+            recipient_name: name of the recipient
+
+        Returns:
+            a directory name
+        """
+        dirname = f"camcops_export_db_{recipient_name}_checkpoints"
+        return os.path.join(self.export_lockdir, dirname)
+
     def get_export_lockfilename_recipient_fhir(
         self, recipient_name: str
     ) -> str:
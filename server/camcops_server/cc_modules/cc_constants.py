@@ -449,6 +449,7 @@ class ConfigParamSite(object):
     CAMCOPS_LOGO_FILE_ABSOLUTE = "CAMCOPS_LOGO_FILE_ABSOLUTE"
     CLIENT_API_LOGLEVEL = "CLIENT_API_LOGLEVEL"
     CTV_FILENAME_SPEC = "CTV_FILENAME_SPEC"
+    DATA_SNAPSHOT_DIR = "DATA_SNAPSHOT_DIR"
     DB_URL = "DB_URL"
     DB_ECHO = "DB_ECHO"
     DISABLE_PASSWORD_AUTOCOMPLETE = "DISABLE_PASSWORD_AUTOCOMPLETE"
@@ -472,18 +473,27 @@ class ConfigParamSite(object):
     PASSWORD_CHANGE_FREQUENCY_DAYS = "PASSWORD_CHANGE_FREQUENCY_DAYS"
     PATIENT_SPEC = "PATIENT_SPEC"
     PATIENT_SPEC_IF_ANONYMOUS = "PATIENT_SPEC_IF_ANONYMOUS"
+    PDF_WORKERS = "PDF_WORKERS"
     PERMIT_IMMEDIATE_DOWNLOADS = "PERMIT_IMMEDIATE_DOWNLOADS"
     REGION_CODE = "REGION_CODE"
     RESTRICTED_TASKS = "RESTRICTED_TASKS"
+    SESSION_ACTIVITY_FLUSH_INTERVAL_S = "SESSION_ACTIVITY_FLUSH_INTERVAL_S"
     SESSION_COOKIE_SECRET = "SESSION_COOKIE_SECRET"
     SESSION_TIMEOUT_MINUTES = "SESSION_TIMEOUT_MINUTES"
     SESSION_CHECK_USER_IP = "SESSION_CHECK_USER_IP"
+    SHARED_CACHE_BACKEND = "SHARED_CACHE_BACKEND"
+    SHARED_CACHE_EXPIRY_S = "SHARED_CACHE_EXPIRY_S"
+    SHARED_CACHE_LOCATION = "SHARED_CACHE_LOCATION"
     SMS_BACKEND = "SMS_BACKEND"
     SNOMED_TASK_XML_FILENAME = "SNOMED_TASK_XML_FILENAME"
     SNOMED_ICD9_XML_FILENAME = "SNOMED_ICD9_XML_FILENAME"
     SNOMED_ICD10_XML_FILENAME = "SNOMED_ICD10_XML_FILENAME"
+    TASK_FETCH_THREADS = "TASK_FETCH_THREADS"
     TASK_FILENAME_SPEC = "TASK_FILENAME_SPEC"
     TRACKER_FILENAME_SPEC = "TRACKER_FILENAME_SPEC"
+    TRACKER_PLOT_CACHE_DIR = "TRACKER_PLOT_CACHE_DIR"
+    TRACKER_PLOT_CACHE_ENTRIES = "TRACKER_PLOT_CACHE_ENTRIES"
+    TRACKER_PLOT_PROCESSES = "TRACKER_PLOT_PROCESSES"
     USER_DOWNLOAD_DIR = "USER_DOWNLOAD_DIR"
     USER_DOWNLOAD_FILE_LIFETIME_MIN = "USER_DOWNLOAD_FILE_LIFETIME_MIN"
     USER_DOWNLOAD_MAX_SPACE_MB = "USER_DOWNLOAD_MAX_SPACE_MB"
@@ -659,6 +669,18 @@ class MfaMethod:
             return cls.NO_MFA
 
 
+class SharedCacheBackendNames:
+    """
+    Names of shared cache backends. (Other dogpile.cache backends can also be
+    given by their full names, e.g. ``dogpile.cache.redis``.)
+    """
+
+    NONE = "none"
+    MEMORY = "memory"
+    FILE = "file"
+    UNIX_SOCKET = "unix_socket"
+
+
 class SmsBackendNames:
     """
     Names of allowed SMS backends.
@@ -739,11 +761,18 @@ class ConfigDefaults(object):
     MFA_TIMEOUT_S = 600  # zero for never
     PASSWORD_CHANGE_FREQUENCY_DAYS = 0  # zero for never
     PATIENT_SPEC_IF_ANONYMOUS = "anonymous"
+    PDF_WORKERS = 1
     PERMIT_IMMEDIATE_DOWNLOADS = False
     REGION_CODE = "GB"
+    SESSION_ACTIVITY_FLUSH_INTERVAL_S = 5  # zero to write through
     SESSION_CHECK_USER_IP = True
     SESSION_TIMEOUT_MINUTES = 30
+    SHARED_CACHE_BACKEND = SharedCacheBackendNames.NONE
+    SHARED_CACHE_EXPIRY_S = 600
     SMS_BACKEND = SmsBackendNames.CONSOLE
+    TASK_FETCH_THREADS = 1
+    TRACKER_PLOT_CACHE_ENTRIES = 200  # zero for no in-memory cache
+    TRACKER_PLOT_PROCESSES = 0  # 0 or 1 to plot within the server process
     USER_DOWNLOAD_DIR = (
         LINUX_DEFAULT_USER_DOWNLOAD_DIR  # for demo configs only
     )
@@ -27,11 +27,12 @@ camcops_server/cc_modules/cc_dataclasses.py
 
 """
 
-from dataclasses import dataclass
-from typing import Dict, TYPE_CHECKING
+from dataclasses import dataclass, field
+from typing import Dict, Optional, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from sqlalchemy.sql.schema import Column
+    from sqlalchemy.sql.type_api import TypeEngine
     from camcops_server.cc_modules.cc_summaryelement import SummaryElement
 
 
@@ -57,6 +58,9 @@ class SummarySchemaInfo:
     column_name: str
     data_type: str
     comment: str
+    coltype: Optional["TypeEngine"] = field(
+        default=None, compare=False, repr=False
+    )  # the type itself, for typed (e.g. Parquet) output
 
     def __post_init__(self) -> None:
         assert (
@@ -102,6 +106,7 @@ class SummarySchemaInfo:
             column_name=column_name_prefix + column.name,
             data_type=str(column.type),
             comment=column.comment,
+            coltype=column.type,
         )
 
     @classmethod
@@ -123,4 +128,5 @@ class SummarySchemaInfo:
             column_name=column_name_prefix + element.name,
             data_type=str(element.coltype),
             comment=element.decorated_comment,
+            coltype=element.coltype,
         )
@@ -0,0 +1,365 @@
+"""
+camcops_server/cc_modules/cc_dbexport.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Chunked, resumable export of tasks to a destination database.**
+
+A whole-database export used to copy every task in one transaction. Here, we
+work one task class at a time, and within that, a chunk of tasks at a time:
+
+- the :class:`camcops_server.cc_modules.cc_dump.DumpController` queues rows
+  per destination table and sends them as bulk (executemany) INSERTs;
+- after each chunk, we COMMIT the destination database, mark the tasks as
+  exported in our own database, and record a checkpoint (a small JSON file
+  per task class);
+- if the export is interrupted, the next one for the same recipient resumes
+  it. Tasks already present in the destination are skipped (the destination
+  is the authority, since each chunk is committed atomically), as are rows
+  of shared tables (e.g. patients) that are already there;
+- task classes can be exported by separate (e.g. Celery) jobs in parallel;
+  rows of shared tables are then written under a lock.
+
+The checkpoints are deleted when the whole export has finished, so the
+following export starts afresh (and, as before, expects an empty destination
+database).
+
+"""
+
+import json
+import logging
+import os
+from typing import List, Type, TYPE_CHECKING
+
+from cardinal_pythonlib.logs import BraceStyleAdapter
+from sqlalchemy.sql.expression import func, select
+
+from camcops_server.cc_modules.cc_dump import (
+    chunks_from_iterable,
+    DumpController,
+    SUMMARY_PREFETCH_CHUNK_SIZE,
+)
+from camcops_server.cc_modules.cc_exportmodels import ExportedTask
+from camcops_server.cc_modules.cc_task import Task
+
+if TYPE_CHECKING:
+    from camcops_server.cc_modules.cc_exportrecipient import ExportRecipient
+    from camcops_server.cc_modules.cc_request import CamcopsRequest
+    from camcops_server.cc_modules.cc_taskcollection import TaskCollection
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+
+# =============================================================================
+# Constants
+# =============================================================================
+
+CHECKPOINT_EXTENSION = ".json"
+RUN_FILENAME = "_export_run" + CHECKPOINT_EXTENSION
+DB_EXPORT_CHUNK_SIZE = SUMMARY_PREFETCH_CHUNK_SIZE
+# ... number of tasks per destination COMMIT
+
+
+# =============================================================================
+# Checkpoints
+# =============================================================================
+
+
+class DatabaseExportCheckpoint(object):
+    """
+    How far we have got with exporting one task class to a destination
+    database. Stored as a JSON file per task table, within a checkpoint
+    directory.
+    """
+
+    def __init__(
+        self, tablename: str, n_tasks: int = 0, complete: bool = False
+    ) -> None:
+        """
+        Args:
+            tablename:
+                the task's base table name
+            n_tasks:
+                number of tasks exported (and committed) so far
+            complete:
+                have we finished this task class?
+        """
+        self.tablename = tablename
+        self.n_tasks = n_tasks
+        self.complete = complete
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(tablename={self.tablename!r}, "
+            f"n_tasks={self.n_tasks!r}, complete={self.complete!r})"
+        )
+
+    @staticmethod
+    def filename(checkpoint_dir: str, tablename: str) -> str:
+        """
+        Returns the checkpoint filename for a task table.
+        """
+        return os.path.join(checkpoint_dir, tablename + CHECKPOINT_EXTENSION)
+
+    @classmethod
+    def load(
+        cls, checkpoint_dir: str, tablename: str
+    ) -> "DatabaseExportCheckpoint":
+        """
+        Reads a task table's checkpoint, or returns a fresh one (if there
+        isn't one).
+        """
+        try:
+            with open(cls.filename(checkpoint_dir, tablename)) as f:
+                d = json.load(f)
+        except FileNotFoundError:
+            return cls(tablename)
+        return cls(
+            tablename,
+            n_tasks=d.get("n_tasks", 0),
+            complete=d.get("complete", False),
+        )
+
+    def save(self, checkpoint_dir: str) -> None:
+        """
+        Writes the checkpoint (atomically, so that an interruption never
+        leaves a half-written file).
+        """
+        filename = self.filename(checkpoint_dir, self.tablename)
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(dict(n_tasks=self.n_tasks, complete=self.complete), f)
+        os.replace(tmp_filename, filename)
+
+
+def start_database_export_run(
+    checkpoint_dir: str, tablenames: List[str]
+) -> bool:
+    """
+    Records the start of a whole-database export, unless an earlier one is
+    still unfinished.
+
+    Args:
+        checkpoint_dir: the recipient's checkpoint directory
+        tablenames: base table names of the task classes being exported
+
+    Returns:
+        are we resuming an unfinished export?
+    """
+    run_filename = os.path.join(checkpoint_dir, RUN_FILENAME)
+    if os.path.exists(run_filename):
+        log.info("Resuming unfinished database export: {}", checkpoint_dir)
+        return True
+    clear_database_export_checkpoints(checkpoint_dir)
+    tmp_filename = run_filename + ".tmp"
+    with open(tmp_filename, "w") as f:
+        json.dump(dict(tablenames=tablenames), f)
+    os.replace(tmp_filename, run_filename)
+    return False
+
+
+def database_export_run_in_progress(checkpoint_dir: str) -> bool:
+    """
+    Has a whole-database export been started, and not yet finished?
+    """
+    return os.path.exists(os.path.join(checkpoint_dir, RUN_FILENAME))
+
+
+def database_export_run_complete(checkpoint_dir: str) -> bool:
+    """
+    Have all the task classes of the current whole-database export been
+    exported?
+    """
+    try:
+        with open(os.path.join(checkpoint_dir, RUN_FILENAME)) as f:
+            tablenames = json.load(f)["tablenames"]
+    except FileNotFoundError:
+        return False
+    return all(
+        DatabaseExportCheckpoint.load(checkpoint_dir, tablename).complete
+        for tablename in tablenames
+    )
+
+
+def clear_database_export_checkpoints(checkpoint_dir: str) -> None:
+    """
+    Deletes all checkpoints (and the record of the export run) from the
+    checkpoint directory, creating the directory if necessary. Safe to call
+    from several processes at once.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    for filename in os.listdir(checkpoint_dir):
+        if filename.endswith(CHECKPOINT_EXTENSION):
+            try:
+                os.remove(os.path.join(checkpoint_dir, filename))
+            except FileNotFoundError:
+                pass
+
+
+# =============================================================================
+# Export
+# =============================================================================
+
+
+def export_task_class_to_database(
+    req: "CamcopsRequest",
+    recipient: "ExportRecipient",
+    collection: "TaskCollection",
+    task_class: Type[Task],
+    controller: DumpController,
+    checkpoint_dir: str,
+    resuming: bool,
+    chunk_size: int = DB_EXPORT_CHUNK_SIZE,
+    shared_rows_lockfilename: str = None,
+) -> int:
+    """
+    Exports all tasks of one class (from an export collection) to a
+    destination database, committing each chunk and recording a checkpoint.
+
+    Args:
+        req:
+            a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        recipient:
+            the :class:`camcops_server.cc_modules.cc_exportrecipient.ExportRecipient`
+        collection:
+            the :class:`camcops_server.cc_modules.cc_taskcollection.TaskCollection`
+            of tasks to export
+        task_class:
+            the task class to export
+        controller:
+            a :class:`camcops_server.cc_modules.cc_dump.DumpController` for
+            the destination database, whose tables must already exist
+        checkpoint_dir:
+            the recipient's checkpoint directory
+        resuming:
+            is this an unfinished export, so that the destination may already
+            contain some of the tasks?
+        chunk_size:
+            number of tasks per destination COMMIT
+        shared_rows_lockfilename:
+            lockfile to hold while writing shared rows (see
+            :meth:`camcops_server.cc_modules.cc_dump.DumpController.commit`)
+
+    Returns:
+        the number of tasks exported
+    """  # noqa
+    tablename = task_class.__tablename__
+    dst_task_table = controller.get_dest_table_for_src_object(task_class())
+    checkpoint = DatabaseExportCheckpoint.load(checkpoint_dir, tablename)
+    if checkpoint.complete:
+        n_present = controller.dst_session.execute(
+            select(func.count()).select_from(dst_task_table)
+        ).scalar()
+        if n_present >= checkpoint.n_tasks:
+            log.info("Already exported: {}", tablename)
+            return 0
+        log.warning(
+            "Destination table {} has {} rows but {} tasks were exported; "
+            "exporting again",
+            tablename,
+            n_present,
+            checkpoint.n_tasks,
+        )
+        checkpoint = DatabaseExportCheckpoint(tablename)
+
+    n_exported = 0
+    dbsession = req.dbsession
+    for tasks in chunks_from_iterable(
+        collection.gen_tasks_for_task_class_in_chunks(task_class, chunk_size),
+        chunk_size,
+    ):
+        if resuming:
+            already = controller.existing_pks(
+                tablename, [task.pk for task in tasks]
+            )
+            tasks = [task for task in tasks if task.pk not in already]
+            if not tasks:
+                continue
+        exported_tasks = [ExportedTask(recipient, task) for task in tasks]
+        dbsession.add_all(exported_tasks)
+        controller.copy_tasks(tasks)
+        controller.commit(shared_rows_lockfilename=shared_rows_lockfilename)
+        for et in exported_tasks:
+            et.succeed()
+        dbsession.commit()
+        controller.forget_task_objects()
+        n_exported += len(tasks)
+        checkpoint.n_tasks += len(tasks)
+        checkpoint.save(checkpoint_dir)
+        log.debug("Exported {} {} tasks", checkpoint.n_tasks, tablename)
+    checkpoint.complete = True
+    checkpoint.save(checkpoint_dir)
+    log.info("Exported {} tasks: {}", n_exported, tablename)
+    return n_exported
+
+
+def export_collection_to_database(
+    req: "CamcopsRequest",
+    recipient: "ExportRecipient",
+    collection: "TaskCollection",
+    controller: DumpController,
+    checkpoint_dir: str,
+    resuming: bool,
+    chunk_size: int = DB_EXPORT_CHUNK_SIZE,
+) -> int:
+    """
+    Exports all tasks in an export collection to a destination database, one
+    task class at a time (see :func:`export_task_class_to_database`), then
+    clears the checkpoints.
+
+    Args:
+        req:
+            a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        recipient:
+            the :class:`camcops_server.cc_modules.cc_exportrecipient.ExportRecipient`
+        collection:
+            the :class:`camcops_server.cc_modules.cc_taskcollection.TaskCollection`
+            of tasks to export
+        controller:
+            a :class:`camcops_server.cc_modules.cc_dump.DumpController` for
+            the destination database, whose tables must already exist
+        checkpoint_dir:
+            the recipient's checkpoint directory
+        resuming:
+            is this an unfinished export (see
+            :func:`start_database_export_run`)?
+        chunk_size:
+            number of tasks per destination COMMIT
+
+    Returns:
+        the number of tasks exported
+    """  # noqa
+    n_exported = 0
+    for task_class in collection.task_classes():
+        n_exported += export_task_class_to_database(
+            req=req,
+            recipient=recipient,
+            collection=collection,
+            task_class=task_class,
+            controller=controller,
+            checkpoint_dir=checkpoint_dir,
+            resuming=resuming,
+            chunk_size=chunk_size,
+        )
+    clear_database_export_checkpoints(checkpoint_dir)
+    return n_exported
@@ -27,6 +27,7 @@ camcops_server/cc_modules/cc_dump.py
 
 """
 
+import itertools
 import logging
 from typing import (
     Any,
@@ -48,9 +49,11 @@ from cardinal_pythonlib.sqlalchemy.orm_inspect import (
     gen_orm_classes_from_base,
     walk_orm_tree,
 )
+import lockfile
 from sqlalchemy.exc import CompileError
 from sqlalchemy.engine.base import Engine
 from sqlalchemy.orm import Session as SqlASession
+from sqlalchemy.sql.expression import select
 from sqlalchemy.sql.schema import Column, MetaData, Table
 
 from camcops_server.cc_modules.cc_blob import Blob
@@ -75,7 +78,9 @@ from camcops_server.cc_modules.cc_patientidnum import (
     PatientIdNum,
 )
 from camcops_server.cc_modules.cc_sqla_coltypes import CamcopsColumn
+from camcops_server.cc_modules.cc_sqlalchemy import get_max_bind_params
 from camcops_server.cc_modules.cc_task import Task
+from camcops_server.cc_modules.cc_tasksummary import get_stored_summaries
 from camcops_server.cc_modules.cc_user import User
 
 if TYPE_CHECKING:
@@ -136,6 +141,33 @@ DUMP_SKIP_TABLES = [
 DUMP_SKIP_ALL_RELS_FOR_TABLES = [Group.__tablename__]
 FOREIGN_KEY_CONSTRAINTS_IN_DUMP = False
 # ... the keys will be present, but should we try to enforce constraints?
+# Number of tasks for which to fetch stored summaries at once:
+SUMMARY_PREFETCH_CHUNK_SIZE = 500
+# Maximum number of rows to send to a destination table in one INSERT
+# ("executemany") batch:
+DEFAULT_INSERT_BATCH_SIZE = 1000
+# How long to wait for another process to finish writing shared rows:
+SHARED_ROWS_LOCK_TIMEOUT_S = 600
+
+
+# =============================================================================
+# Helper functions
+# =============================================================================
+
+
+def chunks_from_iterable(
+    iterable: Iterable[Any], n: int
+) -> Generator[List[Any], None, None]:
+    """
+    Yields successive lists of (up to) ``n`` items from any iterable
+    (including a generator).
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, n))
+        if not chunk:
+            return
+        yield chunk
 
 
 # =============================================================================
@@ -155,6 +187,10 @@ class DumpController(object):
         dst_session: SqlASession,
         export_options: "TaskExportOptions",
         req: "CamcopsRequest",
+        insert_batch_size: int = DEFAULT_INSERT_BATCH_SIZE,
+        tables_may_exist: bool = False,
+        skip_existing_shared_rows: bool = False,
+        defer_shared_rows: bool = False,
     ) -> None:
         """
         Args:
@@ -162,11 +198,31 @@ class DumpController(object):
             dst_session:  destination SQLAlchemy Session
             export_options: :class:`camcops_server.cc_modules.cc_simpleobjects.TaskExportOptions`
             req: :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+            insert_batch_size:
+                Rows are buffered per destination table and sent in batches
+                of up to this many.
+            tables_may_exist:
+                Destination tables may already exist (e.g. when resuming an
+                export); don't try to create them again.
+            skip_existing_shared_rows:
+                Don't insert rows of "shared" tables (those not belonging to
+                a single task, such as patients, ID numbers, devices and
+                users) whose primary key is already present in the
+                destination. Used when several exports write to the same
+                destination, or when one resumes.
+            defer_shared_rows:
+                Hold back rows of shared tables until :meth:`commit` (rather
+                than sending them as their batches fill), so they can be
+                written under a lock.
         """  # noqa
         self.dst_engine = dst_engine
         self.dst_session = dst_session
         self.export_options = export_options
         self.req = req
+        self.insert_batch_size = max(1, insert_batch_size)
+        self.tables_may_exist = tables_may_exist
+        self.skip_existing_shared_rows = skip_existing_shared_rows
+        self.defer_shared_rows = defer_shared_rows
 
         # We start with blank metadata.
         self.dst_metadata = MetaData()
@@ -181,6 +237,15 @@ class DumpController(object):
         self.tablenames_seen = set()  # type: Set[str]
         # ORM objects we've visited:
         self.instances_seen = set()  # type: Set[object]
+        # Stored task summaries, by (tablename, server PK), for the tasks
+        # currently being copied (see prefetch_stored_summaries):
+        self.stored_summaries = (
+            {}
+        )  # type: Dict[Tuple[str, int], Dict[str, Any]]  # noqa
+        # Rows not yet sent to the destination, by tablename:
+        self._pending_rows = {}  # type: Dict[str, List[Dict[str, Any]]]
+        # Tables whose rows don't belong to a single task:
+        self.shared_tablenames = set()  # type: Set[str]
 
         if export_options.db_make_all_tables_even_empty:
             self._create_all_dest_tables()
@@ -463,7 +528,7 @@ class DumpController(object):
         #     "sqlalchemy.exc.OperationalError: (sqlite3.OperationalError)
         #     database is locked", since a session is also being used.
         self.dst_session.commit()
-        dst_table.create(self.dst_engine)
+        dst_table.create(self.dst_engine, checkfirst=self.tables_may_exist)
         self.tablenames_created.add(tablename)
 
     def _copy_object_to_dump(self, src_obj: object) -> None:
@@ -493,18 +558,17 @@ class DumpController(object):
         # Any other columns to add for this table?
         if isinstance(src_obj, GenericTabletRecordMixin):
             if self.export_options.db_include_summaries:
-                for summary_element in src_obj.get_summaries(self.req):
-                    row[summary_element.name] = summary_element.value
+                row.update(self._get_summary_values(src_obj))
             if adding_extra_ids:
                 if patient:
                     patient.add_extra_idnum_info_to_row(row)
                 if isinstance(src_obj, TaskDescendant):
                     src_obj.add_extra_task_xref_info_to_row(row)
-        try:
-            self.dst_session.execute(dst_table.insert(row))
-        except CompileError:
-            log.critical("\ndst_table:\n{}\nrow:\n{}", dst_table, row)
-            raise
+        self._insert_row(
+            dst_table,
+            row,
+            shared=not isinstance(src_obj, (Task, TaskDescendant)),
+        )
 
         # 2. If required, add extra tables/rows that this task wants to
         #    offer (usually tables whose rows don't have a 1:1 correspondence
@@ -521,15 +585,193 @@ class DumpController(object):
                         patient.add_extra_idnum_info_to_row(row)
                     if adding_extra_ids:
                         est.add_extra_task_xref_info_to_row(row)
-                    try:
-                        self.dst_session.execute(dst_summary_table.insert(row))
-                    except CompileError:
-                        log.critical(
-                            "\ndst_summary_table:\n{}\nrow:\n{}",
-                            dst_table,
-                            row,
-                        )
-                        raise
+                    self._insert_row(dst_summary_table, row)
+
+    def _insert_row(
+        self, dst_table: Table, row: Dict[str, Any], shared: bool = False
+    ) -> None:
+        """
+        Queues a row for insertion into a destination table, sending that
+        table's queue if it is full.
+
+        Args:
+            dst_table: destination table
+            row: the row, as a dictionary mapping column names to values
+            shared: is this a row of a shared table (see :meth:`__init__`)?
+        """
+        tablename = dst_table.name
+        if shared:
+            self.shared_tablenames.add(tablename)
+        pending = self._pending_rows.setdefault(tablename, [])
+        pending.append(row)
+        if len(pending) >= self.insert_batch_size and not (
+            shared and self.defer_shared_rows
+        ):
+            self._flush_table(tablename)
+
+    def flush(self, include_shared: bool = True) -> None:
+        """
+        Sends all queued rows to the destination session (without
+        committing).
+
+        Args:
+            include_shared: include rows for shared tables?
+        """
+        for tablename in list(self._pending_rows.keys()):
+            if not include_shared and tablename in self.shared_tablenames:
+                continue
+            self._flush_table(tablename)
+
+    def commit(self, shared_rows_lockfilename: str = None) -> None:
+        """
+        Sends all queued rows and commits the destination session.
+
+        Args:
+            shared_rows_lockfilename:
+                Optional name of a lockfile to hold while writing rows for
+                shared tables and committing, so that concurrent exports to
+                the same destination don't insert the same shared row twice.
+        """
+        self.flush(include_shared=False)
+        if shared_rows_lockfilename:
+            with lockfile.FileLock(
+                shared_rows_lockfilename, timeout=SHARED_ROWS_LOCK_TIMEOUT_S
+            ):
+                self.flush()
+                self.dst_session.commit()
+        else:
+            self.flush()
+            self.dst_session.commit()
+
+    def _flush_table(self, tablename: str) -> None:
+        """
+        Sends queued rows for one table, as "executemany" inserts.
+        """
+        rows = self._pending_rows.pop(tablename, [])
+        if (
+            self.skip_existing_shared_rows
+            and tablename in self.shared_tablenames
+        ):
+            rows = self._without_existing_rows(tablename, rows)
+        if not rows:
+            return
+        dst_table = self.dst_tables[tablename]
+        # Each executemany batch must have the same columns in every row.
+        rows_by_colnames = (
+            {}
+        )  # type: Dict[Tuple[str, ...], List[Dict[str, Any]]]
+        for row in rows:
+            rows_by_colnames.setdefault(tuple(sorted(row.keys())), []).append(
+                row
+            )
+        for batch in rows_by_colnames.values():
+            try:
+                self.dst_session.execute(dst_table.insert(), batch)
+            except CompileError:
+                log.critical(
+                    "\ndst_table:\n{}\nfirst row:\n{}", dst_table, batch[0]
+                )
+                raise
+
+    def _without_existing_rows(
+        self, tablename: str, rows: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Removes rows whose (single-column) primary key is already present in
+        the destination table.
+        """
+        dst_table = self.dst_tables[tablename]
+        pk_columns = list(dst_table.primary_key.columns)
+        if not rows or len(pk_columns) != 1:
+            return rows
+        pkname = pk_columns[0].name
+        existing = self.existing_pks(
+            tablename, [row.get(pkname) for row in rows]
+        )
+        return [row for row in rows if row.get(pkname) not in existing]
+
+    def existing_pks(self, tablename: str, pks: Iterable[Any]) -> Set[Any]:
+        """
+        Returns those of the primary key values given that are already
+        present in a destination table (which must have a single-column
+        primary key, and must exist).
+        """
+        dst_table = self.dst_tables[tablename]
+        (pkcol,) = dst_table.primary_key.columns
+        existing = set()  # type: Set[Any]
+        for pk_chunk in chunks_from_iterable(
+            set(pks), get_max_bind_params(self.dst_engine.dialect.name)
+        ):
+            existing.update(
+                r[0]
+                for r in self.dst_session.execute(
+                    select(pkcol).where(pkcol.in_(pk_chunk))
+                )
+            )
+        return existing
+
+    def forget_task_objects(self) -> None:
+        """
+        Forgets the task-specific ORM objects we have visited (but not shared
+        ones like patients), so that memory use doesn't grow with the number
+        of tasks copied. Only do this once the tasks are finished with; each
+        task should be copied once.
+        """
+        self.instances_seen = set(
+            obj
+            for obj in self.instances_seen
+            if not isinstance(obj, (Task, TaskDescendant))
+        )
+
+    def copy_tasks(self, tasks: List[Task]) -> None:
+        """
+        Copies some tasks, and their associated related information (found
+        by walking the SQLAlchemy ORM tree), to the dump. Rows may remain
+        queued; see :meth:`flush` and :meth:`commit`.
+        """
+        self.prefetch_stored_summaries(tasks)
+        for startobj in tasks:
+            log.debug("Processing task: {!r}", startobj)
+            for src_obj in walk_orm_tree(
+                startobj,
+                seen=self.instances_seen,
+                skip_relationships_always=DUMP_SKIP_RELNAMES,
+                skip_all_relationships_for_tablenames=DUMP_SKIP_ALL_RELS_FOR_TABLES,  # noqa
+                skip_all_objects_for_tablenames=DUMP_SKIP_TABLES,
+            ):
+                self.consider_object(src_obj)
+
+    def prefetch_stored_summaries(self, tasks: List[Task]) -> None:
+        """
+        Fetches stored task summaries (see
+        :mod:`camcops_server.cc_modules.cc_tasksummary`) for some tasks, in
+        bulk, replacing any previously fetched, so that we don't have to
+        recalculate them.
+        """
+        self.stored_summaries = {}
+        if not self.export_options.db_include_summaries:
+            return
+        pks_by_tablename = {}  # type: Dict[str, List[int]]
+        for task in tasks:
+            pks_by_tablename.setdefault(task.tablename, []).append(task.pk)
+        for tablename, pks in pks_by_tablename.items():
+            for pk, values in get_stored_summaries(
+                self.req.dbsession, tablename, pks, self.req.language
+            ).items():
+                self.stored_summaries[(tablename, pk)] = values
+
+    def _get_summary_values(
+        self, src_obj: GenericTabletRecordMixin
+    ) -> Dict[str, Any]:
+        """
+        Returns summary values for an object: stored ones, if we have them
+        (in our language), or else freshly calculated ones.
+        """
+        if isinstance(src_obj, Task):
+            stored = self.stored_summaries.get((src_obj.tablename, src_obj.pk))
+            if stored is not None:
+                return stored
+        return {s.name: s.value for s in src_obj.get_summaries(self.req)}
 
     def _get_or_insert_summary_table(
         self, est: "ExtraSummaryTable", add_extra_id_cols: bool = False
@@ -633,16 +875,10 @@ def copy_tasks_and_summaries(
         req=req,
     )
 
-    # We walk through all the objects.
+    # We walk through all the objects, a chunk of tasks at a time (so that we
+    # can fetch their stored summaries in bulk).
     log.debug("Starting to copy tasks...")
-    for startobj in tasks:
-        log.debug("Processing task: {!r}", startobj)
-        for src_obj in walk_orm_tree(
-            startobj,
-            seen=controller.instances_seen,
-            skip_relationships_always=DUMP_SKIP_RELNAMES,
-            skip_all_relationships_for_tablenames=DUMP_SKIP_ALL_RELS_FOR_TABLES,  # noqa
-            skip_all_objects_for_tablenames=DUMP_SKIP_TABLES,
-        ):
-            controller.consider_object(src_obj)
+    for task_chunk in chunks_from_iterable(tasks, SUMMARY_PREFETCH_CHUNK_SIZE):
+        controller.copy_tasks(task_chunk)
+    controller.flush()
     log.debug("... finished copying tasks.")
@@ -153,10 +153,14 @@ from contextlib import ExitStack
 import json
 import logging
 import os
+import shutil
 import sqlite3
 import tempfile
 from typing import (
+    Any,
+    BinaryIO,
     Dict,
+    Iterable,
     List,
     Generator,
     Optional,
@@ -199,28 +203,51 @@ from sqlalchemy.sql.schema import Column, MetaData, Table
 from sqlalchemy.sql.sqltypes import Text
 
 from camcops_server.cc_modules.cc_audit import audit
-from camcops_server.cc_modules.cc_constants import DateFormat, JSON_INDENT
+from camcops_server.cc_modules.cc_constants import (
+    DateFormat,
+    FileType,
+    JSON_INDENT,
+)
 from camcops_server.cc_modules.cc_dataclasses import SummarySchemaInfo
 from camcops_server.cc_modules.cc_db import (
     REMOVE_COLUMNS_FOR_SIMPLIFIED_SPREADSHEETS,
 )
-from camcops_server.cc_modules.cc_dump import copy_tasks_and_summaries
+from camcops_server.cc_modules.cc_dbexport import (
+    clear_database_export_checkpoints,
+    database_export_run_complete,
+    database_export_run_in_progress,
+    export_collection_to_database,
+    export_task_class_to_database,
+    start_database_export_run,
+)
+from camcops_server.cc_modules.cc_dump import (
+    copy_tasks_and_summaries,
+    DumpController,
+)
 from camcops_server.cc_modules.cc_email import Email
 from camcops_server.cc_modules.cc_exception import FhirExportException
 from camcops_server.cc_modules.cc_exportmodels import (
     ExportedTask,
     ExportRecipient,
-    gen_tasks_having_exportedtasks,
     get_collection_for_export,
 )
 from camcops_server.cc_modules.cc_forms import UserDownloadDeleteForm
 from camcops_server.cc_modules.cc_pyramid import Routes, ViewArg, ViewParam
 from camcops_server.cc_modules.cc_simpleobjects import TaskExportOptions
 from camcops_server.cc_modules.cc_sqlalchemy import sql_from_sqlite_database
-from camcops_server.cc_modules.cc_task import SNOMED_TABLENAME, Task
+from camcops_server.cc_modules.cc_task import (
+    make_task_pdfs_in_advance,
+    SNOMED_TABLENAME,
+    tablename_to_task_class_dict,
+    Task,
+)
 from camcops_server.cc_modules.cc_spreadsheet import (
     SpreadsheetCollection,
     SpreadsheetPage,
+    StreamingSpreadsheetCollection,
+)
+from camcops_server.cc_modules.cc_taskcollection import (
+    DEFAULT_FETCH_CHUNK_SIZE,
 )
 from camcops_server.cc_modules.celery import (
     create_user_download,
@@ -244,6 +271,7 @@ INFOSCHEMA_PAGENAME = "_camcops_information_schema_columns"
 SUMMARYSCHEMA_PAGENAME = "_camcops_column_explanations"
 REMOVE_TABLES_FOR_SIMPLIFIED_SPREADSHEETS = {SNOMED_TABLENAME}
 EMPTY_SET = set()
+PDF_BATCH_SIZE_PER_WORKER = 4
 
 
 # =============================================================================
@@ -328,7 +356,9 @@ def export(
 
     - Called from the command line, or from
       :func:`camcops_server.cc_modules.celery.export_to_recipient_backend`.
-    - Calls :func:`export_whole_database` or :func:`export_tasks_individually`.
+    - Calls :func:`export_whole_database`,
+      :func:`schedule_whole_database_export`, or
+      :func:`export_tasks_individually`.
 
     Args:
         req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
@@ -349,10 +379,9 @@ def export(
         log.info("Exporting to recipient: {}", recipient.recipient_name)
         if recipient.using_db():
             if schedule_via_backend:
-                raise NotImplementedError(
-                    "Not yet implemented: whole-database export via Celery "
-                    "backend"
-                )  # todo: implement whole-database export via Celery backend  # noqa
+                schedule_whole_database_export(
+                    req, recipient, via_index=via_index
+                )
             else:
                 export_whole_database(req, recipient, via_index=via_index)
         else:
@@ -366,6 +395,39 @@ def export(
         log.info("Finished exporting to {}", recipient.recipient_name)
 
 
+def _get_db_export_options(recipient: ExportRecipient) -> TaskExportOptions:
+    """
+    Returns the options for a whole-database export to a recipient.
+    """
+    return TaskExportOptions(
+        include_blobs=recipient.db_include_blobs,
+        db_patient_id_per_row=recipient.db_patient_id_per_row,
+        db_make_all_tables_even_empty=True,
+        db_include_summaries=recipient.db_add_summaries,
+    )
+
+
+def _get_db_export_controller(
+    req: "CamcopsRequest", recipient: ExportRecipient, **kwargs: Any
+) -> DumpController:
+    """
+    Connects to a recipient's destination database and returns a
+    :class:`camcops_server.cc_modules.cc_dump.DumpController` for it (which
+    creates the destination tables). Keyword arguments are passed to the
+    controller.
+    """
+    dst_engine = create_engine(recipient.db_url, echo=recipient.db_echo)
+    log.info("Exporting to database: {}", get_safe_url_from_engine(dst_engine))
+    dst_session = sessionmaker(bind=dst_engine)()  # type: SqlASession
+    return DumpController(
+        dst_engine=dst_engine,
+        dst_session=dst_session,
+        export_options=_get_db_export_options(recipient),
+        req=req,
+        **kwargs,
+    )
+
+
 def export_whole_database(
     req: "CamcopsRequest", recipient: ExportRecipient, via_index: bool = True
 ) -> None:
@@ -374,6 +436,8 @@ def export_whole_database(
 
     - Called by :func:`export`.
     - Holds a recipient-specific "database" file lock in the process.
+    - Commits in chunks, recording checkpoints, so that an interrupted export
+      is resumed next time; see :mod:`camcops_server.cc_modules.cc_dbexport`.
 
     Args:
         req:
@@ -393,29 +457,27 @@ def export_whole_database(
             collection = get_collection_for_export(
                 req, recipient, via_index=via_index
             )
-            dst_engine = create_engine(
-                recipient.db_url, echo=recipient.db_echo
+            checkpoint_dir = cfg.get_export_db_checkpoint_dir(
+                recipient.recipient_name
             )
-            log.info(
-                "Exporting to database: {}",
-                get_safe_url_from_engine(dst_engine),
+            resuming = start_database_export_run(
+                checkpoint_dir,
+                [cls.__tablename__ for cls in collection.task_classes()],
             )
-            dst_session = sessionmaker(bind=dst_engine)()  # type: SqlASession
-            task_generator = gen_tasks_having_exportedtasks(collection)
-            export_options = TaskExportOptions(
-                include_blobs=recipient.db_include_blobs,
-                db_patient_id_per_row=recipient.db_patient_id_per_row,
-                db_make_all_tables_even_empty=True,
-                db_include_summaries=recipient.db_add_summaries,
+            controller = _get_db_export_controller(
+                req,
+                recipient,
+                tables_may_exist=resuming,
+                skip_existing_shared_rows=resuming,
             )
-            copy_tasks_and_summaries(
-                tasks=task_generator,
-                dst_engine=dst_engine,
-                dst_session=dst_session,
-                export_options=export_options,
+            export_collection_to_database(
                 req=req,
+                recipient=recipient,
+                collection=collection,
+                controller=controller,
+                checkpoint_dir=checkpoint_dir,
+                resuming=resuming,
             )
-            dst_session.commit()
     except lockfile.AlreadyLocked:
         log.warning(
             "Export logfile {!r} already locked by another process; "
@@ -426,6 +488,155 @@ def export_whole_database(
         # are doing the work that we wanted to do.
 
 
+def schedule_whole_database_export(
+    req: "CamcopsRequest", recipient: ExportRecipient, via_index: bool = True
+) -> None:
+    """
+    Exports to a database via the backend, with one backend job per task
+    class, running in parallel.
+
+    - Called by :func:`export`.
+    - Creates the destination tables, then schedules
+      :func:`camcops_server.cc_modules.celery.export_database_task_class_backend`
+      for each task class, which calls
+      :func:`export_whole_database_task_class`.
+    - Holds a recipient-specific "database" file lock while doing so.
+
+    Args:
+        req:
+            a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        recipient:
+            an
+            :class:`camcops_server.cc_modules.cc_exportmodels.ExportRecipient`
+        via_index:
+            use the task index (faster)?
+    """
+    from camcops_server.cc_modules.celery import (
+        export_database_task_class_backend,
+    )  # delayed import
+
+    cfg = req.config
+    recipient_name = recipient.recipient_name
+    lockfilename = cfg.get_export_lockfilename_recipient_db(
+        recipient_name=recipient_name
+    )
+    try:
+        with lockfile.FileLock(lockfilename, timeout=0):  # doesn't wait
+            collection = get_collection_for_export(
+                req, recipient, via_index=via_index
+            )
+            tablenames = [
+                cls.__tablename__ for cls in collection.task_classes()
+            ]
+            checkpoint_dir = cfg.get_export_db_checkpoint_dir(recipient_name)
+            resuming = start_database_export_run(checkpoint_dir, tablenames)
+            controller = _get_db_export_controller(
+                req, recipient, tables_may_exist=resuming
+            )
+            controller.dst_session.commit()
+            if not tablenames:
+                # No backend job will finish the run, so we must.
+                log.info("No tasks to export to {}", recipient_name)
+                clear_database_export_checkpoints(checkpoint_dir)
+                return
+            for tablename in tablenames:
+                log.info(
+                    "Scheduling database export of {} to {}",
+                    tablename,
+                    recipient_name,
+                )
+                export_database_task_class_backend.delay(
+                    recipient_name, tablename, via_index=via_index
+                )
+    except lockfile.AlreadyLocked:
+        log.warning(
+            "Export logfile {!r} already locked by another process; "
+            "aborting (another process is doing this work)",
+            lockfilename,
+        )
+
+
+def export_whole_database_task_class(
+    req: "CamcopsRequest",
+    recipient: ExportRecipient,
+    basetable: str,
+    via_index: bool = True,
+) -> None:
+    """
+    Exports one task class, as part of a whole-database export that is being
+    run via the backend.
+
+    - Called by
+      :func:`camcops_server.cc_modules.celery.export_database_task_class_backend`.
+    - Calls
+      :func:`camcops_server.cc_modules.cc_dbexport.export_task_class_to_database`.
+    - Holds a recipient- and task-class-specific file lock in the process,
+      and a recipient-specific lock while writing rows that task classes may
+      share (e.g. patients).
+    - The last job to finish clears the checkpoints.
+
+    Args:
+        req:
+            a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        recipient:
+            an
+            :class:`camcops_server.cc_modules.cc_exportmodels.ExportRecipient`
+        basetable:
+            base table name of the task class
+        via_index:
+            use the task index (faster)?
+    """
+    cfg = req.config
+    recipient_name = recipient.recipient_name
+    checkpoint_dir = cfg.get_export_db_checkpoint_dir(recipient_name)
+    lockfilename = cfg.get_export_lockfilename_recipient_db_task_class(
+        recipient_name=recipient_name, basetable=basetable
+    )
+    try:
+        with lockfile.FileLock(lockfilename, timeout=0):  # doesn't wait
+            if not database_export_run_in_progress(checkpoint_dir):
+                log.warning(
+                    "No database export to {} in progress; not exporting {}",
+                    recipient_name,
+                    basetable,
+                )
+                return
+            task_class = tablename_to_task_class_dict()[basetable]
+            collection = get_collection_for_export(
+                req, recipient, via_index=via_index
+            )
+            controller = _get_db_export_controller(
+                req,
+                recipient,
+                tables_may_exist=True,
+                skip_existing_shared_rows=True,
+                defer_shared_rows=True,
+            )
+            export_task_class_to_database(
+                req=req,
+                recipient=recipient,
+                collection=collection,
+                task_class=task_class,
+                controller=controller,
+                checkpoint_dir=checkpoint_dir,
+                resuming=True,
+                shared_rows_lockfilename=(
+                    cfg.get_export_lockfilename_recipient_db_shared_rows(
+                        recipient_name
+                    )
+                ),
+            )
+            if database_export_run_complete(checkpoint_dir):
+                log.info("Finished database export to {}", recipient_name)
+                clear_database_export_checkpoints(checkpoint_dir)
+    except lockfile.AlreadyLocked:
+        log.warning(
+            "Export logfile {!r} already locked by another process; "
+            "aborting (another process is doing this work)",
+            lockfilename,
+        )
+
+
 def export_tasks_individually(
     req: "CamcopsRequest",
     recipient: ExportRecipient,
@@ -439,6 +650,8 @@ def export_tasks_individually(
     - Calls :func:`export_task`, if ``schedule_via_backend`` is False.
     - Schedules :func:``camcops_server.cc_modules.celery.export_task_backend``,
       if ``schedule_via_backend`` is True, which calls :func:`export` in turn.
+      (Except for REDCap recipients, and FHIR recipients that don't allow
+      concurrent exports, which are always exported within this job.)
 
     Args:
         req:
@@ -454,6 +667,28 @@ def export_tasks_individually(
     collection = get_collection_for_export(req, recipient, via_index=via_index)
     n_tasks = 0
     recipient_name = recipient.recipient_name
+    if schedule_via_backend and recipient.using_redcap():
+        # REDCap exports share a downloaded copy of the REDCap project (see
+        # cc_redcap.py), and must allocate instance IDs in sequence, so we do
+        # these within this job, rather than one backend job per task.
+        log.info(
+            "Exporting to REDCap recipient {} within this job",
+            recipient_name,
+        )
+        schedule_via_backend = False
+    if (
+        schedule_via_backend
+        and recipient.using_fhir()
+        and not recipient.fhir_concurrent
+    ):
+        # These exports are serialized by a lock anyway (see export_task()),
+        # so we gain nothing from separate jobs. Within this job, the tasks
+        # share an HTTP client and Questionnaire resources (see cc_fhir.py).
+        log.info(
+            "Exporting to FHIR recipient {} within this job",
+            recipient_name,
+        )
+        schedule_via_backend = False
     if schedule_via_backend:
         for task_or_index in collection.gen_all_tasks_or_indexes():
             if isinstance(task_or_index, Task):
@@ -479,14 +714,69 @@ def export_tasks_individually(
             f"{recipient_name}"
         )
     else:
+        if making_pdfs_in_batches(req, recipient):
+            batch_size = req.config.pdf_workers * PDF_BATCH_SIZE_PER_WORKER
+            log.info(
+                "Making PDFs for {} in batches of {}",
+                recipient_name,
+                batch_size,
+            )
+        else:
+            batch_size = 1
+        batch = []  # type: List[Task]
         for task in collection.gen_tasks_by_class():
+            batch.append(task)
+            if len(batch) >= batch_size:
+                n_tasks += export_task_batch(req, recipient, batch)
+                batch = []
+        n_tasks += export_task_batch(req, recipient, batch)
+        log.info(f"Exported {n_tasks} tasks to {recipient_name}")
+
+
+def making_pdfs_in_batches(
+    req: "CamcopsRequest", recipient: ExportRecipient
+) -> bool:
+    """
+    Should :func:`export_tasks_individually` make PDFs for this recipient
+    several at a time (see
+    :func:`camcops_server.cc_modules.cc_task.make_task_pdfs_in_advance`)?
+    """
+    return (
+        req.config.pdf_workers > 1
+        and (recipient.using_file() or recipient.using_email())
+        and recipient.task_format == FileType.PDF
+    )
+
+
+def export_task_batch(
+    req: "CamcopsRequest", recipient: ExportRecipient, tasks: List[Task]
+) -> int:
+    """
+    Exports tasks to a recipient, one by one via :func:`export_task`, having
+    made their PDFs all at once if appropriate. Returns the number of tasks.
+    """
+    if len(tasks) > 1 and making_pdfs_in_batches(req, recipient):
+        to_make = [
+            task
+            for task in tasks
+            if not ExportedTask.task_already_exported(
+                dbsession=req.dbsession,
+                recipient_name=recipient.recipient_name,
+                basetable=task.tablename,
+                task_pk=task.pk,
+            )
+        ]
+        make_task_pdfs_in_advance(req, to_make)
+    try:
+        for task in tasks:
             # Do NOT use this to check the working of export_task_backend():
             # export_task_backend(recipient.recipient_name, task.tablename, task.pk)  # noqa
             # ... it will deadlock at the database (because we're already
             # within a query of some sort, I presume)
             export_task(req, recipient, task)
-            n_tasks += 1
-        log.info(f"Exported {n_tasks} tasks to {recipient_name}")
+    finally:
+        req.pdf_html_cache.discard_pdfs()
+    return len(tasks)
 
 
 def export_task(
@@ -602,6 +892,7 @@ def gen_audited_tasks_for_task_class(
     collection: "TaskCollection",
     cls: Type[Task],
     audit_descriptions: List[str],
+    chunk_size: int = None,
 ) -> Generator[Task, None, None]:
     """
     Generates tasks from a collection, for a given task class, simultaneously
@@ -615,12 +906,22 @@ def gen_audited_tasks_for_task_class(
             the task class to generate
         audit_descriptions:
             list of strings to be modified
+        chunk_size:
+            if specified, fetch tasks from the database in chunks of this
+            size, without keeping them all in memory (see
+            :meth:`camcops_server.cc_modules.cc_taskcollection.TaskCollection.gen_tasks_for_task_class_in_chunks`)
 
     Yields:
         :class:`camcops_server.cc_modules.cc_task.Task` objects
-    """
+    """  # noqa
+    if chunk_size:
+        tasks = collection.gen_tasks_for_task_class_in_chunks(
+            cls, chunk_size
+        )  # type: Iterable[Task]
+    else:
+        tasks = collection.tasks_for_task_class(cls)
     pklist = []  # type: List[int]
-    for task in collection.tasks_for_task_class(cls):
+    for task in tasks:
         pklist.append(task.pk)
         yield task
     audit_descriptions.append(
@@ -794,6 +1095,10 @@ class TaskCollectionExporter(object):
     Class to provide tasks for user download.
     """
 
+    collects_schema_elements = False
+    # ... Does the output format need column information (types), even if
+    # the user hasn't asked for a summary schema?
+
     def __init__(
         self,
         req: "CamcopsRequest",
@@ -812,6 +1117,7 @@ class TaskCollectionExporter(object):
         self.req = req
         self.collection = collection
         self.options = options
+        self.schema_elements = set()  # type: Set[SummarySchemaInfo]
 
     @property
     def viewtype(self) -> str:
@@ -913,38 +1219,52 @@ class TaskCollectionExporter(object):
 
         download_dir = self.req.user_download_dir
         space = self.req.user_download_bytes_available
-        filename, contents = self.to_file()
-        size = len(contents)
-
-        if size > space:
-            # Not enough space
-            total_permitted = self.req.user_download_bytes_permitted
-            msg = _(
-                "You do not have enough space to create this download. "
-                "You are allowed {total_permitted} bytes and you are have "
-                "{space} bytes free. This download would need {size} bytes."
-            ).format(total_permitted=total_permitted, space=space, size=size)
-        else:
-            # Create file
-            fullpath = os.path.join(download_dir, filename)
-            try:
-                with open(fullpath, "wb") as f:
-                    f.write(contents)
-                # Success
-                log.info(f"Created user download: {fullpath}")
-                msg = (
-                    _(
-                        "The research data dump you requested is ready to be "
-                        "downloaded. You will find it in your download area. "
-                        "It is called %s"
-                    )
-                    % filename
-                )
-            except Exception as e:
-                # Some other error
+        filename = self.get_filename()
+
+        # Write to a temporary file first, so that (a) the user never sees a
+        # partial file in their download area, and (b) we can check its size
+        # without holding the contents in memory.
+        tmpfile = tempfile.NamedTemporaryFile(delete=False)
+        try:
+            with tmpfile:
+                self.write_file_body(tmpfile)
+                size = tmpfile.tell()
+
+            if size > space:
+                # Not enough space
+                total_permitted = self.req.user_download_bytes_permitted
                 msg = _(
-                    "Failed to create file {filename}. Error was: {message}"
-                ).format(filename=filename, message=e)
+                    "You do not have enough space to create this download. "
+                    "You are allowed {total_permitted} bytes and you are have "
+                    "{space} bytes free. This download would need {size} "
+                    "bytes."
+                ).format(
+                    total_permitted=total_permitted, space=space, size=size
+                )
+            else:
+                # Create file
+                fullpath = os.path.join(download_dir, filename)
+                try:
+                    shutil.move(tmpfile.name, fullpath)
+                    # Success
+                    log.info(f"Created user download: {fullpath}")
+                    msg = (
+                        _(
+                            "The research data dump you requested is ready to "
+                            "be downloaded. You will find it in your download "
+                            "area. It is called %s"
+                        )
+                        % filename
+                    )
+                except Exception as e:
+                    # Some other error
+                    msg = _(
+                        "Failed to create file {filename}. Error was: "
+                        "{message}"
+                    ).format(filename=filename, message=e)
+        finally:
+            if os.path.exists(tmpfile.name):
+                os.remove(tmpfile.name)
 
         # E-mail the user, if they have an e-mail address
         email_to = self.req.user.email
@@ -983,6 +1303,13 @@ class TaskCollectionExporter(object):
             "Exporter needs to implement 'get_file_body'"
         )
 
+    def write_file_body(self, file: BinaryIO) -> None:
+        """
+        Writes the binary data to a file. Exporters that can write their data
+        incrementally override this, to save memory.
+        """
+        file.write(self.get_file_body())
+
     def get_spreadsheet_collection(self) -> SpreadsheetCollection:
         """
         Converts the collection of tasks to a collection of spreadsheet-style
@@ -993,6 +1320,51 @@ class TaskCollectionExporter(object):
             :class:`camcops_server.cc_modules.cc_spreadsheet.SpreadsheetCollection`
             object
         """
+        coll = SpreadsheetCollection()
+        self.add_to_spreadsheet_collection(coll)
+        return coll
+
+    def get_streaming_spreadsheet_collection(
+        self,
+    ) -> StreamingSpreadsheetCollection:
+        """
+        As for :meth:`get_spreadsheet_collection`, but fetches tasks in
+        chunks and spools the data to disk, so memory use doesn't grow with
+        the number of tasks. The caller must close the collection (e.g. by
+        using it as a context manager).
+
+        Returns:
+            a
+            :class:`camcops_server.cc_modules.cc_spreadsheet.StreamingSpreadsheetCollection`
+            object
+        """
+        coll = StreamingSpreadsheetCollection()
+        try:
+            self.add_to_spreadsheet_collection(
+                coll, chunk_size=DEFAULT_FETCH_CHUNK_SIZE
+            )
+        except Exception:
+            coll.close()
+            raise
+        return coll
+
+    def add_to_spreadsheet_collection(
+        self,
+        coll: Union[SpreadsheetCollection, StreamingSpreadsheetCollection],
+        chunk_size: int = None,
+    ) -> None:
+        """
+        Converts the collection of tasks to spreadsheet-style data, in the
+        spreadsheet collection provided. Also audits the request as a basic
+        data dump.
+
+        Args:
+            coll:
+                the spreadsheet collection to add to
+            chunk_size:
+                if specified, fetch tasks from the database in chunks of this
+                size, rather than all at once
+        """
         audit_descriptions = []  # type: List[str]
         options = self.options
         if options.spreadsheet_simplified:
@@ -1006,24 +1378,27 @@ class TaskCollectionExporter(object):
             summary_exclusion_tables = EMPTY_SET
             summary_exclusion_columns = EMPTY_SET
         # Task may return >1 sheet for output (e.g. for subtables).
-        coll = SpreadsheetCollection()
 
         # Iterate through tasks, creating the spreadsheet collection
         schema_elements = set()  # type: Set[SummarySchemaInfo]
+        want_schema = (
+            options.include_summary_schema or self.collects_schema_elements
+        )
         for cls in self.collection.task_classes():
             schema_done = False
             for task in gen_audited_tasks_for_task_class(
-                self.collection, cls, audit_descriptions
+                self.collection, cls, audit_descriptions, chunk_size
             ):
                 # Task data
                 coll.add_pages(task.get_spreadsheet_pages(self.req))
-                if not schema_done and options.include_summary_schema:
+                if not schema_done and want_schema:
                     # Schema (including summary explanations)
                     schema_elements |= task.get_spreadsheet_schema_elements(
                         self.req
                     )
                     # We just need this from one task instance.
                     schema_done = True
+        self.schema_elements = schema_elements
 
         if options.include_summary_schema:
             coll.add_page(
@@ -1055,10 +1430,37 @@ class TaskCollectionExporter(object):
         # Audit
         audit(self.req, f"Basic dump: {'; '.join(audit_descriptions)}")
 
-        return coll
 
+class StreamingSpreadsheetExporter(TaskCollectionExporter):
+    """
+    Base class for exporters that write spreadsheet files incrementally,
+    via a
+    :class:`camcops_server.cc_modules.cc_spreadsheet.StreamingSpreadsheetCollection`,
+    so that memory use doesn't grow with the number of tasks.
+    """  # noqa
+
+    def write_streaming_collection(
+        self, coll: StreamingSpreadsheetCollection, file: BinaryIO
+    ) -> None:
+        """
+        Writes the spreadsheet collection to a file, in our format.
+        """
+        raise NotImplementedError(
+            "Exporter needs to implement 'write_streaming_collection'"
+        )
+
+    def write_file_body(self, file: BinaryIO) -> None:
+        with self.get_streaming_spreadsheet_collection() as coll:
+            self.write_streaming_collection(coll, file)
+
+    def get_file_body(self) -> bytes:
+        with tempfile.TemporaryFile() as f:
+            self.write_file_body(f)
+            f.seek(0)
+            return f.read()
 
-class OdsExporter(TaskCollectionExporter):
+
+class OdsExporter(StreamingSpreadsheetExporter):
     """
     Converts a set of tasks to an OpenOffice ODS file.
     """
@@ -1066,8 +1468,10 @@ class OdsExporter(TaskCollectionExporter):
     file_extension = "ods"
     viewtype = ViewArg.ODS
 
-    def get_file_body(self) -> bytes:
-        return self.get_spreadsheet_collection().as_ods()
+    def write_streaming_collection(
+        self, coll: StreamingSpreadsheetCollection, file: BinaryIO
+    ) -> None:
+        coll.write_ods(file)
 
     def get_data_response(self, body: bytes, filename: str) -> Response:
         return OdsResponse(body=body, filename=filename)
@@ -1097,7 +1501,7 @@ class RExporter(TaskCollectionExporter):
         return TextAttachmentResponse(body=r_script, filename=filename)
 
 
-class TsvZipExporter(TaskCollectionExporter):
+class TsvZipExporter(StreamingSpreadsheetExporter):
     """
     Converts a set of tasks to a set of TSV (tab-separated value) file, (one
     per table) in a ZIP file.
@@ -1106,14 +1510,41 @@ class TsvZipExporter(TaskCollectionExporter):
     file_extension = "zip"
     viewtype = ViewArg.TSV_ZIP
 
-    def get_file_body(self) -> bytes:
-        return self.get_spreadsheet_collection().as_zip()
+    def write_streaming_collection(
+        self, coll: StreamingSpreadsheetCollection, file: BinaryIO
+    ) -> None:
+        coll.write_zip(file)
 
     def get_data_response(self, body: bytes, filename: str) -> Response:
         return ZipResponse(body=body, filename=filename)
 
 
-class XlsxExporter(TaskCollectionExporter):
+class ParquetZipExporter(StreamingSpreadsheetExporter):
+    """
+    Converts a set of tasks to a set of typed, columnar Apache Parquet files
+    (one per table) in a ZIP file. See
+    :mod:`camcops_server.cc_modules.cc_parquet`.
+    """
+
+    collects_schema_elements = True
+    file_extension = "parquet.zip"
+    viewtype = ViewArg.PARQUET_ZIP
+
+    def write_streaming_collection(
+        self, coll: StreamingSpreadsheetCollection, file: BinaryIO
+    ) -> None:
+        # pyarrow is slow to import and only needed for this export format:
+        from camcops_server.cc_modules.cc_parquet import (
+            write_parquet_zip,
+        )  # delayed import
+
+        write_parquet_zip(coll, file, schema_elements=self.schema_elements)
+
+    def get_data_response(self, body: bytes, filename: str) -> Response:
+        return ZipResponse(body=body, filename=filename)
+
+
+class XlsxExporter(StreamingSpreadsheetExporter):
     """
     Converts a set of tasks to an Excel XLSX file.
     """
@@ -1121,8 +1552,10 @@ class XlsxExporter(TaskCollectionExporter):
     file_extension = "xlsx"
     viewtype = ViewArg.XLSX
 
-    def get_file_body(self) -> bytes:
-        return self.get_spreadsheet_collection().as_xlsx()
+    def write_streaming_collection(
+        self, coll: StreamingSpreadsheetCollection, file: BinaryIO
+    ) -> None:
+        coll.write_xlsx(file)
 
     def get_data_response(self, body: bytes, filename: str) -> Response:
         return XlsxResponse(body=body, filename=filename)
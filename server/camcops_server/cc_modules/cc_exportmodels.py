@@ -30,7 +30,6 @@ camcops_server/cc_modules/cc_exportmodels.py
 import logging
 import os
 import posixpath
-import socket
 import subprocess
 import sys
 from typing import Generator, List, Optional, Tuple, TYPE_CHECKING
@@ -45,7 +44,6 @@ from cardinal_pythonlib.email.sendmail import (
 )
 from cardinal_pythonlib.fileops import mkdir_p
 from cardinal_pythonlib.logs import BraceStyleAdapter
-from cardinal_pythonlib.network import ping
 from cardinal_pythonlib.sqlalchemy.list_types import StringListType
 from cardinal_pythonlib.sqlalchemy.orm_query import bool_from_exists_clause
 import hl7
@@ -74,18 +72,15 @@ from camcops_server.cc_modules.cc_exportrecipientinfo import (
 from camcops_server.cc_modules.cc_fhir import (
     FhirExportException,
     FhirTaskExporter,
+    get_fhir_export_session,
 )
 from camcops_server.cc_modules.cc_filename import change_filename_ext
 from camcops_server.cc_modules.cc_hl7 import (
+    get_mllp_connection_pool,
     make_msh_segment,
-    MLLPTimeoutClient,
     msg_is_successful_ack,
     SEGMENT_SEPARATOR,
 )
-from camcops_server.cc_modules.cc_redcap import (
-    RedcapExportException,
-    RedcapTaskExporter,
-)
 from camcops_server.cc_modules.cc_sqla_coltypes import (
     LongText,
     TableNameColType,
@@ -762,39 +757,34 @@ class ExportedTaskHL7Message(Base):
 
         - https://python-hl7.readthedocs.org/en/latest/api.html; however,
           we've modified that
+
+        - Connections are kept open between messages; see
+          :class:`camcops_server.cc_modules.cc_hl7.MLLPConnectionPool`.
         """  # noqa
         recipient = self.exported_task.recipient
-
-        if recipient.hl7_ping_first:
-            pinged = self.ping_hl7_server(recipient)
-            if not pinged:
-                self.abort("Could not ping HL7 host")
-                return
-
-        try:
-            log.info(
-                "Sending HL7 message to {}:{}",
-                recipient.hl7_host,
-                recipient.hl7_port,
-            )
-            with MLLPTimeoutClient(
-                recipient.hl7_host,
-                recipient.hl7_port,
-                recipient.hl7_network_timeout_ms,
-            ) as client:
-                server_replied, reply = client.send_message(self._hl7_msg)
-        except socket.timeout:
-            self.abort("Failed to send message via MLLP: timeout")
-            return
-        except Exception as e:
-            self.abort(f"Failed to send message via MLLP: {e}")
-            return
-
-        if not server_replied:
-            self.abort("No response from server")
+        pool = get_mllp_connection_pool(
+            recipient.hl7_host,
+            recipient.hl7_port,
+            timeout_ms=recipient.hl7_network_timeout_ms,
+            ping_first=recipient.hl7_ping_first,
+        )
+        log.info(
+            "Sending HL7 message to {}:{}",
+            recipient.hl7_host,
+            recipient.hl7_port,
+        )
+        result = pool.send_message(self._hl7_msg)
+        if not result.replied:
+            self.abort(f"Failed to send message via MLLP: {result.error}")
             return
+        log.debug(
+            "HL7 message {} acknowledged in {:.1f} ms",
+            self.id,
+            1000 * result.latency_s,
+        )
 
         self.reply_at_utc = get_now_utc_datetime()
+        reply = result.reply
         if recipient.hl7_keep_reply:
             self.reply = reply
 
@@ -810,32 +800,6 @@ class ExportedTaskHL7Message(Base):
         else:
             self.abort(failure_reason)
 
-    @staticmethod
-    def ping_hl7_server(recipient: ExportRecipient) -> bool:
-        # noinspection HttpUrlsUsage
-        """
-        Performs a TCP/IP ping on our HL7 server; returns success. If we've
-        already pinged successfully during this run, don't bother doing it
-        again.
-
-        (No HL7 PING method yet. Proposal is
-        http://hl7tsc.org/wiki/index.php?title=FTSD-ConCalls-20081028
-        So use TCP/IP ping.)
-
-        Args:
-            recipient: an :class:`camcops_server.cc_modules.cc_exportrecipient.ExportRecipient`
-
-        Returns:
-            bool: success
-
-        """  # noqa
-        timeout_s = min(recipient.hl7_network_timeout_ms // 1000, 1)
-        if ping(hostname=recipient.hl7_host, timeout_s=timeout_s):
-            return True
-        else:
-            log.error("Failed to ping {!r}", recipient.hl7_host)
-            return False
-
 
 # =============================================================================
 # File export
@@ -1265,8 +1229,12 @@ class ExportedTaskRedcap(Base):
         Args:
             req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
         """
+        # Delayed import; REDCap support brings in pandas, which is slow to
+        # import, and most processes never need it.
+        from camcops_server.cc_modules.cc_redcap import RedcapExportException
+
         exported_task = self.exported_task
-        exporter = RedcapTaskExporter()
+        exporter = req.redcap_task_exporter
 
         try:
             exporter.export_task(req, self)
@@ -1326,7 +1294,8 @@ class ExportedTaskFhir(Base):
         exported_task = self.exported_task
 
         try:
-            exporter = FhirTaskExporter(req, self)
+            session = get_fhir_export_session(req, exported_task.recipient)
+            exporter = FhirTaskExporter(req, self, session=session)
             exporter.export_task()
             exported_task.succeed()
         except FhirExportException as e:
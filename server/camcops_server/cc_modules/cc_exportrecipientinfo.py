@@ -975,6 +975,12 @@ class ExportRecipientInfo(object):
         """
         return self.transmission_method == ExportTransmissionMethod.FHIR
 
+    def using_redcap(self) -> bool:
+        """
+        Is the recipient a REDCap recipient?
+        """
+        return self.transmission_method == ExportTransmissionMethod.REDCAP
+
     def anonymous_ok(self) -> bool:
         """
         Does this recipient permit/want anonymous tasks?
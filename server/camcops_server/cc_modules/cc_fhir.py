@@ -137,6 +137,14 @@ This problem occurs intermittently:
   So we use a carefully sequenced file lock; see
   :func:`camcops_server.cc_modules.cc_export.export_task`.
 
+
+*Export sessions*
+
+Tasks exported to the same recipient in one run share a
+:class:`FhirExportSession`: one HTTP client, and one Questionnaire per task
+type, which is sent only until the server has accepted it. (That also means
+fewer conditional creates to race with each other.)
+
 """
 
 
@@ -144,10 +152,20 @@ This problem occurs intermittently:
 # Imports
 # =============================================================================
 
+import copy
 from enum import Enum
 import json
 import logging
-from typing import Any, Dict, List, TYPE_CHECKING
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TYPE_CHECKING,
+)
 
 from cardinal_pythonlib.datetimefunc import format_datetime
 from cardinal_pythonlib.httpconst import HttpMethod
@@ -180,6 +198,7 @@ from camcops_server.cc_modules.cc_snomed import SnomedExpression, SnomedLookup
 
 if TYPE_CHECKING:
     from camcops_server.cc_modules.cc_exportmodels import ExportedTaskFhir
+    from camcops_server.cc_modules.cc_exportrecipient import ExportRecipient
     from camcops_server.cc_modules.cc_request import CamcopsRequest
 
 log = logging.getLogger(__name__)
@@ -326,35 +345,67 @@ They are validated in FHIRAbstractBase.update_with_json().
 # =============================================================================
 
 
+def fhir_client_settings(recipient: "ExportRecipient") -> Dict[str, str]:
+    """
+    Returns the settings for a :class:`fhirclient.client.FHIRClient` talking
+    to a recipient's FHIR server.
+    """
+    # TODO: In theory these settings should handle authentication
+    # for any server that is SMART-compliant but we've not tested this.
+    # https://sep.com/blog/smart-on-fhir-what-is-smart-what-is-fhir/
+    return {
+        Fc.API_BASE: recipient.fhir_api_url,
+        Fc.APP_ID: recipient.fhir_app_id,
+        Fc.APP_SECRET: recipient.fhir_app_secret,
+        Fc.LAUNCH_TOKEN: recipient.fhir_launch_token,
+    }
+
+
+def make_fhir_client(recipient: "ExportRecipient") -> FHIRClient:
+    """
+    Creates a :class:`fhirclient.client.FHIRClient` for a recipient, or raises
+    :exc:`FhirExportException`.
+    """
+    try:
+        return FHIRClient(settings=fhir_client_settings(recipient))
+    except Exception as e:
+        raise FhirExportException(f"Error creating FHIRClient: {e}")
+
+
 class FhirTaskExporter(object):
     """
     Class that knows how to export a single task to FHIR.
     """
 
     def __init__(
-        self, request: "CamcopsRequest", exported_task_fhir: "ExportedTaskFhir"
+        self,
+        request: "CamcopsRequest",
+        exported_task_fhir: "ExportedTaskFhir",
+        session: "FhirExportSession" = None,
     ) -> None:
+        """
+        Args:
+            request:
+                a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+            exported_task_fhir:
+                a :class:`camcops_server.cc_modules.cc_exportmodels.ExportedTaskFhir`
+            session:
+                optional :class:`FhirExportSession` for the recipient, shared
+                with other tasks being exported to it; if not supplied, we
+                use a client of our own and send everything
+        """  # noqa
         self.request = request
         self.exported_task = exported_task_fhir.exported_task
         self.exported_task_fhir = exported_task_fhir
 
         self.recipient = self.exported_task.recipient
         self.task = self.exported_task.task
+        self.session = session
 
-        # TODO: In theory these settings should handle authentication
-        # for any server that is SMART-compliant but we've not tested this.
-        # https://sep.com/blog/smart-on-fhir-what-is-smart-what-is-fhir/
-        settings = {
-            Fc.API_BASE: self.recipient.fhir_api_url,
-            Fc.APP_ID: self.recipient.fhir_app_id,
-            Fc.APP_SECRET: self.recipient.fhir_app_secret,
-            Fc.LAUNCH_TOKEN: self.recipient.fhir_launch_token,
-        }
-
-        try:
-            self.client = FHIRClient(settings=settings)
-        except Exception as e:
-            raise FhirExportException(f"Error creating FHIRClient: {e}")
+        if session is not None:
+            self.client = session.client
+        else:
+            self.client = make_fhir_client(self.recipient)
 
     def export_task(self) -> None:
         """
@@ -373,7 +424,7 @@ class FhirTaskExporter(object):
         # supported resource types (statement.rest[0].resource[])
 
         bundle = self.task.get_fhir_bundle(
-            self.request, self.exported_task.recipient
+            self.request, self.exported_task.recipient, session=self.session
         )  # may raise FhirExportException
 
         try:
@@ -393,6 +444,8 @@ class FhirTaskExporter(object):
                 )
 
             self.parse_response(response)
+            if self.session is not None:
+                self.session.note_bundle_sent(bundle)
 
         except HTTPError as e:
             raise FhirExportException(
@@ -479,6 +532,114 @@ class FhirTaskExporter(object):
             self.request.dbsession.add(saved_entry)
 
 
+# =============================================================================
+# Export sessions: things shared by all tasks exported to one recipient
+# =============================================================================
+
+
+class FhirExportSession(object):
+    """
+    What we keep for one FHIR recipient during an export run:
+
+    - one :class:`fhirclient.client.FHIRClient`, so that all tasks go via the
+      same HTTP session (and thus reuse its connections);
+
+    - the Questionnaire bundle entries we have built. A Questionnaire
+      describes a task in the abstract. Its identifier incorporates the task
+      table and the server version. The server keeps the first one it is
+      sent, because of "ifNoneExist". So we build one per identifier and
+      language, not one per task;
+
+    - which of those Questionnaires the server has accepted. We don't send
+      them again; QuestionnaireResponse resources refer to them by
+      identifier anyway.
+
+    Use one per recipient for a whole export run (see
+    :func:`get_fhir_export_session`).
+    """
+
+    def __init__(self, recipient: "ExportRecipient") -> None:
+        """
+        Args:
+            recipient:
+                an
+                :class:`camcops_server.cc_modules.cc_exportrecipient.ExportRecipient`
+        """
+        self.settings = fhir_client_settings(recipient)
+        self.client = make_fhir_client(recipient)
+        self._questionnaire_entries = (
+            {}
+        )  # type: Dict[Tuple[str, str], Dict]  # noqa
+        self._questionnaires_sent = set()  # type: Set[str]
+
+    def get_questionnaire_bundle_entry(
+        self,
+        identifier: Identifier,
+        language: str,
+        make_entry: Callable[[], Optional[Dict]],
+    ) -> Optional[Dict]:
+        """
+        Returns a (copy of a) Questionnaire bundle entry, building it via
+        ``make_entry()`` the first time.
+
+        Args:
+            identifier:
+                the Questionnaire's identifier
+            language:
+                the language of its text
+            make_entry:
+                function to build the bundle entry
+        """
+        key = (fhir_sysval_from_id(identifier), language)
+        if key not in self._questionnaire_entries:
+            self._questionnaire_entries[key] = make_entry()
+        return copy.deepcopy(self._questionnaire_entries[key])
+
+    def questionnaire_sent(self, identifier: Identifier) -> bool:
+        """
+        Has the server accepted this Questionnaire during our session?
+        """
+        return fhir_sysval_from_id(identifier) in self._questionnaires_sent
+
+    def note_bundle_sent(self, bundle: Bundle) -> None:
+        """
+        Records that the server has accepted a (transaction) bundle, and
+        therefore any Questionnaire resources in it.
+        """
+        for entry in bundle.entry or []:
+            resource = entry.resource
+            if (
+                resource is None
+                or resource.resource_type != Fc.RESOURCE_TYPE_QUESTIONNAIRE
+            ):
+                continue
+            for identifier in resource.identifier or []:
+                self._questionnaires_sent.add(fhir_sysval_from_id(identifier))
+
+
+def get_fhir_export_session(
+    req: "CamcopsRequest", recipient: "ExportRecipient"
+) -> FhirExportSession:
+    """
+    Returns the :class:`FhirExportSession` for a recipient, shared by all FHIR
+    task exports in this request (export run), creating it if necessary (or
+    if the recipient's FHIR server settings have changed).
+
+    Args:
+        req:
+            a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        recipient:
+            an
+            :class:`camcops_server.cc_modules.cc_exportrecipient.ExportRecipient`
+    """
+    sessions = req.fhir_export_sessions
+    session = sessions.get(recipient.recipient_name)
+    if session is None or session.settings != fhir_client_settings(recipient):
+        session = FhirExportSession(recipient)
+        sessions[recipient.recipient_name] = session
+    return session
+
+
 # =============================================================================
 # Helper functions for building FHIR component objects
 # =============================================================================
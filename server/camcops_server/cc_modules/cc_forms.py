@@ -4117,6 +4117,10 @@ class SpreadsheetFormatSelector(SchemaNode, RequestAwareMixin):
                 ViewArg.TSV_ZIP,
                 _("ZIP file of tab-separated value (TSV) files"),
             ),
+            (
+                ViewArg.PARQUET_ZIP,
+                _("ZIP file of Apache Parquet (typed, columnar) files"),
+            ),
         )
         values, pv = get_values_and_permissible(choices)
         self.widget = RadioChoiceWidget(values=values)
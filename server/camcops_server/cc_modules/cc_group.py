@@ -28,7 +28,7 @@ camcops_server/cc_modules/cc_group.py
 """
 
 import logging
-from typing import List, Optional, Set
+from typing import Dict, List, Optional, Set
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.reprfunc import simple_repr
@@ -36,11 +36,21 @@ from cardinal_pythonlib.sqlalchemy.orm_inspect import gen_columns
 from cardinal_pythonlib.sqlalchemy.orm_query import exists_orm
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm import relationship, Session as SqlASession
+from sqlalchemy.sql.expression import select
 from sqlalchemy.sql.schema import Column, ForeignKey, Table
 from sqlalchemy.sql.sqltypes import Integer
 
+from camcops_server.cc_modules.cc_cache import (
+    register_shared_cache_dependency,
+    shared_cache_get_or_create,
+    SharedCacheKeys,
+)
 from camcops_server.cc_modules.cc_ipuse import IpUse
-from camcops_server.cc_modules.cc_policy import TokenizedPolicy
+from camcops_server.cc_modules.cc_policy import (
+    compile_id_policy,
+    CompiledPolicy,
+    TokenizedPolicy,
+)
 from camcops_server.cc_modules.cc_sqla_coltypes import (
     GroupDescriptionColType,
     GroupNameColType,
@@ -262,3 +272,48 @@ class Group(Base):
         Returns the finalize policy for a group.
         """
         return TokenizedPolicy(self.finalize_policy)
+
+    def compiled_upload_policy(self) -> CompiledPolicy:
+        """
+        Returns the upload policy for a group, compiled for checking patients
+        (and cached until the policy changes).
+        """
+        return compile_id_policy(self.upload_policy)
+
+    def compiled_finalize_policy(self) -> CompiledPolicy:
+        """
+        Returns the finalize policy for a group, compiled for checking
+        patients (and cached until the policy changes).
+        """
+        return compile_id_policy(self.finalize_policy)
+
+
+# =============================================================================
+# Which groups can see which
+# =============================================================================
+
+
+def get_group_visibility(dbsession: SqlASession) -> Dict[int, List[int]]:
+    """
+    Returns a dictionary mapping group IDs to the IDs of the other groups that
+    each may see, via the shared cache if the session has one.
+    """
+
+    def creator() -> Dict[int, List[int]]:
+        visibility = {}  # type: Dict[int, List[int]]
+        query = select(
+            [
+                group_group_table.c.group_id,
+                group_group_table.c.can_see_group_id,
+            ]
+        )
+        for group_id, can_see_group_id in dbsession.execute(query):
+            visibility.setdefault(group_id, []).append(can_see_group_id)
+        return visibility
+
+    return shared_cache_get_or_create(
+        dbsession, SharedCacheKeys.GROUP_VISIBILITY, creator
+    )
+
+
+register_shared_cache_dependency(Group, SharedCacheKeys.GROUP_VISIBILITY)
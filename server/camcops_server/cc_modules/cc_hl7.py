@@ -63,11 +63,15 @@ We can then add an option for structure (XML), HTML, PDF export.
 
 import base64
 import logging
+import select
 import socket
-from typing import List, Optional, Tuple, TYPE_CHECKING, Union
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING, Union
 
 from cardinal_pythonlib.datetimefunc import format_datetime
 from cardinal_pythonlib.logs import BraceStyleAdapter
+from cardinal_pythonlib.network import ping
 import hl7
 from pendulum import Date, DateTime as Pendulum
 
@@ -862,6 +866,8 @@ CR = "\x0d"  # <CR>, \r
 FF = "\x0c"  # <FF>, new page form feed
 
 RECV_BUFFER = 4096
+# Close pooled MLLP connections that have been idle for longer than this:
+MLLP_MAX_IDLE_S = 60
 
 
 class MLLPTimeoutClient(object):
@@ -878,6 +884,7 @@ class MLLPTimeoutClient(object):
         self.socket.settimeout(timeout_s)
         self.socket.connect((host, port))
         self.encoding = "utf-8"
+        self._recv_buffer = bytearray()
 
     def __enter__(self):
         """
@@ -932,3 +939,472 @@ class MLLPTimeoutClient(object):
             return True, ack_msg
         except socket.timeout:
             return False, None
+
+    def is_alive(self) -> bool:
+        """
+        Can this (idle) connection be reused? Checks, without blocking, that
+        the server hasn't closed it (or sent us anything unexpected, which
+        would leave us unsure what any later reply refers to).
+        """
+        if self._recv_buffer:
+            return False
+        try:
+            readable, _, _ = select.select([self.socket], [], [], 0)
+            if not readable:
+                return True
+            # Readable: either EOF (closed by the server) or unsolicited data.
+            # Either way, don't use it.
+            data = self.socket.recv(1, socket.MSG_PEEK)
+        except (OSError, ValueError):  # ValueError: socket already closed
+            return False
+        if data:
+            log.warning("Unexpected data on idle MLLP connection; closing it")
+        return False
+
+    def send_framed(self, data: bytes) -> None:
+        """
+        Sends data that is already wrapped in an MLLP container, without
+        waiting for a reply.
+        """
+        self.socket.sendall(data)
+
+    def recv_message(self) -> Optional[str]:
+        """
+        Waits for, and returns, the next complete MLLP-framed message from
+        the server (without its MLLP container). Unlike :meth:`send`, copes
+        with replies that span several reads, or several replies in one read.
+
+        Returns ``None`` if the server has closed the connection.
+
+        Raises :exc:`socket.timeout` if the server doesn't reply in time.
+        """
+        terminator = (EB + CR).encode(self.encoding)
+        while True:
+            end = self._recv_buffer.find(terminator)
+            if end >= 0:
+                frame = self._recv_buffer[:end]
+                del self._recv_buffer[: end + len(terminator)]
+                start = frame.find(SB.encode(self.encoding))
+                if start >= 0:
+                    frame = frame[start + 1 :]
+                return frame.decode(self.encoding)
+            chunk = self.socket.recv(RECV_BUFFER)
+            if not chunk:
+                return None
+            self._recv_buffer.extend(chunk)
+
+
+def wrap_in_mllp_container(message: Union[str, hl7.Message]) -> str:
+    """
+    Wraps a string or :class:`hl7.Message` in an MLLP container, as per
+    :meth:`MLLPTimeoutClient.send_message`.
+    """
+    return SB + str(message) + CR + EB + CR
+
+
+def _get_segment_field(
+    message: Union[str, hl7.Message], segment_id: str, field_number: int
+) -> str:
+    """
+    Returns a field from the first segment of a given type, using standard
+    HL7 numbering (e.g. MSH-10), by splitting the message text. (This is
+    independent of how python-hl7 numbers MSH fields.) Raises
+    :exc:`ValueError` if it's not there.
+    """
+    for segment in (
+        str(message).strip(SB + EB + CR + "\n").split(SEGMENT_SEPARATOR)
+    ):
+        segment = segment.strip()
+        if not segment.startswith(segment_id) or len(segment) < 4:
+            continue
+        field_separator = segment[3]
+        fields = segment.split(field_separator)
+        if segment_id == "MSH":
+            # MSH-1 is the field separator itself.
+            field_number -= 1
+        if field_number < len(fields):
+            return fields[field_number]
+        break
+    raise ValueError(f"No {segment_id}-{field_number} field in message")
+
+
+def get_message_control_id(message: Union[str, hl7.Message]) -> str:
+    """
+    Returns the message control ID (MSH-10) of an HL7 message.
+    """
+    return _get_segment_field(message, "MSH", 10)
+
+
+def get_acknowledged_control_id(ack: Union[str, hl7.Message]) -> str:
+    """
+    Returns the control ID of the message being acknowledged (MSA-2) by an
+    HL7 ACK message.
+    """
+    return _get_segment_field(ack, "MSA", 2)
+
+
+# =============================================================================
+# MLLP connection pool
+# =============================================================================
+
+
+class MLLPReply(object):
+    """
+    The result of sending one message via an :class:`MLLPConnectionPool`.
+    """
+
+    def __init__(
+        self,
+        replied: bool,
+        reply: Optional[str] = None,
+        latency_s: Optional[float] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        """
+        Args:
+            replied:
+                did the server reply?
+            reply:
+                the reply (without its MLLP container)
+            latency_s:
+                time from sending the message to receiving the reply
+            error:
+                reason for failure, if the server didn't reply
+        """
+        self.replied = replied
+        self.reply = reply
+        self.latency_s = latency_s
+        self.error = error
+
+    def __repr__(self) -> str:
+        return (
+            f"MLLPReply(replied={self.replied!r}, reply={self.reply!r}, "
+            f"latency_s={self.latency_s!r}, error={self.error!r})"
+        )
+
+
+class MLLPConnectionPool(object):
+    """
+    Keeps MLLP connections to one HL7 server open across messages, rather
+    than opening a new TCP connection for each message.
+
+    - Connections are reused until they fail. Before reusing an idle
+      connection, we check that the server hasn't closed it, and we close
+      connections that have been idle for longer than ``max_idle_s``.
+    - A message is never sent twice. If a connection fails after a message
+      has been sent (so the server may have processed it), the message is
+      reported as not acknowledged. (If it fails while we are sending, on a
+      reused connection, the server can't have had the whole message, so we
+      reconnect and send it again.)
+    - :meth:`send_messages` can keep several messages in flight on one
+      connection, matching ACKs to messages by control ID (MSH-10/MSA-2).
+    - Thread-safe: each thread using the pool at once gets its own
+      connection.
+
+    Use :func:`get_mllp_connection_pool` to share pools within a process.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        timeout_ms: int = None,
+        ping_first: bool = False,
+        max_idle_s: float = MLLP_MAX_IDLE_S,
+    ) -> None:
+        """
+        Args:
+            host: HL7 server hostname
+            port: HL7 server port
+            timeout_ms: network timeout, in ms
+            ping_first: ping the host (via TCP/IP ping) before opening each
+                new connection?
+            max_idle_s: close connections that have been idle for longer
+                than this, in seconds
+        """
+        self.host = host
+        self.port = port
+        self.timeout_ms = timeout_ms
+        self.ping_first = ping_first
+        self.max_idle_s = max_idle_s
+        # Idle connections, with the time each was last used:
+        self._idle = []  # type: List[Tuple[MLLPTimeoutClient, float]]
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return (
+            f"<{self.__class__.__name__} {self.host}:{self.port}, "
+            f"{len(self._idle)} idle connection(s)>"
+        )
+
+    # -------------------------------------------------------------------------
+    # Connections
+    # -------------------------------------------------------------------------
+
+    def _connect(self) -> MLLPTimeoutClient:
+        """
+        Opens a new connection, or raises :exc:`OSError`.
+        """
+        if self.ping_first:
+            timeout_s = max(1, (self.timeout_ms or 0) // 1000)
+            if not ping(hostname=self.host, timeout_s=timeout_s):
+                raise OSError(f"Could not ping HL7 host {self.host!r}")
+        log.debug("Opening MLLP connection to {}:{}", self.host, self.port)
+        return MLLPTimeoutClient(self.host, self.port, self.timeout_ms)
+
+    def _acquire(self) -> Tuple[MLLPTimeoutClient, bool]:
+        """
+        Returns ``client, reused``: the most recently used idle connection
+        that is still usable, or a new connection. Closes idle connections
+        that have been idle for too long, or that the server has closed.
+        """
+        oldest_allowed = time.monotonic() - self.max_idle_s
+        with self._lock:
+            # The least recently used connections are first.
+            n_expired = 0
+            while (
+                n_expired < len(self._idle)
+                and self._idle[n_expired][1] < oldest_allowed
+            ):
+                n_expired += 1
+            expired = [client for client, _ in self._idle[:n_expired]]
+            del self._idle[:n_expired]
+        for client in expired:
+            client.close()
+        if expired:
+            log.debug(
+                "Closed {} idle MLLP connection(s) to {}:{}",
+                len(expired),
+                self.host,
+                self.port,
+            )
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                client, _ = self._idle.pop()
+            if client.is_alive():
+                return client, True
+            log.debug(
+                "Idle MLLP connection to {}:{} was closed by the server",
+                self.host,
+                self.port,
+            )
+            client.close()
+        return self._connect(), False
+
+    def _release(self, client: MLLPTimeoutClient) -> None:
+        """
+        Returns a healthy connection to the pool.
+        """
+        with self._lock:
+            self._idle.append((client, time.monotonic()))
+
+    def close(self) -> None:
+        """
+        Closes all idle connections.
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for client, _ in idle:
+            client.close()
+
+    # -------------------------------------------------------------------------
+    # Sending
+    # -------------------------------------------------------------------------
+
+    def send_message(self, message: Union[str, hl7.Message]) -> MLLPReply:
+        """
+        Sends a single message and waits for the reply.
+
+        Args:
+            message: a string or :class:`hl7.Message`
+
+        Returns:
+            an :class:`MLLPReply`
+        """
+        data = wrap_in_mllp_container(message).encode("utf-8")
+        while True:
+            try:
+                client, reused = self._acquire()
+            except OSError as e:
+                return MLLPReply(replied=False, error=str(e))
+            start = time.perf_counter()
+            try:
+                client.send_framed(data)
+            except OSError as e:
+                # The server can't have received the whole message, so it's
+                # safe to send it again on a new connection (if this one was
+                # an old one that has just failed).
+                client.close()
+                if reused:
+                    log.debug("Reconnecting to {}:{}", self.host, self.port)
+                    continue
+                return MLLPReply(replied=False, error=str(e))
+            # From here on, the server may have processed the message, so we
+            # mustn't send it again.
+            try:
+                reply = client.recv_message()
+            except socket.timeout:
+                # We don't know what state the stream is in; don't reuse it.
+                client.close()
+                return MLLPReply(
+                    replied=False, error="No response from server (timeout)"
+                )
+            except OSError as e:
+                client.close()
+                return MLLPReply(replied=False, error=str(e))
+            if reply is None:
+                # Server closed the connection without replying.
+                client.close()
+                return MLLPReply(
+                    replied=False, error="Connection closed by server"
+                )
+            self._release(client)
+            return MLLPReply(
+                replied=True,
+                reply=reply,
+                latency_s=time.perf_counter() - start,
+            )
+
+    def send_messages(
+        self,
+        messages: List[Union[str, hl7.Message]],
+        max_in_flight: int = 1,
+    ) -> List[MLLPReply]:
+        """
+        Sends several messages on one connection, keeping up to
+        ``max_in_flight`` messages sent but not yet acknowledged. Replies are
+        matched to messages by control ID, so the server may acknowledge
+        them in any order. Each message must have a distinct control ID.
+
+        If the connection fails, messages sent but not yet acknowledged are
+        reported as failed (they may have been processed, so we don't send
+        them again), and messages not yet sent are sent one at a time via
+        :meth:`send_message`.
+
+        Args:
+            messages: strings or :class:`hl7.Message` objects
+            max_in_flight: maximum number of unacknowledged messages
+
+        Returns:
+            a list of :class:`MLLPReply` objects, one per message, in the
+            same order as ``messages``
+        """
+        max_in_flight = max(1, max_in_flight)
+        n = len(messages)
+        results = [None] * n  # type: List[Optional[MLLPReply]]
+        if n == 0:
+            return []
+        if max_in_flight == 1 or n == 1:
+            return [self.send_message(m) for m in messages]
+
+        control_ids = [get_message_control_id(m) for m in messages]
+        if len(set(control_ids)) != n:
+            raise ValueError("Messages must have distinct control IDs")
+        index_for_control_id = {cid: i for i, cid in enumerate(control_ids)}
+        sent_at = {}  # type: Dict[str, float]
+        next_to_send = 0
+
+        try:
+            client, _ = self._acquire()
+        except OSError as e:
+            return [MLLPReply(replied=False, error=str(e))] * n
+        healthy = True
+        try:
+            while next_to_send < n or sent_at:
+                # Fill the pipeline
+                while next_to_send < n and len(sent_at) < max_in_flight:
+                    message = messages[next_to_send]
+                    start = time.perf_counter()
+                    client.send_framed(
+                        wrap_in_mllp_container(message).encode("utf-8")
+                    )
+                    sent_at[control_ids[next_to_send]] = start
+                    next_to_send += 1
+                # Collect a reply
+                reply = client.recv_message()
+                if reply is None:
+                    raise ConnectionError("Connection closed by server")
+                try:
+                    cid = get_acknowledged_control_id(reply)
+                except ValueError:  # malformed reply, or not an ACK
+                    cid = None
+                if cid not in sent_at:
+                    log.warning(
+                        "Ignoring unexpected reply from {}:{}: {!r}",
+                        self.host,
+                        self.port,
+                        reply,
+                    )
+                    continue
+                results[index_for_control_id[cid]] = MLLPReply(
+                    replied=True,
+                    reply=reply,
+                    latency_s=time.perf_counter() - sent_at.pop(cid),
+                )
+        except socket.timeout:
+            healthy = False
+            for cid in sent_at:
+                results[index_for_control_id[cid]] = MLLPReply(
+                    replied=False, error="No response from server (timeout)"
+                )
+        except OSError as e:
+            healthy = False
+            log.debug(
+                "Pipelined sending to {}:{} failed ({}); sending the rest "
+                "singly",
+                self.host,
+                self.port,
+                e,
+            )
+            for cid in sent_at:
+                results[index_for_control_id[cid]] = MLLPReply(
+                    replied=False, error=str(e) or "Connection failed"
+                )
+        finally:
+            if healthy:
+                self._release(client)
+            else:
+                client.close()
+        # Anything not yet sent goes singly:
+        for i in range(n):
+            if results[i] is None:
+                results[i] = self.send_message(messages[i])
+        return results
+
+
+_mllp_pools = (
+    {}
+)  # type: Dict[Tuple[str, int, Optional[int], bool], MLLPConnectionPool]  # noqa
+_mllp_pools_lock = threading.Lock()
+
+
+def get_mllp_connection_pool(
+    host: str, port: int, timeout_ms: int = None, ping_first: bool = False
+) -> MLLPConnectionPool:
+    """
+    Returns the process-wide :class:`MLLPConnectionPool` for an HL7 server,
+    creating it if necessary.
+    """
+    key = (host, port, timeout_ms, ping_first)
+    with _mllp_pools_lock:
+        pool = _mllp_pools.get(key)
+        if pool is None:
+            pool = MLLPConnectionPool(
+                host, port, timeout_ms=timeout_ms, ping_first=ping_first
+            )
+            _mllp_pools[key] = pool
+        return pool
+
+
+def close_mllp_connection_pools() -> None:
+    """
+    Closes all idle connections in all pools made by
+    :func:`get_mllp_connection_pool`.
+    """
+    with _mllp_pools_lock:
+        pools = list(_mllp_pools.values())
+    for pool in pools:
+        pool.close()
@@ -28,15 +28,22 @@ camcops_server/cc_modules/cc_idnumdef.py
 """
 
 import logging
-from typing import List, Optional, Tuple, TYPE_CHECKING
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.nhs import is_valid_nhs_number
 from cardinal_pythonlib.reprfunc import simple_repr
+from sqlalchemy.inspection import inspect
 from sqlalchemy.orm import Session as SqlASession
 from sqlalchemy.sql.schema import Column
 from sqlalchemy.sql.sqltypes import Integer, String
 
+from camcops_server.cc_modules.cc_cache import (
+    get_shared_cache,
+    register_shared_cache_dependency,
+    shared_cache_get_or_create,
+    SharedCacheKeys,
+)
 from camcops_server.cc_modules.cc_pyramid import Routes
 from camcops_server.cc_modules.cc_sqla_coltypes import (
     HL7AssigningAuthorityType,
@@ -229,3 +236,32 @@ def get_idnum_definitions(dbsession: SqlASession) -> List[IdNumDefinition]:
     return list(
         dbsession.query(IdNumDefinition).order_by(IdNumDefinition.which_idnum)
     )
+
+
+def get_cached_idnum_definitions(
+    dbsession: SqlASession,
+) -> List[IdNumDefinition]:
+    """
+    As for :func:`get_idnum_definitions`, but via the shared cache, if the
+    session has one. In that case, the objects returned are copies that are
+    not in the session: they are for reading only.
+    """
+    if get_shared_cache(dbsession) is None:
+        return get_idnum_definitions(dbsession)
+    attrnames = [attr.key for attr in inspect(IdNumDefinition).column_attrs]
+
+    def creator() -> List[Dict[str, Any]]:
+        return [
+            {a: getattr(iddef, a) for a in attrnames}
+            for iddef in get_idnum_definitions(dbsession)
+        ]
+
+    rows = shared_cache_get_or_create(
+        dbsession, SharedCacheKeys.IDNUM_DEFINITIONS, creator
+    )
+    return [IdNumDefinition(**row) for row in rows]
+
+
+register_shared_cache_dependency(
+    IdNumDefinition, SharedCacheKeys.IDNUM_DEFINITIONS
+)
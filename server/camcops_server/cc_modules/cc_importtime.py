@@ -0,0 +1,173 @@
+"""
+camcops_server/cc_modules/cc_importtime.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Measure how long it takes to import CamCOPS modules.**
+
+Every server process, Celery worker, and command-line invocation pays the cost
+of importing CamCOPS (and its dependencies) before it does anything useful.
+This module runs a fresh Python interpreter with ``-X importtime`` (see
+https://docs.python.org/3/using/cmdline.html#cmdoption-X) and summarizes the
+result, so that we can spot slow imports that could be delayed.
+
+"""
+
+import os
+import subprocess
+import sys
+from typing import List, NamedTuple, TextIO
+
+from camcops_server.cc_modules.cc_baseconstants import (
+    CAMCOPS_SERVER_DIRECTORY,
+)
+
+# =============================================================================
+# Constants
+# =============================================================================
+
+DEFAULT_IMPORTTIME_MODULE = "camcops_server.camcops_server_core"
+DEFAULT_IMPORTTIME_TOP_N = 30
+IMPORTTIME_PREFIX = "import time:"
+MICROSECONDS_PER_SECOND = 1000000
+
+
+# =============================================================================
+# Parsing
+# =============================================================================
+
+
+class ModuleImportTime(NamedTuple):
+    """
+    The time taken to import one module.
+    """
+
+    module: str
+    self_us: int  # time spent importing this module, in microseconds
+    cumulative_us: int  # ... including the modules it imported
+    depth: int  # nesting depth; 0 for a module imported at the top level
+
+
+def parse_importtime_output(text: str) -> List[ModuleImportTime]:
+    """
+    Parses the output (to ``stderr``) of ``python -X importtime``, which looks
+    like this:
+
+    .. code-block:: none
+
+        import time: self [us] | cumulative | imported package
+        import time:       123 |        123 |   _io
+        import time:       456 |        579 | io
+
+    Other lines (e.g. warnings) are ignored.
+    """
+    results = []  # type: List[ModuleImportTime]
+    for line in text.splitlines():
+        if not line.startswith(IMPORTTIME_PREFIX):
+            continue
+        parts = line[len(IMPORTTIME_PREFIX) :].split("|")
+        if len(parts) != 3:
+            continue
+        self_us, cumulative_us, name = parts
+        try:
+            self_us = int(self_us)
+            cumulative_us = int(cumulative_us)
+        except ValueError:  # the header line
+            continue
+        stripped = name.lstrip(" ")
+        depth = (len(name) - len(stripped) - 1) // 2
+        results.append(
+            ModuleImportTime(
+                module=stripped.rstrip(),
+                self_us=self_us,
+                cumulative_us=cumulative_us,
+                depth=max(depth, 0),
+            )
+        )
+    return results
+
+
+def measure_import_times(module: str) -> List[ModuleImportTime]:
+    """
+    Imports a module in a new Python interpreter, and returns the time taken
+    to import it and everything it imports.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        # Run from the directory containing our package, so that (for
+        # example) camcops_server.py in the current directory doesn't hide the
+        # camcops_server package:
+        cwd=os.path.dirname(CAMCOPS_SERVER_DIRECTORY),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"Failed to import {module}:\n{result.stderr[-2000:]}"
+        )
+    return parse_importtime_output(result.stderr)
+
+
+# =============================================================================
+# Reporting
+# =============================================================================
+
+
+def report_import_times(
+    times: List[ModuleImportTime],
+    top_n: int = DEFAULT_IMPORTTIME_TOP_N,
+    file: TextIO = sys.stdout,
+) -> None:
+    """
+    Prints the total import time, and the modules that took longest to import
+    (by their own time, and including the modules they imported).
+    """
+
+    def s(us: int) -> str:
+        return f"{us / MICROSECONDS_PER_SECOND:8.3f}"
+
+    total_us = sum(t.cumulative_us for t in times if t.depth == 0)
+    print(
+        f"Imported {len(times)} modules in {s(total_us).strip()} s", file=file
+    )
+    for heading, key in (
+        ("self", lambda t: t.self_us),
+        ("cumulative", lambda t: t.cumulative_us),
+    ):
+        print(f"\nTop {top_n} modules by {heading} time:", file=file)
+        print(f"{'self (s)':>8}  {'cum. (s)':>8}  module", file=file)
+        for t in sorted(times, key=key, reverse=True)[:top_n]:
+            print(
+                f"{s(t.self_us)}  {s(t.cumulative_us)}  {t.module}", file=file
+            )
+
+
+def print_import_times(
+    module: str = DEFAULT_IMPORTTIME_MODULE,
+    top_n: int = DEFAULT_IMPORTTIME_TOP_N,
+) -> None:
+    """
+    Measures how long a module takes to import, and prints a report.
+    """
+    report_import_times(measure_import_times(module), top_n=top_n)
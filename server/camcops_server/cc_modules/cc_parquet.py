@@ -0,0 +1,359 @@
+"""
+camcops_server/cc_modules/cc_parquet.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Write spreadsheet-style data as typed, columnar Apache Parquet files.**
+
+Text formats (TSV, etc.) have to be parsed, and their column types guessed,
+each time they are loaded into an analysis tool. Parquet files are columnar,
+compressed, and typed, and load quickly into R (``arrow::read_parquet``),
+Python (``pandas.read_parquet``), and so on.
+
+- Each page of a
+  :class:`camcops_server.cc_modules.cc_spreadsheet.StreamingSpreadsheetCollection`
+  becomes one Parquet file, within a ZIP file.
+- Column types come from the SQLAlchemy column types and summary element
+  types, via
+  :class:`camcops_server.cc_modules.cc_dataclasses.SummarySchemaInfo`
+  objects. Columns we know nothing about (or whose values don't fit their
+  declared type) are typed from their values.
+- Text summary values are stored as dictionaries (categorical variables, or
+  factors in R).
+- Rows are written in row groups, so memory use doesn't grow with the number
+  of rows.
+
+"""
+
+import datetime
+from decimal import Decimal
+import logging
+import tempfile
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+import zipfile
+
+from cardinal_pythonlib.logs import BraceStyleAdapter
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy.sql.type_api import TypeEngine
+
+from camcops_server.cc_modules.cc_dataclasses import SummarySchemaInfo
+from camcops_server.cc_modules.cc_spreadsheet import (
+    SpooledSpreadsheetPage,
+    StreamingSpreadsheetCollection,
+)
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+
+# =============================================================================
+# Constants
+# =============================================================================
+
+PARQUET_EXTENSION = ".parquet"
+PARQUET_ROW_GROUP_SIZE = 10000  # rows per row group (and per read from disk)
+
+ARROW_BOOL = pa.bool_()
+ARROW_INT = pa.int64()
+ARROW_FLOAT = pa.float64()
+ARROW_STRING = pa.string()
+ARROW_CATEGORY = pa.dictionary(pa.int32(), pa.string())
+ARROW_TIMESTAMP = pa.timestamp("us", tz="UTC")
+ARROW_DATE = pa.date32()
+ARROW_BINARY = pa.binary()
+
+# Arrow types that will also hold values of a narrower Arrow type:
+WIDER_ARROW_TYPES = {
+    ARROW_INT: {ARROW_BOOL},
+    ARROW_FLOAT: {ARROW_BOOL, ARROW_INT},
+}
+
+# Information about columns, by page name, then column name:
+ColumnInfoDict = Dict[str, Dict[str, SummarySchemaInfo]]
+
+
+# =============================================================================
+# Types
+# =============================================================================
+
+
+def arrow_type_from_python_types(python_types: Iterable[type]) -> pa.DataType:
+    """
+    Returns the Arrow type that will store values of all the Python types
+    given (falling back to text).
+    """
+    python_types = set(python_types)
+    if not python_types:
+        return ARROW_STRING
+    if all(issubclass(t, bool) for t in python_types):
+        return ARROW_BOOL
+    if all(issubclass(t, int) for t in python_types):
+        return ARROW_INT
+    if all(issubclass(t, (int, float, Decimal)) for t in python_types):
+        return ARROW_FLOAT
+    if all(issubclass(t, datetime.datetime) for t in python_types):
+        return ARROW_TIMESTAMP
+    if all(issubclass(t, datetime.date) for t in python_types):
+        # ... and they are not all datetimes
+        if not any(issubclass(t, datetime.datetime) for t in python_types):
+            return ARROW_DATE
+    if all(issubclass(t, bytes) for t in python_types):
+        return ARROW_BINARY
+    return ARROW_STRING
+
+
+def arrow_type_from_sqla_type(coltype: TypeEngine) -> pa.DataType:
+    """
+    Returns the Arrow type for an SQLAlchemy column type, via the Python type
+    of its values. Types we can't store natively (e.g. durations or semantic
+    versions) are stored as text.
+    """
+    if isinstance(coltype, type):
+        # e.g. "coltype=Integer" rather than "coltype=Integer()"
+        coltype = coltype()
+    try:
+        python_type = coltype.python_type
+    except NotImplementedError:
+        return ARROW_STRING
+    return arrow_type_from_python_types([python_type])
+
+
+def get_column_info(
+    schema_elements: Iterable[SummarySchemaInfo],
+) -> ColumnInfoDict:
+    """
+    Indexes schema information by page (table) name and column name.
+    """
+    column_info = {}  # type: ColumnInfoDict
+    for si in schema_elements:
+        column_info.setdefault(si.table_name, {})[si.column_name] = si
+    return column_info
+
+
+def choose_arrow_type(
+    info: Optional[SummarySchemaInfo], python_types: Set[type]
+) -> pa.DataType:
+    """
+    Chooses the Arrow type for a column.
+
+    Args:
+        info:
+            what we know about the column (its declared type), if anything
+        python_types:
+            the types of the (non-null) values that the column actually holds
+
+    Returns:
+        the declared type, if the values fit it; otherwise, a type inferred
+        from the values. Text summary columns are dictionary-encoded.
+    """
+    declared = None  # type: Optional[pa.DataType]
+    if info is not None and info.coltype is not None:
+        declared = arrow_type_from_sqla_type(info.coltype)
+    observed = arrow_type_from_python_types(python_types)
+    if declared is None:
+        arrow_type = observed
+    elif (
+        not python_types
+        or observed == declared
+        or declared == ARROW_STRING
+        or observed in WIDER_ARROW_TYPES.get(declared, ())
+    ):
+        arrow_type = declared
+    else:
+        log.debug(
+            "Column {}.{}, declared as {}, holds {}; storing as {}",
+            info.table_name,
+            info.column_name,
+            declared,
+            python_types,
+            observed,
+        )
+        arrow_type = observed
+    if (
+        arrow_type == ARROW_STRING
+        and info is not None
+        and info.source == SummarySchemaInfo.SSV_SUMMARY
+    ):
+        return ARROW_CATEGORY
+    return arrow_type
+
+
+def arrow_values(values: List[Any], arrow_type: pa.DataType) -> pa.Array:
+    """
+    Converts a column of Python values to an Arrow array of the type given
+    (which should have been chosen by :func:`choose_arrow_type`).
+    """
+    if arrow_type in (ARROW_STRING, ARROW_CATEGORY):
+        values = [
+            v if v is None or isinstance(v, str) else str(v) for v in values
+        ]
+        array = pa.array(values, type=ARROW_STRING)
+        if arrow_type == ARROW_CATEGORY:
+            return array.dictionary_encode()
+        return array
+    if arrow_type == ARROW_FLOAT:
+        values = [None if v is None else float(v) for v in values]
+    elif arrow_type == ARROW_INT:
+        values = [None if v is None else int(v) for v in values]
+    elif arrow_type == ARROW_DATE:
+        values = [
+            v.date() if isinstance(v, datetime.datetime) else v for v in values
+        ]
+    return pa.array(values, type=arrow_type)
+
+
+# =============================================================================
+# Writing
+# =============================================================================
+
+
+def get_page_arrow_schema(
+    page: SpooledSpreadsheetPage,
+    headings: List[str],
+    column_info: Dict[str, SummarySchemaInfo],
+) -> pa.Schema:
+    """
+    Works out the Arrow schema for a page. This needs a pass through the data
+    (which is on disk), to check the types of the values.
+    """
+    python_types = [set() for _ in headings]  # type: List[Set[type]]
+    for row in page.gen_rows(headings):
+        for types, value in zip(python_types, row):
+            if value is not None:
+                types.add(type(value))
+    fields = []  # type: List[pa.Field]
+    for heading, types in zip(headings, python_types):
+        info = column_info.get(heading)
+        field = pa.field(heading, choose_arrow_type(info, types))
+        if info is not None and info.comment:
+            field = field.with_metadata({"comment": info.comment})
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def _gen_row_groups(
+    page: SpooledSpreadsheetPage, headings: List[str], size: int
+) -> Iterable[List[List[Any]]]:
+    """
+    Generates rows of a page in groups of (up to) ``size``, as lists of
+    columns.
+    """
+    rows = []  # type: List[List[Any]]
+    for row in page.gen_rows(headings):
+        rows.append(row)
+        if len(rows) >= size:
+            yield [list(column) for column in zip(*rows)]
+            rows = []
+    if rows:
+        yield [list(column) for column in zip(*rows)]
+
+
+def write_parquet_page(
+    page: SpooledSpreadsheetPage,
+    headings: List[str],
+    file: Union[str, BinaryIO],
+    column_info: Dict[str, SummarySchemaInfo] = None,
+    row_group_size: int = PARQUET_ROW_GROUP_SIZE,
+) -> pa.Schema:
+    """
+    Writes one page as a Parquet file.
+
+    Args:
+        page: the page
+        headings: the columns to write, in order
+        file: filename or binary file-like object to write to
+        column_info: information about the page's columns, by column name
+        row_group_size: number of rows per Parquet row group
+
+    Returns:
+        the Arrow schema used
+    """
+    schema = get_page_arrow_schema(page, headings, column_info or {})
+    with pq.ParquetWriter(file, schema) as writer:
+        for columns in _gen_row_groups(page, headings, row_group_size):
+            writer.write_batch(
+                pa.RecordBatch.from_arrays(
+                    [
+                        arrow_values(values, field.type)
+                        for values, field in zip(columns, schema)
+                    ],
+                    schema=schema,
+                )
+            )
+    return schema
+
+
+def write_parquet_zip(
+    coll: StreamingSpreadsheetCollection,
+    file: Union[str, BinaryIO],
+    schema_elements: Iterable[SummarySchemaInfo] = (),
+    row_group_size: int = PARQUET_ROW_GROUP_SIZE,
+) -> List[Tuple[str, pa.Schema]]:
+    """
+    Writes a spreadsheet collection as a ZIP file containing one Parquet file
+    per page.
+
+    Args:
+        coll: the spreadsheet collection
+        file: filename or binary file-like object to write to
+        schema_elements: information about the columns
+        row_group_size: number of rows per Parquet row group
+
+    Returns:
+        a list of ``filename, schema`` tuples for the files written
+    """
+    column_info = get_column_info(schema_elements)
+    written = []  # type: List[Tuple[str, pa.Schema]]
+    # Parquet files are already compressed.
+    with zipfile.ZipFile(file, mode="w", compression=zipfile.ZIP_STORED) as z:
+        for page in coll.pages:
+            filename = page.name + PARQUET_EXTENSION
+            # The Parquet writer needs somewhere it can seek/tell; we write
+            # each file to disk, then copy it into the ZIP file.
+            with tempfile.TemporaryFile() as f:
+                schema = write_parquet_page(
+                    page,
+                    coll.output_headings(page),
+                    f,
+                    column_info=column_info.get(page.name),
+                    row_group_size=row_group_size,
+                )
+                f.seek(0)
+                with z.open(filename, mode="w", force_zip64=True) as zf:
+                    while True:
+                        data = f.read(1024 * 1024)
+                        if not data:
+                            break
+                        zf.write(data)
+            written.append((filename, schema))
+    return written
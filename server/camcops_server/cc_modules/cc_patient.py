@@ -452,7 +452,9 @@ class Patient(GenericTabletRecordMixin, Base):
         IMPERFECT in that it doesn't use intermediate patients to link
         identity (e.g. P1 has RiO#=3, P2 has RiO#=3, NHS#=5, P3 has NHS#=5;
         they are all the same by inference but P1 and P3 will not compare
-        equal).
+        equal). For transitive identity, and for fast grouping of many
+        patients, use ``PatientIdentityIndex`` from
+        :mod:`camcops_server.cc_modules.cc_patientindex`.
 
         """
         # Same object?
@@ -487,6 +489,10 @@ class Patient(GenericTabletRecordMixin, Base):
         If two objects are equal (via :func:`__eq__`) they must provide the
         same hash value (but two objects with the same hash are not necessarily
         equal).
+
+        Since equality here is based on any one of several keys (and is not
+        transitive), no better hash is possible, so sets of patients are
+        slow; see :mod:`camcops_server.cc_modules.cc_patientindex` instead.
         """
         return 0  # all objects have the same hash; "use __eq__() instead"
 
@@ -628,7 +634,7 @@ class Patient(GenericTabletRecordMixin, Base):
         group = self._group  # type: Optional[Group]
         if not group:
             return False
-        return self.satisfies_id_policy(group.tokenized_upload_policy())
+        return group.compiled_upload_policy().satisfies(self.get_bare_ptinfo())
 
     def satisfies_finalize_id_policy(self) -> bool:
         """
@@ -637,7 +643,9 @@ class Patient(GenericTabletRecordMixin, Base):
         group = self._group  # type: Optional[Group]
         if not group:
             return False
-        return self.satisfies_id_policy(group.tokenized_finalize_policy())
+        return group.compiled_finalize_policy().satisfies(
+            self.get_bare_ptinfo()
+        )
 
     def satisfies_id_policy(self, policy: "TokenizedPolicy") -> bool:
         """
@@ -870,6 +878,7 @@ class Patient(GenericTabletRecordMixin, Base):
                         SPREADSHEET_PATIENT_FIELD_PREFIX + FP_ID_NUM + nstr
                     ),
                     data_type=str(PatientIdNum.idnum_value.type),
+                    coltype=PatientIdNum.idnum_value.type,
                     comment=PatientIdNum.idnum_value.comment + comment_suffix,
                 )
             )
@@ -881,6 +890,7 @@ class Patient(GenericTabletRecordMixin, Base):
                         SPREADSHEET_PATIENT_FIELD_PREFIX + FP_ID_DESC + nstr
                     ),
                     data_type=str(IdNumDefinition.description.type),
+                    coltype=IdNumDefinition.description.type,
                     comment=IdNumDefinition.description.comment
                     + comment_suffix,
                 )
@@ -895,6 +905,7 @@ class Patient(GenericTabletRecordMixin, Base):
                         + nstr
                     ),
                     data_type=str(IdNumDefinition.short_description.type),
+                    coltype=IdNumDefinition.short_description.type,
                     comment=(
                         IdNumDefinition.short_description.comment
                         + comment_suffix
@@ -1248,10 +1259,10 @@ def is_candidate_patient_valid_for_group(
         return False, "Nonexistent group"
 
     if finalizing:
-        if not group.tokenized_finalize_policy().satisfies_id_policy(ptinfo):
+        if not group.compiled_finalize_policy().satisfies(ptinfo):
             return False, "Fails finalizing ID policy"
     else:
-        if not group.tokenized_upload_policy().satisfies_id_policy(ptinfo):
+        if not group.compiled_upload_policy().satisfies(ptinfo):
             return False, "Fails upload ID policy"
 
     # todo: add checks against prevalidated patients here
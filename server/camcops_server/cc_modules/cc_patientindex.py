@@ -0,0 +1,327 @@
+"""
+camcops_server/cc_modules/cc_patientindex.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Patient identity index, for grouping tasks by patient.**
+
+:meth:`camcops_server.cc_modules.cc_patient.Patient.__eq__` regards two
+patients as the same if they share a device/era/client ID, or share any ID
+number. That relationship is not transitive, so it can't provide a useful
+hash, and ``Patient.__hash__`` returns a constant. Putting many patients into
+a ``set`` (or grouping many tasks by patient via ``==``) is therefore O(n^2).
+
+Here, instead, we build canonical identity keys for each patient:
+
+- ``("client", device_id, era, client_id)``;
+- ``("idnum", which_idnum, idnum_value)`` for each current ID number;
+
+and merge patients that share any key using a union-find (disjoint-set)
+structure, with path compression and union by rank. Grouping n patients is
+therefore O(n α(n)), and identity is transitive: if P1 has RiO# 3, P2 has
+RiO# 3 and NHS# 5, and P3 has NHS# 5, then P1, P2 and P3 are all in the same
+group (the "IMPERFECT" case described in ``Patient.__eq__``).
+
+"""
+
+from typing import (
+    Dict,
+    Generic,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    TYPE_CHECKING,
+    TypeVar,
+)
+
+if TYPE_CHECKING:
+    from camcops_server.cc_modules.cc_patient import Patient
+    from camcops_server.cc_modules.cc_task import Task
+
+T = TypeVar("T")
+
+KEY_CLIENT = "client"
+KEY_IDNUM = "idnum"
+
+
+# =============================================================================
+# Identity keys
+# =============================================================================
+
+
+def patient_identity_keys(patient: "Patient") -> List[Tuple]:
+    """
+    Returns the canonical identity keys for a patient. Two patients that
+    share any key compare equal under
+    :meth:`camcops_server.cc_modules.cc_patient.Patient.__eq__`.
+
+    Args:
+        patient: a :class:`camcops_server.cc_modules.cc_patient.Patient`
+
+    Returns:
+        a list of hashable tuples
+    """
+    keys = []  # type: List[Tuple]
+    # Same logic as Patient.__eq__: all three parts must be present.
+    # noinspection PyProtectedMember
+    if (
+        patient.id is not None
+        and patient._device_id is not None
+        and patient._era is not None
+    ):
+        # noinspection PyProtectedMember
+        keys.append((KEY_CLIENT, patient._device_id, patient._era, patient.id))
+    # Same logic as PatientIdNum.__eq__: neither part may be None.
+    for idnum in patient.idnums:
+        if idnum.which_idnum is not None and idnum.idnum_value is not None:
+            keys.append((KEY_IDNUM, idnum.which_idnum, idnum.idnum_value))
+    return keys
+
+
+# =============================================================================
+# PatientIdentityIndex
+# =============================================================================
+
+
+class PatientIdentityIndex(Generic[T]):
+    """
+    Union-find index of patient identity.
+
+    Each "item" added is associated with a patient (an item may be the
+    patient itself, or e.g. a task belonging to that patient). Items whose
+    patients share any identity key, directly or via intermediate patients,
+    end up in the same group.
+
+    .. code-block:: python
+
+        index = PatientIdentityIndex()
+        for task in tasks:
+            index.add(task.patient, task)
+        for tasks_for_one_patient in index.groups():
+            ...
+    """
+
+    def __init__(self) -> None:
+        # Union-find arrays, indexed by node number. One node per distinct
+        # Python patient object.
+        self._parent = []  # type: List[int]
+        self._rank = []  # type: List[int]
+        # Mappings into nodes
+        self._node_for_key = {}  # type: Dict[Hashable, int]
+        self._node_for_patient_obj = {}  # type: Dict[int, int]
+        # Node data
+        self._patients = []  # type: List["Patient"]
+        self._items_for_node = []  # type: List[List[T]]
+
+    def __len__(self) -> int:
+        """
+        The number of distinct patient objects added.
+        """
+        return len(self._patients)
+
+    # -------------------------------------------------------------------------
+    # Union-find internals
+    # -------------------------------------------------------------------------
+
+    def _make_node(self, patient: "Patient") -> int:
+        node = len(self._parent)
+        self._parent.append(node)
+        self._rank.append(0)
+        self._patients.append(patient)
+        self._items_for_node.append([])
+        return node
+
+    def _find(self, node: int) -> int:
+        parent = self._parent
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+        # Path compression
+        while parent[node] != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    def _union(self, a: int, b: int) -> int:
+        root_a = self._find(a)
+        root_b = self._find(b)
+        if root_a == root_b:
+            return root_a
+        rank = self._rank
+        if rank[root_a] < rank[root_b]:
+            root_a, root_b = root_b, root_a
+        self._parent[root_b] = root_a
+        if rank[root_a] == rank[root_b]:
+            rank[root_a] += 1
+        return root_a
+
+    def _node_for(self, patient: "Patient") -> int:
+        """
+        Returns the node for a patient object, creating it (and merging it
+        with any existing nodes sharing identity keys) if necessary.
+        """
+        obj_id = id(patient)
+        node = self._node_for_patient_obj.get(obj_id)
+        if node is not None:
+            return node
+        node = self._make_node(patient)
+        self._node_for_patient_obj[obj_id] = node
+        for key in patient_identity_keys(patient):
+            existing = self._node_for_key.get(key)
+            if existing is None:
+                self._node_for_key[key] = node
+            else:
+                self._union(existing, node)
+        return node
+
+    # -------------------------------------------------------------------------
+    # Public interface
+    # -------------------------------------------------------------------------
+
+    def add(self, patient: "Patient", item: T = None) -> int:
+        """
+        Adds a patient, and optionally an item associated with it.
+
+        Args:
+            patient:
+                a :class:`camcops_server.cc_modules.cc_patient.Patient`
+            item:
+                an optional item (e.g. a task) to associate with this
+                patient
+
+        Returns:
+            an integer identifying the patient's group; this is only valid
+            until the next call to :meth:`add`, since later patients can
+            merge groups
+        """
+        node = self._node_for(patient)
+        if item is not None:
+            self._items_for_node[node].append(item)
+        return self._find(node)
+
+    def group_id(self, patient: "Patient") -> Optional[int]:
+        """
+        Returns the group number for a patient already in the index, or
+        ``None`` if no patient sharing its identity has been added.
+        """
+        node = self._node_for_patient_obj.get(id(patient))
+        if node is None:
+            for key in patient_identity_keys(patient):
+                node = self._node_for_key.get(key)
+                if node is not None:
+                    break
+            else:
+                return None
+        return self._find(node)
+
+    def same_patient(self, a: "Patient", b: "Patient") -> bool:
+        """
+        Are the two patients (both already added) the same person, allowing
+        for transitive identity?
+        """
+        group_a = self.group_id(a)
+        return group_a is not None and group_a == self.group_id(b)
+
+    def _root_order(self) -> Tuple[List[int], Dict[int, List[int]]]:
+        """
+        Returns roots in order of first appearance, and a mapping from each
+        root to its member nodes (in order of addition).
+        """
+        roots = []  # type: List[int]
+        members = {}  # type: Dict[int, List[int]]
+        for node in range(len(self._parent)):
+            root = self._find(node)
+            if root not in members:
+                members[root] = []
+                roots.append(root)
+            members[root].append(node)
+        return roots, members
+
+    def patient_groups(self) -> List[List["Patient"]]:
+        """
+        Returns a list of groups, each a list of the distinct patient objects
+        believed to represent the same person. Groups are in order of first
+        addition.
+        """
+        roots, members = self._root_order()
+        return [[self._patients[n] for n in members[r]] for r in roots]
+
+    def representative_patients(self) -> List["Patient"]:
+        """
+        Returns one patient object (the first added) per group.
+        """
+        return [group[0] for group in self.patient_groups()]
+
+    def groups(self) -> List[List[T]]:
+        """
+        Returns a list of groups of items, one group per distinct person,
+        in order of first addition. Within a group, items are in the order
+        they were added (per patient object).
+        """
+        roots, members = self._root_order()
+        result = []  # type: List[List[T]]
+        for root in roots:
+            items = []  # type: List[T]
+            for node in members[root]:
+                items.extend(self._items_for_node[node])
+            result.append(items)
+        return result
+
+
+# =============================================================================
+# Convenience functions
+# =============================================================================
+
+
+def group_tasks_by_patient(tasks: Iterable["Task"]) -> List[List["Task"]]:
+    """
+    Groups tasks by patient, using transitive patient identity. Anonymous
+    tasks (those without a patient) are omitted.
+
+    Args:
+        tasks: an iterable of
+            :class:`camcops_server.cc_modules.cc_task.Task` objects
+
+    Returns:
+        a list of lists of tasks, one per distinct patient, in order of
+        first appearance
+    """
+    index = PatientIdentityIndex()  # type: PatientIdentityIndex["Task"]
+    for task in tasks:
+        patient = task.patient
+        if patient is not None:
+            index.add(patient, task)
+    return index.groups()
+
+
+def distinct_patients(patients: Iterable["Patient"]) -> List["Patient"]:
+    """
+    Returns one patient object per distinct person, using transitive patient
+    identity. Faster alternative to ``set(patients)``.
+    """
+    index = PatientIdentityIndex()  # type: PatientIdentityIndex["Patient"]
+    for patient in patients:
+        if patient is not None:
+            index.add(patient)
+    return index.representative_patients()
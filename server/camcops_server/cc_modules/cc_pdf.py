@@ -31,9 +31,25 @@ camcops_server/cc_modules/cc_pdf.py
 # Imports
 # =============================================================================
 
-from typing import Any, Dict, TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TYPE_CHECKING,
+)
 
-from cardinal_pythonlib.pdf import get_pdf_from_html
+from cardinal_pythonlib.logs import BraceStyleAdapter
+from cardinal_pythonlib.pdf import get_pdf_from_html, Processors
+from pyramid.renderers import render
 
 from camcops_server.cc_modules.cc_constants import (
     PDF_ENGINE,
@@ -43,6 +59,67 @@ from camcops_server.cc_modules.cc_constants import (
 if TYPE_CHECKING:
     from camcops_server.cc_modules.cc_request import CamcopsRequest
 
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+
+# =============================================================================
+# Constants
+# =============================================================================
+
+PAGE_INNER_TEXT_PLACEHOLDER = "<!-- CAMCOPS_PDF_PAGE_INNER_TEXT -->"
+
+
+# =============================================================================
+# PdfJob
+# =============================================================================
+
+
+class PdfJob(object):
+    """
+    Everything needed to make one PDF: HTML and wkhtmltopdf options. Holds no
+    database objects, so it can be made into a PDF in another thread.
+    """
+
+    def __init__(
+        self,
+        html: str,
+        header_html: str = None,
+        footer_html: str = None,
+        extra_wkhtmltopdf_options: Dict[str, Any] = None,
+    ) -> None:
+        """
+        Args:
+            html:
+                main HTML
+            header_html:
+                optional page header HTML (for wkhtmltopdf)
+            footer_html:
+                optional page footer HTML (for wkhtmltopdf)
+            extra_wkhtmltopdf_options:
+                options to add to (or override) the defaults in
+                :data:`camcops_server.cc_modules.cc_constants.WKHTMLTOPDF_OPTIONS`
+        """  # noqa
+        self.html = html
+        self.header_html = header_html
+        self.footer_html = footer_html
+        self.extra_wkhtmltopdf_options = extra_wkhtmltopdf_options or {}
+
+    def make_pdf(self, wkhtmltopdf_filename: str) -> bytes:
+        """
+        Creates and returns the PDF.
+        """
+        wkhtmltopdf_options = dict(
+            WKHTMLTOPDF_OPTIONS, **self.extra_wkhtmltopdf_options
+        )
+        return get_pdf_from_html(
+            self.html,
+            header_html=self.header_html,
+            footer_html=self.footer_html,
+            processor=PDF_ENGINE,
+            wkhtmltopdf_filename=wkhtmltopdf_filename,
+            wkhtmltopdf_options=wkhtmltopdf_options,
+        )
+
 
 # =============================================================================
 # pdf_from_html
@@ -59,18 +136,155 @@ def pdf_from_html(
     """
     Create and return a PDF from the HTML provided.
     """
-    extra_wkhtmltopdf_options = (
-        extra_wkhtmltopdf_options or {}
-    )  # type: Dict[str, Any]
-    wkhtmltopdf_options = dict(
-        WKHTMLTOPDF_OPTIONS, **extra_wkhtmltopdf_options
-    )
-    cfg = req.config
-    return get_pdf_from_html(
+    job = PdfJob(
         html,
         header_html=header_html,
         footer_html=footer_html,
-        processor=PDF_ENGINE,
-        wkhtmltopdf_filename=cfg.wkhtmltopdf_filename,
-        wkhtmltopdf_options=wkhtmltopdf_options,
+        extra_wkhtmltopdf_options=extra_wkhtmltopdf_options,
     )
+    return job.make_pdf(req.config.wkhtmltopdf_filename)
+
+
+# =============================================================================
+# Making many PDFs at once
+# =============================================================================
+
+_pool = None  # type: Optional[ThreadPoolExecutor]
+_pool_workers = 0
+_pool_pid = None  # type: Optional[int]
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ThreadPoolExecutor:
+    """
+    Returns this process's pool of PDF worker threads, creating it if
+    necessary. Each runs its own wkhtmltopdf process, so the pool bounds the
+    number of those (for all requests in this process).
+    """
+    global _pool, _pool_workers, _pool_pid
+    with _pool_lock:
+        if (
+            _pool is None
+            or _pool_workers != workers
+            or _pool_pid != os.getpid()
+        ):
+            if _pool is not None and _pool_pid == os.getpid():
+                _pool.shutdown(wait=False)
+            _pool = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="camcops_pdf"
+            )
+            _pool_workers = workers
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def pdfs_from_jobs(
+    req: "CamcopsRequest", jobs: Sequence[PdfJob], skip_failures: bool = False
+) -> List[Optional[bytes]]:
+    """
+    Makes PDFs from several jobs. If the ``PDF_WORKERS`` config parameter is
+    more than 1, and we're using wkhtmltopdf (which runs in a separate
+    process), they are made concurrently.
+
+    Args:
+        req:
+            a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        jobs:
+            the jobs
+        skip_failures:
+            if a job fails, log a warning and return ``None`` for it, rather
+            than raising the exception
+
+    Returns:
+        the PDFs, in the same order as ``jobs``
+    """
+    cfg = req.config
+    wkhtmltopdf_filename = cfg.wkhtmltopdf_filename
+
+    def make(job: PdfJob) -> Optional[bytes]:
+        try:
+            return job.make_pdf(wkhtmltopdf_filename)
+        except Exception as e:
+            if not skip_failures:
+                raise
+            log.warning("Failed to make PDF: {!r}", e)
+            return None
+
+    workers = min(cfg.pdf_workers, len(jobs))
+    if workers <= 1 or PDF_ENGINE != Processors.PDFKIT:
+        # The Python PDF engines would be bound by the GIL (and may not be
+        # thread-safe).
+        return [make(job) for job in jobs]
+    log.debug("Making {} PDFs with {} workers", len(jobs), workers)
+    return list(_get_pool(cfg.pdf_workers).map(make, jobs))
+
+
+# =============================================================================
+# Caching HTML for PDFs
+# =============================================================================
+
+
+class PdfHtmlCache(object):
+    """
+    Caches HTML used repeatedly to make PDFs within one request (e.g. for many
+    tasks in an export), and PDFs made in advance (in batches).
+    """
+
+    def __init__(self, req: "CamcopsRequest") -> None:
+        self.req = req
+        self._page_wrappers = {}  # type: Dict[str, Tuple[str, str]]
+        self._fragments = {}  # type: Dict[Hashable, str]
+        self._pdfs = {}  # type: Dict[Hashable, bytes]
+
+    def wrap_page_html(self, template_name: str, inner_text: str) -> str:
+        """
+        Returns a wkhtmltopdf page header/footer, made from a template (such as
+        ``wkhtmltopdf_header.mako``) that takes an ``inner_text`` argument.
+        The template is rendered only once per request.
+        """
+        if template_name not in self._page_wrappers:
+            html = render(
+                template_name,
+                dict(inner_text=PAGE_INNER_TEXT_PLACEHOLDER),
+                request=self.req,
+            )
+            parts = html.split(PAGE_INNER_TEXT_PLACEHOLDER)
+            if len(parts) != 2:
+                # Shouldn't happen; don't cache.
+                return render(
+                    template_name,
+                    dict(inner_text=inner_text),
+                    request=self.req,
+                )
+            self._page_wrappers[template_name] = (parts[0], parts[1])
+        before, after = self._page_wrappers[template_name]
+        return before + inner_text + after
+
+    def get_fragment(self, key: Hashable, make: Callable[[], str]) -> str:
+        """
+        Returns HTML cached under ``key``, making it with ``make()`` if
+        necessary.
+        """
+        html = self._fragments.get(key)
+        if html is None:
+            html = make()
+            self._fragments[key] = html
+        return html
+
+    def add_pdf(self, key: Hashable, pdf: bytes) -> None:
+        """
+        Stores a PDF made in advance.
+        """
+        self._pdfs[key] = pdf
+
+    def pop_pdf(self, key: Hashable) -> Optional[bytes]:
+        """
+        Returns (and forgets) a PDF made in advance, or ``None``.
+        """
+        return self._pdfs.pop(key, None)
+
+    def discard_pdfs(self) -> None:
+        """
+        Forgets any PDFs made in advance that weren't used.
+        """
+        self._pdfs.clear()
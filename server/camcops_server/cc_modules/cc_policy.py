@@ -38,10 +38,11 @@ configuration).
 
 """
 
+from functools import lru_cache
 import io
 import logging
 import tokenize
-from typing import Callable, Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
 from cardinal_pythonlib.dicts import reversedict
 from cardinal_pythonlib.logs import BraceStyleAdapter
@@ -1017,7 +1018,29 @@ class TokenizedPolicy(object):
             ptinfo:
                 a `camcops_server.cc_modules.cc_simpleobjects.BarePatientInfo`
         """
-        return self._value_for_ptinfo(ptinfo) is Q_TRUE
+        return self.compiled().satisfies(ptinfo)
+
+    def satisfies_many(self, ptinfos: Iterable[BarePatientInfo]) -> List[bool]:
+        """
+        Does each of several patient information objects satisfy the ID
+        policy?
+
+        Args:
+            ptinfos:
+                `camcops_server.cc_modules.cc_simpleobjects.BarePatientInfo`
+                objects
+
+        Returns:
+            a list of booleans, one per ``ptinfo``
+        """
+        return self.compiled().satisfies_many(ptinfos)
+
+    def compiled(self) -> "CompiledPolicy":
+        """
+        Returns the compiled version of this policy (shared between all
+        policies with the same tokens).
+        """
+        return compile_tokenized_policy(tuple(self.tokens))
 
     # -------------------------------------------------------------------------
     # Functions for the policy to parse itself and compare itself to a patient
@@ -1228,6 +1251,277 @@ class TokenizedPolicy(object):
             return pip.is_present(token)
 
 
+# =============================================================================
+# Compiled policies
+# =============================================================================
+# Evaluating a TokenizedPolicy re-parses its tokens for every patient. For
+# checking patients against a policy, we instead parse the policy once into
+# a tree of closures over a bitmask of the information present. Only
+# True/False can arise from real patient information (Q_DONT_CARE is used
+# only when reasoning about policies), and syntax errors don't depend on the
+# patient, so two-state logic suffices.
+
+COMPILED_POLICY_FUNC_TYPE = Callable[[int], bool]
+
+INFO_TOKEN_BITS = {
+    token: 1 << i for i, token in enumerate(NON_IDNUM_INFO_TOKENS)
+}  # type: Dict[int, int]
+FIRST_IDNUM_BIT = 1 << len(NON_IDNUM_INFO_TOKENS)
+BIT_FORENAME = INFO_TOKEN_BITS[TK_FORENAME]
+BIT_SURNAME = INFO_TOKEN_BITS[TK_SURNAME]
+BIT_SEX = INFO_TOKEN_BITS[TK_SEX]
+BIT_DOB = INFO_TOKEN_BITS[TK_DOB]
+BIT_ADDRESS = INFO_TOKEN_BITS[TK_ADDRESS]
+BIT_EMAIL = INFO_TOKEN_BITS[TK_EMAIL]
+BIT_GP = INFO_TOKEN_BITS[TK_GP]
+BIT_OTHER_DETAILS = INFO_TOKEN_BITS[TK_OTHER_DETAILS]
+BIT_OTHER_IDNUM = INFO_TOKEN_BITS[TK_OTHER_IDNUM]
+BIT_ANY_IDNUM = INFO_TOKEN_BITS[TK_ANY_IDNUM]
+
+MAX_CACHED_MASKS = 4096
+POLICY_CACHE_SIZE = 256
+
+
+class PolicySyntaxError(Exception):
+    """
+    Raised internally when a tokenized policy can't be compiled.
+    """
+
+    pass
+
+
+class CompiledPolicy(object):
+    """
+    An ID policy compiled for fast checking of patients.
+
+    Patient information is reduced to an integer bitmask of the kinds of
+    information present (one bit per fixed token such as ``TK_FORENAME``,
+    plus one bit per ID number type mentioned by the policy), and the policy
+    is a function of that bitmask. Since real patients mostly fall into a few
+    patterns, results are also memoized per bitmask.
+
+    Obtain instances via :func:`compile_id_policy` or
+    :meth:`TokenizedPolicy.compiled`, which cache them.
+    """
+
+    def __init__(self, tokens: TOKENIZED_POLICY_TYPE) -> None:
+        """
+        Args:
+            tokens: a tokenized policy
+        """
+        self.tokens = list(tokens)
+        idnums = sorted(set(t for t in self.tokens if t > 0))
+        self.idnum_bits = {
+            which_idnum: FIRST_IDNUM_BIT << i
+            for i, which_idnum in enumerate(idnums)
+        }  # type: Dict[int, int]
+        try:
+            func, index = self._compile_chunk(0, depth=0)
+        except PolicySyntaxError as e:
+            log.debug("Cannot compile ID policy {!r}: {}", self.tokens, e)
+            func = None
+        self._func = func  # type: Optional[COMPILED_POLICY_FUNC_TYPE]
+        self._results = {}  # type: Dict[int, bool]
+
+    def __repr__(self) -> str:
+        return auto_repr(self)
+
+    @property
+    def syntactically_valid(self) -> bool:
+        """
+        Did the policy compile?
+        """
+        return self._func is not None
+
+    # -------------------------------------------------------------------------
+    # Compilation
+    # -------------------------------------------------------------------------
+    # Mirrors TokenizedPolicy._chunk_value() and _content_chunk_value():
+    # AND and OR have equal precedence and are applied left to right.
+
+    def _compile_chunk(
+        self, index: int, depth: int
+    ) -> Tuple[COMPILED_POLICY_FUNC_TYPE, int]:
+        """
+        Compiles a sequence of the form ``content [op content]...``,
+        starting at ``index`` and continuing to the end of the policy or (if
+        ``depth > 0``) a closing parenthesis.
+
+        Returns:
+            tuple: ``func, next_index``, where ``next_index`` points after
+            the closing parenthesis, if there was one
+        """
+        tokens = self.tokens
+        func, index = self._compile_content(index, depth)
+        while True:
+            if index >= len(tokens):
+                if depth > 0:
+                    raise PolicySyntaxError("Unmatched left parenthesis")
+                return func, index
+            token = tokens[index]
+            if token == TK_RPAREN:
+                if depth == 0:
+                    raise PolicySyntaxError("Unmatched right parenthesis")
+                return func, index + 1
+            if token not in (TK_AND, TK_OR):
+                raise PolicySyntaxError("Expected operator")
+            rhs, index = self._compile_content(index + 1, depth)
+            func = self._combine(token, func, rhs)
+
+    def _compile_content(
+        self, index: int, depth: int
+    ) -> Tuple[COMPILED_POLICY_FUNC_TYPE, int]:
+        """
+        Compiles a single item of content (an information token, a negated
+        item, or a parenthesized sequence), starting at ``index``.
+
+        Returns:
+            tuple: ``func, next_index``
+        """
+        tokens = self.tokens
+        if index >= len(tokens):
+            raise PolicySyntaxError("Expected content; reached end of policy")
+        token = tokens[index]
+        if token == TK_LPAREN:
+            return self._compile_chunk(index + 1, depth + 1)
+        if token == TK_NOT:
+            operand, index = self._compile_content(index + 1, depth)
+            return (lambda mask: not operand(mask)), index
+        if not is_info_token(token):
+            raise PolicySyntaxError(
+                f"Expected content; found {token_to_str(token)}"
+            )
+        if token > 0:
+            bit = self.idnum_bits[token]
+        else:
+            bit = INFO_TOKEN_BITS[token]
+        return (lambda mask: mask & bit != 0), index + 1
+
+    @staticmethod
+    def _combine(
+        operator: int,
+        lhs: COMPILED_POLICY_FUNC_TYPE,
+        rhs: COMPILED_POLICY_FUNC_TYPE,
+    ) -> COMPILED_POLICY_FUNC_TYPE:
+        if operator == TK_AND:
+            return lambda mask: lhs(mask) and rhs(mask)
+        return lambda mask: lhs(mask) or rhs(mask)
+
+    # -------------------------------------------------------------------------
+    # Evaluation
+    # -------------------------------------------------------------------------
+
+    def mask_for_ptinfo(self, ptinfo: BarePatientInfo) -> int:
+        """
+        Returns the bitmask of information present for a patient, as for
+        :meth:`PatientInfoPresence.make_from_ptinfo`.
+
+        Args:
+            ptinfo:
+                a `camcops_server.cc_modules.cc_simpleobjects.BarePatientInfo`
+        """
+        mask = 0
+        if ptinfo.forename:
+            mask |= BIT_FORENAME
+        if ptinfo.surname:
+            mask |= BIT_SURNAME
+        if ptinfo.sex:
+            mask |= BIT_SEX
+        if ptinfo.dob is not None:
+            mask |= BIT_DOB
+        if ptinfo.address:
+            mask |= BIT_ADDRESS
+        if ptinfo.email:
+            mask |= BIT_EMAIL
+        if ptinfo.gp:
+            mask |= BIT_GP
+        if ptinfo.otherdetails:
+            mask |= BIT_OTHER_DETAILS
+        idnum_bits = self.idnum_bits
+        # If an ID number type appears more than once, the last one counts,
+        # as in make_from_ptinfo().
+        idnum_present = {}  # type: Dict[int, bool]
+        for iddef in ptinfo.idnum_definitions:
+            which_idnum = iddef.which_idnum
+            idnum_present[which_idnum] = iddef.idnum_value is not None
+            if which_idnum not in idnum_bits:
+                mask |= BIT_OTHER_IDNUM
+        for which_idnum, present in idnum_present.items():
+            if present:
+                mask |= BIT_ANY_IDNUM | idnum_bits.get(which_idnum, 0)
+        return mask
+
+    def satisfies_mask(self, mask: int) -> bool:
+        """
+        Does patient information with the given bitmask (from
+        :meth:`mask_for_ptinfo`) satisfy the policy?
+        """
+        results = self._results
+        try:
+            return results[mask]
+        except KeyError:
+            pass
+        func = self._func
+        result = func is not None and func(mask)
+        if len(results) >= MAX_CACHED_MASKS:
+            results.clear()
+        results[mask] = result
+        return result
+
+    def satisfies(self, ptinfo: BarePatientInfo) -> bool:
+        """
+        Does the patient information in ptinfo satisfy the policy?
+
+        Args:
+            ptinfo:
+                a `camcops_server.cc_modules.cc_simpleobjects.BarePatientInfo`
+        """
+        return self.satisfies_mask(self.mask_for_ptinfo(ptinfo))
+
+    def satisfies_many(self, ptinfos: Iterable[BarePatientInfo]) -> List[bool]:
+        """
+        Does each of several patient information objects satisfy the policy?
+
+        Args:
+            ptinfos:
+                `camcops_server.cc_modules.cc_simpleobjects.BarePatientInfo`
+                objects
+
+        Returns:
+            a list of booleans, one per ``ptinfo``
+        """
+        if self._func is None:
+            return [False for _ in ptinfos]
+        mask_for_ptinfo = self.mask_for_ptinfo
+        satisfies_mask = self.satisfies_mask
+        return [satisfies_mask(mask_for_ptinfo(p)) for p in ptinfos]
+
+
+@lru_cache(maxsize=POLICY_CACHE_SIZE)
+def compile_tokenized_policy(tokens: Tuple[int, ...]) -> CompiledPolicy:
+    """
+    Returns a (cached) :class:`CompiledPolicy` for a tokenized policy.
+
+    Args:
+        tokens: the policy's tokens, as a tuple (so it can be hashed)
+    """
+    return CompiledPolicy(tokens)
+
+
+@lru_cache(maxsize=POLICY_CACHE_SIZE)
+def compile_id_policy(policy: Optional[str]) -> CompiledPolicy:
+    """
+    Returns a (cached) :class:`CompiledPolicy` for a policy string, such as a
+    group's upload or finalize policy. Since the cache is keyed on the string,
+    a policy is recompiled only when it changes.
+
+    Args:
+        policy: the policy, as a string
+    """
+    tokens = TokenizedPolicy.get_tokenized_id_policy(policy)
+    return compile_tokenized_policy(tuple(tokens))
+
+
 # =============================================================================
 # Tablet ID policy
 # =============================================================================
@@ -74,12 +74,19 @@ from pyramid_mako import (
     text_error_template,
 )
 from sqlalchemy.orm import Query
+from sqlalchemy.sql.elements import ColumnElement
+from sqlalchemy.sql.expression import func, select
 from sqlalchemy.sql.selectable import Select
 from zope.interface import implementer
 
 from camcops_server.cc_modules.cc_baseconstants import TEMPLATE_DIR
 from camcops_server.cc_modules.cc_cache import cache_region_static
 from camcops_server.cc_modules.cc_constants import DEFAULT_ROWS_PER_PAGE
+from camcops_server.cc_modules.cc_sqlalchemy import (
+    decode_keyset_cursor,
+    encode_keyset_cursor,
+    keyset_criterion,
+)
 
 if TYPE_CHECKING:
     from camcops_server.cc_modules.cc_request import CamcopsRequest
@@ -164,12 +171,14 @@ class ViewParam(object):
     ADD_SPECIAL_NOTE = "add_special_note"
     ADMIN = "admin"
     ADVANCED = "advanced"
+    AFTER = "after"
     AGE_MINIMUM = "age_minimum"
     AGE_MAXIMUM = "age_maximum"
     ALL_TASKS = "all_tasks"
     ANONYMISE = "anonymise"
     BACK_TASK_TABLENAME = "back_task_tablename"
     BACK_TASK_SERVER_PK = "back_task_server_pk"
+    BEFORE = "before"
     BY_DAY_OF_MONTH = "by_day_of_month"
     BY_MONTH = "by_month"
     BY_TASK = "by_task"
@@ -302,6 +311,7 @@ class ViewArg(object):
     FHIRJSON = "fhirjson"
     HTML = "html"
     ODS = "ods"
+    PARQUET_ZIP = "parquet_zip"
     PDF = "pdf"
     PDFHTML = "pdfhtml"  # the HTML to create a PDF
     R = "r"
@@ -1929,6 +1939,220 @@ class SqlalchemyOrmPage(CamcopsPage):
         )
 
 
+# =============================================================================
+# Keyset ("seek") pagination
+# =============================================================================
+# LIMIT/OFFSET pagination makes the database read and discard every row
+# before the requested page, so page N gets slower as N grows, and it needs a
+# COUNT(*) of the whole result set. Keyset pagination instead remembers the
+# sort key of the last (or first) row shown, and asks for rows beyond it:
+#
+#   WHERE (a, b) < (:last_a, :last_b) ORDER BY a DESC, b DESC LIMIT n + 1
+#
+# which an index on the key columns can satisfy in constant time, however
+# deep we are. The cost is that we can't jump to page N; we offer first,
+# previous, next and last. The sort key must be unique (so end it with a
+# primary key) and its columns must not be NULL.
+
+KEYSET_CURSOR_END = "end"  # "before" cursor meaning "the last page"
+KEYSET_COUNT_CAP = 10000  # count no further than this to estimate totals
+
+
+def count_query_rows_up_to(query: Query, cap: int) -> int:
+    """
+    Counts the rows returned by an SQLAlchemy ORM query, but stops counting
+    after ``cap + 1`` rows. This bounds the work done for large results.
+
+    Returns:
+        the number of rows, or ``cap + 1`` if there are more than ``cap``
+    """
+    subquery = query.order_by(None).limit(cap + 1).subquery()
+    return query.session.execute(
+        select([func.count()]).select_from(subquery)
+    ).scalar()
+
+
+class KeysetPage(list):
+    """
+    A page of results from an SQLAlchemy ORM query, using keyset ("seek")
+    pagination rather than LIMIT/OFFSET. See above.
+
+    Used like :class:`CamcopsPage` by our templates: iterate over it for the
+    items, and call :meth:`pager` for navigation links. The
+    :attr:`item_count` is approximate (see :meth:`__init__`).
+    """
+
+    def __init__(
+        self,
+        query: Query,
+        key_columns: Sequence[ColumnElement],
+        request: "CamcopsRequest",
+        items_per_page: int = DEFAULT_ROWS_PER_PAGE,
+        descending: bool = True,
+        item_count: int = None,
+        count_cap: int = KEYSET_COUNT_CAP,
+    ) -> None:
+        """
+        Args:
+            query:
+                the query; any existing ``ORDER BY`` is replaced by one on
+                the key columns
+            key_columns:
+                the columns to sort by; together, they must be unique and
+                not NULL
+            request:
+                the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`;
+                we read the ``after``/``before`` cursors from it
+            items_per_page:
+                page size
+            descending:
+                sort in descending order (e.g. newest first)?
+            item_count:
+                an estimate of the total number of items, if the caller has
+                a cheap one (see
+                :func:`camcops_server.cc_modules.cc_sqlalchemy.estimate_table_row_count`);
+                if not, we count up to ``count_cap`` rows
+            count_cap:
+                see ``item_count``
+        """  # noqa
+        super().__init__()
+        assert isinstance(items_per_page, int)
+        self.request = request
+        self.items_per_page = max(1, items_per_page)
+        self.key_columns = list(key_columns)
+
+        before_token = request.GET.get(ViewParam.BEFORE)
+        after = decode_keyset_cursor(
+            request.GET.get(ViewParam.AFTER), key_columns
+        )
+        before = decode_keyset_cursor(before_token, key_columns)
+        to_end = before_token == KEYSET_CURSOR_END
+
+        # Which way are we reading? Forwards (in display order) from the
+        # start or from an "after" cursor; backwards from the end or from a
+        # "before" cursor.
+        backwards = before is not None or to_end
+        ascending = descending == backwards
+        q = query.order_by(None).order_by(
+            *[c.asc() if ascending else c.desc() for c in key_columns]
+        )
+        cursor = before if backwards else after
+        if cursor is not None:
+            q = q.filter(keyset_criterion(key_columns, cursor, ascending))
+        rows = q.limit(self.items_per_page + 1).all()
+        more = len(rows) > self.items_per_page
+        rows = rows[: self.items_per_page]
+        if backwards:
+            rows.reverse()
+            self.has_previous = more
+            self.has_next = not to_end
+        else:
+            self.has_previous = after is not None
+            self.has_next = more
+        self.extend(rows)
+        self.items = rows
+
+        # Total count
+        if item_count is not None:
+            self.item_count_is_estimate = True
+            self.item_count_is_lower_bound = False
+        else:
+            item_count = count_query_rows_up_to(query, count_cap)
+            self.item_count_is_estimate = False
+            self.item_count_is_lower_bound = item_count > count_cap
+            item_count = min(item_count, count_cap)
+        if rows and item_count < len(rows):
+            # Statistics can be stale; never claim fewer than we're showing.
+            item_count = len(rows)
+        self.item_count = item_count
+
+    def _key(self, item: Any) -> List[Any]:
+        return [getattr(item, c.key) for c in self.key_columns]
+
+    def url_for(self, param: Optional[str], cursor: Optional[str]) -> str:
+        """
+        Returns the URL of the current view, with the pagination cursor
+        replaced.
+
+        Args:
+            param: ``ViewParam.AFTER``, ``ViewParam.BEFORE``, or ``None``
+                for the first page
+            cursor: the cursor token
+        """
+        params = {
+            k: v
+            for k, v in self.request.GET.items()
+            if k not in (ViewParam.AFTER, ViewParam.BEFORE, ViewParam.PAGE)
+        }
+        if param:
+            params[param] = cursor
+        qs = urlencode(sorted(params.items()), True)
+        return f"{self.request.path}?{qs}"
+
+    @property
+    def first_url(self) -> str:
+        return self.url_for(None, None)
+
+    @property
+    def previous_url(self) -> Optional[str]:
+        if not self.has_previous or not self.items:
+            return None
+        cursor = encode_keyset_cursor(self._key(self.items[0]))
+        return self.url_for(ViewParam.BEFORE, cursor)
+
+    @property
+    def next_url(self) -> Optional[str]:
+        if not self.has_next or not self.items:
+            return None
+        cursor = encode_keyset_cursor(self._key(self.items[-1]))
+        return self.url_for(ViewParam.AFTER, cursor)
+
+    @property
+    def last_url(self) -> str:
+        return self.url_for(ViewParam.BEFORE, KEYSET_CURSOR_END)
+
+    def item_count_description(self) -> str:
+        """
+        Describes the (possibly approximate) total number of items.
+        """
+        _ = self.request.gettext
+        if self.item_count_is_lower_bound:
+            return _("more than {n} records").format(n=self.item_count)
+        if self.item_count_is_estimate:
+            return _("approximately {n} records").format(n=self.item_count)
+        return _("total {n} records").format(n=self.item_count)
+
+    def pager(
+        self,
+        separator: str = " ",
+        symbol_first: str = DEFAULT_NAV_START,
+        symbol_last: str = DEFAULT_NAV_END,
+        symbol_previous: str = DEFAULT_NAV_BACKWARD,
+        symbol_next: str = DEFAULT_NAV_FORWARD,
+    ) -> str:
+        """
+        Returns HTML for navigation links, in the style of
+        :meth:`CamcopsPage.pager`: links that are not applicable (e.g.
+        "previous" on the first page) are omitted.
+        """
+
+        def link(url: Optional[str], symbol: str) -> str:
+            if not url:
+                return ""
+            return f'<a href="{html_escape(url)}">{symbol}</a>'
+
+        links = [
+            link(self.first_url if self.has_previous else None, symbol_first),
+            link(self.previous_url, symbol_previous),
+            link(self.next_url, symbol_next),
+            link(self.last_url if self.has_next else None, symbol_last),
+        ]
+        return (
+            f"({html_escape(self.item_count_description())}) "
+            f"[ {separator.join(x for x in links if x)} ]"
+        )
+
+
 # From webhelpers.paginate (which is broken on Python 3.5, but good),
 # modified a bit:
 
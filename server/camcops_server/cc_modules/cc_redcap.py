@@ -43,18 +43,38 @@ query the database in order to determine the next instance ID. It is possible
 to create a race condition if more than one client is trying to update the same
 record at the same time.
 
+Downloading the existing records means fetching the whole project, so we do it
+once per export run per recipient, not once per task: a
+:class:`RedcapTaskExporter` keeps a :class:`RedcapProjectSnapshot` for each
+recipient, which indexes the records by patient and by (record, instrument),
+and is updated locally after each successful upload. (Exports to REDCap are
+therefore performed within a single job, rather than being fanned out to one
+backend job per task; see
+:func:`camcops_server.cc_modules.cc_export.export_tasks_individually`.)
+Parsed fieldmaps are also cached, by filename and modification time.
+
 """
 
 from enum import Enum
 import io
 import logging
-from typing import Any, Dict, Iterable, List, Optional, TYPE_CHECKING, Union
+import os
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    TYPE_CHECKING,
+    Union,
+)
 import xml.etree.cElementTree as ElementTree
 
 from asteval import Interpreter, make_symbol_table
 from cardinal_pythonlib.datetimefunc import format_datetime
 from cardinal_pythonlib.logs import BraceStyleAdapter
-from pandas import DataFrame
+from pandas import DataFrame, isna
 from pandas.errors import EmptyDataError
 import redcap
 
@@ -78,6 +98,10 @@ MISSING_EVENT_TAG_OR_ATTRIBUTE = (
 )
 
 
+REDCAP_REPEAT_INSTRUMENT = "redcap_repeat_instrument"
+REDCAP_REPEAT_INSTANCE = "redcap_repeat_instance"
+
+
 class RedcapExportException(Exception):
     pass
 
@@ -220,12 +244,276 @@ class RedcapFieldmap(object):
         return list(self.instruments.values())
 
 
+_fieldmap_cache = (
+    {}
+)  # type: Dict[str, Tuple[Tuple[int, int], RedcapFieldmap]]  # noqa
+
+
+def get_cached_fieldmap(filename: str) -> RedcapFieldmap:
+    """
+    Returns a :class:`RedcapFieldmap` for the file, re-parsing it only if the
+    file has changed (judged by its modification time and size) since we last
+    read it.
+
+    Args:
+        filename: name of the fieldmap XML file
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        # Let RedcapFieldmap report the problem.
+        return RedcapFieldmap(filename)
+    signature = (st.st_mtime_ns, st.st_size)
+    cached = _fieldmap_cache.get(filename)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    fieldmap = RedcapFieldmap(filename)
+    _fieldmap_cache[filename] = (signature, fieldmap)
+    return fieldmap
+
+
+class RedcapRecordIndex(object):
+    """
+    Index of the records downloaded from a REDCap project, so we can find a
+    patient's record, and the next instance ID for a repeating instrument,
+    without scanning all records each time.
+    """
+
+    def __init__(
+        self,
+        records: "DataFrame",
+        record_id_fieldname: str,
+        patient_id_fieldname: Optional[str] = None,
+    ) -> None:
+        """
+        Args:
+            records:
+                records retrieved from REDCap, as a Pandas data frame
+            record_id_fieldname:
+                name of the REDCap field holding the record ID
+            patient_id_fieldname:
+                name of the REDCap field holding the CamCOPS patient ID
+                number, if we need to look up records by patient
+        """
+        self.record_id_fieldname = record_id_fieldname
+        self.patient_id_fieldname = patient_id_fieldname
+        self.empty = records.empty
+        self.has_record_id_field = record_id_fieldname in records
+        self.has_patient_id_field = (
+            patient_id_fieldname is not None
+            and patient_id_fieldname in records
+        )
+        self._record_id_for_patient = {}  # type: Dict[Any, str]
+        # ... {idnum_value: record_id}
+        self._max_instance = {}  # type: Dict[Tuple[str, str], int]
+        # ... {(record_id, instrument): highest instance ID}
+
+        if self.empty:
+            return
+        if self.has_patient_id_field:
+            # The record ID is always the first column of a REDCap export.
+            for record_id, idnum_value in zip(
+                records.iloc[:, 0], records[patient_id_fieldname]
+            ):
+                if not isna(idnum_value):
+                    self._record_id_for_patient.setdefault(
+                        idnum_value, record_id
+                    )
+        if (
+            self.has_record_id_field
+            and REDCAP_REPEAT_INSTRUMENT in records
+            and REDCAP_REPEAT_INSTANCE in records
+        ):
+            for record_id, instrument, instance in zip(
+                records[record_id_fieldname],
+                records[REDCAP_REPEAT_INSTRUMENT],
+                records[REDCAP_REPEAT_INSTANCE],
+            ):
+                if isna(instance):
+                    continue
+                self._note_instance(record_id, instrument, int(instance))
+
+    def _note_instance(
+        self, record_id: str, instrument: str, instance: int
+    ) -> None:
+        key = (record_id, instrument)
+        if instance > self._max_instance.get(key, 0):
+            self._max_instance[key] = instance
+
+    def get_record_id(self, idnum_value: int) -> Optional[str]:
+        """
+        Returns the ID of an existing record that matches a specific
+        patient, if one can be found.
+
+        Args:
+            idnum_value:
+                CamCOPS patient ID number
+
+        Returns:
+            REDCap record ID or ``None``
+        """
+        if not self.empty and not self.has_patient_id_field:
+            raise RedcapExportException(
+                (
+                    f"Field '{self.patient_id_fieldname}' does not exist in "
+                    f"REDCap. Is the 'patient' tag in the fieldmap correct?"
+                )
+            )
+        return self._record_id_for_patient.get(idnum_value)
+
+    def get_next_instance_id(
+        self, instrument: str, existing_record_id: Optional[str]
+    ) -> int:
+        """
+        Returns the next REDCap instance ID to use for a particular
+        instrument (the previous highest ID plus 1, or 1 if none can be
+        found).
+
+        Args:
+            instrument:
+                instrument name
+            existing_record_id:
+                ID of existing record
+        """
+        if existing_record_id is None:
+            return 1
+        if not self.empty and not self.has_record_id_field:
+            raise RedcapExportException(
+                (
+                    f"Field '{self.record_id_fieldname}' does not exist in "
+                    f"REDCap. Is the 'record' tag in the fieldmap correct?"
+                )
+            )
+        return self._max_instance.get((existing_record_id, instrument), 0) + 1
+
+    def note_upload(
+        self,
+        idnum_value: int,
+        record_id: str,
+        instrument: str,
+        instance: int,
+    ) -> None:
+        """
+        Updates the index after a successful upload, as if we had downloaded
+        the project again.
+
+        Args:
+            idnum_value:
+                CamCOPS patient ID number
+            record_id:
+                REDCap ID of the record that was created or updated
+            instrument:
+                instrument name
+            instance:
+                REDCap instance ID used
+        """
+        self._record_id_for_patient.setdefault(idnum_value, record_id)
+        self._note_instance(record_id, instrument, instance)
+
+
+class RedcapProjectSnapshot(object):
+    """
+    What we know about a REDCap project during an export run: the
+    :class:`redcap.project.Project` itself, its project information, and an
+    index of its existing records. Downloaded once, then kept up to date
+    locally as we upload.
+    """
+
+    def __init__(
+        self, project: redcap.project.Project, fieldmap: RedcapFieldmap
+    ) -> None:
+        """
+        Args:
+            project:
+                a :class:`redcap.project.Project`
+            fieldmap:
+                the :class:`RedcapFieldmap` in use
+        """
+        self.project = project
+        self.fieldmap = fieldmap
+        self._project_info = None  # type: Optional[Dict[str, Any]]
+        self._is_longitudinal = None  # type: Optional[bool]
+        self._index = None  # type: Optional[RedcapRecordIndex]
+
+    @property
+    def project_info(self) -> Dict[str, Any]:
+        """
+        Returns the REDCap project information.
+        """
+        if self._project_info is None:
+            self._project_info = self.project.export_project_info()
+        return self._project_info
+
+    @property
+    def is_longitudinal(self) -> bool:
+        """
+        Does the REDCap project have events?
+        """
+        if self._is_longitudinal is None:
+            self._is_longitudinal = self.project.is_longitudinal()
+        return self._is_longitudinal
+
+    @property
+    def index(self) -> RedcapRecordIndex:
+        """
+        Returns the :class:`RedcapRecordIndex` of existing records,
+        downloading them the first time.
+        """
+        if self._index is None:
+            records = RedcapTaskExporter._get_existing_records(
+                self.project, self.fieldmap
+            )
+            self._index = RedcapRecordIndex(
+                records,
+                record_id_fieldname=self.fieldmap.record["redcap_field"],
+                patient_id_fieldname=self.fieldmap.patient["redcap_field"],
+            )
+        return self._index
+
+
 class RedcapTaskExporter(object):
     """
     Main entry point for task export to REDCap. Works out which record needs
     updating or creating. Creates the fieldmap and initiates upload.
+
+    Keeps a :class:`RedcapProjectSnapshot` per recipient, so use one instance
+    for a whole export run (see
+    :meth:`camcops_server.cc_modules.cc_request.CamcopsRequest.redcap_task_exporter`).
     """
 
+    def __init__(self) -> None:
+        self._snapshots = {}  # type: Dict[str, RedcapProjectSnapshot]
+        # ... {recipient_name: snapshot}
+
+    def get_snapshot(
+        self, recipient: ExportRecipient
+    ) -> RedcapProjectSnapshot:
+        """
+        Returns the :class:`RedcapProjectSnapshot` for a recipient, creating
+        it if necessary (or if the fieldmap has changed).
+
+        Args:
+            recipient:
+                an
+                :class:`camcops_server.cc_modules.cc_exportmodels.ExportRecipient`
+        """
+        fieldmap = self.get_fieldmap(recipient)
+        snapshot = self._snapshots.get(recipient.recipient_name)
+        if snapshot is None or snapshot.fieldmap is not fieldmap:
+            snapshot = RedcapProjectSnapshot(
+                self.get_project(recipient), fieldmap
+            )
+            self._snapshots[recipient.recipient_name] = snapshot
+        return snapshot
+
+    def forget_snapshot(self, recipient: ExportRecipient) -> None:
+        """
+        Discards our knowledge of a recipient's REDCap project, so that it is
+        downloaded again for the next task (e.g. after a failed upload, when
+        we don't know what state the project is in).
+        """
+        self._snapshots.pop(recipient.recipient_name, None)
+
     def export_task(
         self, req: "CamcopsRequest", exported_task_redcap: "ExportedTaskRedcap"
     ) -> None:
@@ -250,17 +538,15 @@ class RedcapTaskExporter(object):
         which_idnum = recipient.primary_idnum
         idnum_object = task.patient.get_idnum_object(which_idnum)
 
-        project = self.get_project(recipient)
-        fieldmap = self.get_fieldmap(recipient)
+        snapshot = self.get_snapshot(recipient)
+        fieldmap = snapshot.fieldmap
 
-        if project.is_longitudinal():
+        if snapshot.is_longitudinal:
             if not all(fieldmap.events.values()):
                 raise RedcapExportException(MISSING_EVENT_TAG_OR_ATTRIBUTE)
 
-        existing_records = self._get_existing_records(project, fieldmap)
-        existing_record_id = self._get_existing_record_id(
-            existing_records, fieldmap, idnum_object.idnum_value
-        )
+        index = snapshot.index
+        existing_record_id = index.get_record_id(idnum_object.idnum_value)
 
         if existing_record_id is None:
             uploader_class = RedcapNewRecordUploader
@@ -277,23 +563,30 @@ class RedcapTaskExporter(object):
                 )
             )
 
-        record_id_fieldname = fieldmap.record["redcap_field"]
-
-        next_instance_id = self._get_next_instance_id(
-            existing_records,
-            instrument_name,
-            record_id_fieldname,
-            existing_record_id,
+        next_instance_id = index.get_next_instance_id(
+            instrument_name, existing_record_id
         )
 
-        uploader = uploader_class(req, project)
+        uploader = uploader_class(
+            req, snapshot.project, project_info=snapshot.project_info
+        )
 
-        new_record_id = uploader.upload(
-            task,
-            existing_record_id,
-            next_instance_id,
-            fieldmap,
+        try:
+            new_record_id = uploader.upload(
+                task,
+                existing_record_id,
+                next_instance_id,
+                fieldmap,
+                idnum_object.idnum_value,
+            )
+        except Exception:
+            self.forget_snapshot(recipient)
+            raise
+        index.note_upload(
             idnum_object.idnum_value,
+            new_record_id,
+            instrument_name,
+            next_instance_id,
         )
 
         exported_task_redcap.redcap_record_id = new_record_id
@@ -364,26 +657,12 @@ class RedcapTaskExporter(object):
         Returns:
             REDCap record ID or ``None``
         """
-
-        if records.empty:
-            return None
-
-        patient_id_fieldname = fieldmap.patient["redcap_field"]
-
-        if patient_id_fieldname not in records:
-            raise RedcapExportException(
-                (
-                    f"Field '{patient_id_fieldname}' does not exist in "
-                    f"REDCap. Is the 'patient' tag in the fieldmap correct?"
-                )
-            )
-
-        with_identifier = records[patient_id_fieldname] == idnum_value
-
-        if len(records[with_identifier]) == 0:
-            return None
-
-        return records[with_identifier].iat[0, 0]
+        index = RedcapRecordIndex(
+            records,
+            record_id_fieldname=fieldmap.record["redcap_field"],
+            patient_id_fieldname=fieldmap.patient["redcap_field"],
+        )
+        return index.get_record_id(idnum_value)
 
     @staticmethod
     def _get_next_instance_id(
@@ -406,26 +685,10 @@ class RedcapTaskExporter(object):
             existing_record_id:
                 ID of existing record
         """
-        if existing_record_id is None:
-            return 1
-
-        if record_id_fieldname not in records:
-            raise RedcapExportException(
-                (
-                    f"Field '{record_id_fieldname}' does not exist in REDCap. "
-                    f"Is the 'record' tag in the fieldmap correct?"
-                )
-            )
-
-        previous_instances = records[
-            (records["redcap_repeat_instrument"] == instrument)
-            & (records[record_id_fieldname] == existing_record_id)
-        ]
-
-        if len(previous_instances) == 0:
-            return 1
-
-        return int(previous_instances.max()["redcap_repeat_instance"] + 1)
+        index = RedcapRecordIndex(
+            records, record_id_fieldname=record_id_fieldname
+        )
+        return index.get_next_instance_id(instrument, existing_record_id)
 
     def get_fieldmap(self, recipient: ExportRecipient) -> RedcapFieldmap:
         """
@@ -436,9 +699,7 @@ class RedcapTaskExporter(object):
                 an
                 :class:`camcops_server.cc_modules.cc_exportmodels.ExportRecipient`
         """
-        fieldmap = RedcapFieldmap(self.get_fieldmap_filename(recipient))
-
-        return fieldmap
+        return get_cached_fieldmap(self.get_fieldmap_filename(recipient))
 
     @staticmethod
     def get_fieldmap_filename(recipient: ExportRecipient) -> str:
@@ -507,7 +768,10 @@ class RedcapUploader(object):
     """
 
     def __init__(
-        self, req: "CamcopsRequest", project: "redcap.project.Project"
+        self,
+        req: "CamcopsRequest",
+        project: "redcap.project.Project",
+        project_info: Dict[str, Any] = None,
     ) -> None:
         """
 
@@ -516,10 +780,15 @@ class RedcapUploader(object):
                 a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
             project:
                 a :class:`redcap.project.Project`
+            project_info:
+                the project information, if already known; otherwise, we
+                fetch it
         """
         self.req = req
         self.project = project
-        self.project_info = project.export_project_info()
+        if project_info is None:
+            project_info = project.export_project_info()
+        self.project_info = project_info
 
     def get_record_id(self, existing_record_id: Optional[str]) -> str:
         """
@@ -622,11 +891,11 @@ class RedcapUploader(object):
 
         record = {
             record_id_fieldname: record_id,
-            "redcap_repeat_instrument": instrument_name,
+            REDCAP_REPEAT_INSTRUMENT: instrument_name,
             # https://community.projectredcap.org/questions/74561/unexpected-behaviour-with-import-records-repeat-in.html  # noqa
             # REDCap won't create instance IDs automatically so we have to
             # assume no one else is writing to this record
-            "redcap_repeat_instance": next_instance_id,
+            REDCAP_REPEAT_INSTANCE: next_instance_id,
             f"{instrument_name}_complete": complete_status.value,
             "redcap_event_name": fieldmap.events[task.tablename],
         }
@@ -65,6 +65,7 @@ from camcops_server.cc_modules.cc_constants import (
     DEFAULT_ROWS_PER_PAGE,
 )
 from camcops_server.cc_modules.cc_db import FN_CURRENT, TFN_WHEN_CREATED
+from camcops_server.cc_modules.cc_patientindex import group_tasks_by_patient
 from camcops_server.cc_modules.cc_pyramid import (
     CamcopsPage,
     PageUrl,
@@ -632,6 +633,7 @@ class ScoreDetails(object):
         minimum: int,
         maximum: int,
         higher_score_is_better: bool = False,
+        summary_name: str = None,
     ) -> None:
         """
         Args:
@@ -647,12 +649,39 @@ class ScoreDetails(object):
                 maximum possible value of this score (for display purposes)
             higher_score_is_better:
                 is a higher score a better thing?
+            summary_name:
+                name of the task summary (see
+                :meth:`camcops_server.cc_modules.cc_task.Task.get_summaries`)
+                with the same value, if there is one; its stored value (see
+                :mod:`camcops_server.cc_modules.cc_tasksummary`) is then used
+                in preference to calling ``scorefunc``
         """
         self.name = name
         self.scorefunc = scorefunc
         self.minimum = minimum
         self.maximum = maximum
         self.higher_score_is_better = higher_score_is_better
+        self.summary_name = summary_name
+
+    def get_score(
+        self, task: "Task", stored: Dict[int, Dict[str, Any]] = None
+    ) -> Union[None, int, float]:
+        """
+        Returns the score for a task: the stored summary value, if we have
+        one, or else the value calculated by ``scorefunc``.
+
+        Args:
+            task:
+                the task
+            stored:
+                stored summaries, from
+                :func:`camcops_server.cc_modules.cc_tasksummary.get_stored_summaries`
+        """  # noqa
+        if stored and self.summary_name:
+            value = stored.get(task.pk, {}).get(self.summary_name)
+            if value is not None:
+                return value
+        return self.scorefunc(task)
 
     def calculate_improvement(
         self, first_score: float, latest_score: float
@@ -731,7 +760,9 @@ class AverageScoreReport(DateTimeFilteredReportMixin, Report, ABC):
         We use an SQLAlchemy ORM, rather than Core, method. Why?
 
         - "Patient equality" is complex (e.g. same patient_id on same device,
-          or a shared ID number, etc.) -- simplicity via Patient.__eq__.
+          or a shared ID number, etc.) -- handled by
+          ``group_tasks_by_patient()`` from
+          :mod:`camcops_server.cc_modules.cc_patientindex`.
         - Facilities "is task complete?" checks, and use of Python
           calculations.
         """
@@ -743,6 +774,9 @@ class AverageScoreReport(DateTimeFilteredReportMixin, Report, ABC):
         from camcops_server.cc_modules.cc_taskfilter import (
             TaskFilter,
         )  # delayed import
+        from camcops_server.cc_modules.cc_tasksummary import (
+            get_stored_summaries,
+        )  # delayed import
 
         # Which tasks?
         taskfilter = TaskFilter()
@@ -760,25 +794,36 @@ class AverageScoreReport(DateTimeFilteredReportMixin, Report, ABC):
         )
         all_tasks = collection.all_tasks
 
-        # Get all distinct patients
-        patients = set(t.patient for t in all_tasks)
+        # Group tasks by distinct patient. (Previously this used
+        # set(t.patient ...) and then a scan per patient, which is O(n^2) as
+        # Patient.__hash__ is constant.)
+        tasks_by_patient = group_tasks_by_patient(all_tasks)
         # log.debug("all_tasks: {}", all_tasks)
-        # log.debug("patients: {}", [str(p) for p in patients])
 
         scoretypes = self.scoretypes(req)
         n_scoretypes = len(scoretypes)
 
+        # Use stored scores, where we have them, rather than recalculating.
+        summary_names = [s.summary_name for s in scoretypes if s.summary_name]
+        if summary_names:
+            stored = get_stored_summaries(
+                req.dbsession,
+                self.task_class.__tablename__,
+                [t.pk for t in all_tasks],
+                req.language,
+                summary_names=summary_names,
+            )
+        else:
+            stored = {}
+
         # Sum first/last/progress scores by patient
         sum_first_by_score = [0] * n_scoretypes
         sum_last_by_score = [0] * n_scoretypes
         sum_improvement_by_score = [0] * n_scoretypes
         n_first = 0
         n_last = 0  # also n_progress
-        for patient in patients:
-            # Find tasks for this patient
-            patient_tasks = [t for t in all_tasks if t.patient == patient]
-            assert patient_tasks, f"No tasks for patient {patient}"
-            # log.debug("For patient {}, tasks: {}", patient, patient_tasks)
+        for patient_tasks in tasks_by_patient:
+            # log.debug("Tasks for one patient: {}", patient_tasks)
             # Find first and last task (last may be absent)
             patient_tasks.sort(key=task_when_created_sorter)
             first = patient_tasks[0]
@@ -791,11 +836,11 @@ class AverageScoreReport(DateTimeFilteredReportMixin, Report, ABC):
 
             # Obtain first/last scores and progress
             for scoreidx, scoretype in enumerate(scoretypes):
-                firstscore = scoretype.scorefunc(first)
+                firstscore = scoretype.get_score(first, stored)
                 # Scores should not be None, because all tasks are complete.
                 sum_first_by_score[scoreidx] += firstscore
                 if last:
-                    lastscore = scoretype.scorefunc(last)
+                    lastscore = scoretype.get_score(last, stored)
                     sum_last_by_score[scoreidx] += lastscore
                     improvement = scoretype.calculate_improvement(
                         firstscore, lastscore
@@ -31,6 +31,7 @@ import collections
 from contextlib import contextmanager
 import datetime
 import gettext
+import hashlib
 import logging
 import os
 import re
@@ -65,9 +66,6 @@ from cardinal_pythonlib.plot import (
 import cardinal_pythonlib.rnc_web as ws
 from cardinal_pythonlib.wsgi.constants import WsgiEnvVar
 import lockfile
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.figure import Figure
-from matplotlib.font_manager import FontProperties
 from pendulum import Date, DateTime as Pendulum, Duration
 from pendulum.parsing.exceptions import ParserError
 from pyramid.config import Configurator
@@ -88,6 +86,7 @@ from camcops_server.cc_modules.cc_baseconstants import (
     DOCUMENTATION_URL,
     TRANSLATIONS_DIR,
 )
+from camcops_server.cc_modules.cc_cache import SESSION_INFO_SHARED_CACHE
 from camcops_server.cc_modules.cc_config import (
     CamcopsConfig,
     get_config,
@@ -100,7 +99,7 @@ from camcops_server.cc_modules.cc_constants import (
     USE_SVG_IN_HTML,
 )
 from camcops_server.cc_modules.cc_idnumdef import (
-    get_idnum_definitions,
+    get_cached_idnum_definitions,
     IdNumDefinition,
     validate_id_number,
 )
@@ -110,8 +109,6 @@ from camcops_server.cc_modules.cc_language import (
     POSSIBLE_LOCALES,
 )
 
-# noinspection PyUnresolvedReferences
-import camcops_server.cc_modules.cc_plot  # import side effects (configure matplotlib)  # noqa
 from camcops_server.cc_modules.cc_pyramid import (
     camcops_add_mako_renderer,
     CamcopsAuthenticationPolicy,
@@ -128,10 +125,12 @@ from camcops_server.cc_modules.cc_pyramid import (
 )
 from camcops_server.cc_modules.cc_response import camcops_response_factory
 from camcops_server.cc_modules.cc_serversettings import (
+    get_database_title,
     get_server_settings,
     ServerSettings,
 )
 from camcops_server.cc_modules.cc_string import (
+    all_extra_string_hashes,
     all_extra_strings_as_dicts,
     APPSTRING_TASKNAME,
     MISSING_LOCALE,
@@ -148,11 +147,16 @@ from camcops_server.cc_modules.cc_validators import (
 if TYPE_CHECKING:
     from matplotlib.axis import Axis
     from matplotlib.axes import Axes
+    from matplotlib.figure import Figure
+    from matplotlib.font_manager import FontProperties
     from matplotlib.text import Text
     from camcops_server.cc_modules.cc_exportrecipient import ExportRecipient
     from camcops_server.cc_modules.cc_exportrecipientinfo import (
         ExportRecipientInfo,
     )
+    from camcops_server.cc_modules.cc_fhir import FhirExportSession
+    from camcops_server.cc_modules.cc_pdf import PdfHtmlCache
+    from camcops_server.cc_modules.cc_redcap import RedcapTaskExporter
     from camcops_server.cc_modules.cc_session import CamcopsSession
     from camcops_server.cc_modules.cc_snomed import SnomedConcept
 
@@ -487,6 +491,9 @@ class CamcopsRequest(Request):
         engine = self.engine
         maker = sessionmaker(bind=engine)
         session = maker()  # type: SqlASession
+        shared_cache = self.config.get_shared_cache_region()
+        if shared_cache is not None:
+            session.info[SESSION_INFO_SHARED_CACHE] = shared_cache
         return session
 
     # -------------------------------------------------------------------------
@@ -1132,6 +1139,40 @@ class CamcopsRequest(Request):
             return None
         return ws.webify(value)
 
+    @reify
+    def extra_string_tasks_not_permitted(self) -> Set[str]:
+        """
+        Returns the names of tasks (as used in the extra strings) whose extra
+        strings the current user may not download, according to the
+        :ref:`RESTRICTED_TASKS <RESTRICTED_TASKS>` option.
+        """
+        restricted_tasks = self.config.restricted_tasks
+        if not restricted_tasks:
+            return set()
+        user_group_names = set(self.user.group_names)
+        return set(
+            task
+            for task, permitted_group_names in restricted_tasks.items()
+            if not user_group_names.intersection(permitted_group_names)
+        )
+
+    @reify
+    def extra_strings_version(self) -> str:
+        """
+        Returns the version of the extra strings that the current user may
+        download (see :meth:`get_all_extra_strings`). This changes if the
+        strings change, or if the tasks whose strings the user may download
+        change.
+        """
+        corpus_version, _ = all_extra_string_hashes(self.config_filename)
+        access = hashlib.blake2b(
+            "\n".join(sorted(self.extra_string_tasks_not_permitted)).encode(
+                "utf-8"
+            ),
+            digest_size=4,
+        ).hexdigest()
+        return f"{corpus_version}_{access}"
+
     def get_all_extra_strings(self) -> List[Tuple[str, str, str, str]]:
         """
         Returns all extra strings, as a list of ``task, name, language, value``
@@ -1140,22 +1181,11 @@ class CamcopsRequest(Request):
         2019-09-16: these are filtered according to the :ref:`RESTRICTED_TASKS
         <RESTRICTED_TASKS>` option.
         """
-        restricted_tasks = self.config.restricted_tasks
-        user_group_names = None  # type: Optional[Set[str]]
-
-        def task_permitted(task_xml_name: str) -> bool:
-            nonlocal user_group_names
-            if task_xml_name not in restricted_tasks:
-                return True
-            if user_group_names is None:
-                user_group_names = set(self.user.group_names)
-            permitted_group_names = set(restricted_tasks[task_xml_name])
-            return bool(permitted_group_names.intersection(user_group_names))
-
+        not_permitted = self.extra_string_tasks_not_permitted
         allstrings = self._all_extra_strings
         rows = []
         for task, taskstrings in allstrings.items():
-            if not task_permitted(task):
+            if task in not_permitted:
                 log.debug(
                     f"Skipping extra string download for task {task}: "
                     f"not permitted for user {self.user.username}"
@@ -1331,11 +1361,21 @@ class CamcopsRequest(Request):
         self.provide_png_fallback_for_svg = provide_png_fallback
 
     @staticmethod
-    def create_figure(**kwargs) -> Figure:
+    def create_figure(**kwargs) -> "Figure":
         """
         Creates and returns a :class:`matplotlib.figure.Figure` with a canvas.
         The canvas will be available as ``fig.canvas``.
         """
+        # Delayed imports, since matplotlib is slow to import and most
+        # requests (and commands) don't draw anything. Importing cc_plot
+        # configures matplotlib.
+        # noinspection PyUnresolvedReferences
+        import camcops_server.cc_modules.cc_plot  # noqa: F401
+        from matplotlib.backends.backend_agg import (
+            FigureCanvasAgg as FigureCanvas,
+        )
+        from matplotlib.figure import Figure
+
         fig = Figure(**kwargs)
         # noinspection PyUnusedLocal
         canvas = FigureCanvas(fig)  # noqa: F841
@@ -1474,11 +1514,16 @@ class CamcopsRequest(Request):
         )
 
     @reify
-    def fontprops(self) -> FontProperties:
+    def fontprops(self) -> "FontProperties":
         """
         Return a :class:`matplotlib.font_manager.FontProperties` object for
         use with Matplotlib plotting.
         """
+        # Delayed import; importing cc_plot configures matplotlib.
+        # noinspection PyUnresolvedReferences
+        import camcops_server.cc_modules.cc_plot  # noqa: F401
+        from matplotlib.font_manager import FontProperties
+
         return FontProperties(**self.fontdict)
 
     def set_figure_font_sizes(
@@ -1498,6 +1543,11 @@ class CamcopsRequest(Request):
             x_ticklabels: if ``True``, modify the X-axis tick labels
             y_ticklabels: if ``True``, modify the Y-axis tick labels
         """
+        # Delayed import; importing cc_plot configures matplotlib.
+        # noinspection PyUnresolvedReferences
+        import camcops_server.cc_modules.cc_plot  # noqa: F401
+        from matplotlib.font_manager import FontProperties
+
         final_fontdict = self.fontdict.copy()
         if fontdict:
             final_fontdict.update(fontdict)
@@ -1514,7 +1564,7 @@ class CamcopsRequest(Request):
             ):  # type: Text  # I think!
                 ticklabel.set_fontproperties(fp)
 
-    def get_html_from_pyplot_figure(self, fig: Figure) -> str:
+    def get_html_from_pyplot_figure(self, fig: "Figure") -> str:
         """
         Make HTML (as PNG or SVG) from pyplot
         :class:`matplotlib.figure.Figure`.
@@ -1564,8 +1614,10 @@ class CamcopsRequest(Request):
         """
         Returns all
         :class:`camcops_server.cc_modules.cc_idnumdef.IdNumDefinition` objects.
-        """
-        return get_idnum_definitions(self.dbsession)  # no longer cached
+        These may come from the shared cache, so don't edit them; see
+        :func:`camcops_server.cc_modules.cc_idnumdef.get_cached_idnum_definitions`.
+        """  # noqa
+        return get_cached_idnum_definitions(self.dbsession)
 
     @reify
     def valid_which_idnums(self) -> List[int]:
@@ -1685,8 +1737,7 @@ class CamcopsRequest(Request):
         """
         Return the database friendly title for the server.
         """
-        ss = self.server_settings
-        return ss.database_title or ""
+        return get_database_title(self)
 
     def set_database_title(self, title: str) -> None:
         """
@@ -1942,6 +1993,40 @@ class CamcopsRequest(Request):
         assert len(recipients) == 1
         return recipients[0]
 
+    @reify
+    def redcap_task_exporter(self) -> "RedcapTaskExporter":
+        """
+        Returns a REDCap exporter shared by all REDCap task exports in this
+        request, so that each REDCap project is downloaded once per export
+        run rather than once per task.
+        """
+        from camcops_server.cc_modules.cc_redcap import (
+            RedcapTaskExporter,
+        )  # delayed import
+
+        return RedcapTaskExporter()
+
+    @reify
+    def fhir_export_sessions(self) -> Dict[str, "FhirExportSession"]:
+        """
+        FHIR export sessions, by recipient name, shared by all FHIR task
+        exports in this request; see
+        :func:`camcops_server.cc_modules.cc_fhir.get_fhir_export_session`.
+        """
+        return {}
+
+    @reify
+    def pdf_html_cache(self) -> "PdfHtmlCache":
+        """
+        HTML used repeatedly to make PDFs (and PDFs made in advance) in this
+        request; see :class:`camcops_server.cc_modules.cc_pdf.PdfHtmlCache`.
+        """
+        from camcops_server.cc_modules.cc_pdf import (
+            PdfHtmlCache,
+        )  # delayed import
+
+        return PdfHtmlCache(self)
+
     @reify
     def all_push_recipients(self) -> List["ExportRecipient"]:
         """
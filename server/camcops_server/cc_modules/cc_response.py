@@ -27,13 +27,15 @@ camcops_server/cc_modules/cc_response.py
 
 """
 
-from typing import TYPE_CHECKING
+from typing import Iterable, TYPE_CHECKING
 
+from cardinal_pythonlib.httpconst import MimeType
 from pyramid.response import Response
 
 from camcops_server.cc_modules.cc_baseconstants import (
     DEFORM_SUPPORTS_CSP_NONCE,
 )
+from camcops_server.cc_modules.cc_xml import gen_utf8_chunks
 
 if TYPE_CHECKING:
     from camcops_server.cc_modules.cc_request import CamcopsRequest
@@ -179,6 +181,24 @@ class CamcopsResponse(Response):
         )
 
 
+class XmlStreamingResponse(Response):
+    """
+    Response class for returning XML to the user, streamed from pieces of
+    text (e.g. from :func:`camcops_server.cc_modules.cc_xml.gen_xml_document`)
+    rather than built up as one string first.
+
+    Compare ``cardinal_pythonlib.pyramid.responses.XmlResponse``.
+    """
+
+    def __init__(self, pieces: Iterable[str], **kwargs) -> None:
+        super().__init__(
+            content_type=MimeType.XML,
+            charset="utf-8",
+            app_iter=gen_utf8_chunks(pieces),
+            **kwargs,
+        )
+
+
 def camcops_response_factory(request: "CamcopsRequest") -> Response:
     """
     Factory function to make a response object.
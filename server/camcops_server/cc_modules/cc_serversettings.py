@@ -80,6 +80,11 @@ from sqlalchemy.sql.sqltypes import (
     UnicodeText,
 )
 
+from camcops_server.cc_modules.cc_cache import (
+    register_shared_cache_dependency,
+    shared_cache_get_or_create,
+    SharedCacheKeys,
+)
 from camcops_server.cc_modules.cc_sqla_coltypes import DatabaseTitleColType
 from camcops_server.cc_modules.cc_sqlalchemy import Base
 
@@ -161,7 +166,6 @@ server_stored_var_table_defunct = Table(
 # =============================================================================
 
 SERVER_SETTINGS_SINGLETON_PK = 1
-# CACHE_KEY_DATABASE_TITLE = "database_title"
 
 
 class ServerSettings(Base):
@@ -236,19 +240,20 @@ def get_server_settings(req: "CamcopsRequest") -> ServerSettings:
     return server_settings
 
 
-# def get_database_title(req: "CamcopsRequest") -> str:
-#     def creator() -> str:
-#         server_settings = get_server_settings(req)
-#         return server_settings.database_title or ""
-#
-#     return cache_region_static.get_or_create(CACHE_KEY_DATABASE_TITLE, creator)  # noqa
+def get_database_title(req: "CamcopsRequest") -> str:
+    """
+    Returns the database title, via the shared cache (if there is one), since
+    it's shown on every page.
+    """
 
+    def creator() -> str:
+        return get_server_settings(req).database_title or ""
 
-# def clear_database_title_cache() -> None:
-#     cache_region_static.delete(CACHE_KEY_DATABASE_TITLE)
+    return shared_cache_get_or_create(
+        req.dbsession, SharedCacheKeys.DATABASE_TITLE, creator
+    )
 
 
-# def set_database_title(req: "CamcopsRequest", title: str) -> None:
-#     server_settings = get_server_settings(req)
-#     server_settings.database_title = title
-#     clear_database_title_cache()
+register_shared_cache_dependency(
+    ServerSettings, SharedCacheKeys.DATABASE_TITLE
+)
@@ -41,11 +41,18 @@ from cardinal_pythonlib.sqlalchemy.orm_query import CountStarSpecializedQuery
 from pendulum import DateTime as Pendulum
 from pyramid.interfaces import ISession
 from sqlalchemy.orm import relationship, Session as SqlASession
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql.expression import exists
 from sqlalchemy.sql.schema import Column, ForeignKey
 from sqlalchemy.sql.sqltypes import Boolean, DateTime, Integer
 
 from camcops_server.cc_modules.cc_constants import DateFormat
 from camcops_server.cc_modules.cc_pyramid import CookieKey
+from camcops_server.cc_modules.cc_sessionactivity import (
+    get_session_activity_tracker,
+    naive_utc,
+    SessionActivityTracker,
+)
 from camcops_server.cc_modules.cc_sqla_coltypes import (
     IPAddressColType,
     JsonColType,
@@ -77,6 +84,7 @@ if DEBUG_CAMCOPS_SESSION_CREATION:
 # =============================================================================
 
 DEFAULT_NUMBER_OF_TASKS_TO_VIEW = 25
+DELETE_OLD_SESSIONS_BATCH_SIZE = 1000
 
 
 # =============================================================================
@@ -135,6 +143,7 @@ class CamcopsSession(Base):
     last_activity_utc = Column(
         "last_activity_utc",
         DateTime,
+        index=True,  # for deleting expired sessions
         comment="Date/time of last activity (UTC)",
     )
     number_to_view = Column(
@@ -318,12 +327,10 @@ class CamcopsSession(Base):
         # Fetch or create
         # ---------------------------------------------------------------------
         if session_id and session_token:
-            oldest_permitted = cls.get_oldest_last_activity_allowed(req)
             query = (
                 dbsession.query(cls)
                 .filter(cls.id == session_id)
                 .filter(cls.token == session_token)
-                .filter(cls.last_activity_utc >= oldest_permitted)
             )
 
             if req.config.session_check_user_ip:
@@ -333,19 +340,18 @@ class CamcopsSession(Base):
                 query = query.filter(cls.ip_address == ip_addr)
 
             candidate = query.first()  # type: Optional[CamcopsSession]
+            if candidate is not None and candidate.has_expired(req):
+                candidate = None
             if DEBUG_CAMCOPS_SESSION_CREATION:
                 if candidate is None:
-                    log.debug("Session not found in database")
+                    log.debug("Session not found in database (or expired)")
         else:
             if DEBUG_CAMCOPS_SESSION_CREATION:
                 log.debug("Session ID and/or session token is missing.")
             candidate = None
         found = candidate is not None
         if found:
-            candidate.last_activity_utc = now
-            if DEBUG_CAMCOPS_SESSION_CREATION:
-                log.debug("Committing for last_activity_utc")
-            dbsession.commit()  # avoid holding a lock, 2019-03-21
+            candidate._record_activity(req)
             ccsession = candidate
         else:
             new_http_session = cls(ip_addr=ip_addr, last_activity_utc=now)
@@ -375,26 +381,151 @@ class CamcopsSession(Base):
         oldest_last_activity_allowed = now - cfg.session_timeout
         return oldest_last_activity_allowed
 
-    @classmethod
-    def delete_old_sessions(cls, req: "CamcopsRequest") -> None:
+    @staticmethod
+    def activity_tracker(req: "CamcopsRequest") -> SessionActivityTracker:
         """
-        Delete all expired sessions.
+        Returns the (per-process) tracker that writes session activity to the
+        database in batches.
         """
-        oldest_last_activity_allowed = cls.get_oldest_last_activity_allowed(
-            req
+        return get_session_activity_tracker(
+            req.config.session_activity_flush_interval_s
+        )
+
+    def has_expired(self, req: "CamcopsRequest") -> bool:
+        """
+        Has this session timed out? Allows for activity that hasn't yet been
+        written to the database (see
+        :mod:`camcops_server.cc_modules.cc_sessionactivity`).
+        """
+        tracker = self.activity_tracker(req)
+        candidates = [
+            naive_utc(when)
+            for when in (
+                self.last_activity_utc,
+                tracker.last_activity(self.id),
+            )
+            if when is not None
+        ]
+        if not candidates:
+            return True
+        oldest_permitted = naive_utc(
+            self.get_oldest_last_activity_allowed(req)
         )
+        return max(candidates) < oldest_permitted - tracker.grace
+
+    def _record_activity(self, req: "CamcopsRequest") -> None:
+        """
+        Notes that this (existing) session is in use now.
+        """
+        now = req.now_utc
         dbsession = req.dbsession
+        tracker = self.activity_tracker(req)
+        if not tracker.write_behind:
+            self.last_activity_utc = now
+            if DEBUG_CAMCOPS_SESSION_CREATION:
+                log.debug("Committing for last_activity_utc")
+            dbsession.commit()  # avoid holding a lock, 2019-03-21
+            return
+        # Show the new time to this request, without making the object dirty
+        # (which would mean an UPDATE for every request).
+        set_committed_value(self, "last_activity_utc", now)
+        tracker.record(self.id, now)
+        if tracker.flush_due(now):
+            tracker.flush(dbsession)
+            dbsession.commit()  # as above
+        tracker.ensure_background_flush(dbsession.get_bind().engine)
+
+    @classmethod
+    def delete_old_sessions(
+        cls,
+        req: "CamcopsRequest",
+        batch_size: int = DELETE_OLD_SESSIONS_BATCH_SIZE,
+    ) -> int:
+        """
+        Delete all expired sessions (and their task filters), oldest first,
+        in batches, via the index on ``last_activity_utc``. Then delete any
+        other orphaned task filters; see :meth:`delete_orphan_task_filters`.
+
+        Returns the number of sessions deleted.
+        """
+        dbsession = req.dbsession
+        tracker = cls.activity_tracker(req)
+        # Write our own pending activity first, so we don't delete sessions
+        # that are in use. For other processes, allow for the flush interval.
+        tracker.flush(dbsession)
+        cutoff = pendulum_to_utc_datetime_without_tz(
+            cls.get_oldest_last_activity_allowed(req) - tracker.grace
+        )
         log.debug("Deleting expired sessions")
-        dbsession.query(cls).filter(
-            cls.last_activity_utc < oldest_last_activity_allowed
-        ).delete(synchronize_session=False)
-        # 2020-09-22: The cascade-delete to TaskFilter (see above) isn't
-        # working, even without synchronize_session=False, and even after
-        # adding delete-orphan and single_parent=True. So:
-        subquery_active_taskfilter_ids = dbsession.query(cls.task_filter_id)
-        dbsession.query(TaskFilter).filter(
-            TaskFilter.id.notin_(subquery_active_taskfilter_ids)
-        ).delete(synchronize_session=False)
+        n_deleted = 0
+        while True:
+            rows = (
+                dbsession.query(cls.id, cls.task_filter_id)
+                .filter(cls.last_activity_utc < cutoff)
+                .order_by(cls.last_activity_utc)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            session_ids = [row[0] for row in rows]
+            dbsession.query(cls).filter(cls.id.in_(session_ids)).delete(
+                synchronize_session=False
+            )
+            # 2020-09-22: The cascade-delete to TaskFilter (see above) isn't
+            # working for bulk deletes like this, so delete the task filters
+            # of the sessions we've deleted, too.
+            task_filter_ids = [row[1] for row in rows if row[1] is not None]
+            if task_filter_ids:
+                dbsession.query(TaskFilter).filter(
+                    TaskFilter.id.in_(task_filter_ids)
+                ).delete(synchronize_session=False)
+            for session_id in session_ids:
+                tracker.forget(session_id)
+            n_deleted += len(rows)
+            if len(rows) < batch_size:
+                break
+        cls.delete_orphan_task_filters(req, batch_size=batch_size)
+        return n_deleted
+
+    @classmethod
+    def delete_orphan_task_filters(
+        cls,
+        req: "CamcopsRequest",
+        batch_size: int = DELETE_OLD_SESSIONS_BATCH_SIZE,
+    ) -> int:
+        """
+        Delete task filters that don't belong to any session, in batches.
+        These may be left behind by sessions deleted in other ways, or by
+        older versions of CamCOPS.
+
+        Returns the number of task filters deleted.
+        """
+        dbsession = req.dbsession
+        n_deleted = 0
+        while True:
+            task_filter_ids = [
+                row[0]
+                for row in (
+                    dbsession.query(TaskFilter.id)
+                    .filter(
+                        ~exists().where(cls.task_filter_id == TaskFilter.id)
+                    )
+                    .limit(batch_size)
+                    .all()
+                )
+            ]
+            if not task_filter_ids:
+                break
+            dbsession.query(TaskFilter).filter(
+                TaskFilter.id.in_(task_filter_ids)
+            ).delete(synchronize_session=False)
+            n_deleted += len(task_filter_ids)
+            if len(task_filter_ids) < batch_size:
+                break
+        if n_deleted:
+            log.debug("Deleted {} orphaned task filters", n_deleted)
+        return n_deleted
 
     @classmethod
     def n_sessions_active_since(
@@ -0,0 +1,344 @@
+"""
+camcops_server/cc_modules/cc_sessionactivity.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Write-behind tracking of web session activity.**
+
+Every authenticated request (including every client API call during an
+upload) used to set ``last_activity_utc`` on its
+:class:`camcops_server.cc_modules.cc_session.CamcopsSession` and COMMIT. That
+single-row write was the most frequent write to the database.
+
+Instead, we record activity in memory, per process, and write it in batches
+(one UPDATE statement, executed for many sessions) at most once per flush
+interval. Pending activity is written:
+
+- by the request that finds the flush to be due;
+- by a background thread in each server process, so that an idle process
+  doesn't hold on to it indefinitely (not for SQLite, which is single-process
+  and doesn't like concurrent writers; there, the next request writes it);
+- before expired sessions are deleted.
+
+So the database value of ``last_activity_utc`` may lag behind by up to the
+flush interval, and other processes may therefore see a session as less
+recently active than it is. To compensate, session timeouts are checked (and
+expired sessions deleted) with that much grace, i.e. a session may outlive
+the configured timeout by up to the flush interval.
+
+A flush interval of zero means "write through": the previous behaviour.
+
+"""
+
+import datetime
+import logging
+import os
+import threading
+from typing import Dict, Optional, TYPE_CHECKING
+
+from cardinal_pythonlib.datetimefunc import convert_datetime_to_utc
+from cardinal_pythonlib.logs import BraceStyleAdapter
+from cardinal_pythonlib.sqlalchemy.dialect import SqlaDialectName
+from sqlalchemy.orm import Session as SqlASession
+from sqlalchemy.sql.expression import bindparam, or_
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine.base import Engine
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+
+# =============================================================================
+# Helper functions
+# =============================================================================
+
+
+def naive_utc(when: datetime.datetime) -> datetime.datetime:
+    """
+    Returns a date/time as a naive UTC datetime, the way
+    ``last_activity_utc`` is stored. Naive values are assumed to be UTC
+    already.
+    """
+    if when.tzinfo is None:
+        return when
+    return convert_datetime_to_utc(when).naive()
+
+
+def write_session_activity(
+    dbsession: SqlASession, activity: Dict[int, datetime.datetime]
+) -> None:
+    """
+    Writes last-activity times for many sessions, as one (executemany)
+    UPDATE. Never moves a session's activity time backwards (another process
+    may have written a later one).
+
+    Args:
+        dbsession: an SQLAlchemy session
+        activity: dictionary mapping session ID to naive UTC datetime
+    """
+    from camcops_server.cc_modules.cc_session import (
+        CamcopsSession,
+    )  # delayed import
+
+    table = CamcopsSession.__table__
+    stmt = (
+        table.update()
+        .where(table.c.id == bindparam("b_id"))
+        .where(
+            or_(
+                table.c.last_activity_utc.is_(None),
+                table.c.last_activity_utc < bindparam("b_when"),
+            )
+        )
+        .values(last_activity_utc=bindparam("b_when"))
+    )
+    # In ID order, to reduce the risk of deadlock with other writers.
+    params = [
+        dict(b_id=session_id, b_when=when)
+        for session_id, when in sorted(activity.items())
+    ]
+    dbsession.execute(stmt, params)
+
+
+# =============================================================================
+# SessionActivityTracker
+# =============================================================================
+
+
+class SessionActivityTracker(object):
+    """
+    Coalesces session activity in memory, for writing in batches. One per
+    process; see :func:`get_session_activity_tracker`. Thread-safe.
+    """
+
+    def __init__(self, flush_interval_s: float) -> None:
+        """
+        Args:
+            flush_interval_s:
+                maximum time (in seconds) to hold activity before writing it
+                to the database; zero for "write through" (in which case this
+                object isn't used to hold anything)
+        """
+        self.flush_interval_s = flush_interval_s
+        self._reset()
+
+    def _reset(self) -> None:
+        """
+        Starts afresh. Also used in a child process after a fork, since
+        neither locks nor threads survive that usefully.
+        """
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._pending = {}  # type: Dict[int, datetime.datetime]
+        self._last_flush = datetime.datetime.utcnow()
+        self._flusher = None  # type: Optional[threading.Thread]
+        self._stop = threading.Event()
+
+    def _check_pid(self) -> None:
+        if os.getpid() != self._pid:
+            self._reset()
+
+    @property
+    def write_behind(self) -> bool:
+        """
+        Are we holding activity in memory (rather than writing through)?
+        """
+        return self.flush_interval_s > 0
+
+    @property
+    def grace(self) -> datetime.timedelta:
+        """
+        How far behind the database may be.
+        """
+        return datetime.timedelta(seconds=self.flush_interval_s)
+
+    @property
+    def n_pending(self) -> int:
+        """
+        Number of sessions with activity not yet written.
+        """
+        with self._lock:
+            return len(self._pending)
+
+    def record(self, session_id: int, when: datetime.datetime) -> None:
+        """
+        Records activity for a session.
+        """
+        when = naive_utc(when)
+        self._check_pid()
+        with self._lock:
+            existing = self._pending.get(session_id)
+            if existing is None or when > existing:
+                self._pending[session_id] = when
+
+    def last_activity(self, session_id: int) -> Optional[datetime.datetime]:
+        """
+        Returns the activity time for a session that is pending (not yet
+        written), as a naive UTC datetime, or ``None``.
+        """
+        self._check_pid()
+        with self._lock:
+            return self._pending.get(session_id)
+
+    def clear(self) -> None:
+        """
+        Discards all pending activity.
+        """
+        with self._lock:
+            self._pending = {}
+
+    def forget(self, session_id: int) -> None:
+        """
+        Discards any pending activity for a session (e.g. one being deleted).
+        """
+        with self._lock:
+            self._pending.pop(session_id, None)
+
+    def flush_due(self, now: datetime.datetime = None) -> bool:
+        """
+        Is it time to write pending activity?
+        """
+        now = naive_utc(now) if now else datetime.datetime.utcnow()
+        with self._lock:
+            return bool(self._pending) and now - self._last_flush >= self.grace
+
+    def _take_pending(self) -> Dict[int, datetime.datetime]:
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._last_flush = datetime.datetime.utcnow()
+        return pending
+
+    def _restore_pending(self, pending: Dict[int, datetime.datetime]) -> None:
+        """
+        Puts back activity that we failed to write, unless superseded.
+        """
+        with self._lock:
+            for session_id, when in pending.items():
+                existing = self._pending.get(session_id)
+                if existing is None or when > existing:
+                    self._pending[session_id] = when
+
+    def flush(self, dbsession: SqlASession) -> int:
+        """
+        Writes all pending activity, using the database session supplied (the
+        caller should COMMIT). Returns the number of sessions written.
+        """
+        self._check_pid()
+        pending = self._take_pending()
+        if not pending:
+            return 0
+        try:
+            write_session_activity(dbsession, pending)
+        except Exception:
+            self._restore_pending(pending)
+            raise
+        log.debug("Wrote activity for {} session(s)", len(pending))
+        return len(pending)
+
+    def flush_with_engine(self, engine: "Engine") -> int:
+        """
+        Writes all pending activity in a transaction of its own.
+        """
+        dbsession = SqlASession(bind=engine)
+        try:
+            n = self.flush(dbsession)
+            dbsession.commit()
+            return n
+        except Exception:
+            dbsession.rollback()
+            raise
+        finally:
+            dbsession.close()
+
+    # -------------------------------------------------------------------------
+    # Background flushing
+    # -------------------------------------------------------------------------
+
+    def ensure_background_flush(self, engine: "Engine") -> None:
+        """
+        Starts a daemon thread to write pending activity every flush
+        interval, if one isn't running in this process. Does nothing for
+        SQLite, or if we are writing through.
+        """
+        if (
+            not self.write_behind
+            or engine.dialect.name == SqlaDialectName.SQLITE
+        ):
+            return
+        self._check_pid()
+        with self._lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(
+                target=self._background_flush,
+                args=(engine,),
+                name="session_activity_flush",
+                daemon=True,
+            )
+            self._flusher.start()
+
+    def _background_flush(self, engine: "Engine") -> None:
+        stop = self._stop
+        while not stop.wait(self.flush_interval_s):
+            try:
+                self.flush_with_engine(engine)
+            except Exception as e:
+                # Keep going; the activity will be retried next time.
+                log.error("Failed to write session activity: {}", e)
+
+    def stop_background_flush(self) -> None:
+        """
+        Stops any background thread (it doesn't write again).
+        """
+        self._stop.set()
+        flusher = self._flusher
+        if flusher is not None:
+            flusher.join()
+        self._flusher = None
+        self._stop = threading.Event()
+
+
+# =============================================================================
+# The per-process tracker
+# =============================================================================
+
+_tracker = None  # type: Optional[SessionActivityTracker]
+_tracker_lock = threading.Lock()
+
+
+def get_session_activity_tracker(
+    flush_interval_s: float,
+) -> SessionActivityTracker:
+    """
+    Returns the process's
+    :class:`camcops_server.cc_modules.cc_sessionactivity.SessionActivityTracker`,
+    creating it if necessary (or if the flush interval has changed).
+    """
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None or _tracker.flush_interval_s != flush_interval_s:
+            if _tracker is not None:
+                _tracker.stop_background_flush()
+            _tracker = SessionActivityTracker(flush_interval_s)
+        return _tracker
@@ -0,0 +1,323 @@
+"""
+camcops_server/cc_modules/cc_snapshot.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Precompiled snapshots of data read from XML files.**
+
+Every server process (and Celery worker) reads the extra strings XML files
+(several hundred kilobytes) and the SNOMED-CT XML files when it starts.
+Parsing XML is slow; unpickling the result is much faster. So, if the
+``DATA_SNAPSHOT_DIR`` config option is set, we keep the parsed data in a
+pickle file there (see :func:`load_or_build_snapshot`):
+
+- A snapshot file starts with a header: the snapshot format version, the
+  CamCOPS server version, and the name, size, modification time, and SHA-256
+  hash of every source file. The data follows.
+
+- A snapshot is used only if its header matches the source files exactly;
+  otherwise the data is parsed from the source files again and the snapshot
+  rewritten (atomically, so other processes never see half a file). So
+  editing, adding or removing a source file, or upgrading CamCOPS, rebuilds
+  the snapshot automatically. ``camcops_server build_data_snapshot`` rebuilds
+  them on demand (e.g. at installation).
+
+- Snapshot files are read via a read-only memory map, so the file's pages
+  are shared between processes via the operating system's page cache (though
+  each process unpickles its own copy of the data), and the header is
+  checked before the data is unpickled.
+
+- Pickle files can contain arbitrary code, so the directory must be writable
+  only by the CamCOPS server user; we create it (and the files) readable and
+  writable only by that user.
+
+The same directory also holds "versioned" snapshots (see
+:func:`write_versioned_snapshot`): data we may need again later, labelled by a
+version string rather than checked against source files. For example, we keep
+a table of hashes of the extra strings for each version of the extra strings
+that clients may have, so that we can tell a client which strings have changed
+since its version.
+
+"""
+
+import glob
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import re
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cardinal_pythonlib.logs import BraceStyleAdapter
+
+from camcops_server.cc_modules.cc_version_string import (
+    CAMCOPS_SERVER_VERSION_STRING,
+)
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+
+# =============================================================================
+# Constants
+# =============================================================================
+
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_FILE_EXT = ".pickle"
+HASH_CHUNK_SIZE = 1024 * 1024  # bytes
+DEFAULT_VERSIONED_SNAPSHOTS_KEPT = 20
+VERSION_REGEX = re.compile(r"^[A-Za-z0-9_]+$")
+
+
+class SnapshotHeaderKeys:
+    """
+    Keys in the header of a snapshot file.
+    """
+
+    FORMAT_VERSION = "format_version"
+    SERVER_VERSION = "server_version"
+    SOURCES = "sources"
+    VERSION = "version"  # for versioned snapshots
+
+
+# =============================================================================
+# Source file fingerprints
+# =============================================================================
+
+SourceFingerprint = Tuple[str, int, int, str]
+# ... filename, size (bytes), modification time (ns), SHA-256 hex digest
+
+
+def fingerprint_source_file(filename: str) -> SourceFingerprint:
+    """
+    Returns a fingerprint of a source file: its absolute name, size,
+    modification time, and SHA-256 hash.
+    """
+    filename = os.path.abspath(filename)
+    st = os.stat(filename)
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return filename, st.st_size, st.st_mtime_ns, sha256.hexdigest()
+
+
+def snapshot_header(sources: List[str]) -> Dict[str, Any]:
+    """
+    Returns the header that a snapshot of the source files given should have.
+    """
+    return {
+        SnapshotHeaderKeys.FORMAT_VERSION: SNAPSHOT_FORMAT_VERSION,
+        SnapshotHeaderKeys.SERVER_VERSION: CAMCOPS_SERVER_VERSION_STRING,
+        SnapshotHeaderKeys.SOURCES: [
+            fingerprint_source_file(f) for f in sorted(set(sources))
+        ],
+    }
+
+
+def snapshot_filename(directory: str, name: str, sources: List[str]) -> str:
+    """
+    Returns the filename of the snapshot for a set of source files. Different
+    sets of source files (e.g. from different configs) get different
+    snapshots.
+    """
+    names = "\n".join(sorted(set(os.path.abspath(f) for f in sources)))
+    digest = hashlib.sha256(names.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(directory, f"{name}_{digest}{SNAPSHOT_FILE_EXT}")
+
+
+# =============================================================================
+# Reading and writing snapshots
+# =============================================================================
+
+
+def read_snapshot(
+    filename: str, header: Dict[str, Any]
+) -> Tuple[bool, Optional[Any]]:
+    """
+    Reads a snapshot file, if it exists and its header matches the one given.
+
+    Returns:
+        tuple: ``found, data``
+    """
+    try:
+        with open(filename, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                unpickler = pickle.Unpickler(mm)
+                if unpickler.load() != header:
+                    log.info("Snapshot is out of date: {}", filename)
+                    return False, None
+                return True, unpickler.load()
+    except FileNotFoundError:
+        return False, None
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError) as e:
+        # ValueError: e.g. mmap of an empty file
+        log.warning("Unable to read snapshot {}: {}", filename, e)
+        return False, None
+
+
+def write_snapshot(filename: str, header: Dict[str, Any], data: Any) -> None:
+    """
+    Writes a snapshot file atomically. Failure is not fatal (we log a
+    warning).
+    """
+    directory = os.path.dirname(filename)
+    tmpname = None  # type: Optional[str]
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            # One pickler for both, to match the one unpickler (and its memo)
+            # in read_snapshot().
+            pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+            pickler.dump(header)
+            pickler.dump(data)
+        os.replace(tmpname, filename)
+        log.info("Wrote snapshot: {}", filename)
+    except (OSError, pickle.PicklingError) as e:
+        log.warning("Failed to write snapshot {}: {}", filename, e)
+        if tmpname and os.path.exists(tmpname):
+            os.remove(tmpname)
+
+
+def load_or_build_snapshot(
+    directory: str,
+    name: str,
+    sources: List[str],
+    builder: Callable[[], Any],
+    rebuild: bool = False,
+) -> Any:
+    """
+    Returns data derived from some source files, from a snapshot if there is
+    an up-to-date one, or by calling ``builder`` (and then saving a snapshot)
+    if not.
+
+    Args:
+        directory:
+            directory for snapshot files; if blank, just call ``builder``
+        name:
+            name of this sort of snapshot (used in the filename)
+        sources:
+            the source files from which ``builder`` makes the data
+        builder:
+            function to make the data from the source files (the result must
+            be picklable)
+        rebuild:
+            rebuild the snapshot even if it is up to date?
+    """
+    if not directory:
+        return builder()
+    filename = snapshot_filename(directory, name, sources)
+    header = snapshot_header(sources)
+    if not rebuild:
+        found, data = read_snapshot(filename, header)
+        if found:
+            log.debug("Loaded snapshot: {}", filename)
+            return data
+    data = builder()
+    write_snapshot(filename, header, data)
+    return data
+
+
+# =============================================================================
+# Versioned snapshots
+# =============================================================================
+
+
+def versioned_snapshot_filename(
+    directory: str, name: str, version: str
+) -> str:
+    """
+    Returns the filename of a versioned snapshot.
+
+    Raises:
+        :exc:`ValueError` if the version contains characters other than
+        letters, digits, and underscores (it may come from a client, and
+        becomes part of a filename).
+    """
+    if not VERSION_REGEX.match(version):
+        raise ValueError(f"Bad snapshot version: {version!r}")
+    return os.path.join(directory, f"{name}_v_{version}{SNAPSHOT_FILE_EXT}")
+
+
+def versioned_snapshot_header(version: str) -> Dict[str, Any]:
+    """
+    Returns the header of a versioned snapshot.
+    """
+    return {
+        SnapshotHeaderKeys.FORMAT_VERSION: SNAPSHOT_FORMAT_VERSION,
+        SnapshotHeaderKeys.VERSION: version,
+    }
+
+
+def read_versioned_snapshot(
+    directory: str, name: str, version: str
+) -> Tuple[bool, Optional[Any]]:
+    """
+    Reads a versioned snapshot, if there is one.
+
+    Returns:
+        tuple: ``found, data``
+    """
+    if not directory:
+        return False, None
+    return read_snapshot(
+        versioned_snapshot_filename(directory, name, version),
+        versioned_snapshot_header(version),
+    )
+
+
+def write_versioned_snapshot(
+    directory: str,
+    name: str,
+    version: str,
+    data: Any,
+    keep: int = DEFAULT_VERSIONED_SNAPSHOTS_KEPT,
+) -> None:
+    """
+    Writes a versioned snapshot, unless there is one already for this version.
+    Then deletes all but the ``keep`` most recent snapshots with this name.
+    """
+    if not directory:
+        return
+    filename = versioned_snapshot_filename(directory, name, version)
+    if os.path.exists(filename):
+        return
+    write_snapshot(filename, versioned_snapshot_header(version), data)
+    pattern = os.path.join(
+        glob.escape(directory), f"{glob.escape(name)}_v_*{SNAPSHOT_FILE_EXT}"
+    )
+    existing = []  # type: List[Tuple[float, str]]
+    for other in glob.glob(pattern):
+        try:
+            existing.append((os.path.getmtime(other), other))
+        except OSError:  # deleted by another process
+            pass
+    existing.sort(reverse=True)
+    for _, other in existing[keep:]:
+        log.info("Removing old snapshot: {}", other)
+        try:
+            os.remove(other)
+        except OSError:
+            pass
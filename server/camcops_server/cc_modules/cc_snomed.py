@@ -166,6 +166,7 @@ from cardinal_pythonlib.snomed import (  # noqa: F401
 )
 
 from camcops_server.cc_modules.cc_cache import cache_region_static, fkg
+from camcops_server.cc_modules.cc_snapshot import load_or_build_snapshot
 from camcops_server.cc_modules.cc_xml import XmlDataTypes, XmlElement
 
 log = BraceStyleAdapter(logging.getLogger(__name__))
@@ -660,6 +661,27 @@ def get_snomed_concepts_from_xml(
     return all_concepts
 
 
+def load_snomed_concepts_from_xml(
+    xml_filename: str, snapshot_dir: str = "", rebuild: bool = False
+) -> Dict[str, List[SnomedConcept]]:
+    """
+    As for :func:`get_snomed_concepts_from_xml`, but via a snapshot (see
+    :mod:`camcops_server.cc_modules.cc_snapshot`) if ``snapshot_dir`` is set.
+
+    Args:
+        xml_filename: XML filename to read
+        snapshot_dir: directory for snapshots, or blank for none
+        rebuild: rebuild the snapshot even if it is up to date?
+    """
+    return load_or_build_snapshot(
+        directory=snapshot_dir,
+        name="snomed",
+        sources=[xml_filename],
+        builder=lambda: get_snomed_concepts_from_xml(xml_filename),
+        rebuild=rebuild,
+    )
+
+
 def write_snomed_concepts_to_xml(
     xml_filename: str,
     concepts: Dict[str, List[SnomedConcept]],
@@ -1189,7 +1211,7 @@ VALID_SNOMED_LOOKUPS = set(
 
 @cache_region_static.cache_on_arguments(function_key_generator=fkg)
 def get_all_task_snomed_concepts(
-    xml_filename: str,
+    xml_filename: str, snapshot_dir: str = ""
 ) -> Dict[str, SnomedConcept]:
     """
     Reads in all SNOMED-CT codes for CamCOPS tasks, from the custom CamCOPS XML
@@ -1197,12 +1219,13 @@ def get_all_task_snomed_concepts(
 
     Args:
         xml_filename: XML filename to read
+        snapshot_dir: directory for snapshots, or blank for none
 
     Returns:
         dict: maps lookup strings to :class:`SnomedConcept` objects
 
     """
-    xml_concepts = get_snomed_concepts_from_xml(xml_filename)
+    xml_concepts = load_snomed_concepts_from_xml(xml_filename, snapshot_dir)
     camcops_concepts = {}  # type: Dict[str, SnomedConcept]
     identifiers_seen = set()  # type: Set[int]
     for lookup, concepts in xml_concepts.items():
@@ -1715,6 +1738,7 @@ def get_multiple_snomed_concepts_from_xml(
     xml_filename: str,
     valid_lookups: Set[str] = None,
     require_all: bool = False,
+    snapshot_dir: str = "",
 ) -> Dict[str, List[SnomedConcept]]:
     """
     Reads in all SNOMED-CT codes for ICD-9 or ICD-10, from the custom CamCOPS
@@ -1725,13 +1749,14 @@ def get_multiple_snomed_concepts_from_xml(
         valid_lookups: possible lookup values
         require_all: require that ``valid_lookups`` is truthy and that all
             values in it are present in the XML
+        snapshot_dir: directory for snapshots, or blank for none
 
     Returns:
         dict: maps lookup strings to lists of :class:`SnomedConcept` objects
 
     """
     valid_lookups = set(valid_lookups or [])  # type: Set[str]
-    xml_concepts = get_snomed_concepts_from_xml(xml_filename)
+    xml_concepts = load_snomed_concepts_from_xml(xml_filename, snapshot_dir)
     camcops_concepts = {}  # type: Dict[str, List[SnomedConcept]]
     for lookup, concepts in xml_concepts.items():
         # Check it
@@ -1762,35 +1787,37 @@ def get_multiple_snomed_concepts_from_xml(
 
 @cache_region_static.cache_on_arguments(function_key_generator=fkg)
 def get_icd9_snomed_concepts_from_xml(
-    xml_filename: str,
+    xml_filename: str, snapshot_dir: str = ""
 ) -> Dict[str, List[SnomedConcept]]:
     """
     Reads in all ICD-9-CM SNOMED-CT codes from a custom CamCOPS XML file.
 
     Args:
         xml_filename: filename to read
+        snapshot_dir: directory for snapshots, or blank for none
 
     Returns:
         dict: maps ICD-9-CM codes to lists of :class:`SnomedConcept` objects
     """
     return get_multiple_snomed_concepts_from_xml(
-        xml_filename, CLIENT_ICD9CM_CODES
+        xml_filename, CLIENT_ICD9CM_CODES, snapshot_dir=snapshot_dir
     )
 
 
 @cache_region_static.cache_on_arguments(function_key_generator=fkg)
 def get_icd10_snomed_concepts_from_xml(
-    xml_filename: str,
+    xml_filename: str, snapshot_dir: str = ""
 ) -> Dict[str, List[SnomedConcept]]:
     """
     Reads in all ICD-10 SNOMED-CT codes from a custom CamCOPS XML file.
 
     Args:
         xml_filename: filename to read
+        snapshot_dir: directory for snapshots, or blank for none
 
     Returns:
         dict: maps ICD-10 codes to lists of :class:`SnomedConcept` objects
     """
     return get_multiple_snomed_concepts_from_xml(
-        xml_filename, CLIENT_ICD10_CODES
+        xml_filename, CLIENT_ICD10_CODES, snapshot_dir=snapshot_dir
     )
@@ -53,10 +53,14 @@ A few random notes:
 """
 
 from abc import ABCMeta
+import base64
+import binascii
+import datetime
 from io import StringIO
+import json
 import logging
 import sqlite3
-from typing import Any
+from typing import Any, List, Optional, Sequence
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.sqlalchemy.dialect import (
@@ -75,7 +79,10 @@ from sqlalchemy.engine.base import Engine
 from sqlalchemy.ext.declarative import DeclarativeMeta
 from sqlalchemy.ext.mutable import Mutable
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm.session import Session
 from sqlalchemy.schema import CreateTable
+from sqlalchemy.sql.elements import ColumnElement
+from sqlalchemy.sql.expression import and_, or_, text
 from sqlalchemy.sql.schema import MetaData, Table
 
 from camcops_server.cc_modules.cc_cache import cache_region_static, fkg
@@ -92,6 +99,17 @@ log = BraceStyleAdapter(logging.getLogger(__name__))
 MYSQL_MAX_IDENTIFIER_LENGTH = 64
 LONG_COLUMN_NAME_WARNING_LIMIT = 30
 
+# Maximum number of bound parameters in a single SQL statement. These are
+# hard limits of the databases (or, for SQLite, the compile-time default
+# before SQLite 3.32.0); we stay a little below them.
+MAX_BIND_PARAMS_BY_DIALECT = {
+    SqlaDialectName.MSSQL: 2000,  # limit is 2100
+    SqlaDialectName.MYSQL: 65000,  # limit is 65535
+    SqlaDialectName.POSTGRES: 32000,  # limit is 32767
+    SqlaDialectName.SQLITE: 999,  # default limit before SQLite 3.32.0
+}
+DEFAULT_MAX_BIND_PARAMS = 999
+
 NAMING_CONVENTION = {
     # - Note that constraint names must be unique in the DATABASE, not the
     #   table;
@@ -242,6 +260,170 @@ def make_file_sqlite_engine(filename: str, echo: bool = False) -> Engine:
     return create_engine(make_sqlite_url(filename), echo=echo)
 
 
+def get_max_bind_params(dialect_name: str) -> int:
+    """
+    Returns the maximum number of bound parameters that we will use in a
+    single SQL statement (e.g. for ``IN (...)`` lists or multi-row
+    ``INSERT`` statements) for a given SQLAlchemy dialect.
+
+    Args:
+        dialect_name: SQLAlchemy dialect name
+    """
+    return MAX_BIND_PARAMS_BY_DIALECT.get(
+        dialect_name, DEFAULT_MAX_BIND_PARAMS
+    )
+
+
+# Queries returning the number of rows in a table, as estimated from the
+# database's own statistics (so they are cheap, but may be out of date).
+ESTIMATED_ROW_COUNT_SQL_BY_DIALECT = {
+    SqlaDialectName.MSSQL: (
+        "SELECT SUM(row_count) FROM sys.dm_db_partition_stats "
+        "WHERE object_id = OBJECT_ID(:table_name) AND index_id IN (0, 1)"
+    ),
+    SqlaDialectName.MYSQL: (
+        "SELECT table_rows FROM information_schema.tables "
+        "WHERE table_schema = DATABASE() AND table_name = :table_name"
+    ),
+    SqlaDialectName.POSTGRES: (
+        "SELECT reltuples FROM pg_class WHERE relname = :table_name"
+    ),
+}
+
+
+def estimate_table_row_count(
+    session: Session, table_name: str
+) -> Optional[int]:
+    """
+    Returns the approximate number of rows in a table, from the database's
+    table statistics, without performing a ``COUNT(*)``. This is much
+    faster for large tables, but may be out of date.
+
+    Args:
+        session: SQLAlchemy ORM session
+        table_name: name of the table
+
+    Returns:
+        the estimated number of rows, or ``None`` if the dialect doesn't
+        offer an estimate (e.g. SQLite) or the estimate is unavailable
+    """
+    dialect_name = session.get_bind().dialect.name
+    sql = ESTIMATED_ROW_COUNT_SQL_BY_DIALECT.get(dialect_name)
+    if sql is None:
+        return None
+    try:
+        # Use a savepoint, so that a failure doesn't abort the whole
+        # transaction (as it would under PostgreSQL).
+        with session.begin_nested():
+            estimate = session.execute(
+                text(sql), {"table_name": table_name}
+            ).scalar()
+    except Exception as e:  # e.g. insufficient privileges
+        log.warning(
+            "Unable to estimate row count for table {!r}: {}", table_name, e
+        )
+        return None
+    if estimate is None or estimate < 0:
+        # PostgreSQL reports -1 for tables that have never been analysed.
+        return None
+    return int(estimate)
+
+
+# Keyset ("seek") pagination: rather than LIMIT/OFFSET, remember the sort key
+# of the last row fetched, and ask for rows beyond it, e.g.
+#
+#   WHERE (a, b) > (:last_a, :last_b) ORDER BY a, b LIMIT n
+#
+# See camcops_server.cc_modules.cc_pyramid.KeysetPage.
+
+
+def _keyset_json_default(obj: Any) -> Any:
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    raise TypeError(f"Can't encode {obj!r} in a pagination cursor")
+
+
+def encode_keyset_cursor(values: Sequence[Any]) -> str:
+    """
+    Encodes the sort key of a row as a URL-safe cursor token.
+
+    Args:
+        values: the values of the key columns, e.g. ``[when_created, pk]``
+
+    Returns:
+        a string suitable for use as a URL query parameter
+    """
+    j = json.dumps(
+        list(values), default=_keyset_json_default, separators=(",", ":")
+    )
+    return base64.urlsafe_b64encode(j.encode("utf-8")).decode("ascii")
+
+
+def decode_keyset_cursor(
+    token: Optional[str], key_columns: Sequence[ColumnElement]
+) -> Optional[List[Any]]:
+    """
+    Decodes a cursor token produced by :func:`encode_keyset_cursor`,
+    converting values back to the Python types of the key columns.
+
+    Args:
+        token: the cursor token
+        key_columns: the key columns, in order
+
+    Returns:
+        a list of key values, or ``None`` if the token is absent or invalid
+        (e.g. tampered with, or from a different view)
+    """
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+    if not isinstance(values, list) or len(values) != len(key_columns):
+        return None
+    result = []  # type: List[Any]
+    for column, value in zip(key_columns, values):
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            python_type = None
+        try:
+            if python_type is datetime.datetime:
+                value = datetime.datetime.fromisoformat(value)
+            elif python_type is int and not isinstance(value, int):
+                return None
+        except (TypeError, ValueError):
+            return None
+        result.append(value)
+    return result
+
+
+def keyset_criterion(
+    key_columns: Sequence[ColumnElement],
+    values: Sequence[Any],
+    greater: bool,
+) -> ColumnElement:
+    """
+    Returns an SQL condition selecting rows whose key is strictly beyond
+    ``values``, in lexicographic order, i.e. ``(a, b) > (x, y)`` (or ``<``).
+    We spell out the row-value comparison as ``a > x OR (a = x AND b > y)``,
+    since not all our databases support row values.
+
+    Args:
+        key_columns: the key columns, in order
+        values: the key values of the reference row
+        greater: select rows after (``True``) or before (``False``) it, in
+            ascending order
+    """
+    alternatives = []  # type: List[ColumnElement]
+    for i, (column, value) in enumerate(zip(key_columns, values)):
+        equalities = [c == v for c, v in zip(key_columns[:i], values[:i])]
+        beyond = column > value if greater else column < value
+        alternatives.append(and_(*equalities, beyond))
+    return or_(*alternatives)
+
+
 def sql_from_sqlite_database(connection: sqlite3.Connection) -> str:
     """
     Returns SQL to describe an SQLite database.
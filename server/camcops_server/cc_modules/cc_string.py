@@ -29,8 +29,9 @@ uses these for displaying tasks, and provides them to client devices.**
 """
 
 import glob
+import hashlib
 import logging
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 import xml.etree.cElementTree as ElementTree
 
 # ... cElementTree is a faster implementation
@@ -42,8 +43,13 @@ from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.text import unescape_newlines
 
 from camcops_server.cc_modules.cc_cache import cache_region_static, fkg
-from camcops_server.cc_modules.cc_config import get_config
+from camcops_server.cc_modules.cc_config import CamcopsConfig, get_config
 from camcops_server.cc_modules.cc_exception import raise_runtime_error
+from camcops_server.cc_modules.cc_snapshot import (
+    load_or_build_snapshot,
+    read_versioned_snapshot,
+    write_versioned_snapshot,
+)
 
 log = BraceStyleAdapter(logging.getLogger(__name__))
 
@@ -194,7 +200,9 @@ def all_extra_strings_as_dicts(
     r"""
     Returns strings from the all the extra XML string files.
 
-    The result is cached (via a proper cache).
+    The result is cached (via a proper cache), and if the config sets
+    ``DATA_SNAPSHOT_DIR``, read from a precompiled snapshot when the XML files
+    haven't changed; see :mod:`camcops_server.cc_modules.cc_snapshot`.
 
     Args:
         config_filename: a CamCOPS config filename
@@ -319,6 +327,23 @@ def all_extra_strings_as_dicts(
     """
 
     cfg = get_config(config_filename)
+    filenames = get_extra_string_filenames(cfg)
+    allstrings = load_extra_string_files(filenames, cfg.data_snapshot_dir)
+
+    if APPSTRING_TASKNAME not in allstrings:
+        raise_runtime_error(
+            "Extra string files do not contain core CamCOPS strings; "
+            "config is misconfigured; aborting"
+        )
+
+    return allstrings
+
+
+def get_extra_string_filenames(cfg: CamcopsConfig) -> List[str]:
+    """
+    Returns the (unique, sorted) extra string filenames specified by a
+    config.
+    """
     assert cfg.extra_string_files is not None
     filenames = []  # type: List [str]
     for filespec in cfg.extra_string_files:
@@ -330,6 +355,33 @@ def all_extra_strings_as_dicts(
             "No CamCOPS extra string files specified; "
             "config is misconfigured; aborting"
         )
+    return filenames
+
+
+def load_extra_string_files(
+    filenames: List[str], snapshot_dir: str = "", rebuild: bool = False
+) -> Dict[str, Dict[str, Dict[str, str]]]:
+    """
+    Returns strings from the extra string XML files given, in the format
+    described for :func:`all_extra_strings_as_dicts`, via a snapshot (see
+    :mod:`camcops_server.cc_modules.cc_snapshot`) if ``snapshot_dir`` is set.
+    """
+    return load_or_build_snapshot(
+        directory=snapshot_dir,
+        name="extra_strings",
+        sources=filenames,
+        builder=lambda: parse_extra_string_files(filenames),
+        rebuild=rebuild,
+    )
+
+
+def parse_extra_string_files(
+    filenames: List[str],
+) -> Dict[str, Dict[str, Dict[str, str]]]:
+    """
+    Reads strings from the extra string XML files given, in the format
+    described for :func:`all_extra_strings_as_dicts`.
+    """
     allstrings = {}  # type: Dict[str, Dict[str, Dict[str, str]]]
     for filename in filenames:
         log.info("Loading string XML file: {}", filename)
@@ -355,11 +407,89 @@ def all_extra_strings_as_dicts(
                     stringname, {}
                 )  # type: Dict[str, str]
                 langversions[locale] = final_string
+    return allstrings
 
-    if APPSTRING_TASKNAME not in allstrings:
-        raise_runtime_error(
-            "Extra string files do not contain core CamCOPS strings; "
-            "config is misconfigured; aborting"
-        )
 
-    return allstrings
+# =============================================================================
+# Versions of the extra strings, for clients
+# =============================================================================
+
+ExtraStringKey = Tuple[str, str, str]  # task, string name, language
+EXTRA_STRING_HASHES_SNAPSHOT_NAME = "extra_string_hashes"
+
+
+def extra_string_hashes(
+    allstrings: Dict[str, Dict[str, Dict[str, str]]]
+) -> Dict[ExtraStringKey, str]:
+    """
+    Returns a hash of each extra string, from strings in the format described
+    for :func:`all_extra_strings_as_dicts`.
+    """
+    return {
+        (task, name, language): hashlib.blake2b(
+            value.encode("utf-8"), digest_size=8
+        ).hexdigest()
+        for task, taskstrings in allstrings.items()
+        for name, langversions in taskstrings.items()
+        for language, value in langversions.items()
+    }
+
+
+def extra_strings_version(hashes: Dict[ExtraStringKey, str]) -> str:
+    """
+    Returns a version (a hash of all the strings) from the hashes of
+    individual strings, as returned by :func:`extra_string_hashes`.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for key in sorted(hashes.keys()):
+        h.update("\0".join(key + (hashes[key], "\n")).encode("utf-8"))
+    return h.hexdigest()
+
+
+@cache_region_static.cache_on_arguments(function_key_generator=fkg)
+def all_extra_string_hashes(
+    config_filename: str,
+) -> Tuple[str, Dict[ExtraStringKey, str]]:
+    """
+    Returns the version of the extra strings, and a hash of each string (see
+    :func:`extra_string_hashes`).
+
+    If the config sets ``DATA_SNAPSHOT_DIR``, the hashes are kept there (for
+    this and some previous versions), so that we can work out what has
+    changed since a client's version; see
+    :func:`get_extra_string_hashes_for_version`.
+    """
+    hashes = extra_string_hashes(all_extra_strings_as_dicts(config_filename))
+    version = extra_strings_version(hashes)
+    cfg = get_config(config_filename)
+    write_versioned_snapshot(
+        cfg.data_snapshot_dir,
+        EXTRA_STRING_HASHES_SNAPSHOT_NAME,
+        version,
+        hashes,
+    )
+    return version, hashes
+
+
+def get_extra_string_hashes_for_version(
+    config_filename: str, version: str
+) -> Optional[Dict[ExtraStringKey, str]]:
+    """
+    Returns the hash of each extra string (see :func:`extra_string_hashes`)
+    for a specific version of the extra strings, or ``None`` if we don't know
+    about that version.
+
+    We know about the current version, and (if the config sets
+    ``DATA_SNAPSHOT_DIR``) some previous versions.
+    """
+    current_version, hashes = all_extra_string_hashes(config_filename)
+    if version == current_version:
+        return hashes
+    cfg = get_config(config_filename)
+    try:
+        found, old_hashes = read_versioned_snapshot(
+            cfg.data_snapshot_dir, EXTRA_STRING_HASHES_SNAPSHOT_NAME, version
+        )
+    except ValueError:  # bad version string
+        return None
+    return old_hashes if found else None
@@ -50,6 +50,7 @@ from typing import (
     Any,
     Dict,
     Iterable,
+    Iterator,
     Generator,
     List,
     Optional,
@@ -154,6 +155,7 @@ from camcops_server.cc_modules.cc_db import (
 )
 from camcops_server.cc_modules.cc_exception import FhirExportException
 from camcops_server.cc_modules.cc_fhir import (
+    FhirExportSession,
     fhir_observation_component_from_snomed,
     fhir_system_value,
     fhir_sysval_from_id,
@@ -172,7 +174,7 @@ from camcops_server.cc_modules.cc_html import (
     tr,
     tr_qa,
 )
-from camcops_server.cc_modules.cc_pdf import pdf_from_html
+from camcops_server.cc_modules.cc_pdf import PdfJob, pdfs_from_jobs
 from camcops_server.cc_modules.cc_pyramid import Routes, ViewArg
 from camcops_server.cc_modules.cc_simpleobjects import TaskExportOptions
 from camcops_server.cc_modules.cc_snomed import SnomedLookup
@@ -202,7 +204,7 @@ from camcops_server.cc_modules.cc_version import (
     MINIMUM_TABLET_VERSION,
 )
 from camcops_server.cc_modules.cc_xml import (
-    get_xml_document,
+    gen_xml_document,
     XML_COMMENT_ANCILLARY,
     XML_COMMENT_ANONYMOUS,
     XML_COMMENT_BLOBS,
@@ -857,7 +859,13 @@ class Task(GenericTabletRecordMixin, Base):
         being actual tasks; we discriminate using ``__abstract__`` and/or
         ``__tablename__``. See
         https://docs.sqlalchemy.org/en/latest/orm/inheritance.html#abstract-concrete-classes
+
+        Task modules are imported lazily (see :mod:`camcops_server.tasks`), so
+        we make sure that they have all been imported first.
         """
+        from camcops_server.tasks import import_all_tasks  # delayed import
+
+        import_all_tasks()
         # noinspection PyTypeChecker
         return gen_orm_classes_from_base(cls)
 
@@ -1506,6 +1514,7 @@ class Task(GenericTabletRecordMixin, Base):
         req: "CamcopsRequest",
         recipient: "ExportRecipient",
         skip_docs_if_other_content: bool = DEBUG_SKIP_FHIR_DOCS,
+        session: FhirExportSession = None,
     ) -> Bundle:
         """
         Get a single FHIR Bundle with all entries. See
@@ -1516,6 +1525,7 @@ class Task(GenericTabletRecordMixin, Base):
             req,
             recipient,
             skip_docs_if_other_content=skip_docs_if_other_content,
+            session=session,
         )
         # ... may raise FhirExportException
 
@@ -1555,6 +1565,7 @@ class Task(GenericTabletRecordMixin, Base):
         req: "CamcopsRequest",
         recipient: "ExportRecipient",
         skip_docs_if_other_content: bool = DEBUG_SKIP_FHIR_DOCS,
+        session: FhirExportSession = None,
     ) -> List[Dict]:
         """
         Get all FHIR bundle entries. This is the "top-level" function to
@@ -1578,6 +1589,11 @@ class Task(GenericTabletRecordMixin, Base):
                 making the FHIR output smaller and more legible for debugging.
                 However, if the task offers no other content, this will raise
                 :exc:`FhirExportException`.
+            session:
+                Optional
+                :class:`camcops_server.cc_modules.cc_fhir.FhirExportSession`
+                for the recipient. If supplied, the Questionnaire is built
+                once per session, and left out once the server has it.
         """
         bundle_entries = []  # type: List[Dict]
 
@@ -1593,15 +1609,14 @@ class Task(GenericTabletRecordMixin, Base):
 
         # Questionnaire, QuestionnaireResponse
         q_bundle_entry, qr_bundle_entry = self._get_fhir_q_qr_bundle_entries(
-            req, recipient
-        )
-        if q_bundle_entry and qr_bundle_entry:
-            bundle_entries += [
-                # Questionnaire
-                q_bundle_entry,
-                # Collection of QuestionnaireResponse entries
-                qr_bundle_entry,
-            ]
+            req, recipient, session=session
+        )
+        if qr_bundle_entry:
+            if q_bundle_entry:
+                # Questionnaire (unless the server already has it)
+                bundle_entries.append(q_bundle_entry)
+            # Collection of QuestionnaireResponse entries
+            bundle_entries.append(qr_bundle_entry)
 
         # Observation (0 or more) -- includes Coding
         bundle_entries += self._get_fhir_detail_bundle_entries(req, recipient)
@@ -2034,7 +2049,10 @@ class Task(GenericTabletRecordMixin, Base):
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
     def _get_fhir_q_qr_bundle_entries(
-        self, req: "CamcopsRequest", recipient: "ExportRecipient"
+        self,
+        req: "CamcopsRequest",
+        recipient: "ExportRecipient",
+        session: FhirExportSession = None,
     ) -> Tuple[Optional[Dict], Optional[Dict]]:
         """
         Get a tuple of FHIR bundles: ``questionnaire_bundle_entry,
@@ -2043,6 +2061,11 @@ class Task(GenericTabletRecordMixin, Base):
         A Questionnaire object represents the task in the abstract;
         QuestionnaireReponse items represent each answered question for a
         specific task instance.
+
+        With a
+        :class:`camcops_server.cc_modules.cc_fhir.FhirExportSession`, the
+        Questionnaire entry is shared between tasks of the same type, and is
+        ``None`` if the server has already accepted it.
         """
         # Ask the task for its details (which it may provide directly, by
         # overriding, or rely on autodiscovery for the default).
@@ -2059,11 +2082,22 @@ class Task(GenericTabletRecordMixin, Base):
             return None, None
 
         # Now finish off:
-        q_items = [aq.questionnaire_item() for aq in aq_items]
         qr_items = [aq.questionnaire_response_item() for aq in aq_items]
-        q_bundle_entry = self._make_fhir_questionnaire_bundle_entry(
-            req, q_items
-        )
+
+        def make_q_bundle_entry() -> Optional[Dict]:
+            q_items = [aq.questionnaire_item() for aq in aq_items]
+            return self._make_fhir_questionnaire_bundle_entry(req, q_items)
+
+        if session is None:
+            q_bundle_entry = make_q_bundle_entry()
+        else:
+            q_identifier = self._get_fhir_questionnaire_id(req)
+            if session.questionnaire_sent(q_identifier):
+                q_bundle_entry = None
+            else:
+                q_bundle_entry = session.get_questionnaire_bundle_entry(
+                    q_identifier, req.language, make_q_bundle_entry
+                )
         qr_bundle_entry = self._make_fhir_questionnaire_response_bundle_entry(
             req, recipient, qr_items
         )
@@ -2595,9 +2629,29 @@ class Task(GenericTabletRecordMixin, Base):
             an XML UTF-8 document representing the task.
 
         """  # noqa
+        return "".join(
+            self.gen_xml(
+                req, options=options, indent_spaces=indent_spaces, eol=eol
+            )
+        )
+
+    def gen_xml(
+        self,
+        req: "CamcopsRequest",
+        options: TaskExportOptions = None,
+        indent_spaces: int = 4,
+        eol: str = "\n",
+    ) -> Iterator[str]:
+        """
+        As for :meth:`get_xml`, but returns the XML document in pieces, for
+        streaming.
+
+        The XML tree is built (so the database is read) when this is called;
+        only the writing of the XML is deferred.
+        """
         options = options or TaskExportOptions()
         tree = self.get_xml_root(req=req, options=options)
-        return get_xml_document(
+        return gen_xml_document(
             tree,
             indent_spaces=indent_spaces,
             eol=eol,
@@ -2812,47 +2866,79 @@ class Task(GenericTabletRecordMixin, Base):
         """
         Returns a PDF representing the task.
 
+        Args:
+            req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+            anonymise: hide patient identifying details?
+        """
+        pdf = req.pdf_html_cache.pop_pdf(self.pdf_cache_key(anonymise))
+        if pdf is not None:
+            # Made in advance, with others; see make_task_pdfs_in_advance().
+            return pdf
+        job = self.get_pdf_job(req, anonymise=anonymise)
+        return job.make_pdf(req.config.wkhtmltopdf_filename)
+
+    def get_pdf_job(
+        self, req: "CamcopsRequest", anonymise: bool = False
+    ) -> PdfJob:
+        """
+        Returns the HTML (etc.) needed to make a PDF representing the task.
+
         Args:
             req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
             anonymise: hide patient identifying details?
         """
         html = self.get_pdf_html(req, anonymise=anonymise)  # main content
         if CSS_PAGED_MEDIA:
-            return pdf_from_html(req, html=html)
-        else:
-            return pdf_from_html(
-                req,
-                html=html,
-                header_html=render(
-                    "wkhtmltopdf_header.mako",
-                    dict(
-                        inner_text=render(
-                            "task_page_header.mako",
-                            dict(task=self, anonymise=anonymise),
-                            request=req,
-                        )
+            return PdfJob(html)
+        cache = req.pdf_html_cache
+        return PdfJob(
+            html,
+            header_html=cache.wrap_page_html(
+                "wkhtmltopdf_header.mako",
+                cache.get_fragment(
+                    self._pdf_page_header_key(anonymise),
+                    lambda: render(
+                        "task_page_header.mako",
+                        dict(task=self, anonymise=anonymise),
+                        request=req,
                     ),
-                    request=req,
                 ),
-                footer_html=render(
-                    "wkhtmltopdf_footer.mako",
-                    dict(
-                        inner_text=render(
-                            "task_page_footer.mako",
-                            dict(task=self),
-                            request=req,
-                        )
-                    ),
+            ),
+            footer_html=cache.wrap_page_html(
+                "wkhtmltopdf_footer.mako",
+                render(
+                    "task_page_footer.mako",
+                    dict(task=self),
                     request=req,
                 ),
-                extra_wkhtmltopdf_options={
-                    "orientation": (
-                        "Landscape"
-                        if self.use_landscape_for_pdf
-                        else "Portrait"
-                    )
-                },
-            )
+            ),
+            extra_wkhtmltopdf_options={
+                "orientation": (
+                    "Landscape" if self.use_landscape_for_pdf else "Portrait"
+                )
+            },
+        )
+
+    def _pdf_page_header_key(self, anonymise: bool) -> Tuple:
+        """
+        The page header (see ``task_page_header.mako``) depends only on the
+        patient, so tasks can share it. This is the key for it.
+        """
+        if self.is_anonymous:
+            return "task_page_header", "anonymous_task"
+        if anonymise:
+            return "task_page_header", "anonymised"
+        patient = self.patient
+        if patient is None:
+            return "task_page_header", "no_patient"
+        return "task_page_header", "patient", patient.pk
+
+    def pdf_cache_key(self, anonymise: bool = False) -> Tuple:
+        """
+        Key for a PDF of this task made in advance; see
+        :meth:`camcops_server.cc_modules.cc_pdf.PdfHtmlCache.add_pdf`.
+        """
+        return "task_pdf", self.tablename, self.pk, anonymise
 
     def get_pdf_html(
         self, req: "CamcopsRequest", anonymise: bool = False
@@ -3596,6 +3682,38 @@ def all_task_classes() -> List[Type[Task]]:
     return list(d.values())
 
 
+# =============================================================================
+# Making PDFs for many tasks
+# =============================================================================
+
+
+def make_task_pdfs_in_advance(
+    req: "CamcopsRequest", tasks: Iterable[Task], anonymise: bool = False
+) -> None:
+    """
+    Makes PDFs for several tasks at once (concurrently, if the ``PDF_WORKERS``
+    config parameter allows), keeping them for this request, so that
+    :meth:`Task.get_pdf` for each task returns its PDF without further work.
+
+    Tasks' HTML is rendered here, in turn, since that needs the database.
+    Call :meth:`camcops_server.cc_modules.cc_pdf.PdfHtmlCache.discard_pdfs`
+    afterwards, to free any PDFs that weren't used.
+
+    Args:
+        req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        tasks: the tasks
+        anonymise: hide patient identifying details?
+    """
+    tasks = list(tasks)
+    jobs = [task.get_pdf_job(req, anonymise=anonymise) for task in tasks]
+    pdfs = pdfs_from_jobs(req, jobs, skip_failures=True)
+    # ... any that fail will be tried again (and fail properly) by get_pdf()
+    cache = req.pdf_html_cache
+    for task, pdf in zip(tasks, pdfs):
+        if pdf is not None:
+            cache.add_pdf(task.pdf_cache_key(anonymise), pdf)
+
+
 # =============================================================================
 # Support functions
 # =============================================================================
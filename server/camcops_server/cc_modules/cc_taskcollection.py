@@ -28,13 +28,16 @@ camcops_server/cc_modules/cc_taskcollection.py
 """
 
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 from enum import Enum
 import logging
-from threading import Thread
+import time
 from typing import (
+    Any,
     Dict,
     Generator,
+    Iterable,
     List,
     Optional,
     Tuple,
@@ -47,18 +50,26 @@ from cardinal_pythonlib.json.serialize import (
     register_class_for_json,
     register_enum_for_json,
 )
+from cardinal_pythonlib.lists import chunks
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.reprfunc import auto_repr, auto_str
 from cardinal_pythonlib.sort import MINTYPE_SINGLETON, MinType
+from cardinal_pythonlib.sqlalchemy.dialect import SqlaDialectName
 from kombu.serialization import dumps, loads
 from pendulum import DateTime as Pendulum
+from sqlalchemy.engine.base import Engine
 from sqlalchemy.orm import Query
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.session import Session as SqlASession
 from sqlalchemy.sql.functions import func
 from sqlalchemy.sql.expression import and_, exists, or_
 
 from camcops_server.cc_modules.cc_constants import ERA_NOW
 from camcops_server.cc_modules.cc_exportrecipient import ExportRecipient
+from camcops_server.cc_modules.cc_sqlalchemy import (
+    get_max_bind_params,
+    keyset_criterion,
+)
 from camcops_server.cc_modules.cc_task import (
     tablename_to_task_class_dict,
     Task,
@@ -71,19 +82,17 @@ from camcops_server.cc_modules.cc_taskindex import TaskIndexEntry
 
 if TYPE_CHECKING:
     from sqlalchemy.sql.elements import ClauseElement, ColumnElement
+    from camcops_server.cc_modules.cc_patient import Patient
     from camcops_server.cc_modules.cc_request import CamcopsRequest
 
 log = BraceStyleAdapter(logging.getLogger(__name__))
 
 
 # =============================================================================
-# Debugging options
+# Constants
 # =============================================================================
 
-DEBUG_QUERY_TIMING = False
-
-if DEBUG_QUERY_TIMING:
-    log.warning("Debugging options enabled!")
+DEFAULT_FETCH_CHUNK_SIZE = 500  # for gen_tasks_for_task_class_in_chunks()
 
 
 # =============================================================================
@@ -134,72 +143,115 @@ def sort_tasks_in_place(
 
 
 # =============================================================================
-# Parallel fetch helper
+# Parallel fetch helpers
 # =============================================================================
 # - Why consider a parallel fetch?
-#   Because a typical fetch might involve 27ms per query (as seen by Python;
-#   less as seen by MySQL) but about 100 queries, for a not-very-large
-#   database.
-# - Initially UNSUCCESSFUL: even after tweaking pool_size=0 in create_engine()
-#   to get round the SQLAlchemy error "QueuePool limit of size 5 overflow 10
-#   reached", in the parallel code, a great many queries are launched, but then
-#   something goes wrong and others are started but then block -- for ages --
-#   waiting for a spare database connection, or something.
-# - Fixed that: I was not explicitly closing the sessions.
-# - But then a major conceptual problem: anything to be lazy-loaded (e.g.
-#   patient, but also patient ID, special note, BLOB...) will give this sort of
-#   error: "DetachedInstanceError: Parent instance <Phq9 at 0x7fe6cce2d278> is
-#   not bound to a Session; lazy load operation of attribute 'patient' cannot
-#   proceed" -- for obvious reasons. And some of those operations are only
-#   required on the final paginated task set, which requires aggregation across
-#   all tasks.
-#
-# HOWEVER, the query time per table drops from ~27ms to 4-8ms if we disable
-# eager loading (lazy="joined") of patients from tasks.
-
-
-class FetchThread(Thread):
+#   Because a typical fetch might involve 4-27ms per query (as seen by Python;
+#   less as seen by MySQL) but about 150 queries (one per task table) for a
+#   filter across all task types.
+# - Queries are built in the request's thread, since building them involves
+#   the request (e.g. the user's permissions, which may be lazily loaded via
+#   the request's session). Only their execution happens in worker threads.
+# - Each query is executed with its own session (and therefore connection),
+#   which is closed by the worker thread when the query is complete. Sessions
+#   are not thread-safe.
+# - Anything to be lazy-loaded (patient, special notes, BLOBs...) needs a
+#   session, and some of those operations are only required on the final
+#   (e.g. paginated) task set. So fetched tasks are merged into the request's
+#   session. Patients (and their ID numbers) are eagerly loaded with the tasks
+#   but via view-only relationships, along which merge() doesn't cascade, so
+#   we merge those explicitly.
+# - SQLite gains nothing (and an in-memory SQLite database is per-connection),
+#   and a session bound to a connection rather than an engine may have
+#   uncommitted data that other connections can't see, so in those cases we
+#   fetch serially.
+
+
+def merge_fetched_tasks(
+    dbsession: SqlASession, tasks: List[Task]
+) -> List[Task]:
     """
-    Thread to fetch tasks in parallel.
+    Merges tasks loaded by another (now closed) session into ``dbsession``,
+    without reloading them from the database, along with their eagerly
+    loaded patients and patient ID numbers.
+
+    Args:
+        dbsession: the destination session
+        tasks: detached tasks
 
-    CURRENTLY UNUSED.
+    Returns:
+        the corresponding tasks belonging to ``dbsession``
+    """
+    merged_patients = {}  # type: Dict[int, Patient]
+    merged_tasks = []  # type: List[Task]
+    for task in tasks:
+        merged_task = dbsession.merge(task, load=False)
+        if "patient" in task.__dict__:
+            patient = task.__dict__["patient"]  # type: Optional[Patient]
+            if patient is not None:
+                merged_patient = merged_patients.get(id(patient))
+                if merged_patient is None:
+                    merged_patient = dbsession.merge(patient, load=False)
+                    if "idnums" in patient.__dict__:
+                        set_committed_value(
+                            merged_patient,
+                            "idnums",
+                            [
+                                dbsession.merge(idnum, load=False)
+                                for idnum in patient.__dict__["idnums"]
+                            ],
+                        )
+                    merged_patients[id(patient)] = merged_patient
+                patient = merged_patient
+            set_committed_value(merged_task, "patient", patient)
+        merged_tasks.append(merged_task)
+    return merged_tasks
+
+
+class ParallelTaskFetcher(object):
+    """
+    Executes task queries in a bounded pool of worker threads, each with its
+    own database session.
     """
 
-    def __init__(
-        self,
-        req: "CamcopsRequest",
-        task_class: Type[Task],
-        factory: "TaskCollection",
-        **kwargs
-    ) -> None:
-        self.req = req
-        self.task_class = task_class
-        self.factory = factory
-        self.error = False
-        name = task_class.__tablename__
-        super().__init__(name=name, target=None, **kwargs)
-
-    def run(self) -> None:
-        log.debug("Thread starting")
-        dbsession = self.req.get_bare_dbsession()
-        # noinspection PyBroadException
+    def __init__(self, engine: Engine, n_threads: int) -> None:
+        """
+        Args:
+            engine: the SQLAlchemy engine
+            n_threads: maximum number of worker threads
+        """
+        self.engine = engine
+        self.n_threads = n_threads
+
+    def _fetch(self, query: Query) -> Tuple[List[Task], float]:
+        """
+        Runs in a worker thread.
+        """
+        start = time.perf_counter()
+        # Connections mustn't cross threads (e.g. for SQLite), so the session
+        # is closed in the thread that used it. That detaches the tasks and
+        # returns the connection to the pool.
+        session = SqlASession(bind=self.engine)
         try:
-            # noinspection PyProtectedMember
-            q = self.factory._make_query(dbsession, self.task_class)
-            if q:
-                tasks = q.all()  # type: List[Task]
-                # https://stackoverflow.com/questions/6319207/are-lists-thread-safe  # noqa
-                # https://stackoverflow.com/questions/6953351/thread-safety-in-pythons-dictionary  # noqa
-                # http://effbot.org/pyfaq/what-kinds-of-global-value-mutation-are-thread-safe.htm  # noqa
-                # noinspection PyProtectedMember
-                self.factory._tasks_by_class[self.task_class] = tasks
-                log.debug("Thread finishing with results")
-            else:
-                log.debug("Thread finishing without results")
-        except Exception:
-            self.error = True
-            log.error("Thread error")
-        dbsession.close()
+            tasks = query.with_session(session).all()  # type: List[Task]
+        finally:
+            session.close()
+        return tasks, time.perf_counter() - start
+
+    def fetch(self, queries: List[Query]) -> List[Tuple[List[Task], float]]:
+        """
+        Executes queries in parallel.
+
+        Args:
+            queries: SQLAlchemy ORM queries for tasks
+
+        Returns:
+            a list, in the same order as ``queries``, of tuples ``tasks,
+            seconds``; the tasks are detached from any session
+        """
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            futures = [executor.submit(self._fetch, q) for q in queries]
+            return [f.result() for f in futures]
 
 
 # =============================================================================
@@ -295,6 +347,7 @@ class TaskCollection(object):
         self._all_indexes = (
             None
         )  # type: Optional[Union[List[TaskIndexEntry], Query]]
+        self._query_seconds_by_table = OrderedDict()  # type: Dict[str, float]
 
     def __repr__(self) -> str:
         return auto_repr(self)
@@ -343,6 +396,41 @@ class TaskCollection(object):
         tasklist = self._tasks_by_class.get(task_class, [])
         return tasklist
 
+    def gen_tasks_for_task_class_in_chunks(
+        self,
+        task_class: Type[Task],
+        chunk_size: int = DEFAULT_FETCH_CHUNK_SIZE,
+    ) -> Generator[Task, None, None]:
+        """
+        Generates all appropriate task instances for a specific task type,
+        like :meth:`tasks_for_task_class`, but fetches them from the database
+        in chunks and doesn't keep them, so that memory use doesn't grow with
+        the number of tasks. (Once you have finished with a task, the
+        database session forgets it too, unless it has been modified.)
+
+        Tasks are in order of creation date/time (via the index) or server
+        PK (otherwise), regardless of our sort methods.
+
+        If the tasks have already been fetched (e.g. because filtering on
+        text contents requires it), we generate those instead.
+        """
+        if self._via_index:
+            self._build_index_query()
+            indexes = self._all_indexes
+            if self._all_tasks is None and isinstance(indexes, Query):
+                yield from self._gen_tasks_via_index_in_chunks(
+                    indexes, task_class, chunk_size
+                )
+                return
+            if indexes is None:  # nothing permitted
+                return
+        elif task_class not in self._tasks_by_class:
+            yield from self._gen_tasks_without_index_in_chunks(
+                task_class, chunk_size
+            )
+            return
+        yield from self.tasks_for_task_class(task_class)
+
     @property
     def all_tasks(self) -> List[Task]:
         """
@@ -427,46 +515,114 @@ class TaskCollection(object):
         """
         return self.req.dbsession
 
+    @property
+    def query_seconds_by_table(self) -> Dict[str, float]:
+        """
+        Returns the time spent (so far) executing task queries, by task table
+        name. When fetching in parallel, these overlap.
+        """
+        return self._query_seconds_by_table
+
     # =========================================================================
-    # Internals: fetching Task objects
+    # Internals: executing task queries
     # =========================================================================
 
-    def _fetch_all_tasks_without_index(self, parallel: bool = False) -> None:
+    def _n_fetch_threads(self, n_queries: int) -> int:
         """
-        Fetch all tasks from the database.
+        How many threads should we use to execute ``n_queries`` task queries?
+        Returns 1 for a serial fetch.
         """
+        n_threads = min(self.req.config.task_fetch_threads, n_queries)
+        if n_threads <= 1:
+            return 1
+        bind = self.dbsession.get_bind()
+        if not isinstance(bind, Engine):
+            # Probably within an external transaction (e.g. for testing),
+            # whose uncommitted data other connections can't see.
+            return 1
+        if bind.dialect.name == SqlaDialectName.SQLITE:
+            return 1
+        return n_threads
+
+    def _execute_task_queries(
+        self, queries: List[Tuple[Type[Task], Query]]
+    ) -> List[Tuple[Type[Task], List[Task]]]:
+        """
+        Executes queries for tasks, in parallel if configured and possible.
+        See "Parallel fetch helpers" above.
 
-        # AVOID parallel=True; see notes above.
-        if DEBUG_QUERY_TIMING:
-            start_time = Pendulum.now()
-
-        if parallel:
-            # Deprecated parallel fetch
-            threads = []  # type: List[FetchThread]
-            for task_class in self._filter.task_classes:
-                thread = FetchThread(self.req, task_class, self)
-                thread.start()
-                threads.append(thread)
-            for thread in threads:
-                thread.join()
-                if thread.error:
-                    raise ValueError("Multithreaded fetch failed")
+        Args:
+            queries: list of tuples ``task_class, query``
 
+        Returns:
+            list of tuples ``task_class, tasks``, in the same order, with
+            tasks belonging to the request's session
+        """
+        n_threads = self._n_fetch_threads(len(queries))
+        start = time.perf_counter()
+        if n_threads > 1:
+            dbsession = self.dbsession
+            fetcher = ParallelTaskFetcher(dbsession.get_bind(), n_threads)
+            fetched = fetcher.fetch([q for _, q in queries])
+            results = []  # type: List[Tuple[Type[Task], List[Task]]]
+            for (task_class, _), (tasks, seconds) in zip(queries, fetched):
+                self._add_query_time(task_class, seconds)
+                results.append(
+                    (task_class, merge_fetched_tasks(dbsession, tasks))
+                )
         else:
-            # Fetch all tasks, classwise.
-            for task_class in self._filter.task_classes:
-                self._fetch_task_class(task_class)
+            results = []
+            for task_class, q in queries:
+                query_start = time.perf_counter()
+                tasks = q.all()  # type: List[Task]
+                self._add_query_time(
+                    task_class, time.perf_counter() - query_start
+                )
+                results.append((task_class, tasks))
+        log.debug(
+            "Fetched {} tasks from {} table(s) in {:.3f} s using {} "
+            "thread(s)",
+            sum(len(tasks) for _, tasks in results),
+            len(queries),
+            time.perf_counter() - start,
+            n_threads,
+        )
+        return results
 
-        if DEBUG_QUERY_TIMING:
-            end_time = Pendulum.now()
-            # noinspection PyUnboundLocalVariable
-            time_taken = end_time - start_time
-            log.info("_fetch_all_tasks took {}", time_taken)
+    def _add_query_time(self, task_class: Type[Task], seconds: float) -> None:
+        """
+        Records the time taken for a query.
+        """
+        tablename = task_class.__tablename__
+        self._query_seconds_by_table[tablename] = (
+            self._query_seconds_by_table.get(tablename, 0.0) + seconds
+        )
+
+    # =========================================================================
+    # Internals: fetching Task objects
+    # =========================================================================
+
+    def _fetch_all_tasks_without_index(self) -> None:
+        """
+        Fetch all tasks from the database.
+        """
+        # Fetch all tasks, classwise.
+        queries = []  # type: List[Tuple[Type[Task], Query]]
+        for task_class in self._filter.task_classes:
+            if task_class in self._tasks_by_class:
+                continue  # already fetched
+            q = self._serial_query(task_class)
+            if q is None:
+                self._tasks_by_class[task_class] = []
+            else:
+                queries.append((task_class, q))
+        for task_class, newtasks in self._execute_task_queries(queries):
+            self._store_tasks_for_class(task_class, newtasks)
 
         # Build our joint task list
         self._all_tasks = []  # type: List[Task]
-        for single_task_list in self._tasks_by_class.values():
-            self._all_tasks += single_task_list
+        for task_class in self._filter.task_classes:
+            self._all_tasks += self._tasks_by_class[task_class]
         sort_tasks_in_place(self._all_tasks, self._sort_method_global)
 
     def _fetch_task_class(self, task_class: Type[Task]) -> None:
@@ -477,14 +633,101 @@ class TaskCollection(object):
             return  # already fetched
         q = self._serial_query(task_class)
         if q is None:
-            newtasks = []  # type: List[Task]
-        else:
-            newtasks = q.all()  # type: List[Task]
-            # Apply Python-side filters?
-            newtasks = self._filter_through_python(newtasks)
-            sort_tasks_in_place(newtasks, self._sort_method_by_class)
+            self._tasks_by_class[task_class] = []
+            return
+        [(_, newtasks)] = self._execute_task_queries([(task_class, q)])
+        self._store_tasks_for_class(task_class, newtasks)
+
+    def _store_tasks_for_class(
+        self, task_class: Type[Task], newtasks: List[Task]
+    ) -> None:
+        """
+        Filters and sorts newly fetched tasks of one type, and stores them.
+        """
+        # Apply Python-side filters?
+        newtasks = self._filter_through_python(newtasks)
+        sort_tasks_in_place(newtasks, self._sort_method_by_class)
         self._tasks_by_class[task_class] = newtasks
 
+    def _gen_tasks_without_index_in_chunks(
+        self, task_class: Type[Task], chunk_size: int
+    ) -> Generator[Task, None, None]:
+        """
+        Generates tasks for one task type, directly (without the index), in
+        chunks, by server PK. See :meth:`gen_tasks_for_task_class_in_chunks`.
+        """
+        q = self._serial_query(task_class)
+        if q is None:
+            return
+        # noinspection PyProtectedMember
+        pk_col = task_class._pk
+        last_pk = None  # type: Optional[int]
+        while True:
+            chunk_query = q.order_by(pk_col)
+            if last_pk is not None:
+                chunk_query = chunk_query.filter(pk_col > last_pk)
+            tasks = chunk_query.limit(chunk_size).all()  # type: List[Task]
+            if not tasks:
+                return
+            last_pk = tasks[-1].pk
+            yield from self._filter_through_python(tasks)
+            if len(tasks) < chunk_size:
+                return
+
+    def _gen_tasks_via_index_in_chunks(
+        self, index_query: Query, task_class: Type[Task], chunk_size: int
+    ) -> Generator[Task, None, None]:
+        """
+        Generates tasks for one task type, via an index query, in chunks,
+        seeking through the index by creation time (see
+        :class:`camcops_server.cc_modules.cc_pyramid.KeysetPage`). See
+        :meth:`gen_tasks_for_task_class_in_chunks`.
+        """
+        dbsession = self.req.dbsession
+        chunk_size = min(
+            chunk_size, get_max_bind_params(dbsession.get_bind().dialect.name)
+        )
+        key_columns = [
+            TaskIndexEntry.when_created_utc,
+            TaskIndexEntry.index_entry_pk,
+        ]
+        q = (
+            index_query.filter(
+                TaskIndexEntry.task_table_name == task_class.__tablename__
+            )
+            .order_by(None)
+            .order_by(*[c.asc() for c in key_columns])
+        )
+        # noinspection PyProtectedMember
+        pk_col = task_class._pk
+        last_key = None  # type: Optional[List[Any]]
+        while True:
+            chunk_query = q
+            if last_key is not None:
+                chunk_query = chunk_query.filter(
+                    keyset_criterion(key_columns, last_key, greater=True)
+                )
+            indexes = chunk_query.limit(
+                chunk_size
+            ).all()  # type: List[TaskIndexEntry]
+            if not indexes:
+                return
+            last = indexes[-1]
+            last_key = [last.when_created_utc, last.index_entry_pk]
+            task_pks = [i.task_pk for i in indexes]
+            tasks_by_pk = {
+                task.pk: task
+                for task in dbsession.query(task_class).filter(
+                    pk_col.in_(task_pks)
+                )
+            }  # type: Dict[int, Task]
+            for pk in task_pks:
+                task = tasks_by_pk.get(pk)
+                if task is not None:
+                    yield task
+            if len(indexes) < chunk_size:
+                return
+
     def _serial_query(self, task_class: Type[Task]) -> Optional[Query]:
         """
         Make and return an SQLAlchemy ORM query for a specific task class.
@@ -801,10 +1044,6 @@ class TaskCollection(object):
             return
         assert self._all_indexes is not None
 
-        d = tablename_to_task_class_dict()
-        dbsession = self.req.dbsession
-        self._all_tasks = []  # type: List[Task]
-
         # Fetch indexes
         if isinstance(self._all_indexes, Query):
             # Query built, but indexes not yet fetched.
@@ -812,35 +1051,87 @@ class TaskCollection(object):
             self._all_indexes = (
                 self._all_indexes.all()
             )  # type: List[TaskIndexEntry]
-        indexes = self._all_indexes
 
         # Fetch tasks
-        tablenames = set(index.task_table_name for index in indexes)
-        for tablename in tablenames:
-            # We do this by task class, so we can execute a single query per
-            # task type (rather than per task).
-            try:
-                taskclass = d[tablename]
-            except KeyError:
-                log.warning("Bad tablename in index: {!r}", tablename)
-                continue
-            tasklist = self._tasks_by_class.setdefault(taskclass, [])
-            task_pks = [i.task_pk for i in indexes if i.tablename == tablename]
-            # noinspection PyProtectedMember
-            qtask = dbsession.query(taskclass).filter(
-                taskclass._pk.in_(task_pks)
-            )
-            qtask = self._filter_query_for_text_contents(qtask, taskclass)
-            tasks = qtask.all()  # type: List[Task]
-            for task in tasks:
-                tasklist.append(task)
-                self._all_tasks.append(task)
+        self._all_tasks = self.tasks_for_index_entries(self._all_indexes)
+        for task in self._all_tasks:
+            self._tasks_by_class.setdefault(type(task), []).append(task)
 
         # Sort tasks
         for tasklist in self._tasks_by_class.values():
             sort_tasks_in_place(tasklist, self._sort_method_by_class)
         sort_tasks_in_place(self._all_tasks, self._sort_method_global)
 
+    def tasks_for_index_entries(
+        self, indexes: Iterable[TaskIndexEntry]
+    ) -> List[Task]:
+        """
+        Fetches the tasks for some index entries (e.g. one page of them),
+        with one query per task table (or per chunk of PKs, for very large
+        numbers), rather than one per index entry.
+
+        The index entries should have come from this collection (e.g. from
+        :attr:`all_tasks_or_indexes_or_query`), since that is where
+        permissions are applied.
+
+        Returns:
+            tasks, in the order of the index entries; tasks that don't match
+            our text filter (if any), or that can't be found, are omitted
+        """
+        indexes = list(indexes)
+        tasks_by_table_pk = {}  # type: Dict[Tuple[str, int], Task]
+        for taskclass, tasks in self._execute_task_queries(
+            self._task_queries_for_index_entries(indexes)
+        ):
+            tablename = taskclass.__tablename__
+            for task in tasks:
+                tasks_by_table_pk[(tablename, task.pk)] = task
+        result = []  # type: List[Task]
+        for index in indexes:
+            task = tasks_by_table_pk.get(
+                (index.task_table_name, index.task_pk)
+            )
+            if task is not None:
+                result.append(task)
+        return result
+
+    def _task_queries_for_index_entries(
+        self, indexes: List[TaskIndexEntry]
+    ) -> List[Tuple[Type[Task], Query]]:
+        """
+        Returns queries to fetch the tasks for some index entries. Entries are
+        grouped by task table, in a single pass, and the PKs for each table
+        split into chunks that respect the database's limit on bound
+        parameters.
+        """
+        dbsession = self.req.dbsession
+        # Leave some parameters for the text filter, if there is one.
+        chunk_size = max(
+            1, get_max_bind_params(dbsession.get_bind().dialect.name) - 50
+        )
+        task_pks_by_tablename = OrderedDict()  # type: Dict[str, List[int]]
+        for index in indexes:
+            task_pks_by_tablename.setdefault(index.task_table_name, []).append(
+                index.task_pk
+            )
+
+        d = tablename_to_task_class_dict()
+        queries = []  # type: List[Tuple[Type[Task], Query]]
+        for tablename, task_pks in task_pks_by_tablename.items():
+            try:
+                taskclass = d[tablename]
+            except KeyError:
+                log.warning("Bad tablename in index: {!r}", tablename)
+                continue
+            for pk_chunk in chunks(task_pks, chunk_size):
+                # noinspection PyProtectedMember
+                qtask = dbsession.query(taskclass).filter(
+                    taskclass._pk.in_(pk_chunk)
+                )
+                qtask = self._filter_query_for_text_contents(qtask, taskclass)
+                queries.append((taskclass, qtask))
+        return queries
+
     def _make_index_query(self) -> Optional[Query]:
         """
         Make and return an SQLAlchemy ORM query to retrieve indexes.
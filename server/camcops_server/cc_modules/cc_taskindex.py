@@ -32,12 +32,10 @@ it caches ``is_complete()`` information).
 """
 
 import logging
-from typing import List, Optional, Type, TYPE_CHECKING
+from typing import Any, Dict, List, Optional, Type, TYPE_CHECKING
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.reprfunc import simple_repr
-from cardinal_pythonlib.sqlalchemy.session import get_engine_from_session
-from cardinal_pythonlib.sqlalchemy.schema import table_exists
 from cardinal_pythonlib.sqlalchemy.sqlserver import (
     if_sqlserver_disable_constraints_triggers,
 )
@@ -59,7 +57,6 @@ from camcops_server.cc_modules.cc_patient import Patient
 from camcops_server.cc_modules.cc_patientidnum import PatientIdNum
 from camcops_server.cc_modules.cc_sqla_coltypes import (
     EraColType,
-    isotzdatetime_to_utcdatetime,
     PendulumDateTimeAsIsoTextColType,
     TableNameColType,
 )
@@ -69,6 +66,7 @@ from camcops_server.cc_modules.cc_task import (
     tablename_to_task_class_dict,
     Task,
 )
+from camcops_server.cc_modules.cc_tasksummary import TaskSummaryEntry
 from camcops_server.cc_modules.cc_user import User
 
 if TYPE_CHECKING:
@@ -273,7 +271,7 @@ class PatientIdNumIndexEntry(Base):
                     select(
                         [
                             idnumcols._pk,
-                            literal(indexed_at_utc),
+                            literal(indexed_at_utc, DateTime),
                             patientcols._pk,
                             idnumcols.which_idnum,
                             idnumcols.idnum_value,
@@ -450,7 +448,7 @@ class PatientIdNumIndexEntry(Base):
                         select(
                             [
                                 idnumcols._pk,
-                                literal(indexed_at_utc),
+                                literal(indexed_at_utc, DateTime),
                                 patientcols._pk,
                                 idnumcols.which_idnum,
                                 idnumcols.idnum_value,
@@ -740,29 +738,40 @@ class TaskIndexEntry(Base):
             indexed_at_utc:
                 current time in UTC
         """
-        assert indexed_at_utc is not None, "Missing indexed_at_utc"
-
-        index = cls()
+        return cls(**cls.index_values_for_task(task, indexed_at_utc))
 
-        index.indexed_at_utc = indexed_at_utc
-
-        index.task_table_name = task.tablename
-        index.task_pk = task.pk
+    @classmethod
+    def index_values_for_task(
+        cls, task: Task, indexed_at_utc: Pendulum
+    ) -> Dict[str, Any]:
+        """
+        Returns the column values of a task index entry for the specified
+        :class:`camcops_server.cc_modules.cc_task.Task`, as a dictionary
+        suitable for a (bulk) SQLAlchemy Core insert.
 
+        Args:
+            task:
+                a :class:`camcops_server.cc_modules.cc_task.Task`
+            indexed_at_utc:
+                current time in UTC
+        """
+        assert indexed_at_utc is not None, "Missing indexed_at_utc"
         patient = task.patient
-        index.patient_pk = patient.pk if patient else None
-
-        index.device_id = task.device_id
-        index.era = task.era
-        index.when_created_utc = task.get_creation_datetime_utc()
-        index.when_created_iso = task.when_created
         # noinspection PyProtectedMember
-        index.when_added_batch_utc = task._when_added_batch_utc
-        index.adding_user_id = task.get_adding_user_id()
-        index.group_id = task.group_id
-        index.task_is_complete = task.is_complete()
-
-        return index
+        return dict(
+            indexed_at_utc=indexed_at_utc,
+            task_table_name=task.tablename,
+            task_pk=task.pk,
+            patient_pk=patient.pk if patient else None,
+            device_id=task.device_id,
+            era=task.era,
+            when_created_utc=task.get_creation_datetime_utc(),
+            when_created_iso=task.when_created,
+            when_added_batch_utc=task._when_added_batch_utc,
+            adding_user_id=task.get_adding_user_id(),
+            group_id=task.group_id,
+            task_is_complete=task.is_complete(),
+        )
 
     @classmethod
     def index_task(
@@ -817,7 +826,9 @@ class TaskIndexEntry(Base):
         delete_first: bool = True,
     ) -> None:
         """
-        Rebuilds the index for a particular task type.
+        Rebuilds the index for a particular task type, within the caller's
+        transaction. See
+        :func:`camcops_server.cc_modules.cc_taskindexrebuild.rebuild_task_table_index`.
 
         Args:
             session: an SQLAlchemy Session
@@ -827,26 +838,18 @@ class TaskIndexEntry(Base):
             delete_first: delete old index entries first? Should always be True
                 unless called as part of a master rebuild that deletes
                 everything first.
-        """
-        # noinspection PyUnresolvedReferences
-        idxtable = cls.__table__  # type: Table
-        idxcols = idxtable.columns
-        tasktablename = taskclass.tablename
-        log.info("Rebuilding task index for {}", tasktablename)
-        # Delete all entries for this task
-        if delete_first:
-            session.execute(
-                idxtable.delete().where(idxcols.table_name == tasktablename)
-            )
-        # Create new entries
-        # noinspection PyPep8,PyUnresolvedReferences,PyProtectedMember
-        q = (
-            session.query(taskclass)
-            .filter(taskclass._current == True)  # noqa: E712
-            .order_by(isotzdatetime_to_utcdatetime(taskclass.when_created))
+        """  # noqa
+        from camcops_server.cc_modules.cc_taskindexrebuild import (
+            rebuild_task_table_index,
+        )  # delayed import
+
+        rebuild_task_table_index(
+            session,
+            taskclass,
+            indexed_at_utc,
+            delete_first=delete_first,
+            commit=False,
         )
-        for task in q:
-            cls.index_task(task, session, indexed_at_utc)
 
     @classmethod
     def rebuild_entire_task_index(
@@ -856,7 +859,10 @@ class TaskIndexEntry(Base):
         skip_tasks_with_missing_tables: bool = False,
     ) -> None:
         """
-        Rebuilds the entire index.
+        Rebuilds the entire index, within the caller's transaction. See
+        :func:`camcops_server.cc_modules.cc_taskindexrebuild.rebuild_entire_task_index`
+        for a version that can commit as it goes, use several processes, and
+        resume.
 
         Args:
             session: an SQLAlchemy Session
@@ -865,25 +871,17 @@ class TaskIndexEntry(Base):
                 tables are not in the database? (This is so we can rebuild an
                 index from a database upgrade, but not crash because newer
                 tasks haven't had their tables created yet.)
-        """
-        log.info("Rebuilding entire task index")
-        # noinspection PyUnresolvedReferences
-        idxtable = cls.__table__  # type: Table
-
-        # Delete all entries
-        with if_sqlserver_disable_constraints_triggers(session, idxtable.name):
-            session.execute(idxtable.delete())
-
-        # Now rebuild:
-        for taskclass in Task.all_subclasses_by_tablename():
-            if skip_tasks_with_missing_tables:
-                basetable = taskclass.tablename
-                engine = get_engine_from_session(session)
-                if not table_exists(engine, basetable):
-                    continue
-            cls.rebuild_index_for_task_type(
-                session, taskclass, indexed_at_utc, delete_first=False
-            )
+        """  # noqa
+        from camcops_server.cc_modules.cc_taskindexrebuild import (
+            rebuild_entire_task_index,
+        )  # delayed import
+
+        rebuild_entire_task_index(
+            session,
+            indexed_at_utc,
+            skip_tasks_with_missing_tables=skip_tasks_with_missing_tables,
+            commit=False,
+        )
 
     # -------------------------------------------------------------------------
     # Update index at the point of upload from a device
@@ -1054,7 +1052,7 @@ def update_indexes_and_push_exports(
     tablechanges: UploadTableChanges,
 ) -> None:
     """
-    Update server indexes, if required.
+    Update server indexes (and stored task summaries), if required.
 
     Also triggers background jobs to export "new arrivals", if required.
 
@@ -1066,7 +1064,14 @@ def update_indexes_and_push_exports(
             object describing the changes to a table
     """  # noqa
     tablename = tablechanges.tablename
-    if tablename == PatientIdNum.__tablename__:
+    if tablename == Patient.__tablename__:
+        # Task summaries may depend on patient details
+        TaskSummaryEntry.update_for_patient_upload(
+            req=req,
+            tablechanges=tablechanges,
+            computed_at_utc=batchdetails.batchtime,
+        )
+    elif tablename == PatientIdNum.__tablename__:
         # Update idnum index
         PatientIdNumIndexEntry.update_idnum_index_for_upload(
             session=req.dbsession,
@@ -1080,6 +1085,12 @@ def update_indexes_and_push_exports(
             tablechanges=tablechanges,
             indexed_at_utc=batchdetails.batchtime,
         )
+        # Store task summaries
+        TaskSummaryEntry.update_for_upload(
+            req=req,
+            tablechanges=tablechanges,
+            computed_at_utc=batchdetails.batchtime,
+        )
         # Push exports
         recipients = req.all_push_recipients
         uploading_group_id = req.user.upload_group_id
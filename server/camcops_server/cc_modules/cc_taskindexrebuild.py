@@ -0,0 +1,610 @@
+"""
+camcops_server/cc_modules/cc_taskindexrebuild.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Bulk rebuilding of the server task index.**
+
+Rebuilding the task index means loading every current task (we need the ORM
+object, because "is it complete?" is a Python method), so on a big database
+it is slow. Here we:
+
+- read each task table in pages of ``batch_size`` tasks, in PK order
+  ("keyset" pagination: ``WHERE _pk > last_pk ORDER BY _pk LIMIT n``). That
+  keeps memory use bounded without holding a server-side cursor open while
+  we write (which MySQL doesn't permit on the same connection);
+- write the index entries for each page with one bulk (executemany) INSERT,
+  rather than via ORM objects, and COMMIT;
+- optionally, record a checkpoint per task table (in a directory of small
+  JSON files) after each page, so that an interrupted rebuild can be resumed;
+- optionally, spread task tables across several worker processes, each with
+  its own database engine;
+- report progress and throughput to the log.
+
+"""
+
+from concurrent.futures import as_completed, ProcessPoolExecutor
+import json
+import logging
+import multiprocessing
+import os
+import time
+from typing import List, Optional, Type, TYPE_CHECKING
+
+from cardinal_pythonlib.logs import (
+    BraceStyleAdapter,
+    main_only_quicksetup_rootlogger,
+)
+from cardinal_pythonlib.sqlalchemy.dialect import SqlaDialectName
+from cardinal_pythonlib.sqlalchemy.schema import table_exists
+from cardinal_pythonlib.sqlalchemy.sqlserver import (
+    if_sqlserver_disable_constraints_triggers,
+)
+from pendulum import DateTime as Pendulum
+from sqlalchemy.engine import create_engine
+from sqlalchemy.orm import Session as SqlASession
+
+from camcops_server.cc_modules.cc_task import (
+    tablename_to_task_class_dict,
+    Task,
+)
+from camcops_server.cc_modules.cc_taskindex import (
+    PatientIdNumIndexEntry,
+    TaskIndexEntry,
+)
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine.base import Engine
+    from sqlalchemy.sql.schema import Table
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+
+# =============================================================================
+# Constants
+# =============================================================================
+
+DEFAULT_REINDEX_BATCH_SIZE = 1000
+DEFAULT_REINDEX_PROGRESS_INTERVAL_S = 10.0
+CHECKPOINT_EXTENSION = ".json"
+
+
+# =============================================================================
+# Checkpoints
+# =============================================================================
+
+
+class TableReindexCheckpoint(object):
+    """
+    How far we have got with (re)indexing one task table. Stored as a JSON
+    file per table, within a checkpoint directory.
+    """
+
+    def __init__(
+        self,
+        tablename: str,
+        last_pk: Optional[int] = None,
+        n_tasks: int = 0,
+        complete: bool = False,
+    ) -> None:
+        """
+        Args:
+            tablename:
+                the task's base table name
+            last_pk:
+                server PK of the last task indexed (and committed), or
+                ``None`` if we haven't started
+            n_tasks:
+                number of tasks indexed so far
+            complete:
+                have we finished this table?
+        """
+        self.tablename = tablename
+        self.last_pk = last_pk
+        self.n_tasks = n_tasks
+        self.complete = complete
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(tablename={self.tablename!r}, "
+            f"last_pk={self.last_pk!r}, n_tasks={self.n_tasks!r}, "
+            f"complete={self.complete!r})"
+        )
+
+    @staticmethod
+    def filename(checkpoint_dir: str, tablename: str) -> str:
+        """
+        Returns the checkpoint filename for a table.
+        """
+        return os.path.join(checkpoint_dir, tablename + CHECKPOINT_EXTENSION)
+
+    @classmethod
+    def load(
+        cls, checkpoint_dir: str, tablename: str
+    ) -> "TableReindexCheckpoint":
+        """
+        Reads a table's checkpoint, or returns a fresh one (if there isn't
+        one).
+        """
+        try:
+            with open(cls.filename(checkpoint_dir, tablename)) as f:
+                d = json.load(f)
+        except FileNotFoundError:
+            return cls(tablename)
+        return cls(
+            tablename,
+            last_pk=d.get("last_pk"),
+            n_tasks=d.get("n_tasks", 0),
+            complete=d.get("complete", False),
+        )
+
+    def save(self, checkpoint_dir: str) -> None:
+        """
+        Writes the checkpoint (atomically, so that an interruption never
+        leaves a half-written file).
+        """
+        filename = self.filename(checkpoint_dir, self.tablename)
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(
+                dict(
+                    last_pk=self.last_pk,
+                    n_tasks=self.n_tasks,
+                    complete=self.complete,
+                ),
+                f,
+            )
+        os.replace(tmp_filename, filename)
+
+
+def clear_reindex_checkpoints(checkpoint_dir: str) -> None:
+    """
+    Deletes all checkpoints from the checkpoint directory (creating the
+    directory if necessary).
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    for filename in os.listdir(checkpoint_dir):
+        if filename.endswith(CHECKPOINT_EXTENSION):
+            os.remove(os.path.join(checkpoint_dir, filename))
+
+
+# =============================================================================
+# Progress
+# =============================================================================
+
+
+class TableReindexResult(object):
+    """
+    What happened when we (re)indexed one task table.
+    """
+
+    def __init__(
+        self,
+        tablename: str,
+        n_tasks: int = 0,
+        seconds: float = 0.0,
+        skipped: bool = False,
+    ) -> None:
+        """
+        Args:
+            tablename:
+                the task's base table name
+            n_tasks:
+                number of tasks indexed by this run
+            seconds:
+                time taken
+            skipped:
+                did we skip the table (because a checkpoint said it was
+                already done)?
+        """
+        self.tablename = tablename
+        self.n_tasks = n_tasks
+        self.seconds = seconds
+        self.skipped = skipped
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(tablename={self.tablename!r}, "
+            f"n_tasks={self.n_tasks!r}, seconds={self.seconds!r}, "
+            f"skipped={self.skipped!r})"
+        )
+
+    @property
+    def tasks_per_second(self) -> float:
+        """
+        Throughput.
+        """
+        return self.n_tasks / self.seconds if self.seconds > 0 else 0.0
+
+
+# =============================================================================
+# Rebuilding the index for one task table
+# =============================================================================
+
+
+def rebuild_task_table_index(
+    dbsession: SqlASession,
+    taskclass: Type[Task],
+    indexed_at_utc: Pendulum,
+    delete_first: bool = True,
+    batch_size: int = DEFAULT_REINDEX_BATCH_SIZE,
+    checkpoint_dir: str = None,
+    resume: bool = False,
+    progress_interval_s: float = DEFAULT_REINDEX_PROGRESS_INTERVAL_S,
+    commit: bool = True,
+) -> TableReindexResult:
+    """
+    Rebuilds the task index for one task type, one page of tasks at a time,
+    committing after each page (unless told not to).
+
+    Args:
+        dbsession:
+            an SQLAlchemy Session
+        taskclass:
+            a subclass of :class:`camcops_server.cc_modules.cc_task.Task`
+        indexed_at_utc:
+            current time in UTC
+        delete_first:
+            delete old index entries for this task type first? Should be True
+            unless the caller has deleted everything first. (Ignored when
+            resuming; then, we delete only entries beyond the checkpoint.)
+        batch_size:
+            number of tasks to read, and index entries to insert, at once
+        checkpoint_dir:
+            optional directory in which to record our progress
+        resume:
+            carry on from the checkpoint in ``checkpoint_dir``, if there is
+            one?
+        progress_interval_s:
+            how often to log progress
+        commit:
+            COMMIT after each page? If not, everything happens within the
+            caller's transaction (so checkpoints can't be used).
+
+    Returns:
+        a :class:`TableReindexResult`
+    """
+    assert batch_size > 0, "Bad batch_size"
+    assert checkpoint_dir or not resume, "Can't resume without checkpoints"
+    assert commit or not checkpoint_dir, "Checkpoints require COMMITs"
+    tablename = taskclass.tablename
+    if resume:
+        checkpoint = TableReindexCheckpoint.load(checkpoint_dir, tablename)
+        if checkpoint.complete:
+            log.info(
+                "Task index for {} already complete ({} tasks); skipping",
+                tablename,
+                checkpoint.n_tasks,
+            )
+            return TableReindexResult(tablename, skipped=True)
+    else:
+        checkpoint = TableReindexCheckpoint(tablename)
+    start = time.monotonic()
+    last_log = start
+    n_tasks = 0
+
+    # noinspection PyUnresolvedReferences
+    idxtable = TaskIndexEntry.__table__  # type: Table
+    idxcols = idxtable.columns
+    if resume or delete_first:
+        delete_stmt = idxtable.delete().where(
+            idxcols.task_table_name == tablename
+        )
+        if checkpoint.last_pk is not None:
+            # Entries we wrote, but didn't record as done.
+            delete_stmt = delete_stmt.where(
+                idxcols.task_pk > checkpoint.last_pk
+            )
+        dbsession.execute(delete_stmt)
+    if checkpoint.last_pk is None:
+        log.info("Rebuilding task index for {}", tablename)
+    else:
+        log.info(
+            "Resuming task index for {} after task PK {}",
+            tablename,
+            checkpoint.last_pk,
+        )
+
+    # noinspection PyProtectedMember
+    q = (
+        dbsession.query(taskclass)
+        .filter(taskclass._current == True)  # noqa: E712
+        .order_by(taskclass._pk)
+    )
+    last_pk = checkpoint.last_pk
+    while True:
+        # noinspection PyProtectedMember
+        page_q = q if last_pk is None else q.filter(taskclass._pk > last_pk)
+        tasks = page_q.limit(batch_size).all()
+        if not tasks:
+            break
+        rows = [
+            TaskIndexEntry.index_values_for_task(task, indexed_at_utc)
+            for task in tasks
+        ]
+        dbsession.execute(idxtable.insert(), rows)
+        last_pk = tasks[-1].pk
+        n_tasks += len(tasks)
+        if commit:
+            dbsession.commit()
+        if checkpoint_dir:
+            checkpoint.last_pk = last_pk
+            checkpoint.n_tasks += len(tasks)
+            checkpoint.save(checkpoint_dir)
+        now = time.monotonic()
+        if now - last_log >= progress_interval_s:
+            log.info(
+                "Task index for {}: {} tasks so far ({:.0f} tasks/s)",
+                tablename,
+                n_tasks,
+                n_tasks / (now - start),
+            )
+            last_log = now
+        if len(tasks) < batch_size:
+            break
+
+    if checkpoint_dir:
+        checkpoint.complete = True
+        checkpoint.save(checkpoint_dir)
+    result = TableReindexResult(
+        tablename, n_tasks=n_tasks, seconds=time.monotonic() - start
+    )
+    log.info(
+        "Task index for {}: {} tasks in {:.1f} s ({:.0f} tasks/s)",
+        tablename,
+        result.n_tasks,
+        result.seconds,
+        result.tasks_per_second,
+    )
+    return result
+
+
+# =============================================================================
+# Worker processes
+# =============================================================================
+
+# One engine per worker process (set by _init_worker).
+_worker_engine = None  # type: Optional[Engine]
+
+
+def _init_worker(db_url: str, echo: bool, loglevel: int) -> None:
+    """
+    Initializes a worker process: sets up logging, registers all tasks, and
+    creates the process's database engine.
+    """
+    global _worker_engine
+    main_only_quicksetup_rootlogger(level=loglevel, with_process_id=True)
+    import camcops_server.cc_modules.cc_all_models  # noqa: F401
+
+    # ... delayed import; import side effects (all task classes)
+    _worker_engine = create_engine(db_url, echo=echo, pool_pre_ping=True)
+
+
+def _rebuild_task_table_in_worker(
+    tablename: str,
+    indexed_at_utc: Pendulum,
+    batch_size: int,
+    checkpoint_dir: Optional[str],
+    resume: bool,
+    progress_interval_s: float,
+) -> TableReindexResult:
+    """
+    Rebuilds the index for one task table, in a worker process.
+    """
+    taskclass = tablename_to_task_class_dict()[tablename]
+    dbsession = SqlASession(bind=_worker_engine)
+    try:
+        return rebuild_task_table_index(
+            dbsession,
+            taskclass,
+            indexed_at_utc,
+            delete_first=False,
+            batch_size=batch_size,
+            checkpoint_dir=checkpoint_dir,
+            resume=resume,
+            progress_interval_s=progress_interval_s,
+        )
+    except Exception:
+        dbsession.rollback()
+        raise
+    finally:
+        dbsession.close()
+
+
+# =============================================================================
+# Rebuilding the entire index
+# =============================================================================
+
+
+def rebuild_entire_task_index(
+    dbsession: SqlASession,
+    indexed_at_utc: Pendulum,
+    skip_tasks_with_missing_tables: bool = False,
+    processes: int = 1,
+    batch_size: int = DEFAULT_REINDEX_BATCH_SIZE,
+    checkpoint_dir: str = None,
+    resume: bool = False,
+    progress_interval_s: float = DEFAULT_REINDEX_PROGRESS_INTERVAL_S,
+    commit: bool = True,
+) -> List[TableReindexResult]:
+    """
+    Rebuilds the entire task index.
+
+    Args:
+        dbsession:
+            an SQLAlchemy Session
+        indexed_at_utc:
+            current time in UTC
+        skip_tasks_with_missing_tables:
+            should we skip over tasks if their tables are not in the
+            database? (This is so we can rebuild an index from a database
+            upgrade, but not crash because newer tasks haven't had their
+            tables created yet.)
+        processes:
+            number of worker processes to share task tables between; if 1,
+            work in this process using ``dbsession``. (SQLite databases are
+            always done in this process.)
+        batch_size:
+            number of tasks to read, and index entries to insert, at once
+        checkpoint_dir:
+            optional directory in which to record progress per task table
+        resume:
+            carry on from the checkpoints in ``checkpoint_dir``, rather than
+            starting again?
+        progress_interval_s:
+            how often to log progress
+        commit:
+            COMMIT as we go? If not, everything happens within the caller's
+            transaction (so neither checkpoints nor worker processes can be
+            used).
+
+    Returns:
+        a list of :class:`TableReindexResult` objects, one per task table
+    """
+    assert processes >= 1, "Bad number of processes"
+    assert commit or (
+        processes == 1 and not checkpoint_dir
+    ), "Checkpoints and worker processes require COMMITs"
+    if resume and not checkpoint_dir:
+        raise ValueError("Can't resume a reindex without a checkpoint_dir")
+    start = time.monotonic()
+    # noinspection PyUnresolvedReferences
+    idxtable = TaskIndexEntry.__table__  # type: Table
+    engine = dbsession.get_bind().engine  # type: Engine
+
+    if resume:
+        log.info("Resuming task index rebuild from {!r}", checkpoint_dir)
+    else:
+        log.info("Rebuilding entire task index")
+        if checkpoint_dir:
+            clear_reindex_checkpoints(checkpoint_dir)
+        # Delete all entries
+        with if_sqlserver_disable_constraints_triggers(
+            dbsession, idxtable.name
+        ):
+            dbsession.execute(idxtable.delete())
+    if commit:
+        dbsession.commit()
+
+    tablenames = []  # type: List[str]
+    for taskclass in Task.all_subclasses_by_tablename():
+        tablename = taskclass.tablename
+        if skip_tasks_with_missing_tables and not table_exists(
+            engine, tablename
+        ):
+            continue
+        tablenames.append(tablename)
+
+    if processes > 1 and engine.dialect.name == SqlaDialectName.SQLITE:
+        log.warning("SQLite database; reindexing in a single process")
+        processes = 1
+
+    kwargs = dict(
+        indexed_at_utc=indexed_at_utc,
+        batch_size=batch_size,
+        checkpoint_dir=checkpoint_dir,
+        resume=resume,
+        progress_interval_s=progress_interval_s,
+    )
+    results = []  # type: List[TableReindexResult]
+
+    def _done(result_: TableReindexResult) -> None:
+        results.append(result_)
+        n_tasks = sum(r.n_tasks for r in results)
+        elapsed = time.monotonic() - start
+        log.info(
+            "Task index: {}/{} tables done; {} tasks in {:.1f} s "
+            "({:.0f} tasks/s)",
+            len(results),
+            len(tablenames),
+            n_tasks,
+            elapsed,
+            n_tasks / elapsed if elapsed > 0 else 0.0,
+        )
+
+    if processes == 1:
+        d = tablename_to_task_class_dict()
+        for tablename in tablenames:
+            _done(
+                rebuild_task_table_index(
+                    dbsession,
+                    d[tablename],
+                    delete_first=False,
+                    commit=commit,
+                    **kwargs,
+                )
+            )
+    else:
+        log.info("Using {} worker processes", processes)
+        # Each worker needs a fresh engine, not a copy of our connection pool,
+        # so we "spawn" rather than "fork".
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(
+                engine.url.render_as_string(hide_password=False),
+                engine.echo,
+                logging.getLogger().getEffectiveLevel(),
+            ),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _rebuild_task_table_in_worker, tablename, **kwargs
+                )
+                for tablename in tablenames
+            ]
+            for future in as_completed(futures):
+                _done(future.result())
+    return results
+
+
+def reindex_everything_in_bulk(
+    dbsession: SqlASession,
+    skip_tasks_with_missing_tables: bool = False,
+    processes: int = 1,
+    batch_size: int = DEFAULT_REINDEX_BATCH_SIZE,
+    checkpoint_dir: str = None,
+    resume: bool = False,
+    progress_interval_s: float = DEFAULT_REINDEX_PROGRESS_INTERVAL_S,
+) -> List[TableReindexResult]:
+    """
+    Deletes from and rebuilds all server index tables. The patient ID number
+    index is rebuilt by a single INSERT ... SELECT, so it's always done
+    afresh; the task index is rebuilt by :func:`rebuild_entire_task_index`,
+    whose arguments these are.
+    """
+    now = Pendulum.utcnow()
+    log.info("Reindexing database; indexed_at_utc = {}", now)
+    PatientIdNumIndexEntry.rebuild_idnum_index(dbsession, now)
+    dbsession.commit()
+    return rebuild_entire_task_index(
+        dbsession,
+        now,
+        skip_tasks_with_missing_tables=skip_tasks_with_missing_tables,
+        processes=processes,
+        batch_size=batch_size,
+        checkpoint_dir=checkpoint_dir,
+        resume=resume,
+        progress_interval_s=progress_interval_s,
+    )
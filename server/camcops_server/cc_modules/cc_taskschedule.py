@@ -25,15 +25,18 @@ camcops_server/cc_modules/cc_taskschedule.py
 
 """
 
+from bisect import bisect_left
+import datetime
 import logging
-from typing import List, Iterable, Optional, Tuple, TYPE_CHECKING
+from typing import Dict, List, Iterable, Optional, Tuple, TYPE_CHECKING
 from urllib.parse import urlencode, urlunsplit
 
+from cardinal_pythonlib.datetimefunc import convert_datetime_to_utc
 from cardinal_pythonlib.uriconst import UriSchemes
 from pendulum import DateTime as Pendulum, Duration
 
 from sqlalchemy import cast, Numeric
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import Query, relationship
 from sqlalchemy.sql.functions import func
 from sqlalchemy.sql.schema import Column, ForeignKey
 from sqlalchemy.sql.sqltypes import BigInteger, Integer, UnicodeText
@@ -64,7 +67,9 @@ from camcops_server.cc_modules.cc_taskcollection import (
 
 if TYPE_CHECKING:
     from sqlalchemy.sql.elements import Cast
+    from camcops_server.cc_modules.cc_patient import Patient
     from camcops_server.cc_modules.cc_request import CamcopsRequest
+    from camcops_server.cc_modules.cc_taskindex import TaskIndexEntry
 
 log = logging.getLogger(__name__)
 
@@ -132,6 +137,211 @@ class ScheduledTaskInfo(object):
         return self.due_now and self.is_identifiable_and_incomplete
 
 
+# =============================================================================
+# ScheduledTaskResolver
+# =============================================================================
+
+# A window in which a scheduled task is due: (tablename, start, end). A task
+# fulfils it if it was created in the range [start, end).
+ScheduleWindow = Tuple[str, Pendulum, Pendulum]
+
+
+def _naive_utc(dt: datetime.datetime) -> datetime.datetime:
+    """
+    Returns a datetime as a naive UTC datetime, as stored in the task index.
+    """
+    if dt.tzinfo is None:
+        return dt
+    return convert_datetime_to_utc(dt).naive()
+
+
+class ScheduledTaskResolver(object):
+    """
+    Finds the tasks that fulfil a patient's scheduled task windows.
+
+    Rather than building a :class:`TaskCollection` per task schedule item,
+    we fetch every candidate index entry for the patient's ID numbers and
+    scheduled task tables, across all windows, with a single index query.
+    Windows are then matched to index entries in memory (the most recently
+    created task in each window wins), and the tasks themselves fetched with
+    one query per task table.
+
+    Windows can be registered up front (e.g. for all of a patient's
+    schedules, via :meth:`for_patient_task_schedules`), so that they are all
+    resolved together; any window not yet seen is resolved when it is first
+    asked for.
+    """
+
+    def __init__(
+        self,
+        req: "CamcopsRequest",
+        patient: Optional["Patient"],
+        windows: Iterable[ScheduleWindow] = (),
+    ) -> None:
+        """
+        Args:
+            req:
+                a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+            patient:
+                the :class:`camcops_server.cc_modules.cc_patient.Patient`;
+                tasks match if they share any of its ID numbers
+            windows:
+                windows to resolve together, on first use
+        """
+        self.req = req
+        self.patient = patient
+        self._pending = []  # type: List[ScheduleWindow]
+        self._tasks_by_window = (
+            {}
+        )  # type: Dict[ScheduleWindow, Optional[Task]]  # noqa
+        self.n_index_queries = 0
+        for window in windows:
+            self.add_window(*window)
+
+    @classmethod
+    def for_patient_task_schedules(
+        cls,
+        req: "CamcopsRequest",
+        patient_task_schedules: Iterable["PatientTaskSchedule"],
+    ) -> "ScheduledTaskResolver":
+        """
+        Returns a resolver for all the (started) windows of some of a
+        patient's task schedules.
+        """
+        patient = None
+        windows = []  # type: List[ScheduleWindow]
+        for pts in patient_task_schedules:
+            patient = pts.patient
+            for tsi, start, end in pts.scheduled_item_windows():
+                if start is not None:
+                    windows.append((tsi.task_table_name, start, end))
+        return cls(req, patient, windows)
+
+    def add_window(
+        self, tablename: str, start_datetime: Pendulum, end_datetime: Pendulum
+    ) -> None:
+        """
+        Registers a window, to be resolved along with any other pending
+        windows.
+        """
+        # Shouldn't happen in normal operation as the task schedule item form
+        # validation will ensure the dates are correct. However, it's quite
+        # easy to write tests with unintentionally inconsistent dates.
+        assert start_datetime <= end_datetime, (
+            f"Inconsistent dates for {tablename}: "
+            f"{start_datetime} > {end_datetime}"
+        )
+        window = (tablename, start_datetime, end_datetime)
+        if window not in self._tasks_by_window and window not in self._pending:
+            self._pending.append(window)
+
+    def find_task(
+        self, tablename: str, start_datetime: Pendulum, end_datetime: Pendulum
+    ) -> Optional[Task]:
+        """
+        Returns the most recently created task that matches the patient (by
+        any ID number, i.e. via OR), task type and timeframe, or ``None``.
+        """
+        window = (tablename, start_datetime, end_datetime)
+        if window not in self._tasks_by_window:
+            self.add_window(*window)
+            self._resolve_pending()
+        return self._tasks_by_window[window]
+
+    def _make_collection(
+        self, windows: List[ScheduleWindow]
+    ) -> TaskCollection:
+        """
+        Returns a task collection spanning all the windows.
+        """
+        taskfilter = TaskFilter()
+        if self.patient is not None:
+            for idnum in self.patient.idnums:
+                idnum_ref = IdNumReference(
+                    which_idnum=idnum.which_idnum,
+                    idnum_value=idnum.idnum_value,
+                )
+                taskfilter.idnum_criteria.append(idnum_ref)
+        taskfilter.task_types = sorted(set(w[0] for w in windows))
+        taskfilter.start_datetime = min(w[1] for w in windows)
+        taskfilter.end_datetime = max(w[2] for w in windows)
+        assert not taskfilter.dates_inconsistent()
+        return TaskCollection(
+            req=self.req,
+            taskfilter=taskfilter,
+            sort_method_global=TaskSortMethod.CREATION_DATE_DESC,
+        )
+
+    def _resolve_pending(self) -> None:
+        """
+        Resolves all pending windows, with a single index query.
+        """
+        windows = self._pending
+        if not windows:
+            return
+        self._pending = []
+        for window in windows:
+            self._tasks_by_window[window] = None
+
+        collection = self._make_collection(windows)
+        indexes = collection.all_tasks_or_indexes_or_query
+        self.n_index_queries += 1
+        if indexes is None:
+            return
+        if isinstance(indexes, Query):
+            indexes = indexes.all()
+
+        # Index entries come newest first. Store them oldest first, per
+        # table, so we can bisect on creation time.
+        entries_by_table = {}  # type: Dict[str, List[TaskIndexEntry]]
+        for index in reversed(indexes):
+            entries_by_table.setdefault(index.task_table_name, []).append(
+                index
+            )
+        times_by_table = {
+            tablename: [_naive_utc(e.when_created_utc) for e in entries]
+            for tablename, entries in entries_by_table.items()
+        }
+
+        # For each window, the position of the newest entry within it.
+        positions = {}  # type: Dict[ScheduleWindow, int]
+        bounds = {}  # type: Dict[ScheduleWindow, datetime.datetime]
+        for window in windows:
+            tablename, start, end = window
+            times = times_by_table.get(tablename)
+            if not times:
+                continue
+            bounds[window] = _naive_utc(start)
+            i = bisect_left(times, _naive_utc(end)) - 1
+            if i >= 0 and times[i] >= bounds[window]:
+                positions[window] = i
+
+        # Fetch the candidate tasks. Normally there is one round; if a task
+        # has vanished (or fails the collection's filters), we fall back to
+        # the next most recent entry in that window.
+        while positions:
+            candidates = [
+                entries_by_table[window[0]][i]
+                for window, i in positions.items()
+            ]
+            tasks = collection.tasks_for_index_entries(candidates)
+            tasks_by_table_pk = {
+                (task.__tablename__, task.pk): task for task in tasks
+            }
+            next_positions = {}  # type: Dict[ScheduleWindow, int]
+            for (window, i), index in zip(positions.items(), candidates):
+                task = tasks_by_table_pk.get(
+                    (index.task_table_name, index.task_pk)
+                )
+                if task is not None:
+                    self._tasks_by_window[window] = task
+                    continue
+                i -= 1
+                if i >= 0 and times_by_table[window[0]][i] >= bounds[window]:
+                    next_positions[window] = i
+            positions = next_positions
+
+
 # =============================================================================
 # PatientTaskSchedule
 # =============================================================================
@@ -176,30 +386,67 @@ class PatientTaskSchedule(Base):
         cascade="all, delete",
     )
 
+    def scheduled_item_windows(
+        self,
+    ) -> List[
+        Tuple["TaskScheduleItem", Optional[Pendulum], Optional[Pendulum]]
+    ]:
+        """
+        Returns ``(item, start_datetime, end_datetime)`` tuples for each item
+        of this schedule. The dates are ``None`` if the schedule hasn't
+        started.
+        """
+        windows = []
+        for tsi in self.task_schedule.items:
+            start_datetime = None
+            end_datetime = None
+            if self.start_datetime is not None:
+                start_datetime = self.start_datetime.add(
+                    days=tsi.due_from.days
+                )
+                end_datetime = self.start_datetime.add(days=tsi.due_by.days)
+            windows.append((tsi, start_datetime, end_datetime))
+        return windows
+
     def get_list_of_scheduled_tasks(
-        self, req: "CamcopsRequest"
+        self,
+        req: "CamcopsRequest",
+        resolver: ScheduledTaskResolver = None,
     ) -> List[ScheduledTaskInfo]:
         """
         Tasks scheduled for this patient.
+
+        Args:
+            req:
+                a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+            resolver:
+                optional :class:`ScheduledTaskResolver` to find the tasks,
+                which may be shared across all of the patient's schedules;
+                if not given, one is created for this schedule
         """
 
         task_list = []
 
         task_class_lookup = tablename_to_task_class_dict()
 
-        for tsi in self.task_schedule.items:
-            start_datetime = None
-            end_datetime = None
-            task = None
+        item_windows = self.scheduled_item_windows()
+        if resolver is None:
+            resolver = ScheduledTaskResolver(
+                req,
+                self.patient,
+                [
+                    (tsi.task_table_name, start, end)
+                    for tsi, start, end in item_windows
+                    if start is not None
+                ],
+            )
 
-            if self.start_datetime is not None:
-                start_datetime = self.start_datetime.add(
-                    days=tsi.due_from.days
-                )
-                end_datetime = self.start_datetime.add(days=tsi.due_by.days)
+        for tsi, start_datetime, end_datetime in item_windows:
+            task = None
 
-                task = self.find_scheduled_task(
-                    req, tsi, start_datetime, end_datetime
+            if start_datetime is not None:
+                task = resolver.find_task(
+                    tsi.task_table_name, start_datetime, end_datetime
                 )
 
             task_class = task_class_lookup[tsi.task_table_name]
@@ -226,43 +473,17 @@ class PatientTaskSchedule(Base):
     ) -> Optional[Task]:
         """
         Returns the most recently uploaded task that matches the patient (by
-        any ID number, i.e. via OR), task type and timeframe
-        """
-        taskfilter = TaskFilter()
-        for idnum in self.patient.idnums:
-            idnum_ref = IdNumReference(
-                which_idnum=idnum.which_idnum, idnum_value=idnum.idnum_value
-            )
-            taskfilter.idnum_criteria.append(idnum_ref)
+        any ID number, i.e. via OR), task type and timeframe.
 
-        taskfilter.task_types = [tsi.task_table_name]
-
-        taskfilter.start_datetime = start_datetime
-        taskfilter.end_datetime = end_datetime
-
-        # TODO: Improve error reporting
-        # Shouldn't happen in normal operation as the task schedule item form
-        # validation will ensure the dates are correct.
-        # However, it's quite easy to write tests with unintentionally
-        # inconsistent dates.
-        # If we don't assert this here, we get a more cryptic assertion
-        # failure later:
-        #
-        # cc_taskcollection.py _fetch_tasks_from_indexes()
-        # assert self._all_indexes is not None
-        assert not taskfilter.dates_inconsistent()
-
-        collection = TaskCollection(
-            req=req,
-            taskfilter=taskfilter,
-            sort_method_global=TaskSortMethod.CREATION_DATE_DESC,
+        To find tasks for several items, use
+        :meth:`get_list_of_scheduled_tasks` or a :class:`ScheduledTaskResolver`,
+        which need only one index query.
+        """
+        resolver = ScheduledTaskResolver(req, self.patient)
+        return resolver.find_task(
+            tsi.task_table_name, start_datetime, end_datetime
         )
 
-        if len(collection.all_tasks) > 0:
-            return collection.all_tasks[0]
-
-        return None
-
     def email_body(self, req: "CamcopsRequest") -> str:
         """
         Body content (HTML) for an e-mail to the patient -- the schedule's
@@ -0,0 +1,653 @@
+"""
+camcops_server/cc_modules/cc_tasksummary.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Server-side store of precomputed task summaries.**
+
+Task summaries (scores and the like; see
+:meth:`camcops_server.cc_modules.cc_task.Task.get_summaries`) are calculated
+in Python. Rather than recalculating them for every report and export, we
+store them when tasks are uploaded, one row per summary, keyed by task table,
+task PK and summary name.
+
+- Numeric (and Boolean) values are also stored as numbers, so they can be
+  aggregated in SQL.
+- Text values are often translated (e.g. a severity rating such as "severe"),
+  so each records the language it was calculated in. Stored summaries for a
+  task are used only if all its text values are in the reader's language;
+  otherwise the reader calculates them afresh.
+- Each row records the server version that calculated it. Rows from any other
+  version are ignored; they are "stale", because the scoring code may have
+  changed. The ``rebuild_task_summaries`` command recalculates them.
+- Either all of a task's summaries are stored, or none are (if one of them
+  can't be stored, e.g. because it's not a simple type, or if calculating
+  them fails). Readers fall back to calculating summaries that aren't stored.
+- Only current tasks are stored, as for the task index.
+- Some summaries (e.g. whether a task is complete) depend on the patient's
+  details, so when a patient record changes, the summaries of that patient's
+  current tasks are recalculated.
+
+"""
+
+import json
+import logging
+import math
+import time
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    TYPE_CHECKING,
+)
+
+from cardinal_pythonlib.lists import chunks
+from cardinal_pythonlib.logs import BraceStyleAdapter
+from pendulum import DateTime as Pendulum
+from semantic_version import Version
+from sqlalchemy.orm import Session as SqlASession
+from sqlalchemy.sql.expression import and_, exists, select
+from sqlalchemy.sql.functions import func
+from sqlalchemy.sql.schema import Column
+from sqlalchemy.sql.sqltypes import DateTime, Float, Integer, UnicodeText
+
+from camcops_server.cc_modules.cc_patient import Patient
+from camcops_server.cc_modules.cc_sqla_coltypes import (
+    LanguageCodeColType,
+    SemanticVersionColType,
+    TableNameColType,
+)
+from camcops_server.cc_modules.cc_sqlalchemy import Base, get_max_bind_params
+from camcops_server.cc_modules.cc_task import (
+    tablename_to_task_class_dict,
+    Task,
+)
+from camcops_server.cc_modules.cc_version import CAMCOPS_SERVER_VERSION
+
+if TYPE_CHECKING:
+    from sqlalchemy.sql.elements import ColumnElement
+    from sqlalchemy.sql.schema import Table
+    from camcops_server.cc_modules.cc_client_api_core import (
+        UploadTableChanges,
+    )
+    from camcops_server.cc_modules.cc_request import CamcopsRequest
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+
+# =============================================================================
+# Constants
+# =============================================================================
+
+DEFAULT_SUMMARY_REBUILD_BATCH_SIZE = 500
+
+
+# =============================================================================
+# Helper functions
+# =============================================================================
+
+
+def _storable(value: Any) -> bool:
+    """
+    Can we store (and faithfully retrieve) this summary value?
+    """
+    return value is None or isinstance(value, (bool, int, float, str))
+
+
+def _as_number(value: Any) -> Optional[float]:
+    """
+    The numeric version of a summary value, for SQL aggregation, or ``None``.
+    """
+    if isinstance(value, (bool, int, float)) and math.isfinite(value):
+        return float(value)
+    return None
+
+
+def _pk_chunk_size(dbsession: SqlASession) -> int:
+    """
+    How many task PKs can go in one query (leaving a few parameters spare)?
+    """
+    return max(1, get_max_bind_params(dbsession.get_bind().dialect.name) - 10)
+
+
+# =============================================================================
+# TaskSummaryEntry
+# =============================================================================
+
+
+class TaskSummaryEntry(Base):
+    """
+    One stored summary value for one task.
+    """
+
+    __tablename__ = "_task_summaries"
+
+    summary_entry_pk = Column(
+        "summary_entry_pk",
+        Integer,
+        primary_key=True,
+        autoincrement=True,
+        comment="Arbitrary primary key of this summary entry",
+    )
+    task_table_name = Column(
+        "task_table_name",
+        TableNameColType,
+        nullable=False,
+        index=True,
+        comment="Table name of the task's base table",
+    )
+    task_pk = Column(
+        "task_pk",
+        Integer,
+        nullable=False,
+        index=True,
+        comment="Server primary key of the task",
+    )
+    summary_name = Column(
+        "summary_name",
+        TableNameColType,
+        nullable=False,
+        index=True,
+        comment="Name of the summary (as a column name)",
+    )
+    value_number = Column(
+        "value_number",
+        Float,
+        comment="Value, if numeric or Boolean (for aggregation)",
+    )
+    value_json = Column(
+        "value_json",
+        UnicodeText,
+        comment="Value, as JSON",
+    )
+    language = Column(
+        "language",
+        LanguageCodeColType,
+        comment="Language of the value, if text (which may be "
+        "translated); NULL for values that don't depend on language",
+    )
+    camcops_version = Column(
+        "camcops_version",
+        SemanticVersionColType,
+        nullable=False,
+        comment="CamCOPS server version that calculated the summary",
+    )
+    computed_at_utc = Column(
+        "computed_at_utc",
+        DateTime,
+        nullable=False,
+        comment="When the summary was calculated",
+    )
+
+    # -------------------------------------------------------------------------
+    # Create
+    # -------------------------------------------------------------------------
+
+    @classmethod
+    def summary_rows_for_task(
+        cls,
+        req: "CamcopsRequest",
+        task: Task,
+        computed_at_utc: Pendulum,
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Calculates a task's summaries, and returns them as rows for a (bulk)
+        SQLAlchemy Core insert, or ``None`` if they can't all be stored.
+        """
+        try:
+            summaries = task.get_summaries(req)
+        except Exception as e:
+            log.warning(
+                "Not storing summaries for {} PK {}: {!r}",
+                task.tablename,
+                task.pk,
+                e,
+            )
+            return None
+        rows = []  # type: List[Dict[str, Any]]
+        for s in summaries:
+            value = s.value
+            language = req.language if isinstance(value, str) else None
+            if isinstance(value, Version):
+                value = str(value)
+            if not _storable(value):
+                return None
+            rows.append(
+                dict(
+                    task_table_name=task.tablename,
+                    task_pk=task.pk,
+                    summary_name=s.name,
+                    value_number=_as_number(value),
+                    value_json=json.dumps(value),
+                    language=language,
+                    camcops_version=CAMCOPS_SERVER_VERSION,
+                    computed_at_utc=computed_at_utc,
+                )
+            )
+        return rows
+
+    @classmethod
+    def delete_for_tasks(
+        cls, dbsession: SqlASession, tablename: str, task_pks: Sequence[int]
+    ) -> None:
+        """
+        Deletes stored summaries for some tasks of one type.
+        """
+        # noinspection PyUnresolvedReferences
+        table = cls.__table__  # type: Table
+        for pk_chunk in chunks(list(task_pks), _pk_chunk_size(dbsession)):
+            dbsession.execute(
+                table.delete()
+                .where(table.c.task_table_name == tablename)
+                .where(table.c.task_pk.in_(pk_chunk))
+            )
+
+    @classmethod
+    def store_for_tasks(
+        cls,
+        req: "CamcopsRequest",
+        tasks: Iterable[Task],
+        computed_at_utc: Pendulum,
+        dbsession: SqlASession = None,
+    ) -> int:
+        """
+        Calculates and stores summaries for some tasks (all of the same
+        type), replacing any already stored. Returns the number of tasks whose
+        summaries were stored.
+
+        Args:
+            req:
+                a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+                (for calculating summaries)
+            tasks:
+                the tasks
+            computed_at_utc:
+                current time in UTC
+            dbsession:
+                database session to use; default ``req.dbsession``
+        """
+        dbsession = dbsession or req.dbsession
+        tasks = list(tasks)
+        if not tasks:
+            return 0
+        tablename = tasks[0].tablename
+        cls.delete_for_tasks(dbsession, tablename, [t.pk for t in tasks])
+        rows = []  # type: List[Dict[str, Any]]
+        n_tasks = 0
+        for task in tasks:
+            task_rows = cls.summary_rows_for_task(req, task, computed_at_utc)
+            if task_rows is not None:
+                rows.extend(task_rows)
+                n_tasks += 1
+        if rows:
+            # noinspection PyUnresolvedReferences
+            dbsession.execute(cls.__table__.insert(), rows)
+        return n_tasks
+
+    # -------------------------------------------------------------------------
+    # Update at the point of upload from a device
+    # -------------------------------------------------------------------------
+
+    @classmethod
+    def update_for_upload(
+        cls,
+        req: "CamcopsRequest",
+        tablechanges: "UploadTableChanges",
+        computed_at_utc: Pendulum,
+    ) -> None:
+        """
+        Updates stored summaries for a device's upload, for the same tasks
+        as the task index (see
+        :meth:`camcops_server.cc_modules.cc_taskindex.TaskIndexEntry.update_task_index_for_upload`).
+        """  # noqa
+        tablename = tablechanges.tablename
+        taskclass = tablename_to_task_class_dict()[tablename]
+        delete_pks = tablechanges.task_delete_index_pks
+        if delete_pks:
+            cls.delete_for_tasks(req.dbsession, tablename, delete_pks)
+        recalc_pks = tablechanges.task_reindex_pks
+        if recalc_pks:
+            log.debug(
+                "Storing task summaries: {}, server PKs {}",
+                tablename,
+                recalc_pks,
+            )
+            # noinspection PyProtectedMember
+            q = req.dbsession.query(taskclass).filter(
+                taskclass._pk.in_(recalc_pks)
+            )
+            cls.store_for_tasks(req, q, computed_at_utc)
+
+    @classmethod
+    def update_for_patient_upload(
+        cls,
+        req: "CamcopsRequest",
+        tablechanges: "UploadTableChanges",
+        computed_at_utc: Pendulum,
+    ) -> None:
+        """
+        Recalculates stored summaries for the current tasks of patients whose
+        records have changed in a device's upload (of the patient table),
+        since summaries may depend on patient details.
+        """
+        dbsession = req.dbsession
+        new_patient_pks = sorted(
+            set(tablechanges.addition_pks) & set(tablechanges.current_pks)
+        )
+        if not new_patient_pks:
+            return
+        ids_by_device_era = {}  # type: Dict[Tuple[int, str], Set[int]]
+        chunk_size = _pk_chunk_size(dbsession)
+        for pk_chunk in chunks(new_patient_pks, chunk_size):
+            # noinspection PyProtectedMember
+            q = dbsession.query(
+                Patient._device_id, Patient._era, Patient.id
+            ).filter(Patient._pk.in_(pk_chunk))
+            for device_id, era, patient_id in q:
+                ids_by_device_era.setdefault((device_id, era), set()).add(
+                    patient_id
+                )
+        log.debug(
+            "Storing task summaries for tasks of changed patients: server "
+            "PKs {}",
+            new_patient_pks,
+        )
+        for taskclass in Task.all_subclasses_by_tablename():
+            if not taskclass.has_patient:
+                continue
+            for (device_id, era), ids in ids_by_device_era.items():
+                for id_chunk in chunks(sorted(ids), chunk_size):
+                    # noinspection PyProtectedMember
+                    q = (
+                        dbsession.query(taskclass)
+                        .filter(taskclass._device_id == device_id)
+                        .filter(taskclass._era == era)
+                        .filter(taskclass._current == True)  # noqa: E712
+                        .filter(taskclass.patient_id.in_(id_chunk))
+                    )
+                    cls.store_for_tasks(req, q, computed_at_utc)
+
+    # -------------------------------------------------------------------------
+    # Read
+    # -------------------------------------------------------------------------
+
+    @classmethod
+    def current_version_criterion(cls) -> "ColumnElement":
+        """
+        SQL criterion for "calculated by this server version".
+        """
+        # noinspection PyUnresolvedReferences
+        return cls.__table__.c.camcops_version == CAMCOPS_SERVER_VERSION
+
+
+def get_stored_summaries(
+    dbsession: SqlASession,
+    tablename: str,
+    task_pks: Sequence[int],
+    language: str,
+    summary_names: Sequence[str] = None,
+) -> Dict[int, Dict[str, Any]]:
+    """
+    Fetches stored (current-version) summaries for some tasks of one type.
+
+    Args:
+        dbsession:
+            an SQLAlchemy Session
+        tablename:
+            the task's base table name
+        task_pks:
+            server PKs of the tasks
+        language:
+            the reader's language (e.g. ``req.language``); tasks with text
+            summaries stored in a different language are treated as having no
+            stored summaries
+        summary_names:
+            optional list of summary names to restrict to
+
+    Returns:
+        dict: ``{task_pk: {summary_name: value}}``. Tasks without stored
+        summaries are absent.
+    """
+    # noinspection PyUnresolvedReferences
+    table = TaskSummaryEntry.__table__  # type: Table
+    cols = table.c
+    result = {}  # type: Dict[int, Dict[str, Any]]
+    other_language_pks = set()  # type: Set[int]
+    chunk_size = _pk_chunk_size(dbsession) - len(summary_names or [])
+    for pk_chunk in chunks(list(task_pks), max(1, chunk_size)):
+        q = (
+            select(
+                [
+                    cols.task_pk,
+                    cols.summary_name,
+                    cols.value_json,
+                    cols.language,
+                ]
+            )
+            .where(cols.task_table_name == tablename)
+            .where(cols.task_pk.in_(pk_chunk))
+            .where(TaskSummaryEntry.current_version_criterion())
+        )
+        if summary_names is not None:
+            q = q.where(cols.summary_name.in_(summary_names))
+        for task_pk, name, value_json, value_language in dbsession.execute(q):
+            if value_language is not None and value_language != language:
+                other_language_pks.add(task_pk)
+            result.setdefault(task_pk, {})[name] = json.loads(value_json)
+    for task_pk in other_language_pks:
+        del result[task_pk]
+    return result
+
+
+def aggregate_stored_summary(
+    dbsession: SqlASession,
+    tablename: str,
+    summary_name: str,
+    aggregate: Any = func.avg,
+    group_ids: Sequence[int] = None,
+) -> Optional[float]:
+    """
+    Aggregates a stored (current-version) numeric summary in SQL, across all
+    tasks of one type that have it stored.
+
+    Args:
+        dbsession:
+            an SQLAlchemy Session
+        tablename:
+            the task's base table name
+        summary_name:
+            the summary to aggregate
+        aggregate:
+            SQL aggregate function, e.g. ``func.avg`` (the default),
+            ``func.sum``, ``func.min``, ``func.max``, ``func.count``
+        group_ids:
+            optional IDs of groups to restrict to (via the task index)
+
+    Returns:
+        the aggregate value (or ``None`` if there are no values)
+    """
+    from camcops_server.cc_modules.cc_taskindex import (
+        TaskIndexEntry,
+    )  # delayed import
+
+    # noinspection PyUnresolvedReferences
+    table = TaskSummaryEntry.__table__  # type: Table
+    cols = table.c
+    q = (
+        select([aggregate(cols.value_number)])
+        .where(cols.task_table_name == tablename)
+        .where(cols.summary_name == summary_name)
+        .where(TaskSummaryEntry.current_version_criterion())
+    )
+    if group_ids is not None:
+        # noinspection PyUnresolvedReferences
+        idxcols = TaskIndexEntry.__table__.c
+        q = q.where(
+            exists().where(
+                and_(
+                    idxcols.task_table_name == cols.task_table_name,
+                    idxcols.task_pk == cols.task_pk,
+                    idxcols.group_id.in_(group_ids),
+                )
+            )
+        )
+    return dbsession.execute(q).scalar()
+
+
+# =============================================================================
+# Backfill
+# =============================================================================
+
+
+def rebuild_task_summaries_for_task_type(
+    req: "CamcopsRequest",
+    taskclass: Type[Task],
+    stale_only: bool = False,
+    batch_size: int = DEFAULT_SUMMARY_REBUILD_BATCH_SIZE,
+) -> int:
+    """
+    Recalculates and stores summaries for all current tasks of one type, a
+    page at a time (committing after each page).
+
+    Args:
+        req:
+            a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        taskclass:
+            a subclass of :class:`camcops_server.cc_modules.cc_task.Task`
+        stale_only:
+            only do tasks without summaries stored by this server version?
+        batch_size:
+            number of tasks to do at once
+
+    Returns:
+        the number of tasks processed
+    """
+    dbsession = req.dbsession
+    tablename = taskclass.tablename
+    # noinspection PyUnresolvedReferences
+    summarycols = TaskSummaryEntry.__table__.c
+    start = time.monotonic()
+    now = Pendulum.utcnow()
+
+    # noinspection PyProtectedMember
+    q = (
+        dbsession.query(taskclass)
+        .filter(taskclass._current == True)  # noqa: E712
+        .order_by(taskclass._pk)
+    )
+    if stale_only:
+        # noinspection PyProtectedMember
+        q = q.filter(
+            ~exists().where(
+                and_(
+                    summarycols.task_table_name == tablename,
+                    summarycols.task_pk == taskclass._pk,
+                    TaskSummaryEntry.current_version_criterion(),
+                )
+            )
+        )
+    else:
+        # Including any stored for tasks that are no longer current.
+        # noinspection PyUnresolvedReferences
+        dbsession.execute(
+            TaskSummaryEntry.__table__.delete().where(
+                summarycols.task_table_name == tablename
+            )
+        )
+    n_tasks = 0
+    last_pk = None  # type: Optional[int]
+    while True:
+        # noinspection PyProtectedMember
+        page_q = q if last_pk is None else q.filter(taskclass._pk > last_pk)
+        tasks = page_q.limit(batch_size).all()
+        if not tasks:
+            break
+        TaskSummaryEntry.store_for_tasks(req, tasks, now)
+        dbsession.commit()
+        n_tasks += len(tasks)
+        last_pk = tasks[-1].pk
+        if len(tasks) < batch_size:
+            break
+    seconds = time.monotonic() - start
+    log.info(
+        "Task summaries for {}: {} tasks in {:.1f} s ({:.0f} tasks/s)",
+        tablename,
+        n_tasks,
+        seconds,
+        n_tasks / seconds if seconds > 0 else 0.0,
+    )
+    return n_tasks
+
+
+def rebuild_task_summaries(
+    req: "CamcopsRequest",
+    tablenames: Sequence[str] = None,
+    stale_only: bool = False,
+    batch_size: int = DEFAULT_SUMMARY_REBUILD_BATCH_SIZE,
+) -> int:
+    """
+    Recalculates and stores summaries for all current tasks (e.g. after an
+    upgrade that changes scoring code; summaries stored by a previous server
+    version are otherwise ignored).
+
+    Args:
+        req:
+            a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        tablenames:
+            optional task base table names to restrict to
+        stale_only:
+            only do tasks without summaries stored by this server version?
+        batch_size:
+            number of tasks to do at once
+
+    Returns:
+        the number of tasks processed
+    """
+    log.info(
+        "Rebuilding task summaries for server version {}{}",
+        CAMCOPS_SERVER_VERSION,
+        " (stale only)" if stale_only else "",
+    )
+    n_tasks = 0
+    for taskclass in Task.all_subclasses_by_tablename():
+        if tablenames and taskclass.tablename not in tablenames:
+            continue
+        n_tasks += rebuild_task_summaries_for_task_type(
+            req, taskclass, stale_only=stale_only, batch_size=batch_size
+        )
+    if not stale_only and not tablenames:
+        # Anything left is for task tables that no longer exist.
+        # noinspection PyUnresolvedReferences
+        req.dbsession.execute(
+            TaskSummaryEntry.__table__.delete().where(
+                ~TaskSummaryEntry.current_version_criterion()
+            )
+        )
+        req.dbsession.commit()
+    return n_tasks
@@ -29,7 +29,16 @@ showing text that a clinician might care about.**
 """
 
 import logging
-from typing import Any, Dict, List, Optional, Set, Tuple, TYPE_CHECKING
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TYPE_CHECKING,
+)
 
 from cardinal_pythonlib.datetimefunc import format_datetime
 from cardinal_pythonlib.logs import BraceStyleAdapter
@@ -41,11 +50,8 @@ from camcops_server.cc_modules.cc_constants import (
     CssClass,
     CSS_PAGED_MEDIA,
     DateFormat,
-    MatplotlibConstants,
-    PlotDefaults,
 )
 from camcops_server.cc_modules.cc_filename import get_export_filename
-from camcops_server.cc_modules.cc_plot import matplotlib
 from camcops_server.cc_modules.cc_pdf import pdf_from_html
 from camcops_server.cc_modules.cc_pyramid import ViewArg, ViewParam
 from camcops_server.cc_modules.cc_simpleobjects import TaskExportOptions
@@ -55,14 +61,17 @@ from camcops_server.cc_modules.cc_taskcollection import (
     TaskFilter,
     TaskSortMethod,
 )
+from camcops_server.cc_modules.cc_trackerplot import (
+    get_tracker_plot_cache,
+    render_tracker_plots,
+    TrackerPlotSpec,
+)
 from camcops_server.cc_modules.cc_xml import (
-    get_xml_document,
+    gen_xml_document,
     XmlDataTypes,
     XmlElement,
 )
 
-import matplotlib.dates  # delayed until after the cc_plot import
-
 if TYPE_CHECKING:
     from camcops_server.cc_modules.cc_patient import Patient  # noqa: F401
     from camcops_server.cc_modules.cc_patientidnum import (
@@ -82,7 +91,6 @@ log = BraceStyleAdapter(logging.getLogger(__name__))
 # Constants
 # =============================================================================
 
-TRACKER_DATEFORMAT = "%Y-%m-%d"
 WARNING_NO_PATIENT_FOUND = f"""
     <div class="{CssClass.WARNING}">
     </div>
@@ -430,6 +438,24 @@ class TrackerCtvCommon(object):
         Returns:
             an XML UTF-8 document representing our object.
         """
+        return "".join(
+            self.gen_xml(
+                indent_spaces=indent_spaces,
+                eol=eol,
+                include_comments=include_comments,
+            )
+        )
+
+    def gen_xml(
+        self,
+        indent_spaces: int = 4,
+        eol: str = "\n",
+        include_comments: bool = False,
+    ) -> Iterator[str]:
+        """
+        As for :meth:`get_xml`, but returns the XML document in pieces, for
+        streaming.
+        """
         raise NotImplementedError("implement in subclass")
 
     def _get_html(self) -> str:
@@ -448,16 +474,19 @@ class TrackerCtvCommon(object):
     # XML view
     # -------------------------------------------------------------------------
 
-    def _get_xml(
+    def _gen_xml(
         self,
         audit_string: str,
         xml_name: str,
         indent_spaces: int = 4,
         eol: str = "\n",
         include_comments: bool = False,
-    ) -> str:
+    ) -> Iterator[str]:
         """
-        Returns an XML document representing this object.
+        Returns an XML document representing this object, in pieces.
+
+        The XML tree is built (and access audited) when this is called; only
+        the writing of the XML is deferred.
 
         Args:
             audit_string: description used to audit access to this information
@@ -467,7 +496,8 @@ class TrackerCtvCommon(object):
             include_comments: include comments describing each field?
 
         Returns:
-            an XML UTF-8 document representing the task.
+            an iterator of pieces of an XML UTF-8 document representing the
+            task.
         """
         iddef = self.taskfilter.get_only_iddef()
         if not iddef:
@@ -525,7 +555,7 @@ class TrackerCtvCommon(object):
                 patient_server_pk=t.get_patient_server_pk(),
             )
         tree = XmlElement(name=xml_name, value=branches)
-        return get_xml_document(
+        return gen_xml_document(
             tree,
             indent_spaces=indent_spaces,
             eol=eol,
@@ -639,14 +669,15 @@ class Tracker(TrackerCtvCommon):
         super().__init__(
             req=req, taskfilter=taskfilter, as_ctv=False, via_index=via_index
         )
+        self._plots_html = None  # type: Optional[Dict[tuple, List[str]]]
 
-    def get_xml(
+    def gen_xml(
         self,
         indent_spaces: int = 4,
         eol: str = "\n",
         include_comments: bool = False,
-    ) -> str:
-        return self._get_xml(
+    ) -> Iterator[str]:
+        return self._gen_xml(
             audit_string="Tracker XML accessed",
             xml_name="tracker",
             indent_spaces=indent_spaces,
@@ -676,34 +707,101 @@ class Tracker(TrackerCtvCommon):
         """
         HTML for all plots for a given task type.
         """
-        html = ""
+        if not tasks:
+            return ""
+        key = self._plot_key(tasks)
+        all_plots = self._get_all_plots_html()
+        if key in all_plots:
+            plots = all_plots[key]
+        else:
+            # Not one of our task types; draw it now.
+            plots = self._render_plots(self._get_plot_specs(tasks))
+        for task in tasks:
+            audit(
+                self.req,
+                "Tracker data accessed",
+                table=task.tablename,
+                server_pk=task.pk,
+                patient_server_pk=task.get_patient_server_pk(),
+            )
+        return "".join(plots)
+
+    @staticmethod
+    def _plot_key(tasks: List[Task]) -> Tuple[str, Tuple[int, ...]]:
+        """
+        Identifies the plots for a list of tasks of one type.
+        """
+        return tasks[0].tablename, tuple(task.pk for task in tasks)
+
+    def _get_all_plots_html(
+        self,
+    ) -> Dict[Tuple[str, Tuple[int, ...]], List[str]]:
+        """
+        HTML for the plots of all our task types, by :meth:`_plot_key`.
+        We draw them all at once, so that (if so configured) they can be drawn
+        in parallel.
+        """
+        if self._plots_html is None:
+            keys = []  # type: List[Tuple[str, Tuple[int, ...]]]
+            specs_by_key = []  # type: List[List[TrackerPlotSpec]]
+            for cls in self.taskfilter.task_classes:
+                tasks = self.collection.tasks_for_task_class(cls)
+                if not tasks:
+                    continue
+                keys.append(self._plot_key(tasks))
+                specs_by_key.append(self._get_plot_specs(tasks))
+            rendered = self._render_plots(
+                [spec for specs in specs_by_key for spec in specs]
+            )
+            self._plots_html = {}
+            for key, specs in zip(keys, specs_by_key):
+                self._plots_html[key] = rendered[: len(specs)]
+                rendered = rendered[len(specs) :]
+        return self._plots_html
+
+    def _get_plot_specs(self, tasks: List[Task]) -> List[TrackerPlotSpec]:
+        """
+        Specifications for all plots for a given task type.
+        """
         ntasks = len(tasks)
         if ntasks == 0:
-            return html
+            return []
         if not tasks[0].provides_trackers:
             # ask the first of the task instances
-            return html
+            return []
         alltrackers = [task.get_trackers(self.req) for task in tasks]
         datetimes = [task.get_creation_datetime() for task in tasks]
         ntrackers = len(alltrackers[0])
         # ... number of trackers supplied by the first task (and all tasks)
+        specs = []  # type: List[TrackerPlotSpec]
         for tracker in range(ntrackers):
             values = [
                 alltrackers[tasknum][tracker].value
                 for tasknum in range(ntasks)
             ]
-            html += self.get_single_plot_html(
-                datetimes, values, specimen_tracker=alltrackers[0][tracker]
-            )
-        for task in tasks:
-            audit(
-                self.req,
-                "Tracker data accessed",
-                table=task.tablename,
-                server_pk=task.pk,
-                patient_server_pk=task.get_patient_server_pk(),
+            specs.append(
+                TrackerPlotSpec.from_tracker_info(
+                    self.req,
+                    datetimes,
+                    values,
+                    specimen_tracker=alltrackers[0][tracker],
+                    earliest=self.earliest,
+                    latest=self.latest,
+                )
             )
-        return html
+        return specs
+
+    def _render_plots(self, specs: List[TrackerPlotSpec]) -> List[str]:
+        """
+        HTML for each plot, via the tracker plot cache.
+        """
+        cfg = self.req.config
+        cache = get_tracker_plot_cache(
+            cfg.tracker_plot_cache_entries, cfg.tracker_plot_cache_dir
+        )
+        return render_tracker_plots(
+            specs, cache=cache, processes=cfg.tracker_plot_processes
+        )
 
     def get_single_plot_html(
         self,
@@ -714,149 +812,15 @@ class Tracker(TrackerCtvCommon):
         """
         HTML for a single figure.
         """
-        nonblank_values = [x for x in values if x is not None]
-        # NB DIFFERENT to list(filter(None, values)), which implements the
-        # test "if x", not "if x is not None" -- thus eliminating zero values!
-        # We don't want that.
-        if not nonblank_values:
-            return ""
-
-        plot_label = specimen_tracker.plot_label
-        axis_label = specimen_tracker.axis_label
-        axis_min = specimen_tracker.axis_min
-        axis_max = specimen_tracker.axis_max
-        axis_ticks = specimen_tracker.axis_ticks
-        horizontal_lines = specimen_tracker.horizontal_lines
-        horizontal_labels = specimen_tracker.horizontal_labels
-        aspect_ratio = specimen_tracker.aspect_ratio
-
-        figsize = (
-            PlotDefaults.FULLWIDTH_PLOT_WIDTH,
-            (1.0 / float(aspect_ratio)) * PlotDefaults.FULLWIDTH_PLOT_WIDTH,
-        )
-        fig = self.req.create_figure(figsize=figsize)
-        ax = fig.add_subplot(MatplotlibConstants.WHOLE_PANEL)
-        x = [matplotlib.dates.date2num(t) for t in datetimes]
-        datelabels = [dt.strftime(TRACKER_DATEFORMAT) for dt in datetimes]
-
-        # Plot lines and markers (on top of lines)
-        ax.plot(
-            x,  # x
-            values,  # y
-            color=MatplotlibConstants.COLOUR_BLUE,  # line colour
-            linestyle=MatplotlibConstants.LINESTYLE_SOLID,
-            marker=MatplotlibConstants.MARKER_PLUS,  # point shape
-            markeredgecolor=MatplotlibConstants.COLOUR_RED,  # point colour
-            markerfacecolor=MatplotlibConstants.COLOUR_RED,  # point colour
-            label=None,
-            zorder=PlotDefaults.ZORDER_DATA_LINES_POINTS,
+        spec = TrackerPlotSpec.from_tracker_info(
+            self.req,
+            datetimes,
+            values,
+            specimen_tracker=specimen_tracker,
+            earliest=self.earliest,
+            latest=self.latest,
         )
-
-        # x axis
-        ax.set_xlabel("Date/time", fontdict=self.req.fontdict)
-        ax.set_xticks(x)
-        ax.set_xticklabels(datelabels, fontdict=self.req.fontdict)
-        if (
-            self.earliest is not None
-            and self.latest is not None
-            and self.earliest != self.latest
-        ):
-            xlim = matplotlib.dates.date2num((self.earliest, self.latest))
-            margin = (2.5 / 95.0) * (xlim[1] - xlim[0])
-            xlim[0] -= margin
-            xlim[1] += margin
-            ax.set_xlim(xlim)
-        xlim = ax.get_xlim()
-        fig.autofmt_xdate(rotation=90)
-        # ... autofmt_xdate must be BEFORE twinx:
-        # http://stackoverflow.com/questions/8332395
-        if axis_ticks is not None and len(axis_ticks) > 0:
-            tick_positions = [m.y for m in axis_ticks]
-            tick_labels = [m.label for m in axis_ticks]
-            ax.set_yticks(tick_positions)
-            ax.set_yticklabels(tick_labels, fontdict=self.req.fontdict)
-
-        # y axis
-        ax.set_ylabel(axis_label, fontdict=self.req.fontdict)
-        axis_min = (
-            min(axis_min, min(nonblank_values))
-            if axis_min is not None
-            else min(nonblank_values)
-        )
-        axis_max = (
-            max(axis_max, max(nonblank_values))
-            if axis_max is not None
-            else max(nonblank_values)
-        )
-        # ... the supplied values are stretched if the data are outside them
-        # ... but min(something, None) is None, so beware
-        # If we get something with no sense of scale whatsoever, then what
-        # we do is arbitrary. Matplotlib does its own thing, but we could do:
-        if axis_min == axis_max:
-            if axis_min == 0:
-                axis_min, axis_min = -1.0, 1.0
-            else:
-                singlevalue = axis_min
-                axis_min = 0.9 * singlevalue
-                axis_max = 1.1 * singlevalue
-                if axis_min > axis_max:
-                    axis_min, axis_max = axis_max, axis_min
-        ax.set_ylim(axis_min, axis_max)
-
-        # title
-        ax.set_title(plot_label, fontdict=self.req.fontdict)
-
-        # Horizontal lines
-        stupid_jitter = 0.001
-        if horizontal_lines is not None:
-            for y in horizontal_lines:
-                ax.plot(
-                    xlim,  # x
-                    [y, y + stupid_jitter],  # y
-                    color=MatplotlibConstants.COLOUR_GREY_50,
-                    linestyle=MatplotlibConstants.LINESTYLE_DOTTED,
-                    zorder=PlotDefaults.ZORDER_PRESET_LINES,
-                )
-                # PROBLEM: horizontal lines becoming invisible
-                # (whether from ax.axhline or plot)
-
-        # Horizontal labels
-        if horizontal_labels is not None:
-            label_left = xlim[0] + 0.01 * (xlim[1] - xlim[0])
-            for lab in horizontal_labels:
-                y = lab.y
-                l_ = lab.label
-                va = lab.vertical_alignment.value
-                ax.text(
-                    label_left,  # x
-                    y,  # y
-                    l_,  # text
-                    verticalalignment=va,
-                    # alpha=0.5,
-                    # ... was "0.5" rather than 0.5, which led to a
-                    # tricky-to-find "TypeError: a float is required" exception
-                    # after switching to Python 3.
-                    # ... and switched to grey colour with zorder on 2020-06-28
-                    # after wkhtmltopdf 0.12.5 had problems rendering
-                    # opacity=0.5 with SVG lines
-                    color=MatplotlibConstants.COLOUR_GREY_50,
-                    fontdict=self.req.fontdict,
-                    zorder=PlotDefaults.ZORDER_PRESET_LABELS,
-                )
-
-        self.req.set_figure_font_sizes(ax)
-
-        fig.tight_layout()
-        # ... stop the labels dropping off
-        # (only works properly for LEFT labels...)
-
-        # http://matplotlib.org/faq/howto_faq.html
-        # ... tried it - didn't work (internal numbers change fine,
-        # check the logger, but visually doesn't help)
-        # - http://stackoverflow.com/questions/9126838
-        # - http://matplotlib.org/examples/pylab_examples/finance_work2.html
-        return self.req.get_html_from_pyplot_figure(fig) + "<br>"
-        # ... extra line break for the PDF rendering
+        return self._render_plots([spec])[0]
 
 
 # =============================================================================
@@ -879,13 +843,13 @@ class ClinicalTextView(TrackerCtvCommon):
             req=req, taskfilter=taskfilter, as_ctv=True, via_index=via_index
         )
 
-    def get_xml(
+    def gen_xml(
         self,
         indent_spaces: int = 4,
         eol: str = "\n",
         include_comments: bool = False,
-    ) -> str:
-        return self._get_xml(
+    ) -> Iterator[str]:
+        return self._gen_xml(
             audit_string="Clinical text view XML accessed",
             xml_name="ctv",
             indent_spaces=indent_spaces,
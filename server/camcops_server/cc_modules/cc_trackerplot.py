@@ -0,0 +1,625 @@
+"""
+camcops_server/cc_modules/cc_trackerplot.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Rendering tracker plots: cached, and optionally in parallel.**
+
+Rendering tracker plots with matplotlib takes most of the time for trackers
+(and their PDFs), and holds the GIL while it does so. But clinicians often
+look at the same patient's tracker again, and the plot depends only on:
+
+- the data (dates and values);
+- the :class:`camcops_server.cc_modules.cc_trackerhelpers.TrackerInfo`
+  settings (labels, axis limits, ticks, lines...);
+- the font;
+- the output format (SVG, with or without a PNG fallback, or PNG).
+
+A :class:`TrackerPlotSpec` holds all of that, as plain data, and
+:func:`render_tracker_plot_html` draws it. So:
+
+- the rendered HTML is cached under a hash of the spec (plus the server and
+  matplotlib versions), in memory per process (least recently used entries
+  are evicted first), and optionally in a directory shared by all processes
+  (see :class:`TrackerPlotCache`). No one can retrieve a plot without already
+  having its data;
+
+- plots that aren't cached may be drawn by a pool of worker processes (see
+  :func:`render_tracker_plots`), since a spec can be sent to another process.
+
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TYPE_CHECKING,
+)
+
+from cardinal_pythonlib.logs import BraceStyleAdapter
+from cardinal_pythonlib.plot import (
+    png_img_html_from_pyplot_figure,
+    svg_html_from_pyplot_figure,
+)
+
+from camcops_server.cc_modules.cc_constants import (
+    MatplotlibConstants,
+    PlotDefaults,
+    USE_SVG_IN_HTML,
+)
+from camcops_server.cc_modules.cc_plot import matplotlib
+from camcops_server.cc_modules.cc_version_string import (
+    CAMCOPS_SERVER_VERSION_STRING,
+)
+
+import matplotlib.dates  # noqa: E402 (delayed until after the cc_plot import)
+from matplotlib.backends.backend_agg import (  # noqa: E402
+    FigureCanvasAgg as FigureCanvas,
+)
+from matplotlib.figure import Figure  # noqa: E402
+from matplotlib.font_manager import FontProperties  # noqa: E402
+
+if TYPE_CHECKING:
+    from pendulum import DateTime as Pendulum
+    from camcops_server.cc_modules.cc_request import CamcopsRequest
+    from camcops_server.cc_modules.cc_trackerhelpers import TrackerInfo
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+
+# =============================================================================
+# Constants
+# =============================================================================
+
+TRACKER_DATEFORMAT = "%Y-%m-%d"
+CACHE_FILE_EXT = ".html"
+MAX_DISK_CACHE_ENTRIES = 10000
+DISK_CACHE_PRUNE_EVERY = 100  # writes
+
+
+# =============================================================================
+# TrackerPlotSpec
+# =============================================================================
+
+
+@dataclass(eq=True, frozen=True)  # hashable
+class TrackerPlotSpec:
+    """
+    Everything needed to draw one tracker plot, as plain (picklable,
+    JSON-serializable) data.
+    """
+
+    x: Tuple[float, ...]  # matplotlib date numbers
+    datelabels: Tuple[str, ...]
+    values: Tuple[Optional[float], ...]
+    xlim: Optional[Tuple[float, float]]  # earliest/latest for the tracker
+    plot_label: Optional[str]
+    axis_label: Optional[str]
+    axis_min: Optional[float]
+    axis_max: Optional[float]
+    axis_ticks: Tuple[Tuple[float, str], ...]  # y, label
+    horizontal_lines: Tuple[float, ...]
+    horizontal_labels: Tuple[Tuple[float, str, str], ...]  # y, label, align
+    aspect_ratio: float
+    fontdict: Tuple[Tuple[str, Any], ...]
+    use_svg: bool
+    png_fallback: bool
+    dpi: int = PlotDefaults.DEFAULT_PLOT_DPI
+
+    @classmethod
+    def from_tracker_info(
+        cls,
+        req: "CamcopsRequest",
+        datetimes: Sequence["Pendulum"],
+        values: Sequence[Optional[float]],
+        specimen_tracker: "TrackerInfo",
+        earliest: Optional["Pendulum"] = None,
+        latest: Optional["Pendulum"] = None,
+    ) -> "TrackerPlotSpec":
+        """
+        Builds a spec.
+
+        Args:
+            req:
+                a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+                (for the font and output format)
+            datetimes:
+                when each value was recorded
+            values:
+                the values (``None`` for missing)
+            specimen_tracker:
+                a :class:`camcops_server.cc_modules.cc_trackerhelpers.TrackerInfo`
+                with the plot settings
+            earliest:
+                start of the whole tracker's time range (to line up the plots)
+            latest:
+                end of the whole tracker's time range
+        """  # noqa
+        if earliest is not None and latest is not None and earliest != latest:
+            xlim = tuple(
+                float(d) for d in matplotlib.dates.date2num((earliest, latest))
+            )
+        else:
+            xlim = None
+        t = specimen_tracker
+        return cls(
+            x=tuple(float(matplotlib.dates.date2num(d)) for d in datetimes),
+            datelabels=tuple(
+                d.strftime(TRACKER_DATEFORMAT) for d in datetimes
+            ),
+            values=tuple(None if v is None else float(v) for v in values),
+            xlim=xlim,
+            plot_label=t.plot_label,
+            axis_label=t.axis_label,
+            axis_min=None if t.axis_min is None else float(t.axis_min),
+            axis_max=None if t.axis_max is None else float(t.axis_max),
+            axis_ticks=tuple(
+                (float(tick.y), tick.label) for tick in t.axis_ticks or []
+            ),
+            horizontal_lines=tuple(float(y) for y in t.horizontal_lines or []),
+            horizontal_labels=tuple(
+                (float(lab.y), lab.label, lab.vertical_alignment.value)
+                for lab in t.horizontal_labels or []
+            ),
+            aspect_ratio=float(t.aspect_ratio),
+            fontdict=tuple(sorted(req.fontdict.items())),
+            use_svg=USE_SVG_IN_HTML and req.use_svg,
+            png_fallback=req.provide_png_fallback_for_svg,
+        )
+
+    @property
+    def cache_key(self) -> str:
+        """
+        A hash of everything that determines the plot (including the code
+        that draws it).
+        """
+        content = json.dumps(
+            [
+                CAMCOPS_SERVER_VERSION_STRING,
+                matplotlib.__version__,
+                asdict(self),
+            ],
+            sort_keys=True,
+        )
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+# =============================================================================
+# Rendering
+# =============================================================================
+
+
+def render_tracker_plot_html(spec: TrackerPlotSpec) -> str:
+    """
+    Draws a tracker plot, returning HTML (an SVG and/or PNG image), or an
+    empty string if there are no values to plot.
+    """
+    values = list(spec.values)
+    nonblank_values = [x for x in values if x is not None]
+    # NB DIFFERENT to list(filter(None, values)), which implements the
+    # test "if x", not "if x is not None" -- thus eliminating zero values!
+    # We don't want that.
+    if not nonblank_values:
+        return ""
+    fontdict = dict(spec.fontdict)
+
+    figsize = (
+        PlotDefaults.FULLWIDTH_PLOT_WIDTH,
+        (1.0 / spec.aspect_ratio) * PlotDefaults.FULLWIDTH_PLOT_WIDTH,
+    )
+    fig = Figure(figsize=figsize)
+    # noinspection PyUnusedLocal
+    canvas = FigureCanvas(fig)  # noqa: F841
+    ax = fig.add_subplot(MatplotlibConstants.WHOLE_PANEL)
+    x = list(spec.x)
+
+    # Plot lines and markers (on top of lines)
+    ax.plot(
+        x,  # x
+        values,  # y
+        color=MatplotlibConstants.COLOUR_BLUE,  # line colour
+        linestyle=MatplotlibConstants.LINESTYLE_SOLID,
+        marker=MatplotlibConstants.MARKER_PLUS,  # point shape
+        markeredgecolor=MatplotlibConstants.COLOUR_RED,  # point colour
+        markerfacecolor=MatplotlibConstants.COLOUR_RED,  # point colour
+        label=None,
+        zorder=PlotDefaults.ZORDER_DATA_LINES_POINTS,
+    )
+
+    # x axis
+    ax.set_xlabel("Date/time", fontdict=fontdict)
+    ax.set_xticks(x)
+    ax.set_xticklabels(list(spec.datelabels), fontdict=fontdict)
+    if spec.xlim is not None:
+        xlim = list(spec.xlim)
+        margin = (2.5 / 95.0) * (xlim[1] - xlim[0])
+        xlim[0] -= margin
+        xlim[1] += margin
+        ax.set_xlim(xlim)
+    xlim = ax.get_xlim()
+    fig.autofmt_xdate(rotation=90)
+    # ... autofmt_xdate must be BEFORE twinx:
+    # http://stackoverflow.com/questions/8332395
+    if spec.axis_ticks:
+        ax.set_yticks([y for y, _ in spec.axis_ticks])
+        ax.set_yticklabels(
+            [label for _, label in spec.axis_ticks], fontdict=fontdict
+        )
+
+    # y axis
+    ax.set_ylabel(spec.axis_label, fontdict=fontdict)
+    axis_min = (
+        min(spec.axis_min, min(nonblank_values))
+        if spec.axis_min is not None
+        else min(nonblank_values)
+    )
+    axis_max = (
+        max(spec.axis_max, max(nonblank_values))
+        if spec.axis_max is not None
+        else max(nonblank_values)
+    )
+    # ... the supplied values are stretched if the data are outside them
+    # ... but min(something, None) is None, so beware
+    # If we get something with no sense of scale whatsoever, then what
+    # we do is arbitrary. Matplotlib does its own thing, but we could do:
+    if axis_min == axis_max:
+        if axis_min == 0:
+            axis_min, axis_max = -1.0, 1.0
+        else:
+            singlevalue = axis_min
+            axis_min = 0.9 * singlevalue
+            axis_max = 1.1 * singlevalue
+            if axis_min > axis_max:
+                axis_min, axis_max = axis_max, axis_min
+    ax.set_ylim(axis_min, axis_max)
+
+    # title
+    ax.set_title(spec.plot_label, fontdict=fontdict)
+
+    # Horizontal lines
+    stupid_jitter = 0.001
+    for y in spec.horizontal_lines:
+        ax.plot(
+            xlim,  # x
+            [y, y + stupid_jitter],  # y
+            color=MatplotlibConstants.COLOUR_GREY_50,
+            linestyle=MatplotlibConstants.LINESTYLE_DOTTED,
+            zorder=PlotDefaults.ZORDER_PRESET_LINES,
+        )
+        # PROBLEM: horizontal lines becoming invisible
+        # (whether from ax.axhline or plot)
+
+    # Horizontal labels
+    label_left = xlim[0] + 0.01 * (xlim[1] - xlim[0])
+    for y, label, va in spec.horizontal_labels:
+        ax.text(
+            label_left,  # x
+            y,  # y
+            label,  # text
+            verticalalignment=va,
+            # alpha=0.5,
+            # ... was "0.5" rather than 0.5, which led to a
+            # tricky-to-find "TypeError: a float is required" exception
+            # after switching to Python 3.
+            # ... and switched to grey colour with zorder on 2020-06-28
+            # after wkhtmltopdf 0.12.5 had problems rendering
+            # opacity=0.5 with SVG lines
+            color=MatplotlibConstants.COLOUR_GREY_50,
+            fontdict=fontdict,
+            zorder=PlotDefaults.ZORDER_PRESET_LABELS,
+        )
+
+    # Tick label fonts (cf. CamcopsRequest.set_figure_font_sizes)
+    fp = FontProperties(**fontdict)
+    for axis in (ax.xaxis, ax.yaxis):
+        for ticklabel in axis.get_ticklabels(which="both"):
+            ticklabel.set_fontproperties(fp)
+
+    fig.tight_layout()
+    # ... stop the labels dropping off
+    # (only works properly for LEFT labels...)
+
+    # Output (cf. CamcopsRequest.get_html_from_pyplot_figure)
+    if spec.use_svg:
+        html = svg_html_from_pyplot_figure(fig)
+        if spec.png_fallback:
+            html += png_img_html_from_pyplot_figure(
+                fig, spec.dpi, "pngfallback"
+            )
+    else:
+        html = png_img_html_from_pyplot_figure(fig, spec.dpi)
+    return html + "<br>"
+    # ... extra line break for the PDF rendering
+
+
+# =============================================================================
+# Cache
+# =============================================================================
+
+
+class TrackerPlotCache(object):
+    """
+    Cache of rendered tracker plots (HTML), by
+    :attr:`TrackerPlotSpec.cache_key`. Thread-safe.
+
+    - In memory, we keep up to ``max_entries`` plots, evicting the least
+      recently used.
+    - On disk (optionally), we keep up to :data:`MAX_DISK_CACHE_ENTRIES`
+      plots in one file each, so they are shared by all processes and survive
+      restarts. A file's modification time records its last use.
+    """
+
+    def __init__(self, max_entries: int, directory: str = "") -> None:
+        """
+        Args:
+            max_entries:
+                maximum number of plots to hold in memory
+            directory:
+                directory for the on-disk tier, or blank for none
+        """
+        self.max_entries = max_entries
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # type: OrderedDict[str, str]
+        self._n_disk_writes = 0
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _filename(self, key: str) -> str:
+        return os.path.join(self.directory, key + CACHE_FILE_EXT)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the cached HTML for a key, or ``None``.
+        """
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                return html
+        if not self.directory:
+            return None
+        filename = self._filename(key)
+        try:
+            with open(filename, encoding="utf-8") as f:
+                html = f.read()
+            os.utime(filename)
+        except OSError:
+            return None
+        self._put_in_memory(key, html)
+        return html
+
+    def put(self, key: str, html: str) -> None:
+        """
+        Caches HTML under a key.
+        """
+        self._put_in_memory(key, html)
+        if self.directory:
+            self._put_on_disk(key, html)
+
+    def _put_in_memory(self, key: str, html: str) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _put_on_disk(self, key: str, html: str) -> None:
+        # Write atomically, so other processes never see part of a file.
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(html)
+            os.replace(tmpname, self._filename(key))
+        except OSError as e:
+            log.warning("Failed to cache tracker plot on disk: {}", e)
+            return
+        with self._lock:
+            self._n_disk_writes += 1
+            prune = self._n_disk_writes % DISK_CACHE_PRUNE_EVERY == 0
+        if prune:
+            self.prune_disk()
+
+    def prune_disk(self, max_entries: int = MAX_DISK_CACHE_ENTRIES) -> None:
+        """
+        Deletes the least recently used files from the on-disk tier, leaving
+        at most ``max_entries``.
+        """
+        if not self.directory:
+            return
+        files = []  # type: List[Tuple[float, str]]
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(CACHE_FILE_EXT):
+                try:
+                    files.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass  # deleted by another process
+        if len(files) <= max_entries:
+            return
+        files.sort()
+        for _, path in files[: len(files) - max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        """
+        Empties the in-memory tier.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = None  # type: Optional[TrackerPlotCache]
+_cache_lock = threading.Lock()
+
+
+def get_tracker_plot_cache(
+    max_entries: int, directory: str = ""
+) -> Optional[TrackerPlotCache]:
+    """
+    Returns the process's :class:`TrackerPlotCache`, creating it if necessary
+    (or if its settings have changed), or ``None`` if caching is off (no
+    memory entries and no directory).
+    """
+    global _cache
+    if max_entries <= 0 and not directory:
+        return None
+    with _cache_lock:
+        if (
+            _cache is None
+            or _cache.max_entries != max_entries
+            or _cache.directory != directory
+        ):
+            _cache = TrackerPlotCache(max_entries, directory)
+        return _cache
+
+
+# =============================================================================
+# Rendering many plots, via the cache and perhaps in parallel
+# =============================================================================
+
+_pool = None  # type: Optional[ProcessPoolExecutor]
+_pool_processes = 0
+_pool_pid = None  # type: Optional[int]
+_pool_lock = threading.Lock()
+
+
+def _get_pool(processes: int) -> ProcessPoolExecutor:
+    """
+    Returns this process's pool of renderer processes, creating it if
+    necessary. The workers are spawned (not forked), since we may be a
+    multithreaded web server process.
+    """
+    global _pool, _pool_processes, _pool_pid
+    with _pool_lock:
+        if (
+            _pool is None
+            or _pool_processes != processes
+            or _pool_pid != os.getpid()
+        ):
+            if _pool is not None and _pool_pid == os.getpid():
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _pool_processes = processes
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def shutdown_tracker_plot_pool() -> None:
+    """
+    Shuts down this process's pool of renderer processes, if there is one.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=True)
+        _pool = None
+
+
+def render_tracker_plots(
+    specs: Sequence[TrackerPlotSpec],
+    cache: Optional[TrackerPlotCache] = None,
+    processes: int = 0,
+) -> List[str]:
+    """
+    Renders tracker plots, using the cache if supplied.
+
+    Args:
+        specs:
+            the plots
+        cache:
+            optional :class:`TrackerPlotCache`
+        processes:
+            if more than 1 (and more than one plot needs drawing), draw them
+            in a pool of this many worker processes; otherwise, draw them
+            here
+
+    Returns:
+        HTML for each plot, in the same order as ``specs``
+    """
+    results = {}  # type: Dict[str, str]
+    to_render = OrderedDict()  # type: OrderedDict[str, TrackerPlotSpec]
+    keys = [spec.cache_key for spec in specs]
+    for key, spec in zip(keys, specs):
+        if key in results or key in to_render:
+            continue
+        html = cache.get(key) if cache is not None else None
+        if html is None:
+            to_render[key] = spec
+        else:
+            results[key] = html
+
+    if to_render:
+        log.debug(
+            "Rendering {} tracker plot(s) ({} cached)",
+            len(to_render),
+            len(results),
+        )
+        rendered = None  # type: Optional[List[str]]
+        if processes > 1 and len(to_render) > 1:
+            try:
+                rendered = list(
+                    _get_pool(processes).map(
+                        render_tracker_plot_html, to_render.values()
+                    )
+                )
+            except BrokenProcessPool as e:
+                log.warning(
+                    "Tracker plot processes failed ({}); plotting here", e
+                )
+                shutdown_tracker_plot_pool()
+        if rendered is None:
+            rendered = [
+                render_tracker_plot_html(spec) for spec in to_render.values()
+            ]
+        for key, html in zip(to_render.keys(), rendered):
+            results[key] = html
+            if cache is not None:
+                cache.put(key, html)
+
+    return [results[key] for key in keys]
@@ -53,13 +53,14 @@ from sqlalchemy.sql.schema import Column, ForeignKey
 from sqlalchemy.sql.sqltypes import Boolean, DateTime, Integer
 
 from camcops_server.cc_modules.cc_audit import audit
+from camcops_server.cc_modules.cc_cache import get_shared_cache
 from camcops_server.cc_modules.cc_constants import (
     MfaMethod,
     OBSCURE_EMAIL_ASTERISKS,
     OBSCURE_PHONE_ASTERISKS,
     USER_NAME_FOR_SYSTEM,
 )
-from camcops_server.cc_modules.cc_group import Group
+from camcops_server.cc_modules.cc_group import Group, get_group_visibility
 from camcops_server.cc_modules.cc_membership import UserGroupMembership
 from camcops_server.cc_modules.cc_sqla_coltypes import (
     Base32ColType,
@@ -997,6 +998,15 @@ class User(Base):
         #
         # Process as a set rather than a list, to eliminate duplicates:
         group_ids = set()  # type: Set[int]
+        dbsession = SqlASession.object_session(self)
+        if dbsession is not None and get_shared_cache(dbsession) is not None:
+            # One cached lookup, rather than loading our groups (and the
+            # groups they can see) from the database:
+            visibility = get_group_visibility(dbsession)
+            for m in self.user_group_memberships:
+                group_ids.add(m.group_id)
+                group_ids.update(visibility.get(m.group_id, ()))
+            return list(group_ids)
         for my_group in self.groups:  # type: Group
             group_ids.update(my_group.ids_of_groups_group_may_see())
         return list(group_ids)
@@ -25,12 +25,27 @@ camcops_server/cc_modules/cc_xml.py
 
 **XML helper functions/classes.**
 
+XML is written by :func:`gen_xml_tree`, which yields the document in pieces
+rather than building one large string, so that it can be streamed (e.g. to
+a file, or as an HTTP response body). BLOBs are base64-encoded piecewise as
+they are written.
+
 """
 
 import base64
+from collections.abc import Iterator as IteratorAbc
 import datetime
 import logging
-from typing import Any, List, Optional, TYPE_CHECKING, Union
+from typing import (
+    Any,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    TextIO,
+    TYPE_CHECKING,
+    Union,
+)
 import xml.sax.saxutils
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
@@ -75,6 +90,16 @@ XML_IGNORE_NAMESPACES = [
 # http://www.w3.org/TR/xmlschema-1/
 # http://www.w3.org/TR/2004/REC-xmlschema-2-20041028/datatypes.html
 
+# Same as xml.sax.saxutils.escape(), but in a single pass.
+XML_ESCAPE_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+
+# Bytes of binary data to base64-encode at a time. Must be a multiple of 3,
+# so that the encoded chunks can simply be concatenated.
+BASE64_CHUNK_SIZE = 3 * 16384
+
+# Size of chunks (in bytes, after encoding) for streamed XML documents.
+DEFAULT_XML_STREAM_CHUNK_SIZE = 65536
+
 
 class XmlDataTypes(object):
     """
@@ -144,6 +169,39 @@ class XmlLiteral(XmlElement):
         super().__init__(name="", literal=literal)
 
 
+class XmlBase64Value(object):
+    """
+    Represents binary data, to be written to XML as base64 text. The data is
+    encoded only when the XML is written, a chunk at a time.
+    """
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+    def __str__(self) -> str:
+        return base64.b64encode(self.data).decode("ascii")
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__}: {len(self.data)} bytes>"
+
+    def gen_base64(
+        self, chunk_size: int = BASE64_CHUNK_SIZE
+    ) -> Generator[str, None, None]:
+        """
+        Generates the base64 encoding of the data, in pieces.
+
+        Args:
+            chunk_size: number of bytes to encode at a time; must be a
+                multiple of 3
+        """
+        assert chunk_size % 3 == 0, "chunk_size must be a multiple of 3"
+        data = memoryview(self.data)
+        for start in range(0, len(data), chunk_size):
+            yield base64.b64encode(data[start : start + chunk_size]).decode(
+                "ascii"
+            )
+
+
 # =============================================================================
 # Some literals
 # =============================================================================
@@ -325,10 +383,8 @@ def get_xml_blob_element(
         comment: XML comment
     """
     if blobdata:
-        # blobdata is raw binary
-        b64bytes = base64.b64encode(blobdata)
-        b64str = b64bytes.decode("ascii")
-        value = b64str
+        # blobdata is raw binary; encoded when the XML is written
+        value = XmlBase64Value(blobdata)
     else:
         value = None
     return XmlElement(
@@ -346,7 +402,7 @@ def xml_escape_value(value: str) -> str:
     """
     # http://stackoverflow.com/questions/1091945/
     # https://wiki.python.org/moin/EscapingXml
-    return xml.sax.saxutils.escape(value)
+    return value.translate(XML_ESCAPE_TABLE)
 
 
 def xml_quote_attribute(attr: str) -> str:
@@ -358,18 +414,22 @@ def xml_quote_attribute(attr: str) -> str:
     return xml.sax.saxutils.quoteattr(attr)
 
 
-def get_xml_tree(
+def gen_xml_tree(
     element: Union[
-        XmlElement, XmlSimpleValue, List[Union[XmlElement, XmlSimpleValue]]
+        XmlElement,
+        XmlSimpleValue,
+        List[Union[XmlElement, XmlSimpleValue]],
+        Iterable[XmlElement],
     ],
     level: int = 0,
     indent_spaces: int = 4,
     eol: str = "\n",
     include_comments: bool = False,
-) -> str:
+) -> Generator[str, None, None]:
     # noinspection HttpUrlsUsage
     """
-    Returns an :class:`camcops_server.cc_modules.cc_xml.XmlElement` as text.
+    Generates an :class:`camcops_server.cc_modules.cc_xml.XmlElement` as
+    text, in pieces.
 
     Args:
         element: root :class:`camcops_server.cc_modules.cc_xml.XmlElement`
@@ -378,6 +438,9 @@ def get_xml_tree(
         eol: end-of-line string
         include_comments: include comments describing each field?
 
+    The value of an element may be a list of elements, or any other iterator
+    of them (e.g. a generator), which is consumed as it is written.
+
     We will represent NULL values with ``xsi:nil``, but this requires a
     namespace:
 
@@ -400,14 +463,13 @@ def get_xml_tree(
       too).
 
     """  # noqa
-    xmltext = ""
     prefix = " " * level * indent_spaces
 
     if isinstance(element, XmlElement):
 
         if element.literal:
             # A user-inserted piece of XML. Insert, but indent.
-            xmltext += prefix + element.literal + eol
+            yield prefix + element.literal + eol
 
         else:
 
@@ -430,41 +492,33 @@ def get_xml_tree(
             attributes = f"{namespace}{dt}{cmt}"
 
             # Assemble
-            if element.value is None:
+            value = element.value
+            if value is None:
                 # NULL handling
-                xmltext += (
+                yield (
                     f"{prefix}<{element.name}{attributes} "
                     f'xsi:nil="true"/>{eol}'
                 )
-            else:
-                complex_value = isinstance(
-                    element.value, XmlElement
-                ) or isinstance(element.value, list)
-                value_to_recurse = (
-                    element.value
-                    if complex_value
-                    else XmlSimpleValue(element.value)
-                )
-                # ... XmlSimpleValue is a marker that subsequently
-                # distinguishes things that were part of an XmlElement from
-                # user-inserted raw XML.
-                nl = eol if complex_value else ""
-                pr2 = prefix if complex_value else ""
-                v = get_xml_tree(
-                    value_to_recurse,
+            elif isinstance(value, (XmlElement, list, IteratorAbc)):
+                yield f"{prefix}<{element.name}{attributes}>{eol}"
+                yield from gen_xml_tree(
+                    value,
                     level=level + 1,
                     indent_spaces=indent_spaces,
                     eol=eol,
                     include_comments=include_comments,
                 )
-                xmltext += (
-                    f"{prefix}<{element.name}{attributes}>{nl}"
-                    f"{v}{pr2}</{element.name}>{eol}"
-                )
+                yield f"{prefix}</{element.name}>{eol}"
+            else:
+                yield f"{prefix}<{element.name}{attributes}>"
+                # XmlSimpleValue is a marker that distinguishes things that
+                # were part of an XmlElement from user-inserted raw XML.
+                yield from gen_xml_tree(XmlSimpleValue(value))
+                yield f"</{element.name}>{eol}"
 
-    elif isinstance(element, list):
+    elif isinstance(element, (list, IteratorAbc)):
         for subelement in element:
-            xmltext += get_xml_tree(
+            yield from gen_xml_tree(
                 subelement,
                 level,
                 indent_spaces=indent_spaces,
@@ -475,22 +529,49 @@ def get_xml_tree(
 
     elif isinstance(element, XmlSimpleValue):
         # The lowest-level thing a value. No extra indent.
-        xmltext += xml_escape_value(str(element.value))
+        value = element.value
+        if isinstance(value, XmlBase64Value):
+            # Base64 needs no escaping.
+            yield from value.gen_base64()
+        else:
+            yield xml_escape_value(str(value))
 
     else:
         raise ValueError(f"Bad value to get_xml_tree: {element!r}")
 
-    return xmltext
 
+def get_xml_tree(
+    element: Union[
+        XmlElement, XmlSimpleValue, List[Union[XmlElement, XmlSimpleValue]]
+    ],
+    level: int = 0,
+    indent_spaces: int = 4,
+    eol: str = "\n",
+    include_comments: bool = False,
+) -> str:
+    """
+    Returns an :class:`camcops_server.cc_modules.cc_xml.XmlElement` as text.
+    See :func:`gen_xml_tree` for arguments.
+    """
+    return "".join(
+        gen_xml_tree(
+            element,
+            level=level,
+            indent_spaces=indent_spaces,
+            eol=eol,
+            include_comments=include_comments,
+        )
+    )
 
-def get_xml_document(
+
+def gen_xml_document(
     root: XmlElement,
     indent_spaces: int = 4,
     eol: str = "\n",
     include_comments: bool = False,
-) -> str:
+) -> Generator[str, None, None]:
     """
-    Returns an entire XML document as text, given the root
+    Generates an entire XML document as text, in pieces, given the root
     :class:`camcops_server.cc_modules.cc_xml.XmlElement`.
 
     Args:
@@ -504,9 +585,74 @@ def get_xml_document(
             "get_xml_document: root not an XmlElement; "
             "XML requires a single root"
         )
-    return xml_header(eol) + get_xml_tree(
+    yield xml_header(eol)
+    yield from gen_xml_tree(
         root,
         indent_spaces=indent_spaces,
         eol=eol,
         include_comments=include_comments,
     )
+
+
+def get_xml_document(
+    root: XmlElement,
+    indent_spaces: int = 4,
+    eol: str = "\n",
+    include_comments: bool = False,
+) -> str:
+    """
+    Returns an entire XML document as text, given the root
+    :class:`camcops_server.cc_modules.cc_xml.XmlElement`. See
+    :func:`gen_xml_document` for arguments.
+    """
+    return "".join(
+        gen_xml_document(
+            root,
+            indent_spaces=indent_spaces,
+            eol=eol,
+            include_comments=include_comments,
+        )
+    )
+
+
+def write_xml_document(
+    f: TextIO,
+    root: XmlElement,
+    indent_spaces: int = 4,
+    eol: str = "\n",
+    include_comments: bool = False,
+) -> None:
+    """
+    Writes an entire XML document to a text file-like object, without
+    holding it all in memory. See :func:`gen_xml_document` for arguments.
+    """
+    for piece in gen_xml_document(
+        root,
+        indent_spaces=indent_spaces,
+        eol=eol,
+        include_comments=include_comments,
+    ):
+        f.write(piece)
+
+
+def gen_utf8_chunks(
+    pieces: Iterable[str], chunk_size: int = DEFAULT_XML_STREAM_CHUNK_SIZE
+) -> Generator[bytes, None, None]:
+    """
+    Encodes text pieces (e.g. from :func:`gen_xml_document`) as UTF-8, and
+    regroups them into chunks of at least (approximately) ``chunk_size``
+    bytes, suitable for a streamed HTTP response body (such as a WSGI
+    ``app_iter``).
+    """
+    buffer = []  # type: List[bytes]
+    size = 0
+    for piece in pieces:
+        encoded = piece.encode("utf-8")
+        buffer.append(encoded)
+        size += len(encoded)
+        if size >= chunk_size:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b"".join(buffer)
@@ -116,6 +116,7 @@ from typing import Any, Dict, TYPE_CHECKING
 from cardinal_pythonlib.json.serialize import json_encode, json_decode
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from celery import Celery, current_task
+from celery.signals import worker_process_shutdown, worker_shutdown
 from kombu.serialization import register
 
 # TODO: Investigate
@@ -365,6 +366,25 @@ def purge_jobs() -> None:
     log.info("... purged.")
 
 
+# =============================================================================
+# Worker shutdown
+# =============================================================================
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_connections_at_shutdown(**kwargs: Any) -> None:
+    """
+    When a worker (process) shuts down, close the network connections that
+    it has kept open for reuse.
+    """
+    from camcops_server.cc_modules.cc_hl7 import (
+        close_mllp_connection_pools,
+    )  # delayed import
+
+    close_mllp_connection_pools()
+
+
 # =============================================================================
 # Note re request creation and context manager
 # =============================================================================
@@ -430,6 +450,47 @@ def export_task_backend(
             export_task(req, recipient, task)
 
 
+@celery_app.task(
+    bind=True,
+    ignore_result=True,
+    max_retries=MAX_RETRIES,
+    soft_time_limit=CELERY_SOFT_TIME_LIMIT_SEC,
+)
+def export_database_task_class_backend(
+    self: "CeleryTask",
+    recipient_name: str,
+    basetable: str,
+    via_index: bool = True,
+) -> None:
+    """
+    Exports all tasks of one class to a database recipient, as part of a
+    whole-database export. Several of these may run in parallel. If retried,
+    it resumes where it left off.
+
+    - Calls
+      :func:`camcops_server.cc_modules.cc_export.export_whole_database_task_class`.
+
+    Args:
+        self: the Celery task, :class:`celery.app.task.Task`
+        recipient_name: export recipient name (as per the config file)
+        basetable: name of the task's base table
+        via_index: use the task index (faster)?
+    """
+    from camcops_server.cc_modules.cc_export import (
+        export_whole_database_task_class,
+    )  # delayed import
+    from camcops_server.cc_modules.cc_request import (
+        command_line_request_context,
+    )  # delayed import
+
+    with retry_backoff_if_raises(self):
+        with command_line_request_context() as req:
+            recipient = req.get_export_recipient(recipient_name)
+            export_whole_database_task_class(
+                req, recipient, basetable, via_index=via_index
+            )
+
+
 @celery_app.task(
     bind=True,
     ignore_result=True,
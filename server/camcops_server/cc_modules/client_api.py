@@ -355,6 +355,7 @@ from cardinal_pythonlib.datetimefunc import (
     format_datetime,
 )
 from cardinal_pythonlib.httpconst import HttpMethod
+from cardinal_pythonlib.lists import chunks
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.pyramid.responses import TextResponse
 from cardinal_pythonlib.sqlalchemy.core_query import (
@@ -370,7 +371,14 @@ from semantic_version import Version
 from sqlalchemy.engine import CursorResult
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload
-from sqlalchemy.sql.expression import exists, select, update
+from sqlalchemy.sql.expression import (
+    and_,
+    bindparam,
+    exists,
+    func,
+    select,
+    update,
+)
 from sqlalchemy.sql.schema import Table
 
 from camcops_server.cc_modules import cc_audit  # avoids "audit" name clash
@@ -382,6 +390,7 @@ from camcops_server.cc_modules.cc_client_api_core import (
     BatchDetails,
     exception_description,
     ExtraStringFieldNames,
+    ExtraStringsReplyType,
     fail_server_error,
     fail_unsupported_operation,
     fail_user_error,
@@ -389,6 +398,7 @@ from camcops_server.cc_modules.cc_client_api_core import (
     require_keys,
     ServerErrorException,
     ServerRecord,
+    ServerRecordIndex,
     TabletParam,
     UploadRecordResult,
     UploadTableChanges,
@@ -461,15 +471,23 @@ from camcops_server.cc_modules.cc_simpleobjects import (
     IdNumReference,
 )
 from camcops_server.cc_modules.cc_specialnote import SpecialNote
+from camcops_server.cc_modules.cc_sqlalchemy import get_max_bind_params
+from camcops_server.cc_modules.cc_string import (
+    all_extra_string_hashes,
+    all_extra_strings_as_dicts,
+    get_extra_string_hashes_for_version,
+)
 from camcops_server.cc_modules.cc_task import (
     all_task_tables_with_min_client_version,
 )
 from camcops_server.cc_modules.cc_taskindex import (
     update_indexes_and_push_exports,
 )
+from camcops_server.cc_modules.cc_taskschedule import ScheduledTaskResolver
 from camcops_server.cc_modules.cc_user import User
 from camcops_server.cc_modules.cc_validators import (
     STRING_VALIDATOR_TYPE,
+    validate_alphanum_underscore,
     validate_anything,
     validate_email,
 )
@@ -497,6 +515,8 @@ FAILURE_CODE = "0"
 
 DEBUG_UPLOAD = False
 
+UPLOAD_BATCH_SIZE = 1000  # maximum number of rows per bulk INSERT
+
 
 # =============================================================================
 # Quasi-constants
@@ -1238,6 +1258,64 @@ def get_all_predecessor_pks(
     return sorted(pks)
 
 
+def get_all_predecessor_pks_multiple(
+    req: "CamcopsRequest",
+    table: Table,
+    last_pks: Iterable[int],
+    include_last: bool = True,
+) -> Dict[int, List[int]]:
+    """
+    Retrieves the PKs of all records that are predecessors of each of the
+    specified ones. Equivalent to calling :func:`get_all_predecessor_pks` for
+    each, but uses one query per "generation" of predecessors (with chunked
+    ``IN`` clauses), rather than one query per record per generation.
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        table: an SQLAlchemy :class:`Table`
+        last_pks: the PKs to start with, and work backwards
+        include_last: include each of ``last_pks`` in its own list
+
+    Returns:
+        dict: mapping each of ``last_pks`` to a sorted list of PKs
+    """
+    dbsession = req.dbsession
+    pkcol = table.c[FN_PK]
+    chunksize = get_max_bind_params(dbsession.get_bind().dialect.name)
+    last_pks = list(last_pks)
+    predecessor_of = {}  # type: Dict[int, Optional[int]]
+    frontier = set(last_pks)
+    while frontier:
+        next_frontier = set()  # type: Set[int]
+        for pkchunk in chunks(list(frontier), chunksize):
+            rows = dbsession.execute(
+                select([pkcol, table.c[FN_PREDECESSOR_PK]]).where(
+                    pkcol.in_(pkchunk)
+                )
+            )
+            for pk, predecessor_pk in rows:
+                predecessor_of[pk] = predecessor_pk
+                if (
+                    predecessor_pk is not None
+                    and predecessor_pk not in predecessor_of
+                ):
+                    next_frontier.add(predecessor_pk)
+        for pk in frontier:
+            predecessor_of.setdefault(pk, None)  # e.g. nonexistent
+        frontier = next_frontier
+    result = {}  # type: Dict[int, List[int]]
+    for last_pk in last_pks:
+        pks = [last_pk] if include_last else []
+        seen = {last_pk}
+        current_pk = predecessor_of.get(last_pk)
+        while current_pk is not None and current_pk not in seen:
+            pks.append(current_pk)
+            seen.add(current_pk)
+            current_pk = predecessor_of.get(current_pk)
+        result[last_pk] = sorted(pks)
+    return result
+
+
 # =============================================================================
 # Record modification functions
 # =============================================================================
@@ -1346,6 +1424,52 @@ def flag_modified(
         )
 
 
+def flag_multiple_modified(
+    req: "CamcopsRequest",
+    batchdetails: BatchDetails,
+    table: Table,
+    successor_pks: Dict[int, int],
+) -> None:
+    """
+    Marks multiple records as old, storing their successors' details. Like
+    :func:`flag_modified`, but for many records at once, using a single
+    "executemany" call.
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        batchdetails: the :class:`BatchDetails`
+        table: SQLAlchemy :class:`Table`
+        successor_pks: dictionary mapping the server PK of each record to
+            mark as old to the server PK of its successor
+    """
+    if not successor_pks:
+        return
+    # Bind parameter names must not clash with column names.
+    b_pk = "b_old_pk"
+    b_successor_pk = "b_successor_pk"
+    if batchdetails.onestep:
+        values = {
+            FN_CURRENT: 0,
+            FN_REMOVAL_PENDING: 0,
+            FN_SUCCESSOR_PK: bindparam(b_successor_pk),
+            FN_REMOVING_USER_ID: req.user_id,
+            FN_WHEN_REMOVED_EXACT: req.now,
+            FN_WHEN_REMOVED_BATCH_UTC: batchdetails.batchtime,
+        }
+    else:
+        values = {
+            FN_REMOVAL_PENDING: 1,
+            FN_SUCCESSOR_PK: bindparam(b_successor_pk),
+        }
+    req.dbsession.execute(
+        update(table).where(table.c[FN_PK] == bindparam(b_pk)).values(values),
+        [
+            {b_pk: pk, b_successor_pk: successor_pk}
+            for pk, successor_pk in successor_pks.items()
+        ],
+    )
+
+
 def flag_multiple_records_for_preservation(
     req: "CamcopsRequest",
     batchdetails: BatchDetails,
@@ -1422,6 +1546,39 @@ def flag_record_for_preservation(
     return pks_to_preserve
 
 
+def flag_records_for_preservation(
+    req: "CamcopsRequest",
+    batchdetails: BatchDetails,
+    table: Table,
+    pks: Iterable[int],
+) -> Dict[int, List[int]]:
+    """
+    Marks several records for preservation, including their predecessor
+    chains. Like :func:`flag_record_for_preservation`, but for many records
+    at once, using set-based queries.
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        batchdetails: the :class:`BatchDetails`
+        table: SQLAlchemy :class:`Table`
+        pks: server PKs of the records to mark
+
+    Returns:
+        dict: mapping each of ``pks`` to the list of PKs being preserved
+        because of it
+    """
+    chains = get_all_predecessor_pks_multiple(req, table, pks)
+    if not chains:
+        return chains
+    all_pks = sorted(set(pk for chain in chains.values() for pk in chain))
+    chunksize = get_max_bind_params(req.dbsession.get_bind().dialect.name)
+    for pkchunk in chunks(all_pks, chunksize):
+        flag_multiple_records_for_preservation(
+            req, batchdetails, table, pkchunk
+        )
+    return chains
+
+
 def preserve_all(
     req: "CamcopsRequest", batchdetails: BatchDetails, table: Table
 ) -> None:
@@ -1553,7 +1710,8 @@ def upload_record_core(
     table: Table,
     clientpk_name: str,
     valuedict: Dict[str, Any],
-    server_live_current_records: List[ServerRecord] = None,
+    server_record_index: ServerRecordIndex = None,
+    batch_writer: "UploadBatchWriter" = None,
 ) -> UploadRecordResult:
     """
     Uploads a record. Deals with IDENTICAL, NEW, and MODIFIED records.
@@ -1566,8 +1724,16 @@ def upload_record_core(
         table: an SQLAlchemy :class:`Table`
         clientpk_name: the column name of the client's PK
         valuedict: a dictionary of {colname: value} pairs from the client
-        server_live_current_records: list of :class:`ServerRecord` objects for
-            the active records on the server for this client, in this table
+        server_record_index: optional :class:`ServerRecordIndex` of the
+            active records on the server for this client, in this table. If
+            supplied, it is assumed to be complete (so we don't query the
+            database for this record), and existing records that are matched
+            are noted in it, for deletion handling by the caller.
+        batch_writer: optional :class:`UploadBatchWriter` for this table. If
+            supplied, database writes are queued in it rather than being
+            performed immediately, and the result is incomplete (lacking
+            ``newserverpk``, and details of preservation) until the caller
+            calls its :meth:`UploadBatchWriter.flush` method.
 
     Returns:
         a :class:`UploadRecordResult` object
@@ -1577,18 +1743,11 @@ def upload_record_core(
     )
     clientpk_value = valuedict[clientpk_name]
 
-    if server_live_current_records:
+    if server_record_index is not None:
         # All server records for this table/device/era have been prefetched.
-        serverrec = next(
-            (
-                r
-                for r in server_live_current_records
-                if r.client_pk == clientpk_value
-            ),
-            None,
-        )
-        if serverrec is None:
-            serverrec = ServerRecord(clientpk_value, False)
+        serverrec = server_record_index.get(clientpk_value)
+        if serverrec.exists:
+            server_record_index.note_uploaded(serverrec.server_pk)
     else:
         # Look up this record specifically.
         serverrec = record_exists(req, table, clientpk_name, clientpk_value)
@@ -1616,6 +1775,9 @@ def upload_record_core(
             # The existing record is different. We need a logical UPDATE, but
             # maintaining an audit trail.
             process_upload_record_special(req, batchdetails, table, valuedict)
+            if batch_writer is not None:
+                batch_writer.add_insert(valuedict, urr)
+                return urr
             urr.newserverpk = insert_record(
                 req, batchdetails, table, valuedict, oldserverpk
             )
@@ -1625,10 +1787,16 @@ def upload_record_core(
     else:
         # The record is NEW. We need to INSERT it.
         process_upload_record_special(req, batchdetails, table, valuedict)
+        if batch_writer is not None:
+            batch_writer.add_insert(valuedict, urr)
+            return urr
         urr.newserverpk = insert_record(
             req, batchdetails, table, valuedict, None
         )
     if urr.specifically_marked_for_preservation:
+        if batch_writer is not None:
+            batch_writer.add_preservation(urr)
+            return urr
         preservation_pks = flag_record_for_preservation(
             req, batchdetails, table, urr.latest_pk
         )
@@ -1639,25 +1807,22 @@ def upload_record_core(
     return urr
 
 
-def insert_record(
+def add_server_fields_for_insert(
     req: "CamcopsRequest",
     batchdetails: BatchDetails,
-    table: Table,
     valuedict: Dict[str, Any],
     predecessor_pk: Optional[int],
-) -> int:
+) -> None:
     """
-    Inserts a record, or raises an exception if that fails.
+    Adds server-side fields (device, era, flags, etc.) to a record that is
+    about to be inserted.
 
     Args:
         req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
         batchdetails: the :class:`BatchDetails`
-        table: an SQLAlchemy :class:`Table`
-        valuedict: a dictionary of {colname: value} pairs from the client
+        valuedict: a dictionary of {colname: value} pairs from the client;
+            will be modified
         predecessor_pk: an optional server PK of the record's predecessor
-
-    Returns:
-        the server PK of the new record
     """
     ts = req.tabletsession
     valuedict.update(
@@ -1682,6 +1847,29 @@ def insert_record(
         )
     else:
         valuedict.update({FN_CURRENT: 0, FN_ADDITION_PENDING: 1})
+
+
+def insert_record(
+    req: "CamcopsRequest",
+    batchdetails: BatchDetails,
+    table: Table,
+    valuedict: Dict[str, Any],
+    predecessor_pk: Optional[int],
+) -> int:
+    """
+    Inserts a record, or raises an exception if that fails.
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        batchdetails: the :class:`BatchDetails`
+        table: an SQLAlchemy :class:`Table`
+        valuedict: a dictionary of {colname: value} pairs from the client
+        predecessor_pk: an optional server PK of the record's predecessor
+
+    Returns:
+        the server PK of the new record
+    """
+    add_server_fields_for_insert(req, batchdetails, valuedict, predecessor_pk)
     rp = req.dbsession.execute(
         table.insert().values(valuedict)
     )  # type: CursorResult
@@ -1706,6 +1894,238 @@ def insert_record(
     return rp.inserted_primary_key[0]
 
 
+# =============================================================================
+# Batched writes
+# =============================================================================
+
+
+class UploadBatchWriter(object):
+    """
+    Accumulates the writes needed to upload many records to one table, and
+    performs them in bulk: new rows are inserted with multi-row INSERT
+    statements, superseded records are flagged with a single "executemany"
+    UPDATE, and predecessor chains for records being preserved are resolved
+    level by level rather than record by record.
+
+    Use it via :func:`upload_record_core` (``batch_writer`` parameter), and
+    call :meth:`flush` before using any :class:`UploadRecordResult` objects,
+    whose ``newserverpk`` attributes are only filled in then.
+
+    Where the database can return the PKs of multi-row inserts directly
+    (PostgreSQL via ``RETURNING``; SQL Server via ``OUTPUT``), we use that.
+    Otherwise (MySQL, SQLite), we insert with an "executemany" call, and then
+    fetch the new server PKs by client PK: the new rows are the only records
+    with our device ID, the current era, and a PK beyond the previous maximum.
+    """
+
+    def __init__(
+        self,
+        req: "CamcopsRequest",
+        batchdetails: BatchDetails,
+        table: Table,
+        clientpk_name: str,
+        batch_size: int = UPLOAD_BATCH_SIZE,
+    ) -> None:
+        """
+        Args:
+            req:
+                the
+                :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+            batchdetails:
+                the :class:`BatchDetails`
+            table:
+                an SQLAlchemy :class:`Table`
+            clientpk_name:
+                the column name of the client's PK
+            batch_size:
+                the maximum number of records to hold before writing them
+        """
+        self.req = req
+        self.batchdetails = batchdetails
+        self.table = table
+        self.clientpk_name = clientpk_name
+        self.batch_size = batch_size
+        self.dialect = req.dbsession.get_bind().dialect
+        self.max_bind_params = get_max_bind_params(self.dialect.name)
+        # Pending inserts, as (valuedict, urr) tuples
+        self._inserts = (
+            []
+        )  # type: List[Tuple[Dict[str, Any], UploadRecordResult]]  # noqa
+        self._pending_client_pks = set()  # type: Set[Any]
+        # Existing records specifically marked for preservation
+        self._preserve_only = []  # type: List[UploadRecordResult]
+
+    def __len__(self) -> int:
+        """
+        The number of records awaiting a write.
+        """
+        return len(self._inserts) + len(self._preserve_only)
+
+    def add_insert(
+        self,
+        valuedict: Dict[str, Any],
+        urr: UploadRecordResult,
+    ) -> None:
+        """
+        Queues a new record (or a new version of a modified record) for
+        insertion. If ``urr.oldserverpk`` is set, that record will be marked
+        as superseded by the new one.
+
+        Args:
+            valuedict: a dictionary of {colname: value} pairs from the client
+            urr: the :class:`UploadRecordResult` to complete
+        """
+        clientpk_value = valuedict[self.clientpk_name]
+        if clientpk_value in self._pending_client_pks:
+            # The client has sent the same record twice. We can only map new
+            # server PKs back to records by client PK, so write what we have
+            # first. (This also preserves the order of the two writes.)
+            self.flush()
+        add_server_fields_for_insert(
+            self.req, self.batchdetails, valuedict, urr.oldserverpk
+        )
+        self._inserts.append((valuedict, urr))
+        self._pending_client_pks.add(clientpk_value)
+        if len(self) >= self.batch_size:
+            self.flush()
+
+    def add_preservation(self, urr: UploadRecordResult) -> None:
+        """
+        Queues an existing, unmodified record for preservation.
+
+        Args:
+            urr: the :class:`UploadRecordResult`
+        """
+        self._preserve_only.append(urr)
+        if len(self) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Performs all pending writes, and completes the corresponding
+        :class:`UploadRecordResult` objects.
+        """
+        inserts = self._inserts
+        preserve_only = self._preserve_only
+        self._inserts = []
+        self._pending_client_pks = set()
+        self._preserve_only = []
+
+        # 1. INSERT new rows.
+        urrs_by_keys = (
+            {}
+        )  # type: Dict[Tuple[str, ...], List[Tuple[Dict[str, Any], UploadRecordResult]]]  # noqa
+        for valuedict, urr in inserts:
+            # All rows in one "executemany" call must have the same columns.
+            keys = tuple(sorted(valuedict.keys()))
+            urrs_by_keys.setdefault(keys, []).append((valuedict, urr))
+        for keys, items in urrs_by_keys.items():
+            valuedicts = [valuedict for valuedict, _ in items]
+            new_pks = self._insert_rows(keys, valuedicts)
+            for valuedict, urr in items:
+                urr.newserverpk = new_pks[valuedict[self.clientpk_name]]
+
+        # 2. Mark superseded records as modified.
+        flag_multiple_modified(
+            self.req,
+            self.batchdetails,
+            self.table,
+            {
+                urr.oldserverpk: urr.newserverpk
+                for _, urr in inserts
+                if urr.oldserverpk is not None
+            },
+        )
+
+        # 3. Preserve records (and their predecessors), if asked.
+        to_preserve = [
+            urr
+            for urr in [urr for _, urr in inserts] + preserve_only
+            if urr.specifically_marked_for_preservation
+        ]
+        if to_preserve:
+            chains = flag_records_for_preservation(
+                self.req,
+                self.batchdetails,
+                self.table,
+                [urr.latest_pk for urr in to_preserve],
+            )
+            for urr in to_preserve:
+                urr.note_specifically_marked_preservation_pks(
+                    chains[urr.latest_pk]
+                )
+
+    def _insert_rows(
+        self, keys: Sequence[str], valuedicts: List[Dict[str, Any]]
+    ) -> Dict[Any, int]:
+        """
+        Inserts rows that all have the same columns, and unique client PKs.
+
+        Args:
+            keys: the column names
+            valuedicts: the rows, as dictionaries
+
+        Returns:
+            dict: mapping client PK to new server PK
+        """
+        if len(valuedicts) == 1:
+            valuedict = valuedicts[0]
+            rp = self.req.dbsession.execute(
+                self.table.insert().values(valuedict)
+            )  # type: CursorResult
+            return {valuedict[self.clientpk_name]: rp.inserted_primary_key[0]}
+
+        dbsession = self.req.dbsession
+        table = self.table
+        pkcol = table.c[FN_PK]
+        clientpkcol = table.c[self.clientpk_name]
+        new_pks = {}  # type: Dict[Any, int]
+
+        if self.dialect.insert_executemany_returning:
+            # e.g. PostgreSQL/psycopg2: "executemany" with RETURNING.
+            rows = dbsession.execute(
+                table.insert().returning(pkcol, clientpkcol), valuedicts
+            )
+            new_pks.update((clientpk, pk) for pk, clientpk in rows)
+            return new_pks
+
+        if self.dialect.full_returning:
+            # e.g. SQL Server: multi-VALUES INSERT with OUTPUT. These are
+            # limited by the number of bind parameters per statement.
+            rows_per_statement = max(1, self.max_bind_params // len(keys))
+            for chunk in chunks(valuedicts, rows_per_statement):
+                rows = dbsession.execute(
+                    table.insert().values(chunk).returning(pkcol, clientpkcol)
+                )
+                new_pks.update((clientpk, pk) for pk, clientpk in rows)
+            return new_pks
+
+        # e.g. MySQL, SQLite: "executemany" INSERT (which drivers such as
+        # mysqlclient rewrite into multi-row INSERT statements), then look up
+        # the new PKs.
+        high_water_pk = dbsession.execute(
+            select([func.max(pkcol)])
+        ).scalar()  # type: Optional[int]
+        dbsession.execute(table.insert(), valuedicts)
+        client_pks = [
+            valuedict[self.clientpk_name] for valuedict in valuedicts
+        ]
+        for clientpk_chunk in chunks(client_pks, self.max_bind_params - 3):
+            query = select([pkcol, clientpkcol]).where(
+                and_(
+                    table.c[FN_DEVICE_ID] == self.req.tabletsession.device_id,
+                    table.c[FN_ERA] == ERA_NOW,
+                    clientpkcol.in_(clientpk_chunk),
+                )
+            )
+            if high_water_pk is not None:
+                query = query.where(pkcol > high_water_pk)
+            new_pks.update(
+                (clientpk, pk) for pk, clientpk in dbsession.execute(query)
+            )
+        return new_pks
+
+
 def audit_upload(
     req: "CamcopsRequest", changes: List[UploadTableChanges]
 ) -> None:
@@ -2260,38 +2680,39 @@ def process_table_for_onestep_upload(
         clientpk_name,
         current_only=False,
     )
-    servercurrentrecs = [r for r in serverrecs if r.current]
+    current_index = ServerRecordIndex(r for r in serverrecs if r.current)
     if rows and not clientpk_name:
         fail_user_error(
             f"Client-side PK name not specified by client for "
             f"non-empty table {table.name!r}"
         )
     tablechanges = UploadTableChanges(table)
-    server_pks_uploaded = []  # type: List[int]
+    batch_writer = UploadBatchWriter(req, batchdetails, table, clientpk_name)
+    urrs = []  # type: List[UploadRecordResult]
     for row in rows:
         valuedict = {k: decode_single_value(v) for k, v in row.items()}
-        urr = upload_record_core(
-            req,
-            batchdetails,
-            table,
-            clientpk_name,
-            valuedict,
-            server_live_current_records=servercurrentrecs,
+        urrs.append(
+            upload_record_core(
+                req,
+                batchdetails,
+                table,
+                clientpk_name,
+                valuedict,
+                server_record_index=current_index,
+                batch_writer=batch_writer,
+            )
         )
-        # ... handles addition, modification, preservation, special processing
-        # But we also make a note of these for indexing:
-        if urr.oldserverpk is not None:
-            server_pks_uploaded.append(urr.oldserverpk)
+    batch_writer.flush()
+    # ... handles addition, modification, preservation, special processing
+    # (and notes existing records in current_index). But we also make a
+    # note of these for indexing:
+    for urr in urrs:
         tablechanges.note_urr(
             urr, preserving_new_records=batchdetails.preserving
         )
     # Which leaves:
     # (*) Deletion (where no record was uploaded at all)
-    server_pks_for_deletion = [
-        r.server_pk
-        for r in servercurrentrecs
-        if r.server_pk not in server_pks_uploaded
-    ]
+    server_pks_for_deletion = current_index.server_pks_not_uploaded()
     if server_pks_for_deletion:
         flag_deleted(req, batchdetails, table, server_pks_for_deletion)
         tablechanges.note_removal_deleted_pks(server_pks_for_deletion)
@@ -2545,9 +2966,17 @@ def get_task_schedules(req: "CamcopsRequest", patient: Patient) -> str:
             pts.start_datetime = req.now_utc.replace(second=0, microsecond=0)
             dbsession.add(pts)
 
+    # Find the tasks for all schedules at once.
+    resolver = ScheduledTaskResolver.for_patient_task_schedules(
+        req, patient.task_schedules
+    )
+
+    for pts in patient.task_schedules:
         items = []
 
-        for task_info in pts.get_list_of_scheduled_tasks(req):
+        for task_info in pts.get_list_of_scheduled_tasks(
+            req, resolver=resolver
+        ):
             due_from = task_info.start_datetime.to_iso8601_string()
             due_by = task_info.end_datetime.to_iso8601_string()
 
@@ -2703,23 +3132,112 @@ def op_register_device(req: "CamcopsRequest") -> Dict[str, Any]:
     return get_server_id_info(req)
 
 
+def get_extra_strings_changes(
+    req: "CamcopsRequest", client_version: str
+) -> Optional[
+    Tuple[List[Tuple[str, str, str, str]], List[Tuple[str, str, str]]]
+]:
+    """
+    Works out which extra strings have changed since a client's version of
+    them.
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        client_version: the version of the extra strings that the client has
+
+    Returns:
+        ``None`` if we can't tell (so the client needs all the strings), or a
+        tuple ``rows, deleted``, where ``rows`` is a list of ``task, name,
+        language, value`` tuples for strings that are new or have changed, and
+        ``deleted`` is a list of ``task, name, language`` tuples for strings
+        that have gone.
+    """
+    corpus_version, _, access = client_version.partition("_")
+    _, _, current_access = req.extra_strings_version.partition("_")
+    if access != current_access:
+        # The tasks whose strings this user may see have changed.
+        return None
+    old_hashes = get_extra_string_hashes_for_version(
+        req.config_filename, corpus_version
+    )
+    if old_hashes is None:
+        return None
+    _, hashes = all_extra_string_hashes(req.config_filename)
+    not_permitted = req.extra_string_tasks_not_permitted
+    allstrings = all_extra_strings_as_dicts(req.config_filename)
+    rows = []  # type: List[Tuple[str, str, str, str]]
+    for key, h in hashes.items():
+        task, name, language = key
+        if task not in not_permitted and old_hashes.get(key) != h:
+            rows.append(
+                (task, name, language, allstrings[task][name][language])
+            )
+    deleted = [
+        key
+        for key in old_hashes.keys()
+        if key[0] not in not_permitted and key not in hashes
+    ]  # type: List[Tuple[str, str, str]]
+    return rows, deleted
+
+
 def op_get_extra_strings(req: "CamcopsRequest") -> Dict[str, str]:
     """
-    Fetch all local extra strings from the server.
+    Fetch local extra strings from the server.
+
+    The reply includes the version of the extra strings
+    (``extra_strings_version``). Clients that send this back (as
+    ``extra_strings_version``) get (``extra_strings_reply_type``):
+
+    - ``not_modified``, and no strings, if theirs are up to date;
+    - ``delta``, and only the strings that are new or have changed, plus a
+      JSON list of ``[task, name, language]`` for strings that have been
+      deleted (``extra_strings_deleted``), if we know what has changed since
+      their version (see
+      :func:`camcops_server.cc_modules.cc_string.get_extra_string_hashes_for_version`);
+    - ``full``, and all strings, otherwise.
+
+    Clients that don't send a version get all strings, as before.
 
     Returns:
         a SELECT-style reply (see :func:`get_select_reply`) for the
         extra-string table
-    """
+    """  # noqa
     fields = [
         ExtraStringFieldNames.TASK,
         ExtraStringFieldNames.NAME,
         ExtraStringFieldNames.LANGUAGE,
         ExtraStringFieldNames.VALUE,
     ]
-    rows = req.get_all_extra_strings()
-    reply = get_select_reply(fields, rows)
-    audit(req, "get_extra_strings")
+    version = req.extra_strings_version
+    client_version = get_str_var(
+        req,
+        TabletParam.EXTRA_STRINGS_VERSION,
+        mandatory=False,
+        validator=validate_alphanum_underscore,
+    )
+    changes = None
+    if client_version == version:
+        reply = get_select_reply(fields, [])
+        reply_type = ExtraStringsReplyType.NOT_MODIFIED
+    else:
+        if client_version:
+            changes = get_extra_strings_changes(req, client_version)
+        if changes is None:
+            reply = get_select_reply(fields, req.get_all_extra_strings())
+            reply_type = ExtraStringsReplyType.FULL
+        else:
+            rows, deleted = changes
+            reply = get_select_reply(fields, rows)
+            reply[TabletParam.EXTRA_STRINGS_DELETED] = json.dumps(deleted)
+            reply_type = ExtraStringsReplyType.DELTA
+    reply[TabletParam.EXTRA_STRINGS_VERSION] = version
+    reply[TabletParam.EXTRA_STRINGS_REPLY_TYPE] = reply_type
+    if not client_version:
+        # Unchanged for clients that predate versioned extra strings:
+        audit(req, "get_extra_strings")
+    elif reply_type != ExtraStringsReplyType.NOT_MODIFIED:
+        # Nothing sent, nothing to audit.
+        audit(req, f"get_extra_strings ({reply_type})")
     return reply
 
 
@@ -2857,7 +3375,6 @@ def op_upload_table(req: "CamcopsRequest") -> str:
         # either case, the client PK name was (is) always "id".
         clientpk_name = TABLET_ID_FIELD
         ensure_valid_field_name(table, clientpk_name)
-    server_pks_uploaded = []  # type: List[int]
     n_new = 0
     n_modified = 0
     n_identical = 0
@@ -2869,6 +3386,9 @@ def op_upload_table(req: "CamcopsRequest") -> str:
         clientpk_name=clientpk_name,
         current_only=True,
     )
+    server_record_index = ServerRecordIndex(serverrecs)
+    batch_writer = UploadBatchWriter(req, batchdetails, table, clientpk_name)
+    urrs = []  # type: List[UploadRecordResult]
     for r in range(nrecords):
         recname = TabletParam.RECORD_PREFIX + str(r)
         values = get_values_from_post_var(req, recname)
@@ -2883,16 +3403,20 @@ def op_upload_table(req: "CamcopsRequest") -> str:
         valuedict = dict(zip(fields, values))
         # log.debug("table {!r}, record {}: {!r}", table.name, r, valuedict)
         # CORE: CALLS upload_record_core
-        urr = upload_record_core(
-            req,
-            batchdetails,
-            table,
-            clientpk_name,
-            valuedict,
-            server_live_current_records=serverrecs,
+        urrs.append(
+            upload_record_core(
+                req,
+                batchdetails,
+                table,
+                clientpk_name,
+                valuedict,
+                server_record_index=server_record_index,
+                batch_writer=batch_writer,
+            )
         )
+    batch_writer.flush()
+    for urr in urrs:
         if urr.oldserverpk is not None:  # was an existing record
-            server_pks_uploaded.append(urr.oldserverpk)
             if urr.newserverpk is None:
                 n_identical += 1
             else:
@@ -2903,11 +3427,7 @@ def op_upload_table(req: "CamcopsRequest") -> str:
             dirty = True
 
     # Now deal with any ABSENT (not in uploaded data set) conditions.
-    server_pks_for_deletion = [
-        r.server_pk
-        for r in serverrecs
-        if r.server_pk not in server_pks_uploaded
-    ]
+    server_pks_for_deletion = server_record_index.server_pks_not_uploaded()
     # Note that "deletion" means "end of the line"; records that are modified
     # and replaced were handled by upload_record_core().
     n_deleted = len(server_pks_for_deletion)
@@ -3153,6 +3673,7 @@ def op_which_keys_to_send(req: "CamcopsRequest") -> str:
 
     # 2. See which ones are new or updates.
     client_pks_needed = []  # type: List[int]
+    server_pks_to_preserve = []  # type: List[int]
     client_pk_to_serverrec = client_pks_that_exist(
         req, table, clientpk_name, clientpk_values
     )
@@ -3171,14 +3692,15 @@ def op_which_keys_to_send(req: "CamcopsRequest") -> str:
                     # Not modified on the client. But it is being preserved.
                     # We don't need to ask the client for it again, but we do
                     # need to mark the preservation.
-                    flag_record_for_preservation(
-                        req, batchdetails, table, serverrec.server_pk
-                    )
+                    server_pks_to_preserve.append(serverrec.server_pk)
 
         else:
             # Client hasn't told us about the _move_off_tablet flag. Always
             # request the record (workaround potential bug in old clients).
             client_pks_needed.append(wk.client_pk)
+    flag_records_for_preservation(
+        req, batchdetails, table, server_pks_to_preserve
+    )
 
     # Success
     pk_csv_list = ",".join(
@@ -29,27 +29,58 @@ Has special code to deal with old databases.
 
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import json
 import logging
+import os
 from pprint import pformat
-from typing import Any, cast, Dict, List, Optional, Type, TYPE_CHECKING
+from typing import (
+    Any,
+    cast,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    TYPE_CHECKING,
+)
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
-from cardinal_pythonlib.sqlalchemy.merge_db import merge_db, TranslationContext
-from cardinal_pythonlib.sqlalchemy.schema import get_table_names
+from cardinal_pythonlib.sqlalchemy.merge_db import (
+    merge_db,
+    TableDependency,
+    TranslationContext,
+)
+from cardinal_pythonlib.sqlalchemy.orm_inspect import (
+    get_orm_classes_by_table_name_from_base,
+)
+from cardinal_pythonlib.sqlalchemy.schema import (
+    get_column_names,
+    get_table_names,
+)
 from cardinal_pythonlib.sqlalchemy.session import get_safe_url_from_engine
 from cardinal_pythonlib.sqlalchemy.table_identity import TableIdentity
 from sqlalchemy.engine import create_engine
 from sqlalchemy.engine.base import Engine
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
-from sqlalchemy.orm.session import Session
+from sqlalchemy.orm.session import Session, sessionmaker
 from sqlalchemy.sql.expression import column, func, select, table, text
+from sqlalchemy.sql.schema import Table
 
 from camcops_server.cc_modules.cc_audit import AuditEntry
 from camcops_server.cc_modules.cc_constants import (
     FP_ID_NUM,
     NUMBER_OF_IDNUMS_DEFUNCT,
+    TABLET_ID_FIELD,
+)
+from camcops_server.cc_modules.cc_db import (
+    FN_DEVICE_ID,
+    FN_ERA,
+    FN_GROUP_ID,
+    FN_WHEN_REMOVED_EXACT,
+    GenericTabletRecordMixin,
 )
-from camcops_server.cc_modules.cc_db import GenericTabletRecordMixin
 from camcops_server.cc_modules.cc_device import Device
 from camcops_server.cc_modules.cc_dirtytables import DirtyTable
 from camcops_server.cc_modules.cc_email import Email
@@ -77,6 +108,7 @@ from camcops_server.cc_modules.cc_serversettings import (
 )
 from camcops_server.cc_modules.cc_sqlalchemy import Base
 from camcops_server.cc_modules.cc_taskindex import reindex_everything
+from camcops_server.cc_modules.cc_tasksummary import TaskSummaryEntry
 from camcops_server.cc_modules.cc_user import (
     SecurityAccountLockout,
     SecurityLoginFailure,
@@ -90,12 +122,48 @@ log = BraceStyleAdapter(logging.getLogger(__name__))
 
 DEBUG_VIA_PDB = False
 
+BULK_CHUNK_SIZE = 1000  # rows per INSERT batch (and COMMIT) in bulk mode
+CORE_TABLES_CHECKPOINT = "_core_tables"
+CHECKPOINT_EXTENSION = ".json"
+# In a dummy run, records from the source may refer to devices/users that
+# would have been created in the destination, but weren't:
+DUMMY_RUN_PLACEHOLDER_ID = -1
+
+# Unique key for a record uploaded from a tablet; see translate_fn().
+TabletRecordKey = Tuple[int, int, str, Any]
+
 
 # =============================================================================
 # Information relating to the source database
 # =============================================================================
 
 
+def get_device_dependencies() -> List[TableDependency]:
+    """
+    Returns dependencies of tables on the device table that the table sorting
+    doesn't see for itself.
+
+    The ``_device_id`` foreign keys are created with ``use_alter=True``, and
+    :func:`sqlalchemy.schema.sort_tables` ignores those, so (without this) a
+    tablet table can be processed before ``_security_devices``; its
+    ``_device`` relationship then cannot be rewritten.
+    """
+    dependencies = []  # type: List[TableDependency]
+    for child_table in Base.metadata.sorted_tables:
+        if child_table.name == Device.__tablename__:
+            continue
+        for fk in child_table.foreign_keys:
+            if fk.use_alter and fk.column.table.name == Device.__tablename__:
+                dependencies.append(
+                    TableDependency(
+                        parent_tablename=Device.__tablename__,
+                        child_tablename=child_table.name,
+                    )
+                )
+                break
+    return dependencies
+
+
 def get_skip_tables(src_tables: List[str]) -> List[TableIdentity]:
     """
     From the list of source table names provided, return details of tables in
@@ -388,6 +456,68 @@ def get_dst_iddef(
     )
 
 
+def get_dst_tablet_record_keys(
+    dst_session: Session, dst_table: Table
+) -> Set[TabletRecordKey]:
+    """
+    Fetches the unique keys of all records in a destination table of records
+    uploaded from tablets, so that we can check for duplicates without a
+    query per record.
+
+    Args:
+        dst_session: destination SQLAlchemy :class:`Session`
+        dst_table: the table
+
+    Returns:
+        a set of ``id, _device_id, _era, _when_removed_exact`` tuples
+    """
+    c = dst_table.columns
+    q = select(
+        [
+            c[TABLET_ID_FIELD],
+            c[FN_DEVICE_ID],
+            c[FN_ERA],
+            c[FN_WHEN_REMOVED_EXACT],
+        ]
+    )
+    return set(tuple(row) for row in dst_session.execute(q))
+
+
+def get_src_to_dst_id_map(
+    src_engine: Engine,
+    dst_session: Session,
+    ormclass: Type,
+    name_attr: str,
+    src_tables: List[str],
+) -> Dict[int, int]:
+    """
+    For tables (e.g. users, devices) whose records are merged on a name, maps
+    integer IDs in the source database to IDs in the destination database.
+    Call this after merging the table.
+
+    Args:
+        src_engine: source SQLAlchemy :class:`Engine`
+        dst_session: destination SQLAlchemy :class:`Session`
+        ormclass: the SQLAlchemy ORM class
+        name_attr: attribute name of the name that identifies a record
+        src_tables: list of all table names in the source database
+
+    Returns:
+        dictionary: ``{source_id: destination_id}``
+    """
+    t = ormclass.__table__
+    name_col = getattr(ormclass, name_attr)
+    q = select([ormclass.id, name_col]).select_from(t)
+    dst_ids = {name: id_ for id_, name in dst_session.execute(q)}
+    id_map = {}  # type: Dict[int, int]
+    if t.name not in src_tables:
+        return id_map
+    for src_id, name in src_engine.execute(q):
+        if name in dst_ids:
+            id_map[src_id] = dst_ids[name]
+    return id_map
+
+
 # =============================================================================
 # Extra translation to be applied to individual objects
 # =============================================================================
@@ -688,17 +818,25 @@ def translate_fn(trcon: TranslationContext) -> None:
     if trcon.tablename == User.__tablename__:
         src_user = cast(User, oldobj)
         src_username = src_user.username
-        matching_user = (
-            trcon.dst_session.query(User)
-            .filter(User.username == src_username)
-            .one_or_none()
-        )  # type: Optional[User]
+        dst_users = trcon.info.get(
+            "dst_users_by_name"
+        )  # type: Optional[Dict[str, User]]
+        if dst_users is None:
+            matching_user = (
+                trcon.dst_session.query(User)
+                .filter(User.username == src_username)
+                .one_or_none()
+            )  # type: Optional[User]
+        else:
+            matching_user = dst_users.get(src_username)
         if matching_user is not None:
             log.debug(
                 "Matching User (username {!r}) found; merging",
                 matching_user.username,
             )
             trcon.newobj = matching_user  # so that related records will work
+        elif dst_users is not None:
+            dst_users[src_username] = trcon.newobj
 
     # -------------------------------------------------------------------------
     # If an identical device is found, merge on it rather than creating a
@@ -707,17 +845,25 @@ def translate_fn(trcon: TranslationContext) -> None:
     if trcon.tablename == Device.__tablename__:
         src_device = cast(Device, oldobj)
         src_devicename = src_device.name
-        matching_device = (
-            trcon.dst_session.query(Device)
-            .filter(Device.name == src_devicename)
-            .one_or_none()
-        )  # type: Optional[Device]
+        dst_devices = trcon.info.get(
+            "dst_devices_by_name"
+        )  # type: Optional[Dict[str, Device]]
+        if dst_devices is None:
+            matching_device = (
+                trcon.dst_session.query(Device)
+                .filter(Device.name == src_devicename)
+                .one_or_none()
+            )  # type: Optional[Device]
+        else:
+            matching_device = dst_devices.get(src_devicename)
         if matching_device is not None:
             log.debug(
                 "Matching Device (name {!r}) found; merging",
                 matching_device.name,
             )
             trcon.newobj = matching_device
+        elif dst_devices is not None:
+            dst_devices[src_devicename] = trcon.newobj
 
         # BUT BEWARE, BECAUSE IF YOU MERGE THE SAME DATABASE TWICE (even if
         # that's a silly thing to do...), MERGING DEVICES WILL BREAK THE KEY
@@ -770,7 +916,7 @@ def translate_fn(trcon: TranslationContext) -> None:
             .where(column(Patient._era.name) == old_patient._era)
         )
         rows = trcon.src_session.execute(src_pt_query)  # type: CursorResult
-        list_of_dicts = [dict(row.items()) for row in rows]
+        list_of_dicts = [dict(row._mapping) for row in rows]
         assert (
             len(list_of_dicts) == 1
         ), "Failed to fetch old patient IDs correctly; bug?"
@@ -783,9 +929,10 @@ def translate_fn(trcon: TranslationContext) -> None:
         src_tables = trcon.src_table_names
         for src_which_idnum in range(1, NUMBER_OF_IDNUMS_DEFUNCT + 1):
             old_fieldname = FP_ID_NUM + str(src_which_idnum)
-            idnum_value = old_patient_dict[old_fieldname]
+            idnum_value = old_patient_dict.get(old_fieldname)
             if idnum_value is None:
-                # Old Patient record didn't contain this ID number
+                # Old Patient record didn't contain this ID number (or the
+                # source is new enough not to have the field at all)
                 continue
             # Old Patient record *did* contain the ID number...
             if PatientIdNum.__tablename__ in src_tables:
@@ -922,25 +1069,27 @@ def translate_fn(trcon: TranslationContext) -> None:
         #       _device_id          = device
         #       _era                = device era
         #       _when_removed_exact = removal date or NULL
-        # noinspection PyUnresolvedReferences
-        exists_query = (
-            select([func.count()])
-            .select_from(table(trcon.tablename))
-            .where(column(cls.id.name) == oldobj.id)
-            .where(
-                column(cls._device_id.name) == trcon.objmap[oldobj._device].id
-            )
-            .where(column(cls._era.name) == oldobj._era)
-            .where(
-                column(cls._when_removed_exact.name)
-                == oldobj._when_removed_exact
+        # We fetch the keys of the destination table's records once (when we
+        # meet its first record), rather than querying for every record.
+        dst_keys_by_table = trcon.info.setdefault(
+            "dst_keys_by_table", {}
+        )  # type: Dict[str, Set[TabletRecordKey]]
+        if trcon.tablename not in dst_keys_by_table:
+            dst_keys_by_table[trcon.tablename] = get_dst_tablet_record_keys(
+                trcon.dst_session, trcon.table
             )
+        # noinspection PyUnresolvedReferences
+        key = (
+            oldobj.id,
+            trcon.objmap[oldobj._device].id,
+            oldobj._era,
+            oldobj._when_removed_exact,
         )
         # Note re NULLs... Although it's an inconvenient truth in SQL that
         #   SELECT NULL = NULL; -- returns NULL
-        # in this code we have a comparison of a column to a Python value.
-        # SQLAlchemy is clever and renders "IS NULL" if the Python value is
-        # None, or an "=" comparison otherwise.
+        # in the query below we have a comparison of a column to a Python
+        # value. SQLAlchemy is clever and renders "IS NULL" if the Python value
+        # is None, or an "=" comparison otherwise.
         # If we were comparing a column to another column, we'd have to do
         # more; e.g.
         #
@@ -965,8 +1114,7 @@ def translate_fn(trcon: TranslationContext) -> None:
         #                b._when_removed_exact IS NULL));
         #
         #   -- returns all rows
-        n_exists = trcon.dst_session.execute(exists_query).scalar()
-        if n_exists > 0:
+        if key in dst_keys_by_table[trcon.tablename]:
             # noinspection PyUnresolvedReferences
             existing_rec_q = (
                 select(["*"])
@@ -1037,6 +1185,481 @@ def translate_fn(trcon: TranslationContext) -> None:
             )
 
 
+# =============================================================================
+# Checkpoints
+# =============================================================================
+
+
+class MergeCheckpoint(object):
+    """
+    How far we have got with merging one table, so that an interrupted merge
+    can be resumed. Stored as a JSON file per table, within a checkpoint
+    directory.
+    """
+
+    def __init__(
+        self,
+        tablename: str,
+        last_src_pk: int = 0,
+        n_rows: int = 0,
+        complete: bool = False,
+    ) -> None:
+        """
+        Args:
+            tablename:
+                table name (or :data:`CORE_TABLES_CHECKPOINT` for all the
+                tables merged record by record)
+            last_src_pk:
+                the highest source PK copied (and committed) so far
+            n_rows:
+                number of rows copied (and committed) so far
+            complete:
+                have we finished this table?
+        """
+        self.tablename = tablename
+        self.last_src_pk = last_src_pk
+        self.n_rows = n_rows
+        self.complete = complete
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(tablename={self.tablename!r}, "
+            f"last_src_pk={self.last_src_pk!r}, n_rows={self.n_rows!r}, "
+            f"complete={self.complete!r})"
+        )
+
+    @staticmethod
+    def filename(checkpoint_dir: str, tablename: str) -> str:
+        """
+        Returns the checkpoint filename for a table.
+        """
+        return os.path.join(checkpoint_dir, tablename + CHECKPOINT_EXTENSION)
+
+    @classmethod
+    def exists(cls, checkpoint_dir: Optional[str], tablename: str) -> bool:
+        """
+        Is there a checkpoint for this table (i.e. have we started it)?
+        """
+        return bool(checkpoint_dir) and os.path.exists(
+            cls.filename(checkpoint_dir, tablename)
+        )
+
+    @classmethod
+    def load(
+        cls, checkpoint_dir: Optional[str], tablename: str
+    ) -> "MergeCheckpoint":
+        """
+        Reads a table's checkpoint, or returns a fresh one (if there isn't
+        one, or we're not using checkpoints).
+        """
+        if not checkpoint_dir:
+            return cls(tablename)
+        try:
+            with open(cls.filename(checkpoint_dir, tablename)) as f:
+                d = json.load(f)
+        except FileNotFoundError:
+            return cls(tablename)
+        return cls(
+            tablename,
+            last_src_pk=d.get("last_src_pk", 0),
+            n_rows=d.get("n_rows", 0),
+            complete=d.get("complete", False),
+        )
+
+    def save(self, checkpoint_dir: Optional[str]) -> None:
+        """
+        Writes the checkpoint (atomically), if we're using checkpoints.
+        """
+        if not checkpoint_dir:
+            return
+        filename = self.filename(checkpoint_dir, self.tablename)
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(
+                dict(
+                    last_src_pk=self.last_src_pk,
+                    n_rows=self.n_rows,
+                    complete=self.complete,
+                ),
+                f,
+            )
+        os.replace(tmp_filename, filename)
+
+
+def clear_merge_checkpoints(checkpoint_dir: str) -> None:
+    """
+    Deletes all checkpoints from the checkpoint directory.
+    """
+    for filename in os.listdir(checkpoint_dir):
+        if filename.endswith(CHECKPOINT_EXTENSION):
+            os.remove(os.path.join(checkpoint_dir, filename))
+
+
+# =============================================================================
+# Bulk copying of records uploaded from tablets
+# =============================================================================
+# Tasks (and their ancillary tables) are most of the data, and need little
+# translation: their only server-side relationships are to devices, users, and
+# groups. So, rather than building ORM objects and querying per record (as
+# translate_fn() does), we can copy their rows with bulk INSERT statements,
+# mapping those foreign keys via dictionaries fetched in advance. These tables
+# don't depend on each other, so several can be copied at once.
+
+
+def get_bulk_tables(
+    skip_table_names: List[str], src_tables: List[str]
+) -> List[Table]:
+    """
+    Returns tables that can be copied in bulk by :func:`bulk_copy_table`:
+    tables of records uploaded from tablets (e.g. tasks) whose foreign keys
+    are only to devices, users, and groups, and that no other table refers
+    to. Patients and their ID numbers need translation, and are not included.
+
+    Args:
+        skip_table_names: names of tables not to merge
+        src_tables: list of all table names in the source database
+    """
+    lookup_tablenames = {
+        Device.__tablename__,
+        Group.__tablename__,
+        User.__tablename__,
+    }
+    metadata = Base.metadata
+    referenced = set(
+        fk.column.table.name
+        for t in metadata.tables.values()
+        for fk in t.foreign_keys
+    )
+    tablename_to_ormclass = get_orm_classes_by_table_name_from_base(Base)
+    bulk_tables = []  # type: List[Table]
+    for t in metadata.sorted_tables:
+        ormclass = tablename_to_ormclass.get(t.name)
+        if (
+            ormclass is None
+            or not issubclass(ormclass, GenericTabletRecordMixin)
+            or ormclass in (Patient, PatientIdNum)
+            or t.name in skip_table_names
+            or t.name not in src_tables
+            or t.name in referenced
+            or any(
+                fk.column.table.name not in lookup_tablenames
+                for fk in t.foreign_keys
+            )
+        ):
+            continue
+        bulk_tables.append(t)
+    return bulk_tables
+
+
+class BulkCopyLookups(object):
+    """
+    Source-to-destination mappings for the foreign keys of tables copied in
+    bulk, fetched once (after the devices, users, and groups have been
+    merged). Read-only, so may be shared between threads.
+    """
+
+    def __init__(
+        self,
+        src_engine: Engine,
+        dst_session: Session,
+        src_tables: List[str],
+        groupnum_map: Dict[int, int],
+        default_group_id: Optional[int],
+        dummy_run: bool = False,
+    ) -> None:
+        """
+        Args:
+            src_engine: source SQLAlchemy :class:`Engine`
+            dst_session: destination SQLAlchemy :class:`Session`
+            src_tables: list of all table names in the source database
+            groupnum_map: maps source group IDs to destination group IDs
+            default_group_id: destination group ID for records without one
+            dummy_run: is this a dummy run? If so, records with no
+                destination equivalent (because the dummy run didn't create
+                it) map to :data:`DUMMY_RUN_PLACEHOLDER_ID`
+        """
+        self.default_group_id = default_group_id
+        self.dummy_run = dummy_run
+        self.id_maps = {
+            Device.__tablename__: get_src_to_dst_id_map(
+                src_engine, dst_session, Device, "name", src_tables
+            ),
+            Group.__tablename__: groupnum_map,
+            User.__tablename__: get_src_to_dst_id_map(
+                src_engine, dst_session, User, "username", src_tables
+            ),
+        }  # type: Dict[str, Dict[int, int]]
+
+    def get_dst_id(
+        self, tablename: str, colname: str, target_tablename: str, src_id: int
+    ) -> Optional[int]:
+        """
+        Translates a foreign key value from the source to the destination.
+
+        Args:
+            tablename: table being copied
+            colname: foreign key column
+            target_tablename: table the foreign key refers to
+            src_id: value in the source
+
+        Raises:
+            :exc:`ValueError` if there is no destination equivalent (except
+            in a dummy run)
+        """
+        if src_id is None:
+            if colname == FN_GROUP_ID:
+                return self.default_group_id
+            return None
+        try:
+            return self.id_maps[target_tablename][src_id]
+        except KeyError:
+            if self.dummy_run:
+                return DUMMY_RUN_PLACEHOLDER_ID
+            log.critical(
+                "Table {!r} column {!r} refers to {!r} record {!r} in the "
+                "source database, which has no equivalent in the destination",
+                tablename,
+                colname,
+                target_tablename,
+                src_id,
+            )
+            raise ValueError("Bad foreign key mapping")
+
+
+def bulk_copy_table(
+    dst_table: Table,
+    src_engine: Engine,
+    dst_session: Session,
+    lookups: BulkCopyLookups,
+    chunk_size: int = BULK_CHUNK_SIZE,
+    checkpoint_dir: str = None,
+    dummy_run: bool = False,
+) -> int:
+    """
+    Copies all records from a source table (see :func:`get_bulk_tables`) to
+    the destination, in chunks of rows, in order of source PK. Each chunk is
+    inserted with a single (executemany) INSERT and committed.
+
+    If ``checkpoint_dir`` is given, we record the last source PK committed,
+    and continue from there if the table was started by an earlier
+    (interrupted) merge. Records already present in the destination are then
+    skipped, rather than being treated as an attempt to merge the same
+    database twice.
+
+    Args:
+        dst_table: the table
+        src_engine: source SQLAlchemy :class:`Engine`
+        dst_session: destination SQLAlchemy :class:`Session`
+        lookups: foreign key mappings
+        chunk_size: number of rows per INSERT and COMMIT
+        checkpoint_dir: directory for checkpoints (or ``None``)
+        dummy_run: don't alter the destination database
+
+    Returns:
+        the number of rows copied
+    """
+    tablename = dst_table.name
+    resuming = MergeCheckpoint.exists(checkpoint_dir, tablename)
+    checkpoint = MergeCheckpoint.load(checkpoint_dir, tablename)
+    if checkpoint.complete:
+        log.info("Table {!r} already merged", tablename)
+        return 0
+    if not dummy_run:
+        checkpoint.save(checkpoint_dir)  # we have started this table
+
+    pk_col = list(dst_table.primary_key.columns)[0]
+    src_colnames = set(get_column_names(src_engine, tablename))
+    columns = [
+        c
+        for c in dst_table.columns
+        if c.name in src_colnames and c is not pk_col
+    ]
+    fk_targets = {
+        fk.parent.name: fk.column.table.name for fk in dst_table.foreign_keys
+    }  # type: Dict[str, str]
+    if FN_GROUP_ID not in src_colnames:
+        # Very old source database, without groups.
+        columns.append(dst_table.columns[FN_GROUP_ID])
+    existing_keys = get_dst_tablet_record_keys(dst_session, dst_table)
+
+    n_copied = 0
+    n_skipped = 0
+    while True:
+        q = (
+            select([pk_col] + [c for c in columns if c.name in src_colnames])
+            .where(pk_col > checkpoint.last_src_pk)
+            .order_by(pk_col)
+            .limit(chunk_size)
+        )
+        src_rows = src_engine.execute(q).fetchall()
+        if not src_rows:
+            break
+        dst_rows = []  # type: List[Dict[str, Any]]
+        for src_row in src_rows:
+            dst_row = {}  # type: Dict[str, Any]
+            for c in columns:
+                value = src_row[c] if c.name in src_colnames else None
+                if c.name in fk_targets:
+                    value = lookups.get_dst_id(
+                        tablename, c.name, fk_targets[c.name], value
+                    )
+                dst_row[c.name] = value
+            key = (
+                dst_row[TABLET_ID_FIELD],
+                dst_row[FN_DEVICE_ID],
+                dst_row[FN_ERA],
+                dst_row[FN_WHEN_REMOVED_EXACT],
+            )  # type: TabletRecordKey
+            if key in existing_keys:
+                if resuming:
+                    n_skipped += 1
+                    continue
+                log.critical(
+                    "Source record already exists in destination database, "
+                    "in table {!r}, source PK {!r}, clashing on: id, "
+                    "_device_id, _era, _when_removed_exact = {!r}.\n"
+                    "ARE YOU TRYING TO MERGE THE SAME DATABASE IN TWICE? "
+                    "DON'T.",
+                    tablename,
+                    src_row[pk_col],
+                    key,
+                )
+                raise ValueError("Attempt to insert duplicate record")
+            if dst_row[FN_GROUP_ID] is None:
+                raise ValueError(
+                    f"Record in table {tablename!r} (source PK "
+                    f"{src_row[pk_col]!r}) has no group, and no default "
+                    f"group was specified"
+                )
+            dst_rows.append(dst_row)
+        if not dummy_run:
+            if dst_rows:
+                dst_session.execute(dst_table.insert(), dst_rows)
+            dst_session.commit()
+        n_copied += len(dst_rows)
+        checkpoint.last_src_pk = src_rows[-1][pk_col]
+        checkpoint.n_rows += len(dst_rows)
+        if not dummy_run:
+            checkpoint.save(checkpoint_dir)
+        log.debug("... {}: {} rows", tablename, checkpoint.n_rows)
+
+    checkpoint.complete = True
+    if not dummy_run:
+        checkpoint.save(checkpoint_dir)
+    log.info(
+        "Copied {} rows{}: {}{}",
+        n_copied,
+        " (DUMMY RUN)" if dummy_run else "",
+        tablename,
+        f" (skipped {n_skipped} already present)" if n_skipped else "",
+    )
+    return n_copied
+
+
+def bulk_copy_tables(
+    dst_tables: List[Table],
+    src_engine: Engine,
+    dst_session: Session,
+    lookups: BulkCopyLookups,
+    chunk_size: int = BULK_CHUNK_SIZE,
+    workers: int = 1,
+    checkpoint_dir: str = None,
+    dummy_run: bool = False,
+) -> int:
+    """
+    Copies several tables via :func:`bulk_copy_table`. If ``workers`` is more
+    than 1, that many tables are copied at once, each in its own thread with
+    its own destination session (and database connections). The tables must
+    not refer to each other.
+
+    Returns:
+        the number of rows copied
+    """
+    workers = min(workers, len(dst_tables))
+    if workers <= 1:
+        return sum(
+            bulk_copy_table(
+                dst_table=t,
+                src_engine=src_engine,
+                dst_session=dst_session,
+                lookups=lookups,
+                chunk_size=chunk_size,
+                checkpoint_dir=checkpoint_dir,
+                dummy_run=dummy_run,
+            )
+            for t in dst_tables
+        )
+
+    make_session = sessionmaker(bind=dst_session.get_bind())
+
+    def copy(t: Table) -> int:
+        session = make_session()  # type: Session
+        try:
+            return bulk_copy_table(
+                dst_table=t,
+                src_engine=src_engine,
+                dst_session=session,
+                lookups=lookups,
+                chunk_size=chunk_size,
+                checkpoint_dir=checkpoint_dir,
+                dummy_run=dummy_run,
+            )
+        finally:
+            session.close()
+
+    log.info("Copying {} tables with {} workers", len(dst_tables), workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(copy, dst_tables))
+
+
+def resolve_bulk_default_group_id(
+    src_engine: Engine,
+    dst_session: Session,
+    dst_tables: List[Table],
+    trcon_info: Dict[str, Any],
+) -> Optional[int]:
+    """
+    Returns the destination group ID for records (in tables to be copied in
+    bulk) that have no group, if any do, creating the group if necessary (see
+    :func:`ensure_default_group_id`).
+
+    Args:
+        src_engine: source SQLAlchemy :class:`Engine`
+        dst_session: destination SQLAlchemy :class:`Session`
+        dst_tables: tables to be copied in bulk
+        trcon_info: the ``info`` dictionary passed to :func:`translate_fn`
+    """
+    default_group_id = trcon_info["default_group_id"]  # type: Optional[int]
+    if default_group_id is not None:
+        if not group_exists(default_group_id, dst_session):
+            raise ValueError(
+                f"User specified default_group_id={default_group_id!r}, but "
+                f"that ID doesn't exist in the {Group.__tablename__!r} table "
+                f"of the destination database"
+            )
+        return default_group_id
+    default_group_name = trcon_info[
+        "default_group_name"
+    ]  # type: Optional[str]
+    if not default_group_name:
+        return None  # records without a group will fail
+    for t in dst_tables:
+        if FN_GROUP_ID in get_column_names(src_engine, t.name):
+            q = (
+                select([func.count()])
+                .select_from(t)
+                .where(t.columns[FN_GROUP_ID].is_(None))
+            )
+            if not src_engine.execute(q).scalar():
+                continue
+        default_group_id = fetch_group_id_by_name(
+            group_name=default_group_name, dst_session=dst_session
+        )
+        trcon_info["default_group_id"] = default_group_id
+        return default_group_id
+    return None
+
+
 # =============================================================================
 # Postprocess
 # =============================================================================
@@ -1056,6 +1679,10 @@ def postprocess(src_engine: Engine, dst_session: Session) -> None:
     """
     log.info("Reindexing destination database")
     reindex_everything(dst_session)
+    log.warning(
+        "Stored task summaries were not copied; run the "
+        "'rebuild_task_summaries' command to calculate them."
+    )
     log.warning(
         "NOT IMPLEMENTED AUTOMATICALLY: copying user/group mapping "
         "from table {!r}; do this by hand.",
@@ -1085,6 +1712,10 @@ def merge_camcops_db(
     whichidnum_map: Dict[int, int],
     skip_export_logs: bool = True,
     skip_audit_logs: bool = True,
+    bulk: bool = False,
+    bulk_chunk_size: int = BULK_CHUNK_SIZE,
+    bulk_workers: int = 1,
+    checkpoint_dir: str = None,
 ) -> None:
     """
     Merge an existing database (with a pre-v2 or later structure) into a
@@ -1130,6 +1761,23 @@ def merge_camcops_db(
         skip_audit_logs:
             skip audit log table
 
+        bulk:
+            copy tables of records uploaded from tablets (tasks, etc.) in bulk
+            (see :func:`bulk_copy_tables`), after merging the other tables
+            record by record, rather than merging everything record by record
+
+        bulk_chunk_size:
+            in bulk mode, number of rows per INSERT and COMMIT
+
+        bulk_workers:
+            in bulk mode, number of tables to copy at once
+
+        checkpoint_dir:
+            in bulk mode, directory in which to record progress, so that an
+            interrupted merge can be resumed by running it again (with the
+            same arguments); the checkpoints are deleted once the merge has
+            finished
+
     """
     req = get_command_line_request()  # requires manual COMMIT; see below
     src_engine = create_engine(src, echo=echo, pool_pre_ping=True)
@@ -1163,6 +1811,7 @@ def merge_camcops_db(
     #     TableDependency(parent_tablename="patient",
     #                     child_tablename="_dirty_tables")
     # ]
+    # ... but the device dependencies are real: see get_device_dependencies().
 
     # -------------------------------------------------------------------------
     # Tables to skip
@@ -1181,6 +1830,8 @@ def merge_camcops_db(
             SecurityLoginFailure.__tablename__,
             UserGroupMembership.__tablename__,
             group_group_table.name,
+            # Keyed by source task PKs; recalculate instead:
+            TaskSummaryEntry.__tablename__,
         )
     ]
 
@@ -1211,6 +1862,19 @@ def merge_camcops_db(
     src_iddefs = get_src_iddefs(src_engine, src_tables)
     log.info("Source ID number definitions: {!r}", src_iddefs)
 
+    bulk_tables = []  # type: List[Table]
+    if bulk:
+        bulk_tables = get_bulk_tables(
+            skip_table_names=[ti.tablename for ti in skip_tables],
+            src_tables=src_tables,
+        )
+        log.info("Tables to copy in bulk: {!r}", [t.name for t in bulk_tables])
+        skip_tables += [TableIdentity(tablename=t.name) for t in bulk_tables]
+        if checkpoint_dir:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+    else:
+        checkpoint_dir = None  # only used in bulk mode
+
     # -------------------------------------------------------------------------
     # Initial operations on DESTINATION database
     # -------------------------------------------------------------------------
@@ -1248,29 +1912,65 @@ def merge_camcops_db(
         src_iddefs=src_iddefs,
         whichidnum_map=whichidnum_map,
         groupnum_map=groupnum_map,
+        # Fetched once, rather than queried per record:
+        dst_users_by_name={u.username: u for u in dst_session.query(User)},
+        dst_devices_by_name={d.name: d for d in dst_session.query(Device)},
     )
-    merge_db(
-        base_class=Base,
-        src_engine=src_engine,
-        dst_session=dst_session,
-        allow_missing_src_tables=True,
-        allow_missing_src_columns=True,
-        translate_fn=translate_fn,
-        skip_tables=skip_tables,
-        only_tables=None,
-        tables_to_keep_pks_for=None,
-        # extra_table_dependencies=test_dependencies,
-        extra_table_dependencies=None,
-        dummy_run=dummy_run,
-        info_only=info_only,
-        report_every=report_every,
-        flush_per_table=True,
-        flush_per_record=False,
-        commit_with_flush=False,
-        commit_at_end=True,
-        prevent_eager_load=True,
-        trcon_info=trcon_info,
+    core_checkpoint = MergeCheckpoint.load(
+        checkpoint_dir, CORE_TABLES_CHECKPOINT
     )
+    if core_checkpoint.complete:
+        log.info("Resuming merge; other tables were merged previously")
+    else:
+        merge_db(
+            base_class=Base,
+            src_engine=src_engine,
+            dst_session=dst_session,
+            allow_missing_src_tables=True,
+            allow_missing_src_columns=True,
+            translate_fn=translate_fn,
+            skip_tables=skip_tables,
+            only_tables=None,
+            tables_to_keep_pks_for=None,
+            # extra_table_dependencies=test_dependencies,
+            extra_table_dependencies=get_device_dependencies(),
+            dummy_run=dummy_run,
+            info_only=info_only,
+            report_every=report_every,
+            flush_per_table=True,
+            flush_per_record=False,
+            commit_with_flush=False,
+            commit_at_end=True,
+            prevent_eager_load=True,
+            trcon_info=trcon_info,
+        )
+        if not dummy_run:
+            core_checkpoint.complete = True
+            core_checkpoint.save(checkpoint_dir)
+
+    if bulk_tables and not info_only:
+        lookups = BulkCopyLookups(
+            src_engine=src_engine,
+            dst_session=dst_session,
+            src_tables=src_tables,
+            groupnum_map=groupnum_map,
+            default_group_id=resolve_bulk_default_group_id(
+                src_engine, dst_session, bulk_tables, trcon_info
+            ),
+            dummy_run=dummy_run,
+        )
+        if not dummy_run:
+            dst_session.commit()  # other sessions may be writing from now on
+        bulk_copy_tables(
+            dst_tables=bulk_tables,
+            src_engine=src_engine,
+            dst_session=dst_session,
+            lookups=lookups,
+            chunk_size=bulk_chunk_size,
+            workers=bulk_workers,
+            checkpoint_dir=checkpoint_dir,
+            dummy_run=dummy_run,
+        )
 
     # -------------------------------------------------------------------------
     # Postprocess
@@ -1283,3 +1983,5 @@ def merge_camcops_db(
     # -------------------------------------------------------------------------
 
     dst_session.commit()
+    if checkpoint_dir and not dummy_run and not info_only:
+        clear_merge_checkpoints(checkpoint_dir)
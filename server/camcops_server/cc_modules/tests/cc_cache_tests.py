@@ -0,0 +1,225 @@
+"""
+camcops_server/cc_modules/tests/cc_cache_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+import os
+import stat
+import tempfile
+import threading
+from unittest import mock, TestCase
+
+from dogpile.cache.api import NO_VALUE
+from sqlalchemy.inspection import inspect
+
+from camcops_server.cc_modules.cc_cache import (
+    make_shared_cache_region,
+    SESSION_INFO_SHARED_CACHE,
+    SharedCacheKeys,
+)
+from camcops_server.cc_modules.cc_cacheserver import (
+    UnixSocketCacheBackend,
+    UnixSocketCacheServer,
+)
+from camcops_server.cc_modules.cc_constants import SharedCacheBackendNames
+from camcops_server.cc_modules.cc_group import Group
+from camcops_server.cc_modules.cc_idnumdef import (
+    get_cached_idnum_definitions,
+    IdNumDefinition,
+)
+from camcops_server.cc_modules.cc_serversettings import get_database_title
+from camcops_server.cc_modules.cc_unittest import BasicDatabaseTestCase
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+
+class SharedCacheBackendTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.tmpdir.name, "cache.sock")
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def start_server(self) -> UnixSocketCacheServer:
+        server = UnixSocketCacheServer(self.socket_path)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        def stop() -> None:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.addCleanup(stop)
+        return server
+
+    def test_no_backend(self) -> None:
+        self.assertIsNone(
+            make_shared_cache_region(SharedCacheBackendNames.NONE)
+        )
+
+    def test_bad_backend(self) -> None:
+        with self.assertRaises(ValueError):
+            make_shared_cache_region("nonsense")
+        with self.assertRaises(ValueError):
+            make_shared_cache_region(SharedCacheBackendNames.FILE)
+
+    def test_file_backend_shared_between_regions(self) -> None:
+        filename = os.path.join(self.tmpdir.name, "cache.dbm")
+        region1 = make_shared_cache_region(
+            SharedCacheBackendNames.FILE, filename
+        )
+        region2 = make_shared_cache_region(
+            SharedCacheBackendNames.FILE, filename
+        )
+        region1.set("x", {1: [2, 3]})
+        self.assertEqual(region2.get("x"), {1: [2, 3]})
+        region2.delete("x")
+        self.assertIs(region1.get("x"), NO_VALUE)
+
+    def test_unix_socket_backend(self) -> None:
+        self.start_server()
+        mode = os.stat(self.socket_path).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0o600)
+        backend = UnixSocketCacheBackend({"path": self.socket_path})
+        backend.set_multi({"a": [1, "x"], "b": None})
+        self.assertEqual(
+            backend.get_multi(["a", "b", "c"]), [[1, "x"], None, NO_VALUE]
+        )
+        backend.delete("a")
+        self.assertIs(backend.get("a"), NO_VALUE)
+
+    def test_unix_socket_backend_shared_between_regions(self) -> None:
+        self.start_server()
+        region1 = make_shared_cache_region(
+            SharedCacheBackendNames.UNIX_SOCKET, self.socket_path
+        )
+        region2 = make_shared_cache_region(
+            SharedCacheBackendNames.UNIX_SOCKET, self.socket_path
+        )
+        self.assertEqual(region1.get_or_create("k", lambda: "value"), "value")
+        creator = mock.Mock(return_value="other")
+        self.assertEqual(region2.get_or_create("k", creator), "value")
+        creator.assert_not_called()
+
+    def test_unix_socket_backend_without_server(self) -> None:
+        backend = UnixSocketCacheBackend({"path": self.socket_path})
+        backend.set("a", 1)  # no error
+        self.assertIs(backend.get("a"), NO_VALUE)
+
+    def test_server_restart(self) -> None:
+        backend = UnixSocketCacheBackend({"path": self.socket_path})
+        server = UnixSocketCacheServer(self.socket_path)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        backend.set("a", 1)
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        self.start_server()  # new, empty
+        self.assertIs(backend.get("a"), NO_VALUE)
+        backend.set("a", 2)
+        self.assertEqual(backend.get("a"), 2)
+
+
+class SharedCacheDatabaseTests(BasicDatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.dbsession.commit()
+        self.region = make_shared_cache_region(SharedCacheBackendNames.MEMORY)
+        self.dbsession.info[SESSION_INFO_SHARED_CACHE] = self.region
+
+    def tearDown(self) -> None:
+        self.dbsession.info.pop(SESSION_INFO_SHARED_CACHE, None)
+        super().tearDown()
+
+    def test_idnum_definitions_cached(self) -> None:
+        iddefs = get_cached_idnum_definitions(self.dbsession)
+        self.assertEqual([d.which_idnum for d in iddefs], [1, 2, 3])
+        self.assertEqual(iddefs[0].description, "NHS number")
+        self.assertTrue(inspect(iddefs[0]).transient)
+
+        with mock.patch(
+            "camcops_server.cc_modules.cc_idnumdef.get_idnum_definitions",
+            side_effect=AssertionError("Not cached"),
+        ):
+            iddefs = get_cached_idnum_definitions(self.dbsession)
+        self.assertEqual(iddefs[2].short_description, "Study")
+
+    def test_changes_seen_then_invalidated_on_commit(self) -> None:
+        get_cached_idnum_definitions(self.dbsession)
+        self.dbsession.add(
+            IdNumDefinition(
+                which_idnum=4, description="Other", short_description="O"
+            )
+        )
+        # Our own (uncommitted) change is visible to us...
+        self.assertEqual(len(get_cached_idnum_definitions(self.dbsession)), 4)
+        # ... but not cached for anyone else yet:
+        key = SharedCacheKeys.IDNUM_DEFINITIONS
+        self.assertEqual(len(self.region.get(key)), 3)
+
+        self.dbsession.commit()
+        self.assertIs(self.region.get(key), NO_VALUE)
+        self.assertEqual(len(get_cached_idnum_definitions(self.dbsession)), 4)
+        self.assertEqual(len(self.region.get(key)), 4)
+
+    def test_database_title(self) -> None:
+        self.req.set_database_title("First")
+        self.dbsession.commit()
+        self.assertEqual(get_database_title(self.req), "First")
+        self.assertEqual(
+            self.region.get(SharedCacheKeys.DATABASE_TITLE), "First"
+        )
+        self.req.set_database_title("Second")
+        self.assertEqual(get_database_title(self.req), "Second")
+        self.dbsession.commit()
+        self.assertEqual(get_database_title(self.req), "Second")
+
+    def test_group_visibility(self) -> None:
+        other_group = Group(name="other", description="Other")
+        self.dbsession.add(other_group)
+        self.group.can_see_other_groups.append(other_group)
+        self.user.set_group_ids([self.group.id])
+        self.dbsession.commit()
+        expected = {self.group.id, other_group.id}
+
+        self.assertEqual(set(self.user.ids_of_groups_user_may_see), expected)
+        self.assertEqual(
+            self.region.get(SharedCacheKeys.GROUP_VISIBILITY),
+            {self.group.id: [other_group.id]},
+        )
+
+        self.group.can_see_other_groups.remove(other_group)
+        self.dbsession.commit()
+        self.assertEqual(
+            set(self.user.ids_of_groups_user_may_see), {self.group.id}
+        )
@@ -0,0 +1,251 @@
+"""
+camcops_server/cc_modules/tests/cc_dbexport_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+import itertools
+import os
+import tempfile
+from typing import Any, List
+from unittest import mock
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.expression import text
+
+from camcops_server.cc_modules.cc_dbexport import (
+    database_export_run_complete,
+    database_export_run_in_progress,
+    DatabaseExportCheckpoint,
+    export_collection_to_database,
+    export_task_class_to_database,
+    start_database_export_run,
+)
+from camcops_server.cc_modules.cc_dump import DumpController
+from camcops_server.cc_modules.cc_export import schedule_whole_database_export
+from camcops_server.cc_modules.cc_exportmodels import ExportedTask
+from camcops_server.cc_modules.cc_exportrecipient import ExportRecipient
+from camcops_server.cc_modules.cc_exportrecipientinfo import (
+    ExportRecipientInfo,
+)
+from camcops_server.cc_modules.cc_simpleobjects import TaskExportOptions
+from camcops_server.cc_modules.cc_sqlalchemy import make_file_sqlite_engine
+from camcops_server.cc_modules.cc_taskcollection import TaskCollection
+from camcops_server.cc_modules.cc_taskfilter import TaskFilter
+from camcops_server.cc_modules.cc_unittest import BasicDatabaseTestCase
+from camcops_server.tasks.bmi import Bmi
+from camcops_server.tasks.phq9 import Phq9
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+
+class DatabaseExportTests(BasicDatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        patient = self.create_patient(id=1)
+        self.phq9s = []  # type: List[Phq9]
+        self.bmis = []  # type: List[Bmi]
+        for task_id in range(1, 8):
+            task = Phq9() if task_id <= 5 else Bmi()
+            self.apply_standard_task_fields(task)
+            task.id = task_id
+            task.patient_id = patient.id
+            self.dbsession.add(task)
+            (self.phq9s if task_id <= 5 else self.bmis).append(task)
+        self.recipient = ExportRecipient(ExportRecipientInfo())
+        # auto increment doesn't work for BigInteger with SQLite
+        self.recipient.id = 1
+        self.recipient.recipient_name = "test"
+        self.recipient.primary_idnum = 1
+        self.dbsession.add(self.recipient)
+        self.dbsession.commit()
+        export_ids = itertools.count(1)
+
+        def set_export_id(mapper, connection, target: ExportedTask) -> None:
+            target.id = next(export_ids)
+
+        event.listen(ExportedTask, "before_insert", set_export_id)
+        self.addCleanup(
+            event.remove, ExportedTask, "before_insert", set_export_id
+        )
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.checkpoint_dir = os.path.join(self.tmpdir.name, "checkpoints")
+        self.dst_engine = make_file_sqlite_engine(
+            os.path.join(self.tmpdir.name, "dst.sqlite")
+        )
+
+    def tearDown(self) -> None:
+        self.dst_engine.dispose()
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def get_collection(self) -> TaskCollection:
+        taskfilter = TaskFilter()
+        taskfilter.task_types = [Phq9.__tablename__, Bmi.__tablename__]
+        return TaskCollection(
+            self.req, taskfilter=taskfilter, as_dump=True, via_index=False
+        )
+
+    def get_controller(self, **kwargs: Any) -> DumpController:
+        return DumpController(
+            dst_engine=self.dst_engine,
+            dst_session=sessionmaker(bind=self.dst_engine)(),
+            export_options=TaskExportOptions(
+                db_make_all_tables_even_empty=True
+            ),
+            req=self.req,
+            **kwargs,
+        )
+
+    def export(self, **kwargs: Any) -> int:
+        resuming = start_database_export_run(
+            self.checkpoint_dir, [Phq9.__tablename__, Bmi.__tablename__]
+        )
+        controller = self.get_controller(
+            insert_batch_size=2,
+            tables_may_exist=resuming,
+            skip_existing_shared_rows=resuming,
+        )
+        return export_collection_to_database(
+            req=self.req,
+            recipient=self.recipient,
+            collection=self.get_collection(),
+            controller=controller,
+            checkpoint_dir=self.checkpoint_dir,
+            resuming=resuming,
+            **kwargs,
+        )
+
+    def dst_pks(self, tablename: str) -> List[int]:
+        with self.dst_engine.connect() as connection:
+            return sorted(
+                row[0]
+                for row in connection.execute(
+                    text(f"SELECT _pk FROM {tablename}")
+                )
+            )
+
+    def assert_all_exported(self) -> None:
+        self.assertEqual(
+            self.dst_pks(Phq9.__tablename__), sorted(t.pk for t in self.phq9s)
+        )
+        self.assertEqual(
+            self.dst_pks(Bmi.__tablename__), sorted(t.pk for t in self.bmis)
+        )
+        self.assertEqual(len(self.dst_pks("patient")), 1)
+
+    def test_export_in_chunks(self) -> None:
+        n = self.export(chunk_size=2)
+        self.assertEqual(n, 7)
+        self.assert_all_exported()
+        self.assertEqual(
+            self.dbsession.query(ExportedTask)
+            .filter(ExportedTask.success == True)  # noqa: E712
+            .count(),
+            7,
+        )
+        self.assertFalse(database_export_run_in_progress(self.checkpoint_dir))
+
+    def test_interrupted_export_resumes(self) -> None:
+        real_copy_tasks = DumpController.copy_tasks
+        calls = []
+
+        def failing_copy_tasks(controller: DumpController, tasks) -> None:
+            calls.append(len(tasks))
+            if len(calls) == 2:
+                raise RuntimeError("interrupted")
+            real_copy_tasks(controller, tasks)
+
+        with mock.patch.object(
+            DumpController, "copy_tasks", failing_copy_tasks
+        ):
+            with self.assertRaises(RuntimeError):
+                self.export(chunk_size=2)
+        self.assertEqual(len(self.dst_pks(Phq9.__tablename__)), 2)
+        checkpoint = DatabaseExportCheckpoint.load(
+            self.checkpoint_dir, Phq9.__tablename__
+        )
+        self.assertEqual(checkpoint.n_tasks, 2)
+        self.assertFalse(checkpoint.complete)
+
+        n = self.export(chunk_size=2)
+        self.assertEqual(n, 5)
+        self.assert_all_exported()
+
+    def test_task_classes_exported_separately(self) -> None:
+        start_database_export_run(
+            self.checkpoint_dir, [Phq9.__tablename__, Bmi.__tablename__]
+        )
+        self.get_controller().dst_session.commit()  # creates tables
+        lockfilename = os.path.join(self.tmpdir.name, "shared_rows")
+        for task_class in (Phq9, Bmi):
+            self.assertFalse(database_export_run_complete(self.checkpoint_dir))
+            export_task_class_to_database(
+                req=self.req,
+                recipient=self.recipient,
+                collection=self.get_collection(),
+                task_class=task_class,
+                controller=self.get_controller(
+                    tables_may_exist=True,
+                    skip_existing_shared_rows=True,
+                    defer_shared_rows=True,
+                ),
+                checkpoint_dir=self.checkpoint_dir,
+                resuming=True,
+                shared_rows_lockfilename=lockfilename,
+            )
+        self.assertTrue(database_export_run_complete(self.checkpoint_dir))
+        self.assert_all_exported()
+
+    def test_scheduled_export_with_no_task_classes_finishes_run(self) -> None:
+        # An unfinished run, from an earlier export:
+        start_database_export_run(self.checkpoint_dir, [Phq9.__tablename__])
+        collection = mock.Mock(task_classes=mock.Mock(return_value=[]))
+        cfg = self.req.config
+        with mock.patch.object(
+            cfg,
+            "get_export_db_checkpoint_dir",
+            return_value=self.checkpoint_dir,
+        ), mock.patch.object(
+            cfg,
+            "get_export_lockfilename_recipient_db",
+            return_value=os.path.join(self.tmpdir.name, "db"),
+        ), mock.patch(
+            "camcops_server.cc_modules.cc_export.get_collection_for_export",
+            return_value=collection,
+        ), mock.patch(
+            "camcops_server.cc_modules.cc_export._get_db_export_controller",
+            return_value=self.get_controller(),
+        ), mock.patch(
+            "camcops_server.cc_modules.celery."
+            "export_database_task_class_backend"
+        ) as mock_backend:
+            schedule_whole_database_export(self.req, self.recipient)
+        mock_backend.delay.assert_not_called()
+        self.assertFalse(database_export_run_in_progress(self.checkpoint_dir))
@@ -36,7 +36,11 @@ from cardinal_pythonlib.nhs import generate_random_nhs_number
 import pendulum
 from requests.exceptions import HTTPError
 
-from camcops_server.cc_modules.cc_constants import FHIRConst as Fc, JSON_INDENT
+from camcops_server.cc_modules.cc_constants import (
+    FHIRConst as Fc,
+    FileType,
+    JSON_INDENT,
+)
 from camcops_server.cc_modules.cc_exportmodels import (
     ExportedTask,
     ExportedTaskFhir,
@@ -50,7 +54,9 @@ from camcops_server.cc_modules.cc_fhir import (
     fhir_reference_from_identifier,
     fhir_sysval_from_id,
     FhirExportException,
+    FhirExportSession,
     FhirTaskExporter,
+    get_fhir_export_session,
 )
 from camcops_server.cc_modules.cc_pyramid import Routes
 from camcops_server.cc_modules.cc_unittest import DemoDatabaseTestCase
@@ -511,6 +517,147 @@ class FhirTaskExporterPhq9Tests(FhirExportTestCase):
         self.assertIn("must be initialized with `base_uri`", message)
 
 
+# =============================================================================
+# Export sessions: several tasks to one recipient
+# =============================================================================
+
+
+class FhirExportSessionTests(FhirExportTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        # Faster than PDF (and doesn't need wkhtmltopdf):
+        self.recipient.task_format = FileType.HTML
+
+    def create_tasks(self) -> None:
+        self.create_fhir_patient()
+
+        self.tasks = []  # type: List[Phq9]
+        for _ in range(2):
+            task = Phq9()
+            self.apply_standard_task_fields(task)
+            task.q1 = 1
+            task.patient_id = self.patient.id
+            task.save_with_next_available_id(self.req, self.patient._device_id)
+            self.tasks.append(task)
+        self.dbsession.commit()
+
+    def export(self, task: Phq9, session: FhirExportSession) -> Dict:
+        """
+        Exports a task via the session, and returns the JSON sent.
+        """
+        exported_task = ExportedTask(task=task, recipient=self.recipient)
+        exported_task_fhir = ExportedTaskFhir(exported_task)
+        exporter = MockFhirTaskExporter(
+            self.req, exported_task_fhir, session=session
+        )
+        response_json = {Fc.TYPE: Fc.TRANSACTION_RESPONSE}
+        with mock.patch.object(
+            exporter.client.server,
+            "post_json",
+            return_value=MockFhirResponse(response_json),
+        ) as mock_post:
+            exporter.export_task()
+        args, kwargs = mock_post.call_args
+        return args[1]
+
+    @staticmethod
+    def resource_types(sent_json: Dict) -> List[str]:
+        return [
+            entry[Fc.RESOURCE][Fc.RESOURCE_TYPE]
+            for entry in sent_json[Fc.ENTRY]
+        ]
+
+    def test_questionnaire_sent_once(self) -> None:
+        session = get_fhir_export_session(self.req, self.recipient)
+
+        first = self.export(self.tasks[0], session)
+        second = self.export(self.tasks[1], session)
+
+        self.assertEqual(
+            self.resource_types(first).count(Fc.RESOURCE_TYPE_QUESTIONNAIRE),
+            1,
+        )
+        self.assertNotIn(
+            Fc.RESOURCE_TYPE_QUESTIONNAIRE, self.resource_types(second)
+        )
+
+        # The response still refers to the questionnaire:
+        qr = [
+            entry[Fc.RESOURCE]
+            for entry in second[Fc.ENTRY]
+            if entry[Fc.RESOURCE][Fc.RESOURCE_TYPE]
+            == Fc.RESOURCE_TYPE_QUESTIONNAIRE_RESPONSE
+        ][0]
+        q_identifier = self.tasks[1]._get_fhir_questionnaire_id(self.req)
+        self.assertEqual(
+            qr[Fc.QUESTIONNAIRE], fhir_sysval_from_id(q_identifier)
+        )
+
+    def test_questionnaire_resent_after_failure(self) -> None:
+        session = get_fhir_export_session(self.req, self.recipient)
+
+        exported_task = ExportedTask(
+            task=self.tasks[0], recipient=self.recipient
+        )
+        exporter = MockFhirTaskExporter(
+            self.req, ExportedTaskFhir(exported_task), session=session
+        )
+        with mock.patch.object(
+            exporter.client.server,
+            "post_json",
+            side_effect=HTTPError(response=mock.Mock(text="Failed")),
+        ):
+            with self.assertRaises(FhirExportException):
+                exporter.export_task()
+
+        sent = self.export(self.tasks[1], session)
+        self.assertIn(
+            Fc.RESOURCE_TYPE_QUESTIONNAIRE, self.resource_types(sent)
+        )
+
+    def test_questionnaire_same_as_without_session(self) -> None:
+        session = get_fhir_export_session(self.req, self.recipient)
+        with_session = self.export(self.tasks[0], session)
+        without_session = (
+            self.tasks[0].get_fhir_bundle(self.req, self.recipient).as_json()
+        )
+
+        def questionnaire(sent_json: Dict) -> Dict:
+            return [
+                entry
+                for entry in sent_json[Fc.ENTRY]
+                if entry[Fc.RESOURCE][Fc.RESOURCE_TYPE]
+                == Fc.RESOURCE_TYPE_QUESTIONNAIRE
+            ][0]
+
+        self.assertEqual(
+            questionnaire(with_session), questionnaire(without_session)
+        )
+
+    def test_one_session_and_client_per_recipient(self) -> None:
+        session = get_fhir_export_session(self.req, self.recipient)
+        self.assertIs(
+            get_fhir_export_session(self.req, self.recipient), session
+        )
+        exporters = [
+            FhirTaskExporter(
+                self.req,
+                ExportedTaskFhir(
+                    ExportedTask(task=task, recipient=self.recipient)
+                ),
+                session=session,
+            )
+            for task in self.tasks
+        ]
+        self.assertIs(exporters[0].client, exporters[1].client)
+
+        # A change of server means a new session:
+        self.recipient.fhir_api_url = "https://other.example.com/fhir"
+        self.assertIsNot(
+            get_fhir_export_session(self.req, self.recipient), session
+        )
+
+
 # =============================================================================
 # A generic anonymous task: APEQPT
 # =============================================================================
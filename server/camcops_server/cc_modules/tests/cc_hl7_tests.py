@@ -24,17 +24,30 @@ camcops_server/cc_modules/tests/cc_hl7_tests.py
 ===============================================================================
 """
 
+import socketserver
+import threading
+import time
+from typing import List
+from unittest import TestCase
+
 import hl7
 from pendulum import Date, DateTime as Pendulum
 
 from camcops_server.cc_modules.cc_constants import FileType
 from camcops_server.cc_modules.cc_hl7 import (
+    CR,
+    EB,
     escape_hl7_text,
+    get_acknowledged_control_id,
+    get_message_control_id,
     get_mod11_checkdigit,
     make_msh_segment,
     make_obr_segment,
     make_obx_segment,
     make_pid_segment,
+    MLLPConnectionPool,
+    SB,
+    SEGMENT_SEPARATOR,
 )
 from camcops_server.cc_modules.cc_simpleobjects import (
     HL7PatientIdentifier,
@@ -103,3 +116,167 @@ class HL7CoreTests(DemoDatabaseTestCase):
                     hl7.Segment,
                 )
         self.assertIsInstance(escape_hl7_text("blahblah"), str)
+
+
+# =============================================================================
+# MLLP connection pool tests
+# =============================================================================
+
+
+class AckServer(socketserver.ThreadingTCPServer):
+    """
+    Local MLLP server that acknowledges every message.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), AckHandler)
+        self.n_connections = 0
+        self.n_closed = 0  # connections closed by us
+        self.received = []  # type: List[str]  # control IDs received
+        self.close_after = None  # close connections after this many messages
+        self.drop_next = False  # close, without replying, on next message?
+        self.batch_replies = 1  # reply to this many messages at once...
+        self.reverse_replies = False  # ... in reverse order?
+
+
+class AckHandler(socketserver.BaseRequestHandler):
+    server: AckServer
+
+    def handle(self) -> None:
+        self.server.n_connections += 1
+        try:
+            self._handle()
+        finally:
+            self.request.close()
+            self.server.n_closed += 1
+
+    def _handle(self) -> None:
+        buffer = b""
+        pending = []  # type: List[str]
+        n_received = 0
+        while True:
+            chunk = self.request.recv(4096)
+            if not chunk:
+                return
+            buffer += chunk
+            while (EB + CR).encode() in buffer:
+                frame, buffer = buffer.split((EB + CR).encode(), 1)
+                message = frame.decode().lstrip(SB)
+                self.server.received.append(get_message_control_id(message))
+                if self.server.drop_next:
+                    self.server.drop_next = False
+                    return
+                pending.append(message)
+                n_received += 1
+                if len(pending) >= self.server.batch_replies:
+                    if self.server.reverse_replies:
+                        pending.reverse()
+                    for m in pending:
+                        self.request.sendall(self.ack(m))
+                    pending = []
+                if n_received == self.server.close_after:
+                    return
+
+    @staticmethod
+    def ack(message: str) -> bytes:
+        control_id = get_message_control_id(message)
+        ack = SEGMENT_SEPARATOR.join(
+            [
+                f"MSH|^~\\&|||||20200101000000||ACK|A{control_id}|P|2.3",
+                f"MSA|AA|{control_id}",
+            ]
+        )
+        return (SB + ack + CR + EB + CR).encode()
+
+
+class MLLPConnectionPoolTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.server = AckServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        host, port = self.server.server_address
+        self.pool = MLLPConnectionPool(host, port, timeout_ms=5000)
+
+    def tearDown(self) -> None:
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    @staticmethod
+    def make_message(control_id: int) -> str:
+        return SEGMENT_SEPARATOR.join(
+            [
+                f"MSH|^~\\&|CamCOPS||||20200101000000||ORU^R01|"
+                f"{control_id}|P|2.3",
+                "PID|||123",
+            ]
+        )
+
+    def test_connection_reused(self) -> None:
+        for i in range(5):
+            result = self.pool.send_message(self.make_message(i))
+            self.assertTrue(result.replied)
+            self.assertIsNotNone(result.latency_s)
+            self.assertEqual(get_acknowledged_control_id(result.reply), str(i))
+        self.assertEqual(self.server.n_connections, 1)
+
+    def wait_for_server_to_close(self, n_closed: int) -> None:
+        deadline = time.monotonic() + 5
+        while self.server.n_closed < n_closed:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_reconnects_when_server_closes_idle_connection(self) -> None:
+        self.server.close_after = 2
+        for i in range(5):
+            result = self.pool.send_message(self.make_message(i))
+            self.assertTrue(result.replied, result.error)
+            self.assertEqual(get_acknowledged_control_id(result.reply), str(i))
+            self.wait_for_server_to_close((i + 1) // 2)
+        self.assertEqual(self.server.n_connections, 3)
+        self.assertEqual(self.server.received, [str(i) for i in range(5)])
+
+    def test_message_not_resent_if_connection_drops_before_reply(
+        self,
+    ) -> None:
+        self.assertTrue(self.pool.send_message(self.make_message(1)).replied)
+        self.server.drop_next = True
+        result = self.pool.send_message(self.make_message(2))
+        self.assertFalse(result.replied)
+        self.assertEqual(self.server.received, ["1", "2"])
+        self.assertEqual(self.server.n_connections, 1)
+
+    def test_idle_connections_expire(self) -> None:
+        self.pool.max_idle_s = 0
+        for i in range(2):
+            self.assertTrue(
+                self.pool.send_message(self.make_message(i)).replied
+            )
+            time.sleep(0.01)
+        self.assertEqual(self.server.n_connections, 2)
+
+    def test_pipelined_replies_matched_by_control_id(self) -> None:
+        self.server.batch_replies = 3
+        self.server.reverse_replies = True
+        messages = [self.make_message(i) for i in range(9)]
+        results = self.pool.send_messages(messages, max_in_flight=3)
+        self.assertEqual(
+            [get_acknowledged_control_id(r.reply) for r in results],
+            [str(i) for i in range(9)],
+        )
+        self.assertEqual(self.server.n_connections, 1)
+
+    def test_unreachable_server(self) -> None:
+        host, port = self.server.server_address
+        self.server.shutdown()
+        self.server.server_close()
+        pool = MLLPConnectionPool(host, port, timeout_ms=1000)
+        result = pool.send_message(self.make_message(1))
+        self.assertFalse(result.replied)
+        self.assertTrue(result.error)
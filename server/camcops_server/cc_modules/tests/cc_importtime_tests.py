@@ -0,0 +1,82 @@
+"""
+camcops_server/cc_modules/tests/cc_importtime_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+import io
+from unittest import TestCase
+
+from camcops_server.cc_modules.cc_importtime import (
+    measure_import_times,
+    ModuleImportTime,
+    parse_importtime_output,
+    report_import_times,
+)
+
+IMPORTTIME_OUTPUT = """import time: self [us] | cumulative | imported package
+import time:        80 |         80 |   _io
+import time:       400 |        480 | io
+some warning
+import time:      1000 |       1500 |     b.c
+import time:       300 |       1800 |   b
+import time:        50 |       1850 | a
+"""
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+
+class ImportTimeTests(TestCase):
+    def test_parse(self) -> None:
+        times = parse_importtime_output(IMPORTTIME_OUTPUT)
+        self.assertEqual(
+            times,
+            [
+                ModuleImportTime("_io", 80, 80, 1),
+                ModuleImportTime("io", 400, 480, 0),
+                ModuleImportTime("b.c", 1000, 1500, 2),
+                ModuleImportTime("b", 300, 1800, 1),
+                ModuleImportTime("a", 50, 1850, 0),
+            ],
+        )
+
+    def test_report(self) -> None:
+        f = io.StringIO()
+        report_import_times(
+            parse_importtime_output(IMPORTTIME_OUTPUT), top_n=1, file=f
+        )
+        lines = f.getvalue().splitlines()
+        self.assertEqual(lines[0], "Imported 5 modules in 0.002 s")
+        self.assertIn("   0.001     0.002  b.c", lines)
+        self.assertIn("   0.000     0.002  a", lines)
+        self.assertNotIn("   0.000     0.000  _io", lines)
+
+    def test_measure(self) -> None:
+        times = measure_import_times("json")
+        self.assertIn("json", [t.module for t in times])
+        with self.assertRaises(RuntimeError):
+            measure_import_times("no_such_module_exists")
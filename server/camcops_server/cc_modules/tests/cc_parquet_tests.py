@@ -0,0 +1,164 @@
+"""
+camcops_server/cc_modules/tests/cc_parquet_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+import datetime
+import io
+from unittest import TestCase
+import zipfile
+
+import pendulum
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy.sql.sqltypes import Date, Float, Integer, UnicodeText
+
+from camcops_server.cc_modules.cc_dataclasses import SummarySchemaInfo
+from camcops_server.cc_modules.cc_parquet import (
+    ARROW_CATEGORY,
+    write_parquet_zip,
+)
+from camcops_server.cc_modules.cc_spreadsheet import (
+    SpreadsheetPage,
+    StreamingSpreadsheetCollection,
+)
+from camcops_server.cc_modules.cc_sqla_coltypes import (
+    PendulumDateTimeAsIsoTextColType,
+)
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+
+def schema_info(
+    column_name: str, coltype, source: str = SummarySchemaInfo.SSV_DB
+) -> SummarySchemaInfo:
+    return SummarySchemaInfo(
+        table_name="t",
+        source=source,
+        column_name=column_name,
+        data_type=str(coltype),
+        comment=f"Comment for {column_name}",
+        coltype=coltype,
+    )
+
+
+class ParquetTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.when = pendulum.datetime(2020, 7, 2, 3, 4, 5, tz="Europe/London")
+        self.coll = StreamingSpreadsheetCollection()
+        self.coll.add_pages(
+            [
+                SpreadsheetPage(
+                    name="t",
+                    rows=[
+                        {
+                            "id": i,
+                            "score": i if i % 2 else i + 0.5,
+                            "when": self.when,
+                            "dob": datetime.date(2000, 1, 1),
+                            "category": "high" if i % 2 else "low",
+                            "note": None,
+                            "untyped": True,
+                        }
+                        for i in range(5)
+                    ],
+                ),
+                SpreadsheetPage(name="u", rows=[{"x": "a"}, {"x": 1}]),
+            ]
+        )
+        self.schema_elements = [
+            schema_info("id", Integer()),
+            schema_info("score", Float()),
+            schema_info("when", PendulumDateTimeAsIsoTextColType()),
+            schema_info("dob", Date()),
+            schema_info("note", UnicodeText()),
+            schema_info(
+                "category", UnicodeText(), source=SummarySchemaInfo.SSV_SUMMARY
+            ),
+        ]
+
+    def tearDown(self) -> None:
+        self.coll.close()
+        super().tearDown()
+
+    def write(self, **kwargs) -> zipfile.ZipFile:
+        buffer = io.BytesIO()
+        write_parquet_zip(
+            self.coll, buffer, schema_elements=self.schema_elements, **kwargs
+        )
+        return zipfile.ZipFile(buffer, "r")
+
+    @staticmethod
+    def read(zf: zipfile.ZipFile, filename: str) -> pq.ParquetFile:
+        return pq.ParquetFile(io.BytesIO(zf.read(filename)))
+
+    def test_one_file_per_page(self) -> None:
+        zf = self.write()
+        self.assertEqual(zf.namelist(), ["t.parquet", "u.parquet"])
+
+    def test_column_types(self) -> None:
+        schema = self.read(self.write(), "t.parquet").schema_arrow
+        self.assertEqual(schema.field("id").type, pa.int64())
+        self.assertEqual(schema.field("score").type, pa.float64())
+        self.assertEqual(
+            schema.field("when").type, pa.timestamp("us", tz="UTC")
+        )
+        self.assertEqual(schema.field("dob").type, pa.date32())
+        self.assertEqual(schema.field("note").type, pa.string())
+        self.assertEqual(schema.field("category").type, ARROW_CATEGORY)
+        self.assertEqual(schema.field("untyped").type, pa.bool_())
+        self.assertEqual(
+            schema.field("id").metadata, {b"comment": b"Comment for id"}
+        )
+
+    def test_mixed_untyped_values_stored_as_text(self) -> None:
+        table = self.read(self.write(), "u.parquet").read(use_threads=False)
+        self.assertEqual(table.column("x").to_pylist(), ["a", "1"])
+
+    def test_values(self) -> None:
+        table = self.read(self.write(), "t.parquet").read(use_threads=False)
+        self.assertEqual(
+            table.column("score").to_pylist(), [0.5, 1.0, 2.5, 3.0, 4.5]
+        )
+        self.assertEqual(
+            table.column("category").to_pylist(),
+            ["low", "high", "low", "high", "low"],
+        )
+        when = table.column("when").to_pylist()[0]
+        self.assertEqual(when, self.when)
+        self.assertEqual(when.utcoffset(), datetime.timedelta(0))
+
+    def test_row_groups(self) -> None:
+        pf = self.read(self.write(row_group_size=2), "t.parquet")
+        self.assertEqual(pf.metadata.num_row_groups, 3)
+        self.assertEqual(pf.metadata.num_rows, 5)
+        # Statistics allow readers to skip row groups:
+        id_col = pf.schema_arrow.get_field_index("id")
+        stats = pf.metadata.row_group(1).column(id_col).statistics
+        self.assertEqual((stats.min, stats.max), (2, 3))
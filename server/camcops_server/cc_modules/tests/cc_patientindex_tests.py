@@ -0,0 +1,135 @@
+"""
+camcops_server/cc_modules/tests/cc_patientindex_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+from typing import List, Tuple
+from unittest import TestCase
+
+from camcops_server.cc_modules.cc_patient import Patient
+from camcops_server.cc_modules.cc_patientidnum import PatientIdNum
+from camcops_server.cc_modules.cc_patientindex import (
+    distinct_patients,
+    patient_identity_keys,
+    PatientIdentityIndex,
+)
+
+
+# =============================================================================
+# Helpers
+# =============================================================================
+
+RIO = 1
+NHS = 2
+
+
+def make_patient(
+    client_id: int,
+    device_id: int = 1,
+    era: str = "NOW",
+    idnums: List[Tuple[int, int]] = None,
+) -> Patient:
+    patient = Patient(id=client_id, _device_id=device_id, _era=era)
+    # The "idnums" relationship is view-only, so we set it on the instance
+    # dictionary directly, as if it had been loaded.
+    patient.__dict__["idnums"] = [
+        PatientIdNum(which_idnum=which, idnum_value=value)
+        for which, value in (idnums or [])
+    ]
+    return patient
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+
+class PatientIdentityKeyTests(TestCase):
+    def test_keys_include_client_id_and_idnums(self) -> None:
+        p = make_patient(3, device_id=2, era="x", idnums=[(RIO, 99)])
+        self.assertEqual(
+            patient_identity_keys(p),
+            [("client", 2, "x", 3), ("idnum", RIO, 99)],
+        )
+
+    def test_incomplete_keys_omitted(self) -> None:
+        p = make_patient(None, idnums=[(RIO, None), (None, 5)])
+        self.assertEqual(patient_identity_keys(p), [])
+
+
+class PatientIdentityIndexTests(TestCase):
+    def test_same_client_id_grouped(self) -> None:
+        p1 = make_patient(1)
+        p2 = make_patient(1)
+        p3 = make_patient(1, device_id=2)
+        index = PatientIdentityIndex()
+        for p in (p1, p2, p3):
+            index.add(p, p)
+        self.assertEqual(index.groups(), [[p1, p2], [p3]])
+        self.assertTrue(index.same_patient(p1, p2))
+        self.assertFalse(index.same_patient(p1, p3))
+
+    def test_shared_idnum_grouped(self) -> None:
+        p1 = make_patient(1, idnums=[(NHS, 5)])
+        p2 = make_patient(2, device_id=7, idnums=[(NHS, 5)])
+        self.assertEqual(p1, p2)
+        self.assertEqual(len(distinct_patients([p1, p2])), 1)
+
+    def test_transitive_identity(self) -> None:
+        # The "IMPERFECT" case from Patient.__eq__.
+        p1 = make_patient(1, idnums=[(RIO, 3)])
+        p2 = make_patient(2, idnums=[(RIO, 3), (NHS, 5)])
+        p3 = make_patient(3, idnums=[(NHS, 5)])
+        self.assertNotEqual(p1, p3)
+        # Order matters for naive approaches; try P1, P3, then P2 (which
+        # must merge two existing groups).
+        index = PatientIdentityIndex()
+        index.add(p1, "a")
+        index.add(p3, "c")
+        self.assertFalse(index.same_patient(p1, p3))
+        index.add(p2, "b")
+        self.assertTrue(index.same_patient(p1, p3))
+        self.assertEqual(index.groups(), [["a", "c", "b"]])
+
+    def test_same_object_added_twice(self) -> None:
+        p1 = make_patient(1)
+        index = PatientIdentityIndex()
+        index.add(p1, "a")
+        index.add(p1, "b")
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.groups(), [["a", "b"]])
+
+    def test_group_id_of_unknown_patient(self) -> None:
+        index = PatientIdentityIndex()
+        index.add(make_patient(1, idnums=[(RIO, 3)]))
+        self.assertIsNone(index.group_id(make_patient(2)))
+        self.assertIsNotNone(
+            index.group_id(make_patient(9, idnums=[(RIO, 3)]))
+        )
+
+    def test_many_patients(self) -> None:
+        n = 10000
+        patients = [make_patient(i, idnums=[(NHS, i // 2)]) for i in range(n)]
+        self.assertEqual(len(distinct_patients(patients)), n // 2)
@@ -0,0 +1,134 @@
+"""
+camcops_server/cc_modules/tests/cc_pdf_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+import threading
+import time
+from typing import Any, List, Set
+from unittest import mock
+
+from pyramid.renderers import render
+
+from camcops_server.cc_modules.cc_pdf import PdfJob, pdfs_from_jobs
+from camcops_server.cc_modules.cc_task import make_task_pdfs_in_advance
+from camcops_server.cc_modules.cc_unittest import BasicDatabaseTestCase
+from camcops_server.tasks.phq9 import Phq9
+
+GET_PDF_FROM_HTML = "camcops_server.cc_modules.cc_pdf.get_pdf_from_html"
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+
+class PdfTests(BasicDatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.patient = self.create_patient(
+            id=1, forename="Jo", surname="Patient"
+        )
+        self.phq9s = []  # type: List[Phq9]
+        for task_id in range(1, 4):
+            phq9 = Phq9()
+            self.apply_standard_task_fields(phq9)
+            phq9.id = task_id
+            phq9.patient_id = self.patient.id
+            self.dbsession.add(phq9)
+            self.phq9s.append(phq9)
+        self.dbsession.commit()
+
+    def test_page_header_matches_direct_rendering(self) -> None:
+        task = self.phq9s[0]
+        job = task.get_pdf_job(self.req)
+        expected = render(
+            "wkhtmltopdf_header.mako",
+            dict(
+                inner_text=render(
+                    "task_page_header.mako",
+                    dict(task=task, anonymise=False),
+                    request=self.req,
+                )
+            ),
+            request=self.req,
+        )
+        self.assertEqual(job.header_html, expected)
+        self.assertIn("PATIENT", job.header_html)
+        # Header shared by the patient's tasks; footers aren't.
+        other_job = self.phq9s[1].get_pdf_job(self.req)
+        self.assertEqual(other_job.header_html, job.header_html)
+
+    def test_anonymised_page_header(self) -> None:
+        job = self.phq9s[0].get_pdf_job(self.req, anonymise=True)
+        self.assertNotIn("PATIENT", job.header_html)
+
+    def test_jobs_run_concurrently_in_order(self) -> None:
+        self.req.config.pdf_workers = 3
+        running = set()  # type: Set[int]
+        max_running = [0]
+        lock = threading.Lock()
+
+        def fake_pdf(html: str, **kwargs: Any) -> bytes:
+            with lock:
+                running.add(threading.get_ident())
+                max_running[0] = max(max_running[0], len(running))
+            time.sleep(0.05)
+            with lock:
+                running.discard(threading.get_ident())
+            return html.encode("utf-8")
+
+        jobs = [PdfJob(str(i)) for i in range(6)]
+        with mock.patch(GET_PDF_FROM_HTML, side_effect=fake_pdf):
+            pdfs = pdfs_from_jobs(self.req, jobs)
+        self.assertEqual(pdfs, [str(i).encode("utf-8") for i in range(6)])
+        self.assertGreater(max_running[0], 1)
+
+    def test_failures_skipped_if_requested(self) -> None:
+        def fake_pdf(html: str, **kwargs: Any) -> bytes:
+            if html == "bad":
+                raise OSError("wkhtmltopdf failed")
+            return b"ok"
+
+        jobs = [PdfJob("good"), PdfJob("bad")]
+        with mock.patch(GET_PDF_FROM_HTML, side_effect=fake_pdf):
+            self.assertEqual(
+                pdfs_from_jobs(self.req, jobs, skip_failures=True),
+                [b"ok", None],
+            )
+            with self.assertRaises(OSError):
+                pdfs_from_jobs(self.req, jobs)
+
+    def test_pdfs_made_in_advance_used_once(self) -> None:
+        self.req.config.pdf_workers = 2
+        with mock.patch(GET_PDF_FROM_HTML, return_value=b"pdf") as mock_make:
+            make_task_pdfs_in_advance(self.req, self.phq9s)
+            self.assertEqual(mock_make.call_count, 3)
+            for task in self.phq9s:
+                self.assertEqual(task.get_pdf(self.req), b"pdf")
+            self.assertEqual(mock_make.call_count, 3)
+            # Not kept after use:
+            self.phq9s[0].get_pdf(self.req)
+            self.assertEqual(mock_make.call_count, 4)
@@ -25,12 +25,19 @@ camcops_server/cc_modules/tests/cc_policy_tests.py
 """
 
 import logging
-from typing import Dict
+import random
+import time
+from typing import Dict, List
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from pendulum import Date
+import pytest
 
-from camcops_server.cc_modules.cc_policy import TokenizedPolicy
+from camcops_server.cc_modules.cc_policy import (
+    compile_id_policy,
+    Q_TRUE,
+    TokenizedPolicy,
+)
 from camcops_server.cc_modules.cc_simpleobjects import (
     BarePatientInfo,
     IdNumReference,
@@ -317,3 +324,150 @@ class PolicyTests(ExtendedTestCase):
             if tp.ptinfo_satisfies_id_policy is not None:
                 self.assertEqual(x, tp.ptinfo_satisfies_id_policy)
                 log.info(correct_msg)
+
+
+class CompiledPolicyTests(ExtendedTestCase):
+    """
+    Tests that compiled policies agree with the token-walking evaluator.
+    """
+
+    INFO_WORDS = [
+        "forename",
+        "surname",
+        "sex",
+        "dob",
+        "address",
+        "email",
+        "gp",
+        "otherdetails",
+        "otheridnum",
+        "anyidnum",
+        "idnum1",
+        "idnum2",
+        "idnum3",
+    ]
+
+    def random_policy(self, rng: random.Random, depth: int = 0) -> str:
+        n_items = rng.randint(1, 3)
+        parts = []  # type: List[str]
+        for i in range(n_items):
+            if i > 0:
+                parts.append(rng.choice(["AND", "OR"]))
+            if rng.random() < 0.2:
+                parts.append("NOT")
+            if depth < 2 and rng.random() < 0.3:
+                parts.append(f"({self.random_policy(rng, depth + 1)})")
+            else:
+                parts.append(rng.choice(self.INFO_WORDS))
+        policy = " ".join(parts)
+        if rng.random() < 0.05:
+            # Make it syntactically invalid
+            policy += rng.choice([" AND", " (", " )", " sex", " NOT"])
+        return policy
+
+    @staticmethod
+    def random_ptinfo(rng: random.Random) -> BarePatientInfo:
+        def maybe(value: str) -> str:
+            return rng.choice([None, "", value])
+
+        idnums = [
+            IdNumReference(
+                which_idnum=rng.randint(1, 4),
+                idnum_value=rng.choice([None, 123]),
+            )
+            for _ in range(rng.randint(0, 3))
+        ]
+        # noinspection PyTypeChecker
+        return BarePatientInfo(
+            forename=maybe("Jo"),
+            surname=maybe("Smith"),
+            sex=maybe("F"),
+            dob=rng.choice([None, Date(2000, 1, 1)]),
+            address=maybe("1 Main St"),
+            email=maybe("jo@example.com"),
+            gp=maybe("Dr X"),
+            otherdetails=maybe("x"),
+            idnum_definitions=idnums,
+        )
+
+    def test_agrees_with_interpreter(self) -> None:
+        rng = random.Random(1234)
+        ptinfos = [self.random_ptinfo(rng) for _ in range(50)]
+        for _ in range(300):
+            policy_str = self.random_policy(rng)
+            policy = TokenizedPolicy(policy_str)
+            compiled = policy.compiled()
+            self.assertEqual(
+                compiled.syntactically_valid,
+                policy.is_syntactically_valid(),
+                msg=policy_str,
+            )
+            expected = [
+                # noinspection PyProtectedMember
+                policy._value_for_ptinfo(pt) is Q_TRUE
+                for pt in ptinfos
+            ]
+            self.assertEqual(
+                [compiled.satisfies(pt) for pt in ptinfos],
+                expected,
+                msg=policy_str,
+            )
+            self.assertEqual(
+                policy.satisfies_many(ptinfos), expected, msg=policy_str
+            )
+
+    def test_operators_apply_left_to_right(self) -> None:
+        # noinspection PyTypeChecker
+        ptinfo = BarePatientInfo(forename="Jo")
+        # (forename OR sex) AND surname -- not forename OR (sex AND surname)
+        self.assertFalse(
+            compile_id_policy("forename OR sex AND surname").satisfies(ptinfo)
+        )
+        self.assertTrue(
+            compile_id_policy("surname AND sex OR forename").satisfies(ptinfo)
+        )
+
+    def test_compiled_policies_cached_by_string(self) -> None:
+        a = compile_id_policy("sex AND idnum1")
+        self.assertIs(a, compile_id_policy("sex AND idnum1"))
+        self.assertIs(a, TokenizedPolicy("SEX and IDNUM1").compiled())
+        self.assertIsNot(a, compile_id_policy("sex AND idnum2"))
+
+    def test_invalid_policy_never_satisfied(self) -> None:
+        # noinspection PyTypeChecker
+        ptinfo = BarePatientInfo(sex="M")
+        for policy in (None, "", "sex AND", "(sex", "sex)", "rubbish"):
+            compiled = compile_id_policy(policy)
+            self.assertFalse(compiled.syntactically_valid)
+            self.assertFalse(compiled.satisfies(ptinfo))
+            self.assertEqual(compiled.satisfies_many([ptinfo]), [False])
+
+    @pytest.mark.benchmark
+    def test_compiled_policy_speed(self) -> None:
+        """
+        Run with ``pytest --benchmark -k test_compiled_policy_speed``.
+        """
+        rng = random.Random(1)
+        ptinfos = [self.random_ptinfo(rng) for _ in range(10000)]
+        policy = TokenizedPolicy(
+            "sex AND ((forename AND surname AND dob) OR anyidnum) "
+            "AND (idnum1 OR idnum2)"
+        )
+
+        start = time.perf_counter()
+        for pt in ptinfos:
+            # noinspection PyProtectedMember
+            policy._value_for_ptinfo(pt)
+        interpreted = time.perf_counter() - start
+
+        start = time.perf_counter()
+        policy.satisfies_many(ptinfos)
+        compiled = time.perf_counter() - start
+
+        n = len(ptinfos)
+        log.info(
+            "Interpreted: {:.1f} us/patient; compiled: {:.1f} us/patient",
+            1e6 * interpreted / n,
+            1e6 * compiled / n,
+        )
+        self.assertLess(compiled, interpreted)
@@ -25,13 +25,25 @@ camcops_server/cc_modules/tests/cc_pyramid_tests.py
 
 """
 
+import datetime
+from typing import List
+from urllib.parse import parse_qsl, urlsplit
+
 from pyramid.security import Authenticated, Everyone
 
+from camcops_server.cc_modules.cc_audit import AuditEntry
 from camcops_server.cc_modules.cc_constants import MfaMethod
 from camcops_server.cc_modules.cc_pyramid import (
     CamcopsAuthenticationPolicy,
+    KeysetPage,
     Permission,
+    ViewParam,
+)
+from camcops_server.cc_modules.cc_sqlalchemy import (
+    decode_keyset_cursor,
+    encode_keyset_cursor,
 )
+from camcops_server.cc_modules.cc_taskindex import TaskIndexEntry
 from camcops_server.cc_modules.cc_unittest import BasicDatabaseTestCase
 
 
@@ -128,3 +140,105 @@ class CamcopsAuthenticationPolicyTests(BasicDatabaseTestCase):
             Permission.GROUPADMIN,
             CamcopsAuthenticationPolicy.effective_principals(self.req),
         )
+
+
+class KeysetCursorTests(BasicDatabaseTestCase):
+    def test_cursor_round_trip(self) -> None:
+        columns = [
+            TaskIndexEntry.when_created_utc,
+            TaskIndexEntry.index_entry_pk,
+        ]
+        values = [datetime.datetime(2020, 1, 2, 3, 4, 5, 678), 42]
+        token = encode_keyset_cursor(values)
+        self.assertEqual(decode_keyset_cursor(token, columns), values)
+
+    def test_bad_cursor_ignored(self) -> None:
+        columns = [AuditEntry.id]
+        self.assertIsNone(decode_keyset_cursor("not base64!", columns))
+        self.assertIsNone(
+            decode_keyset_cursor(encode_keyset_cursor([1, 2]), columns)
+        )
+        self.assertIsNone(
+            decode_keyset_cursor(encode_keyset_cursor(["x"]), columns)
+        )
+
+
+class KeysetPageTests(BasicDatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        for i in range(25):
+            self.dbsession.add(
+                AuditEntry(
+                    when_access_utc=datetime.datetime(2020, 1, 1),
+                    source="test",
+                    details=f"entry {i}",
+                )
+            )
+        self.dbsession.flush()
+        self.all_ids = sorted(
+            (e.id for e in self.dbsession.query(AuditEntry)), reverse=True
+        )
+
+    def get_page(self, url: str = None, **kwargs) -> KeysetPage:
+        params = dict(parse_qsl(urlsplit(url).query)) if url else {}
+        self.req.set_get_params(params)
+        return KeysetPage(
+            self.dbsession.query(AuditEntry),
+            key_columns=[AuditEntry.id],
+            request=self.req,
+            items_per_page=10,
+            **kwargs,
+        )
+
+    @staticmethod
+    def ids(page: KeysetPage) -> List[int]:
+        return [e.id for e in page]
+
+    def test_forwards_and_backwards(self) -> None:
+        page1 = self.get_page()
+        self.assertEqual(self.ids(page1), self.all_ids[:10])
+        self.assertIsNone(page1.previous_url)
+        self.assertEqual(page1.item_count, 25)
+
+        page2 = self.get_page(page1.next_url)
+        self.assertEqual(self.ids(page2), self.all_ids[10:20])
+
+        page3 = self.get_page(page2.next_url)
+        self.assertEqual(self.ids(page3), self.all_ids[20:])
+        self.assertIsNone(page3.next_url)
+
+        back = self.get_page(page3.previous_url)
+        self.assertEqual(self.ids(back), self.all_ids[10:20])
+        back = self.get_page(back.previous_url)
+        self.assertEqual(self.ids(back), self.all_ids[:10])
+        self.assertIsNone(back.previous_url)
+
+    def test_last_page(self) -> None:
+        page1 = self.get_page()
+        last = self.get_page(page1.last_url)
+        self.assertEqual(self.ids(last), self.all_ids[15:])
+        self.assertIsNone(last.next_url)
+        self.assertIsNotNone(last.previous_url)
+
+    def test_other_params_kept(self) -> None:
+        self.req.set_get_params({ViewParam.TRUNCATE: "0"})
+        page1 = KeysetPage(
+            self.dbsession.query(AuditEntry),
+            key_columns=[AuditEntry.id],
+            request=self.req,
+            items_per_page=10,
+        )
+        params = dict(parse_qsl(urlsplit(page1.next_url).query))
+        self.assertEqual(params[ViewParam.TRUNCATE], "0")
+        self.assertIn(ViewParam.AFTER, params)
+        self.assertIn(ViewParam.AFTER, page1.pager())
+
+    def test_count_capped(self) -> None:
+        page1 = self.get_page(count_cap=20)
+        self.assertEqual(page1.item_count, 20)
+        self.assertTrue(page1.item_count_is_lower_bound)
+
+    def test_estimated_count_at_least_page_size(self) -> None:
+        page1 = self.get_page(item_count=0)
+        self.assertEqual(page1.item_count, 10)
+        self.assertTrue(page1.item_count_is_estimate)
@@ -38,10 +38,12 @@ from camcops_server.cc_modules.cc_exportrecipientinfo import (
     ExportRecipientInfo,
 )
 from camcops_server.cc_modules.cc_redcap import (
+    get_cached_fieldmap,
     MISSING_EVENT_TAG_OR_ATTRIBUTE,
     RedcapExportException,
     RedcapFieldmap,
     RedcapNewRecordUploader,
+    RedcapRecordIndex,
     RedcapRecordStatus,
     RedcapTaskExporter,
 )
@@ -70,6 +72,7 @@ class MockProject(mock.Mock):
 
 class MockRedcapTaskExporter(RedcapTaskExporter):
     def __init__(self) -> None:
+        super().__init__()
         mock_project = MockProject()
         self.get_project = mock.Mock(return_value=mock_project)
 
@@ -117,6 +120,83 @@ class RedcapExporterTests(TestCase):
         self.assertEqual(type(next_instance_id), int)
 
 
+class RedcapRecordIndexTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.records = DataFrame(
+            {
+                "record_id": ["1", "1", "1", "2"],
+                "patient_id": [555, None, None, 666],
+                "redcap_repeat_instrument": [None, "bmi", "bmi", "bmi"],
+                "redcap_repeat_instance": [None, 1.0, 3.0, 1.0],
+            }
+        )
+        self.index = RedcapRecordIndex(
+            self.records,
+            record_id_fieldname="record_id",
+            patient_id_fieldname="patient_id",
+        )
+
+    def test_record_id_found_by_patient(self) -> None:
+        self.assertEqual(self.index.get_record_id(555), "1")
+        self.assertEqual(self.index.get_record_id(666), "2")
+        self.assertIsNone(self.index.get_record_id(777))
+
+    def test_next_instance_id(self) -> None:
+        self.assertEqual(self.index.get_next_instance_id("bmi", "1"), 4)
+        self.assertEqual(self.index.get_next_instance_id("bmi", "2"), 2)
+        self.assertEqual(self.index.get_next_instance_id("phq9", "1"), 1)
+        self.assertEqual(self.index.get_next_instance_id("bmi", None), 1)
+
+    def test_upload_updates_index(self) -> None:
+        self.index.note_upload(777, "3", "bmi", 1)
+        self.index.note_upload(555, "1", "bmi", 4)
+        self.assertEqual(self.index.get_record_id(777), "3")
+        self.assertEqual(self.index.get_next_instance_id("bmi", "3"), 2)
+        self.assertEqual(self.index.get_next_instance_id("bmi", "1"), 5)
+
+    def test_raises_when_patient_field_missing(self) -> None:
+        index = RedcapRecordIndex(
+            self.records,
+            record_id_fieldname="record_id",
+            patient_id_fieldname="wrong",
+        )
+        with self.assertRaises(RedcapExportException):
+            index.get_record_id(555)
+
+
+class RedcapFieldmapCacheTests(TestCase):
+    fieldmap = """<?xml version="1.0" encoding="UTF-8"?>
+<fieldmap>
+  <patient instrument="patient_record" redcap_field="patient_id" />
+  <record instrument="patient_record" redcap_field="record_id" />
+  <instruments>
+    <instrument task="{task}" name="{task}" />
+  </instruments>
+</fieldmap>
+"""
+
+    def test_fieldmap_reparsed_only_when_file_changes(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "fieldmap.xml")
+            with open(filename, "w") as f:
+                f.write(self.fieldmap.format(task="bmi"))
+            fieldmap1 = get_cached_fieldmap(filename)
+            self.assertIs(get_cached_fieldmap(filename), fieldmap1)
+
+            with open(filename, "w") as f:
+                f.write(self.fieldmap.format(task="phq9"))
+            st = os.stat(filename)
+            os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            fieldmap2 = get_cached_fieldmap(filename)
+            self.assertIsNot(fieldmap2, fieldmap1)
+            self.assertEqual(fieldmap2.instrument_names(), ["phq9"])
+
+    def test_raises_when_xml_file_missing(self) -> None:
+        with self.assertRaises(RedcapExportException):
+            get_cached_fieldmap("/does/not/exist/bmi.xml")
+
+
 class RedcapExportErrorTests(TestCase):
     def test_raises_when_fieldmap_has_unknown_symbols(self) -> None:
         exporter = MockRedcapNewRecordUploader()
@@ -774,6 +854,60 @@ class BmiRedcapUpdateTests(BmiRedcapValidFieldmapTestCase):
         self.assertEqual(kwargs["return_content"], "count")
         self.assertFalse(kwargs["force_auto_number"])
 
+    def test_project_downloaded_once_per_run(self) -> None:
+        from camcops_server.cc_modules.cc_exportmodels import (
+            ExportedTask,
+            ExportedTaskRedcap,
+        )
+
+        exporter = MockRedcapTaskExporter()
+        project = exporter.get_project()
+        project.export_records.return_value = DataFrame({"patient_id": []})
+        project.import_records.return_value = ["123,0"]
+        project.export_project_info.return_value = {
+            "record_autonumbering_enabled": 1
+        }
+
+        for task, expected_instance_id in ((self.task1, 1), (self.task2, 2)):
+            exported_task_redcap = ExportedTaskRedcap(
+                ExportedTask(task=task, recipient=self.recipient)
+            )
+            exporter.export_task(self.req, exported_task_redcap)
+            self.assertEqual(exported_task_redcap.redcap_record_id, "123")
+            self.assertEqual(
+                exported_task_redcap.redcap_instance_id, expected_instance_id
+            )
+
+        self.assertEqual(project.export_records.call_count, 1)
+        self.assertEqual(project.export_project_info.call_count, 1)
+        # Once by us, above, and once by the exporter:
+        self.assertEqual(exporter.get_project.call_count, 2)
+
+    def test_project_downloaded_again_after_failed_upload(self) -> None:
+        from camcops_server.cc_modules.cc_exportmodels import (
+            ExportedTask,
+            ExportedTaskRedcap,
+        )
+
+        exporter = MockRedcapTaskExporter()
+        project = exporter.get_project()
+        project.export_records.return_value = DataFrame({"patient_id": []})
+        project.import_records.side_effect = redcap.RedcapError("Failed")
+        project.export_project_info.return_value = {
+            "record_autonumbering_enabled": 1
+        }
+
+        exported_task_redcap = ExportedTaskRedcap(
+            ExportedTask(task=self.task1, recipient=self.recipient)
+        )
+        with self.assertRaises(RedcapExportException):
+            exporter.export_task(self.req, exported_task_redcap)
+
+        project.import_records.side_effect = None
+        project.import_records.return_value = ["123,0"]
+        exporter.export_task(self.req, exported_task_redcap)
+        self.assertEqual(project.export_records.call_count, 2)
+
 
 class Phq9RedcapExportTests(RedcapExportTestCase):
     """
@@ -25,9 +25,16 @@ camcops_server/cc_modules/tests/cc_session_tests.py
 
 """
 
+import datetime
+
 from pendulum import DateTime as Pendulum
+from sqlalchemy.sql.expression import select
 
 from camcops_server.cc_modules.cc_session import CamcopsSession, generate_token
+from camcops_server.cc_modules.cc_sessionactivity import (
+    naive_utc,
+    SessionActivityTracker,
+)
 from camcops_server.cc_modules.cc_taskfilter import TaskFilter
 from camcops_server.cc_modules.cc_unittest import (
     BasicDatabaseTestCase,
@@ -123,3 +130,148 @@ class GetSessionTests(BasicDatabaseTestCase):
         self.dbsession.add(new_session)
         self.dbsession.flush()
         self.assertNotEqual(self.old_session.id, new_session.id)
+
+
+class SessionActivityTests(BasicDatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.req.config.session_activity_flush_interval_s = 5
+        self.req.config.session_check_user_ip = False
+        self.tracker = CamcopsSession.activity_tracker(self.req)
+        self.tracker.clear()
+        self.now = naive_utc(self.req.now_utc)
+
+    def tearDown(self) -> None:
+        self.tracker.clear()
+        super().tearDown()
+
+    def create_session(self, minutes_ago: int) -> CamcopsSession:
+        session = CamcopsSession(
+            last_activity_utc=self.now
+            - datetime.timedelta(minutes=minutes_ago)
+        )
+        self.dbsession.add(session)
+        self.dbsession.commit()
+        return session
+
+    def stored_last_activity(self, session: CamcopsSession) -> datetime:
+        table = CamcopsSession.__table__
+        return self.dbsession.execute(
+            select(table.c.last_activity_utc).where(table.c.id == session.id)
+        ).scalar()
+
+    def get_session(self, session: CamcopsSession) -> CamcopsSession:
+        return CamcopsSession.get_session(
+            self.req, str(session.id), session.token
+        )
+
+    def test_activity_held_in_memory(self) -> None:
+        session = self.create_session(minutes_ago=1)
+        before = self.stored_last_activity(session)
+
+        found = self.get_session(session)
+
+        self.assertIs(found, session)
+        self.assertEqual(naive_utc(found.last_activity_utc), self.now)
+        self.assertNotIn(found, self.dbsession.dirty)
+        self.assertEqual(self.tracker.last_activity(session.id), self.now)
+        self.assertEqual(self.stored_last_activity(session), before)
+
+    def test_flush_writes_activity(self) -> None:
+        s1 = self.create_session(minutes_ago=1)
+        s2 = self.create_session(minutes_ago=2)
+        self.tracker.record(s1.id, self.now)
+        self.tracker.record(s2.id, self.now)
+
+        self.assertEqual(self.tracker.flush(self.dbsession), 2)
+
+        self.assertEqual(self.tracker.n_pending, 0)
+        self.assertEqual(self.stored_last_activity(s1), self.now)
+        self.assertEqual(self.stored_last_activity(s2), self.now)
+
+    def test_flush_never_moves_activity_backwards(self) -> None:
+        session = self.create_session(minutes_ago=0)
+        self.tracker.record(
+            session.id, self.now - datetime.timedelta(minutes=5)
+        )
+
+        self.tracker.flush(self.dbsession)
+
+        self.assertEqual(self.stored_last_activity(session), self.now)
+
+    def test_flush_due_after_interval(self) -> None:
+        tracker = SessionActivityTracker(flush_interval_s=5)
+        self.assertFalse(tracker.flush_due())
+        tracker.record(1, self.now)
+        self.assertFalse(tracker.flush_due())
+        self.assertTrue(
+            tracker.flush_due(
+                datetime.datetime.utcnow() + datetime.timedelta(seconds=6)
+            )
+        )
+
+    def test_pending_activity_keeps_session_alive(self) -> None:
+        session = self.create_session(minutes_ago=40)
+        self.tracker.record(
+            session.id, self.now - datetime.timedelta(minutes=1)
+        )
+
+        self.assertIs(self.get_session(session), session)
+
+    def test_expired_session_not_found(self) -> None:
+        session = self.create_session(minutes_ago=40)
+
+        self.assertIsNot(self.get_session(session), session)
+
+    def test_write_through_when_interval_zero(self) -> None:
+        self.req.config.session_activity_flush_interval_s = 0
+        session = self.create_session(minutes_ago=1)
+
+        self.get_session(session)
+
+        self.assertEqual(
+            self.stored_last_activity(session),
+            naive_utc(self.req.now_utc),
+        )
+        self.assertEqual(
+            CamcopsSession.activity_tracker(self.req).n_pending, 0
+        )
+
+    def test_delete_old_sessions_in_batches(self) -> None:
+        expired = [self.create_session(minutes_ago=40) for _ in range(5)]
+        for session in expired:
+            session.get_task_filter()
+        current = self.create_session(minutes_ago=1)
+        self.dbsession.commit()
+        self.assertEqual(self.dbsession.query(TaskFilter).count(), 5)
+
+        n_deleted = CamcopsSession.delete_old_sessions(self.req, batch_size=2)
+
+        self.assertEqual(n_deleted, 5)
+        self.assertEqual(
+            [s.id for s in self.dbsession.query(CamcopsSession)],
+            [current.id],
+        )
+        self.assertEqual(self.dbsession.query(TaskFilter).count(), 0)
+
+    def test_delete_old_sessions_deletes_orphan_task_filters(self) -> None:
+        for _ in range(3):
+            self.dbsession.add(TaskFilter())
+        current = self.create_session(minutes_ago=1)
+        current.get_task_filter()
+        self.dbsession.commit()
+
+        CamcopsSession.delete_old_sessions(self.req, batch_size=2)
+
+        self.assertEqual(
+            [tf.id for tf in self.dbsession.query(TaskFilter)],
+            [current.task_filter_id],
+        )
+
+    def test_delete_old_sessions_writes_pending_activity_first(self) -> None:
+        session = self.create_session(minutes_ago=40)
+        self.tracker.record(session.id, self.now)
+
+        CamcopsSession.delete_old_sessions(self.req)
+
+        self.assertEqual(self.stored_last_activity(session), self.now)
@@ -0,0 +1,217 @@
+"""
+camcops_server/cc_modules/tests/cc_snapshot_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+import glob
+import os
+import stat
+import tempfile
+from unittest import mock, TestCase
+
+from camcops_server.cc_modules.cc_baseconstants import (
+    DEFAULT_EXTRA_STRINGS_DIR,
+)
+from camcops_server.cc_modules.cc_snapshot import (
+    load_or_build_snapshot,
+    read_versioned_snapshot,
+    snapshot_filename,
+    versioned_snapshot_filename,
+    write_versioned_snapshot,
+)
+from camcops_server.cc_modules.cc_snomed import (
+    load_snomed_concepts_from_xml,
+)
+from camcops_server.cc_modules.cc_string import (
+    APPSTRING_TASKNAME,
+    load_extra_string_files,
+    parse_extra_string_files,
+)
+
+SNOMED_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<snomed_concepts>
+    <lookup name="F32">
+        <concept><id>35489007</id><term>Depressive disorder</term></concept>
+    </lookup>
+</snomed_concepts>
+"""
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+
+class SnapshotTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.snapshot_dir = os.path.join(self.tmpdir.name, "snapshots")
+        self.source = os.path.join(self.tmpdir.name, "source.txt")
+        self.write_source("hello")
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def write_source(self, text: str) -> None:
+        with open(self.source, "w") as f:
+            f.write(text)
+
+    def read_source(self) -> str:
+        with open(self.source) as f:
+            return f.read()
+
+    def load(self, **kwargs) -> str:
+        builder = mock.Mock(side_effect=self.read_source)
+        result = load_or_build_snapshot(
+            self.snapshot_dir, "test", [self.source], builder, **kwargs
+        )
+        self.n_builds = builder.call_count
+        return result
+
+    def test_no_directory(self) -> None:
+        builder = mock.Mock(return_value=1)
+        self.assertEqual(load_or_build_snapshot("", "test", [], builder), 1)
+        builder.assert_called_once()
+
+    def test_built_then_loaded(self) -> None:
+        self.assertEqual(self.load(), "hello")
+        self.assertEqual(self.n_builds, 1)
+        filename = snapshot_filename(self.snapshot_dir, "test", [self.source])
+        self.assertEqual(stat.S_IMODE(os.stat(filename).st_mode), 0o600)
+        self.assertEqual(
+            stat.S_IMODE(os.stat(self.snapshot_dir).st_mode) & 0o077, 0
+        )
+
+        self.assertEqual(self.load(), "hello")
+        self.assertEqual(self.n_builds, 0)
+
+        self.assertEqual(self.load(rebuild=True), "hello")
+        self.assertEqual(self.n_builds, 1)
+
+    def test_rebuilt_when_source_modified(self) -> None:
+        self.load()
+        st = os.stat(self.source)
+        os.utime(self.source, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.load()
+        self.assertEqual(self.n_builds, 1)
+
+    def test_rebuilt_when_source_content_changes(self) -> None:
+        self.load()
+        st = os.stat(self.source)
+        self.write_source("HELLO")  # same size
+        os.utime(self.source, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertEqual(self.load(), "HELLO")
+        self.assertEqual(self.n_builds, 1)
+
+    def test_rebuilt_when_snapshot_corrupt(self) -> None:
+        self.load()
+        filename = snapshot_filename(self.snapshot_dir, "test", [self.source])
+        with open(filename, "wb") as f:
+            f.write(b"rubbish")
+        self.assertEqual(self.load(), "hello")
+        self.assertEqual(self.n_builds, 1)
+        self.load()
+        self.assertEqual(self.n_builds, 0)
+
+    def test_different_sources_different_snapshots(self) -> None:
+        other = os.path.join(self.tmpdir.name, "other.txt")
+        self.assertNotEqual(
+            snapshot_filename(self.snapshot_dir, "test", [self.source]),
+            snapshot_filename(self.snapshot_dir, "test", [self.source, other]),
+        )
+
+
+class VersionedSnapshotTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def test_write_read_and_prune(self) -> None:
+        d = self.tmpdir.name
+        self.assertEqual(read_versioned_snapshot(d, "x", "v1"), (False, None))
+        for i in range(1, 4):
+            version = f"v{i}"
+            write_versioned_snapshot(d, "x", version, {"i": i}, keep=2)
+            # Make the order of modification times unambiguous:
+            filename = versioned_snapshot_filename(d, "x", version)
+            os.utime(filename, (i, i))
+        self.assertEqual(read_versioned_snapshot(d, "x", "v1"), (False, None))
+        self.assertEqual(
+            read_versioned_snapshot(d, "x", "v3"), (True, {"i": 3})
+        )
+        # Not overwritten:
+        write_versioned_snapshot(d, "x", "v3", {"i": 99}, keep=2)
+        self.assertEqual(
+            read_versioned_snapshot(d, "x", "v3"), (True, {"i": 3})
+        )
+
+    def test_no_directory(self) -> None:
+        write_versioned_snapshot("", "x", "v1", 1)
+        self.assertEqual(read_versioned_snapshot("", "x", "v1"), (False, None))
+
+    def test_bad_version(self) -> None:
+        for version in ("", "../x", "a.b"):
+            with self.assertRaises(ValueError):
+                versioned_snapshot_filename(self.tmpdir.name, "x", version)
+
+
+class SnapshotSourceTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def test_extra_strings(self) -> None:
+        filenames = sorted(
+            glob.glob(os.path.join(DEFAULT_EXTRA_STRINGS_DIR, "*.xml"))
+        )
+        expected = parse_extra_string_files(filenames)
+        self.assertIn(APPSTRING_TASKNAME, expected)
+        for _ in range(2):  # build, then load
+            self.assertEqual(
+                load_extra_string_files(filenames, self.tmpdir.name), expected
+            )
+
+    def test_snomed(self) -> None:
+        xml_filename = os.path.join(self.tmpdir.name, "snomed.xml")
+        with open(xml_filename, "w") as f:
+            f.write(SNOMED_XML)
+        snapshot_dir = os.path.join(self.tmpdir.name, "snapshots")
+        for _ in range(2):  # build, then load
+            concepts = load_snomed_concepts_from_xml(
+                xml_filename, snapshot_dir
+            )
+            self.assertEqual(list(concepts.keys()), ["F32"])
+            self.assertEqual(concepts["F32"][0].identifier, 35489007)
+            self.assertEqual(concepts["F32"][0].term, "Depressive disorder")
@@ -25,8 +25,9 @@ camcops_server/cc_modules/tests/cc_spreadsheet_tests.py
 
 """
 
+import datetime
 import io
-from typing import Any, Dict
+from typing import Any, Dict, List
 from unittest import TestCase
 import uuid
 from xml.dom.minidom import parseString
@@ -35,6 +36,7 @@ import zipfile
 from camcops_server.cc_modules.cc_spreadsheet import (
     SpreadsheetCollection,
     SpreadsheetPage,
+    StreamingSpreadsheetCollection,
     XLSX_VIA_PYEXCEL,
 )
 
@@ -197,3 +199,98 @@ class SpreadsheetCollectionTests(TestCase):
             self.assertIn(
                 ["6457cb90-1ca0-47a7-9f40-767567819bee"], wb["Testing"]
             )
+
+
+class StreamingSpreadsheetCollectionTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.coll = StreamingSpreadsheetCollection()
+        # Rows arrive one at a time, interleaved between pages, and with new
+        # columns appearing part-way through.
+        self.coll.add_pages(
+            [
+                SpreadsheetPage(name="b", rows=[{"x": 1, "y": "one"}]),
+                SpreadsheetPage(name="a", rows=[{"p": 1.5}]),
+                SpreadsheetPage(name="b", rows=[{"z": True, "x": 2}]),
+                SpreadsheetPage(name="b", rows=[]),
+            ]
+        )
+
+    def tearDown(self) -> None:
+        self.coll.close()
+        super().tearDown()
+
+    def xlsx_data(self) -> Dict[str, List[List[Any]]]:
+        buffer = io.BytesIO()
+        self.coll.write_xlsx(buffer)
+        return pyexcel_xlsx.get_data(io.BytesIO(buffer.getvalue()))
+
+    def test_tsv_zip_matches_in_memory_version(self) -> None:
+        buffer = io.BytesIO()
+        self.coll.write_zip(buffer)
+        zf = zipfile.ZipFile(buffer, "r")
+
+        expected = SpreadsheetPage(
+            name="b", rows=[{"x": 1, "y": "one"}, {"z": True, "x": 2}]
+        ).get_tsv()
+        self.assertEqual(zf.namelist(), ["b.tsv", "a.tsv"])
+        self.assertEqual(zf.read("b.tsv").decode("utf-8"), expected)
+
+    def test_xlsx_rows_padded_for_late_columns(self) -> None:
+        self.coll.sort_pages()
+        data = self.xlsx_data()
+        self.assertEqual(list(data.keys()), ["a", "b"])
+        self.assertEqual(
+            data["b"], [["x", "y", "z"], [1, "one"], [2, "", True]]
+        )
+
+    def test_columns_deleted_and_sorted(self) -> None:
+        self.coll.delete_columns(["x"])
+        self.coll.sort_headings_within_all_pages()
+        self.coll.delete_pages(["a"])
+        data = self.xlsx_data()
+        self.assertEqual(data, {"b": [["y", "z"], ["one"], ["", True]]})
+
+    def test_empty_xlsx_is_valid(self) -> None:
+        self.coll.delete_pages(["a", "b"])
+        self.assertEqual(len(self.xlsx_data()), 1)
+
+    def test_ods_values(self) -> None:
+        coll = StreamingSpreadsheetCollection()
+        test_uuid = uuid.UUID("6457cb90-1ca0-47a7-9f40-767567819bee")
+        coll.add_page(
+            SpreadsheetPage(
+                name="What perinatal service have you accessed?",
+                rows=[
+                    {
+                        "UUID": test_uuid,
+                        "when": datetime.datetime(2020, 1, 2, 3, 4, 5),
+                        "number": 3,
+                        "text": "a < b & c",
+                        "nothing": None,
+                    }
+                ],
+            )
+        )
+        buffer = io.BytesIO()
+        coll.write_ods(buffer)
+        coll.close()
+
+        zf = zipfile.ZipFile(buffer, "r")
+        self.assertEqual(zf.namelist()[0], "mimetype")
+        doc = parseString(zf.read("content.xml"))
+        sheets = doc.getElementsByTagName("table:table")
+        self.assertEqual(
+            sheets[0].getAttribute("table:name"),
+            "What perinatal service have ...",
+        )
+        text_values = [
+            t.firstChild.nodeValue for t in doc.getElementsByTagName("text:p")
+        ]
+        self.assertIn(str(test_uuid), text_values)
+        self.assertIn("2020-01-02T03:04:05", text_values)
+        self.assertIn("a < b & c", text_values)
+        cells = doc.getElementsByTagName("table:table-cell")
+        self.assertEqual(cells[7].getAttribute("office:value-type"), "float")
+        self.assertEqual(cells[7].getAttribute("office:value"), "3")
+        self.assertFalse(cells[9].hasChildNodes())
@@ -25,14 +25,31 @@ camcops_server/cc_modules/tests/cc_taskcollection_tests.py
 
 """
 
+import os
+import tempfile
+from unittest import mock
+
 from kombu.serialization import dumps, loads
+from pendulum import datetime
+from sqlalchemy.orm.session import Session
+
+from camcops_server.cc_modules.cc_patient import Patient
+from camcops_server.cc_modules.cc_patientidnum import PatientIdNum
+from camcops_server.cc_modules.cc_sqlalchemy import make_file_sqlite_engine
 from camcops_server.cc_modules.cc_taskcollection import (
+    merge_fetched_tasks,
+    ParallelTaskFetcher,
     TaskCollection,
     TaskSortMethod,
 )
 
 from camcops_server.cc_modules.cc_taskfilter import TaskFilter
+from camcops_server.cc_modules.cc_taskindex import TaskIndexEntry
+from camcops_server.cc_modules.cc_testfactories import PatientFactory
 from camcops_server.cc_modules.cc_unittest import BasicDatabaseTestCase
+from camcops_server.tasks.phq9 import Phq9
+from camcops_server.tasks.bmi import Bmi
+from camcops_server.tasks.tests.factories import BmiFactory, Phq9Factory
 
 
 # =============================================================================
@@ -63,3 +80,204 @@ class TaskCollectionTests(BasicDatabaseTestCase):
             new_coll._filter.task_types, ["task1", "task2", "task3"]
         )
         self.assertEqual(new_coll._filter.group_ids, [1, 2, 3])
+
+
+class TaskCollectionChunkTests(BasicDatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        patient = PatientFactory()
+        # Created in the reverse order of PK:
+        self.tasks = [
+            Phq9Factory(
+                patient_id=patient.id, when_created=datetime(2020, 1, 10 - i)
+            )
+            for i in range(7)
+        ]
+        self.dbsession.flush()
+        for task in self.tasks:
+            TaskIndexEntry.index_task(task, self.dbsession, self.req.now_utc)
+        self.dbsession.flush()
+
+    def get_collection(self, via_index: bool) -> TaskCollection:
+        taskfilter = TaskFilter()
+        taskfilter.task_types = [Phq9.__tablename__]
+        return TaskCollection(
+            self.req,
+            taskfilter=taskfilter,
+            as_dump=True,
+            via_index=via_index,
+        )
+
+    def test_chunks_without_index_in_pk_order(self) -> None:
+        coll = self.get_collection(via_index=False)
+        tasks = list(coll.gen_tasks_for_task_class_in_chunks(Phq9, 3))
+        self.assertEqual(
+            [t.pk for t in tasks], sorted(t.pk for t in self.tasks)
+        )
+
+    def test_chunks_via_index_in_creation_order(self) -> None:
+        coll = self.get_collection(via_index=True)
+        tasks = list(coll.gen_tasks_for_task_class_in_chunks(Phq9, 3))
+        self.assertEqual(
+            [t.pk for t in tasks], [t.pk for t in reversed(self.tasks)]
+        )
+
+    def test_index_entries_resolved_in_order(self) -> None:
+        coll = self.get_collection(via_index=True)
+        indexes = (
+            self.dbsession.query(TaskIndexEntry)
+            .order_by(TaskIndexEntry.task_pk)
+            .all()
+        )
+        page = [indexes[5], indexes[1], indexes[3]]
+        tasks = coll.tasks_for_index_entries(page)
+        self.assertEqual([t.pk for t in tasks], [i.task_pk for i in page])
+
+    def test_missing_tasks_omitted(self) -> None:
+        coll = self.get_collection(via_index=True)
+        gone = TaskIndexEntry(task_table_name=Phq9.__tablename__, task_pk=-1)
+        bad_table = TaskIndexEntry(task_table_name="nonexistent", task_pk=1)
+        index = self.dbsession.query(TaskIndexEntry).first()
+        tasks = coll.tasks_for_index_entries([gone, index, bad_table])
+        self.assertEqual([t.pk for t in tasks], [index.task_pk])
+
+    def test_task_pks_chunked_for_bind_parameter_limit(self) -> None:
+        coll = self.get_collection(via_index=True)
+        indexes = self.dbsession.query(TaskIndexEntry).all()
+        with mock.patch(
+            "camcops_server.cc_modules.cc_taskcollection.get_max_bind_params",
+            return_value=53,
+        ):
+            # noinspection PyProtectedMember
+            queries = coll._task_queries_for_index_entries(indexes)
+            self.assertEqual(len(queries), 3)  # 7 PKs in chunks of 3
+            self.assertCountEqual(coll.all_tasks, self.tasks)
+
+
+class TaskCollectionParallelFetchTests(BasicDatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.patient = PatientFactory()
+        self.dbsession.flush()
+        self.idnum = self.create_patient_idnum(
+            id=1,
+            patient_id=self.patient.id,
+            _device_id=self.patient._device_id,
+            _era=self.patient._era,
+            which_idnum=self.nhs_iddef.which_idnum,
+            idnum_value=555,
+        )
+        same_patient = dict(
+            patient_id=self.patient.id,
+            _device=self.patient._device,
+            _era=self.patient._era,
+        )
+        self.phq9s = [Phq9Factory(**same_patient) for _ in range(3)]
+        self.bmis = [BmiFactory(**same_patient) for _ in range(2)]
+        self.dbsession.flush()
+
+    def get_collection(self) -> TaskCollection:
+        taskfilter = TaskFilter()
+        taskfilter.task_types = [Phq9.__tablename__, Bmi.__tablename__]
+        return TaskCollection(
+            self.req,
+            taskfilter=taskfilter,
+            as_dump=True,
+            via_index=False,
+        )
+
+    def test_sqlite_fetched_serially(self) -> None:
+        self.req.config.task_fetch_threads = 4
+        coll = self.get_collection()
+        # noinspection PyProtectedMember
+        self.assertEqual(coll._n_fetch_threads(2), 1)
+        self.assertCountEqual(coll.all_tasks, self.phq9s + self.bmis)
+        self.assertEqual(
+            set(coll.query_seconds_by_table.keys()),
+            {Phq9.__tablename__, Bmi.__tablename__},
+        )
+
+    def test_merged_tasks_attached_to_request_session(self) -> None:
+        other_session = Session(bind=self.dbsession.connection())
+        tasks = other_session.query(Phq9).order_by(Phq9._pk).all()
+        other_session.close()
+
+        merged = merge_fetched_tasks(self.dbsession, tasks)
+
+        # Objects already in the session are reused
+        self.assertEqual(merged, self.phq9s)
+        self.assertIs(merged[0].patient, self.patient)
+        self.assertIs(merged[1].patient, self.patient)
+
+    def test_merged_patients_keep_idnums(self) -> None:
+        self.dbsession.expunge_all()
+        other_session = Session(bind=self.dbsession.connection())
+        tasks = other_session.query(Phq9).all()
+        other_session.close()
+
+        merged = merge_fetched_tasks(self.dbsession, tasks)
+
+        patient = merged[0].patient
+        self.assertIn(patient, self.dbsession)
+        self.assertIs(merged[1].patient, patient)
+        self.assertEqual(len(patient.idnums), 1)
+        self.assertIn(patient.idnums[0], self.dbsession)
+        self.assertEqual(patient.idnums[0].idnum_value, self.idnum.idnum_value)
+
+
+class ParallelTaskFetcherTests(BasicDatabaseTestCase):
+    """
+    Uses an on-disk SQLite database, so that each worker thread's connection
+    sees the same data.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.engine = make_file_sqlite_engine(
+            os.path.join(self.tmpdir.name, "test.sqlite")
+        )
+        for cls in (Patient, PatientIdNum, Phq9):
+            cls.__table__.create(self.engine)
+        standard_fields = dict(
+            _device_id=1, _era="NOW", _current=True, _group_id=1
+        )
+        with Session(bind=self.engine) as session:
+            session.add(Patient(id=1, **standard_fields))
+            for i in range(1, 11):
+                session.add(
+                    Phq9(
+                        id=i,
+                        patient_id=1,
+                        when_created=datetime(2020, 1, i),
+                        **standard_fields,
+                    )
+                )
+            session.commit()
+
+    def tearDown(self) -> None:
+        self.engine.dispose()
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def test_fetches_in_parallel(self) -> None:
+        session = Session(bind=self.engine)
+        queries = [
+            session.query(Phq9).filter(Phq9.id % 3 == i) for i in range(3)
+        ]
+        results = ParallelTaskFetcher(self.engine, n_threads=3).fetch(queries)
+
+        self.assertEqual(
+            [sorted(t.id for t in tasks) for tasks, _ in results],
+            [[3, 6, 9], [1, 4, 7, 10], [2, 5, 8]],
+        )
+        tasks = [t for tasks, _ in results for t in tasks]
+        self.assertTrue(all(t not in session for t in tasks))
+        merged = merge_fetched_tasks(session, tasks)
+        self.assertTrue(all(t in session for t in merged))
+        # One patient object, loaded by several threads, merged into one
+        self.assertEqual(len(set(id(t.patient) for t in merged)), 1)
+        self.assertIs(
+            merged[0].patient, session.query(Patient).filter_by(id=1).one()
+        )
+        session.close()
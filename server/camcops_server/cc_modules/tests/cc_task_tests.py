@@ -28,14 +28,21 @@ camcops_server/cc_modules/tests/cc_task_tests.py
 import logging
 import os
 from pathlib import Path
+import subprocess
+import sys
+from unittest import TestCase
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from pendulum import Date, DateTime as Pendulum
 
+from camcops_server.cc_modules.cc_baseconstants import (
+    CAMCOPS_SERVER_DIRECTORY,
+)
 from camcops_server.cc_modules.cc_dummy_database import DummyDataInserter
 from camcops_server.cc_modules.cc_task import Task
 from camcops_server.cc_modules.cc_unittest import DemoDatabaseTestCase
 from camcops_server.cc_modules.cc_validators import validate_task_tablename
+from camcops_server.tasks import get_task_class, TASK_MANIFEST
 
 log = BraceStyleAdapter(logging.getLogger(__name__))
 
@@ -248,3 +255,41 @@ class TaskTests(DemoDatabaseTestCase):
             t.manually_erase(req)
             self.assertTrue(t.is_erased())
             t.delete_entirely(req)
+
+
+class TaskManifestTests(TestCase):
+    def test_manifest_matches_tasks(self) -> None:
+        expected = {
+            cls.tablename: (
+                cls.__module__.split(".")[-1],
+                cls.__name__,
+                cls.shortname,
+            )
+            for cls in Task.all_subclasses_by_tablename()
+        }
+        actual = {
+            tablename: (entry.module, entry.classname, entry.shortname)
+            for tablename, entry in TASK_MANIFEST.items()
+        }
+        self.assertEqual(actual, expected)
+
+    def test_get_task_class(self) -> None:
+        from camcops_server.tasks.phq9 import Phq9
+
+        self.assertIs(get_task_class("phq9"), Phq9)
+        with self.assertRaises(KeyError):
+            get_task_class("nonexistent_task")
+
+    def test_single_task_imported_alone(self) -> None:
+        code = (
+            "import sys\n"
+            "from camcops_server.tasks import Phq9\n"
+            "print(sorted(m for m in sys.modules "
+            "if m.startswith('camcops_server.tasks.')))\n"
+        )
+        output = subprocess.check_output(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(CAMCOPS_SERVER_DIRECTORY),
+            universal_newlines=True,
+        )
+        self.assertEqual(output.strip(), "['camcops_server.tasks.phq9']")
@@ -0,0 +1,225 @@
+"""
+camcops_server/cc_modules/tests/cc_taskindexrebuild_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+from contextlib import nullcontext
+import os
+from tempfile import TemporaryDirectory
+from typing import List, Tuple
+from unittest import mock
+
+from pendulum import DateTime as Pendulum
+
+from camcops_server.cc_modules.cc_task import Task
+from camcops_server.cc_modules.cc_taskindex import TaskIndexEntry
+from camcops_server.cc_modules.cc_taskindexrebuild import (
+    rebuild_task_table_index,
+    reindex_everything_in_bulk,
+    TableReindexCheckpoint,
+)
+from camcops_server.cc_modules.cc_unittest import (
+    BasicDatabaseTestCase,
+    DemoDatabaseTestCase,
+)
+from camcops_server.tasks.phq9 import Phq9
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+
+class TaskIndexRebuildTests(BasicDatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.patient = self.create_patient(id=1)
+        self.phq9s = []  # type: List[Phq9]
+        for task_id in range(1, 6):
+            phq9 = Phq9()
+            self.apply_standard_task_fields(phq9)
+            phq9.id = task_id
+            phq9.patient_id = self.patient.id
+            self.dbsession.add(phq9)
+            self.phq9s.append(phq9)
+        self.dbsession.commit()
+        self.now = Pendulum.utcnow()
+        self.tmpdir = TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def indexed_phq9_pks(self) -> List[int]:
+        return sorted(
+            pk
+            for pk, in self.dbsession.query(TaskIndexEntry.task_pk).filter(
+                TaskIndexEntry.task_table_name == Phq9.__tablename__
+            )
+        )
+
+    def test_entries_match_those_made_from_tasks(self) -> None:
+        result = rebuild_task_table_index(
+            self.dbsession, Phq9, self.now, batch_size=2
+        )
+        self.assertEqual(result.n_tasks, 5)
+        self.assertFalse(result.skipped)
+        entries = (
+            self.dbsession.query(TaskIndexEntry)
+            .filter(TaskIndexEntry.task_table_name == Phq9.__tablename__)
+            .order_by(TaskIndexEntry.task_pk)
+            .all()
+        )
+        self.assertEqual(len(entries), 5)
+        for entry, phq9 in zip(entries, self.phq9s):
+            expected = TaskIndexEntry.make_from_task(phq9, self.now)
+            for attr in (
+                "task_pk",
+                "patient_pk",
+                "device_id",
+                "era",
+                "group_id",
+                "adding_user_id",
+                "task_is_complete",
+            ):
+                self.assertEqual(
+                    getattr(entry, attr), getattr(expected, attr), attr
+                )
+            self.assertEqual(entry.patient_pk, self.patient.pk)
+
+    def test_old_entries_replaced(self) -> None:
+        rebuild_task_table_index(self.dbsession, Phq9, self.now)
+        rebuild_task_table_index(self.dbsession, Phq9, self.now)
+        self.assertEqual(
+            self.indexed_phq9_pks(), sorted(t.pk for t in self.phq9s)
+        )
+
+    def test_non_current_tasks_not_indexed(self) -> None:
+        self.phq9s[0]._current = False
+        self.dbsession.commit()
+        rebuild_task_table_index(self.dbsession, Phq9, self.now)
+        self.assertEqual(
+            self.indexed_phq9_pks(), sorted(t.pk for t in self.phq9s[1:])
+        )
+
+    def test_checkpoint_records_completion(self) -> None:
+        rebuild_task_table_index(
+            self.dbsession,
+            Phq9,
+            self.now,
+            batch_size=2,
+            checkpoint_dir=self.tmpdir.name,
+        )
+        checkpoint = TableReindexCheckpoint.load(
+            self.tmpdir.name, Phq9.__tablename__
+        )
+        self.assertTrue(checkpoint.complete)
+        self.assertEqual(checkpoint.n_tasks, 5)
+        self.assertEqual(checkpoint.last_pk, max(t.pk for t in self.phq9s))
+
+        result = rebuild_task_table_index(
+            self.dbsession,
+            Phq9,
+            self.now,
+            checkpoint_dir=self.tmpdir.name,
+            resume=True,
+        )
+        self.assertTrue(result.skipped)
+        self.assertEqual(len(self.indexed_phq9_pks()), 5)
+
+    def test_resume_after_interruption(self) -> None:
+        # Simulate a rebuild that indexed the first two tasks, recorded that,
+        # then indexed a third but was interrupted before recording it.
+        pks = sorted(t.pk for t in self.phq9s)
+        for phq9 in self.phq9s:
+            if phq9.pk in pks[:3]:
+                TaskIndexEntry.index_task(phq9, self.dbsession, self.now)
+        self.dbsession.commit()
+        TableReindexCheckpoint(
+            Phq9.__tablename__, last_pk=pks[1], n_tasks=2
+        ).save(self.tmpdir.name)
+
+        result = rebuild_task_table_index(
+            self.dbsession,
+            Phq9,
+            self.now,
+            checkpoint_dir=self.tmpdir.name,
+            resume=True,
+        )
+        self.assertEqual(result.n_tasks, 3)
+        self.assertEqual(self.indexed_phq9_pks(), pks)
+        checkpoint = TableReindexCheckpoint.load(
+            self.tmpdir.name, Phq9.__tablename__
+        )
+        self.assertTrue(checkpoint.complete)
+        self.assertEqual(checkpoint.n_tasks, 5)
+
+    def test_checkpoint_saved_atomically(self) -> None:
+        TableReindexCheckpoint("x", last_pk=3).save(self.tmpdir.name)
+        self.assertEqual(os.listdir(self.tmpdir.name), ["x.json"])
+        self.assertIsNone(
+            TableReindexCheckpoint.load(self.tmpdir.name, "y").last_pk
+        )
+
+
+class ReindexEverythingTests(DemoDatabaseTestCase):
+    def index_contents(self) -> List[Tuple[str, int, bool]]:
+        return sorted(
+            self.dbsession.query(
+                TaskIndexEntry.task_table_name,
+                TaskIndexEntry.task_pk,
+                TaskIndexEntry.task_is_complete,
+            )
+        )
+
+    def test_same_index_as_task_by_task(self) -> None:
+        now = Pendulum.utcnow()
+        for cls in Task.all_subclasses_by_tablename():
+            for task in self.dbsession.query(cls):
+                TaskIndexEntry.index_task(task, self.dbsession, now)
+        self.dbsession.commit()
+        expected = self.index_contents()
+        self.assertGreater(len(expected), 0)
+
+        # The SQL Server helper wants a session bound to an engine, not (as
+        # here) to a connection.
+        with TemporaryDirectory() as checkpoint_dir, mock.patch(
+            "camcops_server.cc_modules.cc_taskindex."
+            "if_sqlserver_disable_constraints_triggers",
+            return_value=nullcontext(),
+        ), mock.patch(
+            "camcops_server.cc_modules.cc_taskindexrebuild."
+            "if_sqlserver_disable_constraints_triggers",
+            return_value=nullcontext(),
+        ):
+            results = reindex_everything_in_bulk(
+                self.dbsession, batch_size=1, checkpoint_dir=checkpoint_dir
+            )
+            self.assertEqual(
+                len(os.listdir(checkpoint_dir)),
+                len(Task.all_subclasses_by_tablename()),
+            )
+        self.assertEqual(sum(r.n_tasks for r in results), len(expected))
+        self.assertEqual(self.index_contents(), expected)
@@ -28,20 +28,27 @@ camcops_server/cc_modules/tests/cc_taskschedule_tests.py
 from urllib.parse import parse_qs, urlsplit
 
 from cardinal_pythonlib.uriconst import UriSchemes
-from pendulum import Duration
+from pendulum import DateTime as Pendulum, Duration, local
 
 from camcops_server.cc_modules.cc_email import Email
 from camcops_server.cc_modules.cc_pyramid import Routes
+from camcops_server.cc_modules.cc_taskindex import (
+    PatientIdNumIndexEntry,
+    TaskIndexEntry,
+)
 from camcops_server.cc_modules.cc_taskschedule import (
     PatientTaskSchedule,
     PatientTaskScheduleEmail,
+    ScheduledTaskResolver,
     TaskSchedule,
     TaskScheduleItem,
 )
 from camcops_server.cc_modules.cc_unittest import (
+    BasicDatabaseTestCase,
     DemoDatabaseTestCase,
     DemoRequestTestCase,
 )
+from camcops_server.tasks.phq9 import Phq9
 
 
 # =============================================================================
@@ -322,3 +329,125 @@ class PatientTaskScheduleTests(DemoDatabaseTestCase):
         self.dbsession.commit()
 
         self.assertTrue(self.pts.email_sent)
+
+
+class ScheduledTaskResolverTests(BasicDatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+
+        self.schedule = TaskSchedule()
+        self.schedule.group_id = self.group.id
+        self.dbsession.add(self.schedule)
+        self.dbsession.flush()
+
+        for due_from, due_by in ((0, 7), (30, 37), (60, 67)):
+            item = TaskScheduleItem()
+            item.schedule_id = self.schedule.id
+            item.task_table_name = "phq9"
+            item.due_from = Duration(days=due_from)
+            item.due_by = Duration(days=due_by)
+            self.dbsession.add(item)
+
+        self.patient = self.create_patient(id=1)
+        idnum = self.create_patient_idnum(
+            id=1,
+            patient_id=self.patient.id,
+            which_idnum=self.nhs_iddef.which_idnum,
+            idnum_value=555,
+        )
+        PatientIdNumIndexEntry.index_idnum(idnum, self.dbsession)
+
+        server_patient = self.create_patient(id=2, as_server_patient=True)
+        self.create_patient_idnum(
+            id=2,
+            patient_id=server_patient.id,
+            which_idnum=self.nhs_iddef.which_idnum,
+            idnum_value=555,
+            as_server_patient=True,
+        )
+
+        self.pts = PatientTaskSchedule()
+        self.pts.schedule_id = self.schedule.id
+        self.pts.patient_pk = server_patient.pk
+        self.pts.start_datetime = local(2020, 7, 31)
+        self.dbsession.add(self.pts)
+        self.dbsession.commit()
+
+    def create_phq9(self, task_id: int, when_created: Pendulum) -> Phq9:
+        phq9 = Phq9()
+        self.apply_standard_task_fields(phq9)
+        phq9.id = task_id
+        phq9.patient_id = self.patient.id
+        phq9.when_created = when_created
+        self.dbsession.add(phq9)
+        self.dbsession.commit()
+        TaskIndexEntry.index_task(
+            phq9, self.dbsession, indexed_at_utc=Pendulum.utcnow()
+        )
+        self.dbsession.commit()
+        return phq9
+
+    def test_most_recent_task_in_each_window_found(self) -> None:
+        self.create_phq9(1, local(2020, 8, 1))
+        newest_first = self.create_phq9(2, local(2020, 8, 3))
+        self.create_phq9(3, local(2020, 8, 20))  # in no window
+        second = self.create_phq9(4, local(2020, 9, 1))
+
+        resolver = ScheduledTaskResolver.for_patient_task_schedules(
+            self.req, [self.pts]
+        )
+        task_list = self.pts.get_list_of_scheduled_tasks(
+            self.req, resolver=resolver
+        )
+
+        self.assertEqual(
+            [info.task.id if info.task else None for info in task_list],
+            [newest_first.id, second.id, None],
+        )
+        self.assertEqual(resolver.n_index_queries, 1)
+
+        # Same answers as looking for each item separately
+        for tsi, start, end in self.pts.scheduled_item_windows():
+            self.assertIs(
+                self.pts.find_scheduled_task(self.req, tsi, start, end),
+                resolver.find_task(tsi.task_table_name, start, end),
+            )
+
+    def test_window_end_is_exclusive(self) -> None:
+        self.create_phq9(1, local(2020, 8, 7))
+
+        task_list = self.pts.get_list_of_scheduled_tasks(self.req)
+
+        self.assertIsNone(task_list[0].task)
+
+    def test_falls_back_when_task_missing(self) -> None:
+        older = self.create_phq9(1, local(2020, 8, 1))
+        newer = self.create_phq9(2, local(2020, 8, 3))
+        # Leave the index entry behind
+        self.dbsession.delete(newer)
+        self.dbsession.commit()
+
+        task_list = self.pts.get_list_of_scheduled_tasks(self.req)
+
+        self.assertEqual(task_list[0].task.id, older.id)
+
+    def test_shared_across_schedules(self) -> None:
+        self.create_phq9(1, local(2020, 8, 1))
+
+        pts2 = PatientTaskSchedule()
+        pts2.schedule_id = self.schedule.id
+        pts2.patient_pk = self.pts.patient_pk
+        pts2.start_datetime = local(2020, 7, 28)
+        self.dbsession.add(pts2)
+        self.dbsession.commit()
+
+        resolver = ScheduledTaskResolver.for_patient_task_schedules(
+            self.req, [self.pts, pts2]
+        )
+        for pts in (self.pts, pts2):
+            task_list = pts.get_list_of_scheduled_tasks(
+                self.req, resolver=resolver
+            )
+            self.assertEqual(task_list[0].task.id, 1)
+
+        self.assertEqual(resolver.n_index_queries, 1)
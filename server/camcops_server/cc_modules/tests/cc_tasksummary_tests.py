@@ -0,0 +1,205 @@
+"""
+camcops_server/cc_modules/tests/cc_tasksummary_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+from typing import List
+from unittest import mock
+
+from pendulum import DateTime as Pendulum
+from semantic_version import Version
+from sqlalchemy.engine import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.expression import text
+
+from camcops_server.cc_modules.cc_dump import copy_tasks_and_summaries
+from camcops_server.cc_modules.cc_language import DANISH
+from camcops_server.cc_modules.cc_simpleobjects import TaskExportOptions
+
+from camcops_server.cc_modules.cc_tasksummary import (
+    aggregate_stored_summary,
+    get_stored_summaries,
+    rebuild_task_summaries,
+    TaskSummaryEntry,
+)
+from camcops_server.cc_modules.cc_text import SS
+from camcops_server.cc_modules.cc_unittest import BasicDatabaseTestCase
+from camcops_server.tasks.phq9 import Phq9
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+
+class TaskSummaryTests(BasicDatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.patient = self.create_patient(id=1)
+        self.phq9s = []  # type: List[Phq9]
+        for task_id in range(1, 4):
+            phq9 = Phq9()
+            self.apply_standard_task_fields(phq9)
+            phq9.id = task_id
+            phq9.patient_id = self.patient.id
+            for q in range(1, Phq9.N_MAIN_QUESTIONS + 1):
+                setattr(phq9, f"q{q}", task_id)
+            phq9.q10 = 0
+            self.dbsession.add(phq9)
+            self.phq9s.append(phq9)
+        self.dbsession.commit()
+        self.now = Pendulum.utcnow()
+
+    def stored(self, **kwargs) -> dict:
+        return get_stored_summaries(
+            self.dbsession,
+            Phq9.__tablename__,
+            [t.pk for t in self.phq9s],
+            kwargs.pop("language", self.req.language),
+            **kwargs,
+        )
+
+    def switch_language(self, language: str) -> None:
+        self.req.language = language  # overrides the reified property
+        self.req._cached_sstring = {}
+
+    def test_stored_values_match_calculated(self) -> None:
+        n = TaskSummaryEntry.store_for_tasks(self.req, self.phq9s, self.now)
+        self.assertEqual(n, 3)
+        stored = self.stored()
+        for phq9 in self.phq9s:
+            # Versions come back as strings.
+            expected = {
+                s.name: (
+                    str(s.value) if isinstance(s.value, Version) else s.value
+                )
+                for s in phq9.get_summaries(self.req)
+            }
+            self.assertEqual(stored[phq9.pk], expected)
+
+    def test_storing_again_replaces(self) -> None:
+        TaskSummaryEntry.store_for_tasks(self.req, self.phq9s, self.now)
+        TaskSummaryEntry.store_for_tasks(self.req, self.phq9s, self.now)
+        n_per_task = len(self.phq9s[0].get_summaries(self.req))
+        self.assertEqual(
+            self.dbsession.query(TaskSummaryEntry).count(),
+            n_per_task * len(self.phq9s),
+        )
+
+    def test_other_versions_ignored(self) -> None:
+        TaskSummaryEntry.store_for_tasks(self.req, self.phq9s, self.now)
+        self.dbsession.query(TaskSummaryEntry).filter(
+            TaskSummaryEntry.task_pk == self.phq9s[0].pk
+        ).update(
+            {TaskSummaryEntry.camcops_version: "0.0.1"},
+            synchronize_session=False,
+        )
+        self.assertEqual(
+            sorted(self.stored()), sorted(t.pk for t in self.phq9s[1:])
+        )
+
+    def test_text_in_other_language_not_used(self) -> None:
+        TaskSummaryEntry.store_for_tasks(self.req, self.phq9s, self.now)
+        self.assertEqual(self.stored(language=DANISH), {})
+        # Values that don't depend on language are still used:
+        self.assertEqual(
+            self.stored(language=DANISH, summary_names=["total"]),
+            {t.pk: {"total": t.total_score()} for t in self.phq9s},
+        )
+
+    def test_dump_in_other_language(self) -> None:
+        TaskSummaryEntry.store_for_tasks(self.req, self.phq9s, self.now)
+        english = self.req.sstring(SS.SEVERE)
+        self.switch_language(DANISH)
+        translated = self.req.sstring(SS.SEVERE)
+        self.assertNotEqual(translated, english)
+
+        engine = create_engine("sqlite://")
+        copy_tasks_and_summaries(
+            tasks=self.phq9s,
+            dst_engine=engine,
+            dst_session=sessionmaker(bind=engine)(),
+            export_options=TaskExportOptions(db_include_summaries=True),
+            req=self.req,
+        )
+        with engine.connect() as connection:
+            severities = [
+                row[0]
+                for row in connection.execute(
+                    text(f"SELECT severity FROM {Phq9.__tablename__}")
+                )
+            ]
+        # Tasks 1-3 have total scores of 8-24 (from q1-q8); task 3 is severe.
+        self.assertIn(translated, severities)
+        self.assertNotIn(english, severities)
+        self.assertEqual(
+            severities,
+            [t.severity(self.req) for t in self.phq9s],
+        )
+
+    def test_unstorable_task_stores_nothing(self) -> None:
+        with mock.patch.object(
+            Phq9, "get_summaries", side_effect=ValueError("broken")
+        ):
+            n = TaskSummaryEntry.store_for_tasks(
+                self.req, self.phq9s, self.now
+            )
+        self.assertEqual(n, 0)
+        self.assertEqual(self.stored(), {})
+
+    def test_aggregate(self) -> None:
+        TaskSummaryEntry.store_for_tasks(self.req, self.phq9s, self.now)
+        totals = [t.total_score() for t in self.phq9s]
+        self.assertAlmostEqual(
+            aggregate_stored_summary(
+                self.dbsession, Phq9.__tablename__, "total"
+            ),
+            sum(totals) / len(totals),
+        )
+        self.assertIsNone(
+            aggregate_stored_summary(
+                self.dbsession, Phq9.__tablename__, "total", group_ids=[]
+            )
+        )
+
+    def test_rebuild_stale_only_fills_gaps(self) -> None:
+        TaskSummaryEntry.store_for_tasks(self.req, self.phq9s[:1], self.now)
+        n = rebuild_task_summaries(
+            self.req, tablenames=[Phq9.__tablename__], stale_only=True
+        )
+        self.assertEqual(n, 2)
+        self.assertEqual(
+            sorted(self.stored()), sorted(t.pk for t in self.phq9s)
+        )
+
+    def test_rebuild_drops_non_current_tasks(self) -> None:
+        TaskSummaryEntry.store_for_tasks(self.req, self.phq9s, self.now)
+        self.phq9s[0]._current = False
+        self.dbsession.commit()
+        n = rebuild_task_summaries(self.req, tablenames=[Phq9.__tablename__])
+        self.assertEqual(n, 2)
+        self.assertEqual(
+            sorted(self.stored()), sorted(t.pk for t in self.phq9s[1:])
+        )
@@ -0,0 +1,148 @@
+"""
+camcops_server/cc_modules/tests/cc_trackerplot_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+import os
+from tempfile import TemporaryDirectory
+from typing import List, Optional
+from unittest import mock
+
+from pendulum import DateTime as Pendulum
+
+from camcops_server.cc_modules.cc_trackerhelpers import (
+    LabelAlignment,
+    TrackerAxisTick,
+    TrackerInfo,
+    TrackerLabel,
+)
+from camcops_server.cc_modules.cc_trackerplot import (
+    render_tracker_plot_html,
+    render_tracker_plots,
+    TrackerPlotCache,
+    TrackerPlotSpec,
+)
+from camcops_server.cc_modules.cc_unittest import DemoRequestTestCase
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+
+class TrackerPlotTests(DemoRequestTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.datetimes = [
+            Pendulum(2021, 1, 1),
+            Pendulum(2021, 2, 1),
+            Pendulum(2021, 3, 1),
+        ]
+        self.tracker_info = TrackerInfo(
+            value=0,
+            plot_label="PHQ-9 total score",
+            axis_label="Total score (out of 27)",
+            axis_min=-0.5,
+            axis_max=27.5,
+            axis_ticks=[TrackerAxisTick(y, str(y)) for y in (0, 10, 20, 27)],
+            horizontal_lines=[20, 10],
+            horizontal_labels=[
+                TrackerLabel(23, "severe"),
+                TrackerLabel(5, "mild", LabelAlignment.top),
+            ],
+        )
+        self.tmpdir = TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def spec(self, values: List[Optional[float]]) -> TrackerPlotSpec:
+        return TrackerPlotSpec.from_tracker_info(
+            self.req,
+            self.datetimes,
+            values,
+            self.tracker_info,
+            earliest=self.datetimes[0],
+            latest=self.datetimes[-1],
+        )
+
+    def test_cache_key_depends_on_data(self) -> None:
+        key = self.spec([1, 2, 3]).cache_key
+        self.assertEqual(key, self.spec([1, 2, 3]).cache_key)
+        self.assertNotEqual(key, self.spec([1, 2, 4]).cache_key)
+        self.assertNotEqual(key, self.spec([1, 2, None]).cache_key)
+
+    def test_render(self) -> None:
+        self.assertIn("<img", render_tracker_plot_html(self.spec([1, 5, 9])))
+        self.assertEqual(
+            render_tracker_plot_html(self.spec([None, None, None])), ""
+        )
+
+    def test_render_constant_zero(self) -> None:
+        self.tracker_info.axis_min = None
+        self.tracker_info.axis_max = None
+        html = render_tracker_plot_html(self.spec([0, 0, 0]))
+        self.assertIn("<img", html)
+
+    def test_cache_evicts_least_recently_used(self) -> None:
+        cache = TrackerPlotCache(max_entries=2)
+        cache.put("a", "A")
+        cache.put("b", "B")
+        self.assertEqual(cache.get("a"), "A")
+        cache.put("c", "C")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "A")
+        self.assertEqual(cache.get("c"), "C")
+        self.assertEqual(len(cache), 2)
+
+    def test_disk_cache_shared_and_pruned(self) -> None:
+        cachedir = os.path.join(self.tmpdir.name, "plots")
+        TrackerPlotCache(max_entries=10, directory=cachedir).put("a", "A")
+        other = TrackerPlotCache(max_entries=0, directory=cachedir)
+        self.assertEqual(other.get("a"), "A")
+        self.assertIsNone(other.get("b"))
+
+        for key in "bcd":
+            other.put(key, key.upper())
+        other.prune_disk(max_entries=2)
+        self.assertEqual(len(os.listdir(cachedir)), 2)
+
+    def test_render_many_uses_cache(self) -> None:
+        cache = TrackerPlotCache(max_entries=10)
+        specs = [self.spec([1, 2, 3]), self.spec([3, 2, 1])]
+        with mock.patch(
+            "camcops_server.cc_modules.cc_trackerplot."
+            "render_tracker_plot_html",
+            side_effect=lambda spec: str(spec.values),
+        ) as mock_render:
+            first = render_tracker_plots(specs + specs[:1], cache=cache)
+            self.assertEqual(mock_render.call_count, 2)  # duplicate drawn once
+            second = render_tracker_plots(specs, cache=cache)
+            self.assertEqual(mock_render.call_count, 2)
+        self.assertEqual(
+            first, ["(1.0, 2.0, 3.0)", "(3.0, 2.0, 1.0)", "(1.0, 2.0, 3.0)"]
+        )
+        self.assertEqual(second, first[:2])
@@ -0,0 +1,297 @@
+"""
+camcops_server/cc_modules/tests/cc_xml_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+import base64
+import io
+import logging
+import os
+import time
+from typing import List, Union
+from unittest import TestCase
+import xml.sax.saxutils
+
+from cardinal_pythonlib.httpconst import MimeType
+from cardinal_pythonlib.logs import BraceStyleAdapter
+import pytest
+
+from camcops_server.cc_modules.cc_response import XmlStreamingResponse
+from camcops_server.cc_modules.cc_simpleobjects import XmlSimpleValue
+from camcops_server.cc_modules.cc_xml import (
+    gen_utf8_chunks,
+    gen_xml_document,
+    get_xml_blob_element,
+    get_xml_document,
+    get_xml_tree,
+    xml_escape_value,
+    xml_header,
+    xml_quote_attribute,
+    XML_IGNORE_NAMESPACES,
+    XML_NAMESPACES,
+    XmlBase64Value,
+    XmlDataTypes,
+    XmlElement,
+    XmlLiteral,
+    write_xml_document,
+)
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+
+# =============================================================================
+# Helpers
+# =============================================================================
+
+
+def legacy_get_xml_tree(
+    element: Union[
+        XmlElement, XmlSimpleValue, List[Union[XmlElement, XmlSimpleValue]]
+    ],
+    level: int = 0,
+    indent_spaces: int = 4,
+    eol: str = "\n",
+    include_comments: bool = False,
+) -> str:
+    """
+    The previous implementation of get_xml_tree(), by recursive string
+    concatenation, for comparison.
+    """
+    xmltext = ""
+    prefix = " " * level * indent_spaces
+    if isinstance(element, XmlElement):
+        if element.literal:
+            xmltext += prefix + element.literal + eol
+        else:
+            namespaces = []
+            if level == 0:
+                namespaces.extend(XML_NAMESPACES)
+                if include_comments:
+                    namespaces.extend(XML_IGNORE_NAMESPACES)
+            namespace = " ".join(namespaces)
+            dt = f' xsi:type="{element.datatype}"' if element.datatype else ""
+            cmt = ""
+            if include_comments and element.comment:
+                cmt = f" ignore:comment={xml_quote_attribute(element.comment)}"
+            attributes = f"{namespace}{dt}{cmt}"
+            if element.value is None:
+                xmltext += (
+                    f"{prefix}<{element.name}{attributes} "
+                    f'xsi:nil="true"/>{eol}'
+                )
+            else:
+                complex_value = isinstance(
+                    element.value, XmlElement
+                ) or isinstance(element.value, list)
+                value_to_recurse = (
+                    element.value
+                    if complex_value
+                    else XmlSimpleValue(element.value)
+                )
+                nl = eol if complex_value else ""
+                pr2 = prefix if complex_value else ""
+                v = legacy_get_xml_tree(
+                    value_to_recurse,
+                    level=level + 1,
+                    indent_spaces=indent_spaces,
+                    eol=eol,
+                    include_comments=include_comments,
+                )
+                xmltext += (
+                    f"{prefix}<{element.name}{attributes}>{nl}"
+                    f"{v}{pr2}</{element.name}>{eol}"
+                )
+    elif isinstance(element, list):
+        for subelement in element:
+            xmltext += legacy_get_xml_tree(
+                subelement,
+                level,
+                indent_spaces=indent_spaces,
+                eol=eol,
+                include_comments=include_comments,
+            )
+    elif isinstance(element, XmlSimpleValue):
+        xmltext += xml.sax.saxutils.escape(str(element.value))
+    else:
+        raise ValueError(f"Bad value to get_xml_tree: {element!r}")
+    return xmltext
+
+
+def make_task_tree(n: int, blob_size: int = 0) -> XmlElement:
+    """
+    A tree resembling the XML for one task.
+    """
+    branches = [
+        XmlLiteral("<!-- Stored fields -->"),
+        XmlElement(
+            name="id", value=n, datatype=XmlDataTypes.INTEGER, comment="PK"
+        ),
+        XmlElement(
+            name="comments",
+            value=f"Line 1 <b>&</b> 'quoted' \"double\"\nLine 2 of {n}",
+            datatype=XmlDataTypes.STRING,
+            comment='Free text with "quotes" & <brackets>',
+        ),
+        XmlElement(name="missing", datatype=XmlDataTypes.DOUBLE),
+        XmlElement(name="flag", value=True, datatype=XmlDataTypes.BOOLEAN),
+    ]
+    if blob_size:
+        branches.append(
+            XmlElement(
+                name="photo_blob",
+                value=get_xml_blob_element(
+                    "theblob", os.urandom(blob_size), comment="An image"
+                ),
+            )
+        )
+    return XmlElement(name="phq9", value=branches)
+
+
+def make_tracker_tree(n_tasks: int, blob_size: int = 0) -> XmlElement:
+    return XmlElement(
+        name="tracker",
+        value=[make_task_tree(i, blob_size) for i in range(n_tasks)],
+    )
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+
+class XmlEscapeTests(TestCase):
+    def test_escape_matches_saxutils(self) -> None:
+        for text in ("", "plain", "a < b & c > d", "&amp;", "'\"\n\t"):
+            self.assertEqual(
+                xml_escape_value(text), xml.sax.saxutils.escape(text)
+            )
+
+
+class XmlTreeTests(TestCase):
+    def test_same_output_as_legacy(self) -> None:
+        tree = make_tracker_tree(5, blob_size=100)
+        for include_comments in (False, True):
+            for indent_spaces, eol in ((4, "\n"), (0, ""), (2, "\r\n")):
+                self.assertEqual(
+                    get_xml_tree(
+                        tree,
+                        indent_spaces=indent_spaces,
+                        eol=eol,
+                        include_comments=include_comments,
+                    ),
+                    legacy_get_xml_tree(
+                        tree,
+                        indent_spaces=indent_spaces,
+                        eol=eol,
+                        include_comments=include_comments,
+                    ),
+                )
+
+    def test_generator_value_consumed_lazily(self) -> None:
+        made = []  # type: List[int]
+
+        def gen_tasks():
+            for i in range(3):
+                made.append(i)
+                yield make_task_tree(i)
+
+        tree = XmlElement(name="tracker", value=gen_tasks())
+        pieces = gen_xml_document(tree)
+        self.assertEqual(made, [])
+        text = "".join(pieces)
+        self.assertEqual(made, [0, 1, 2])
+        self.assertEqual(text, get_xml_document(make_tracker_tree(3)))
+
+    def test_non_root_document_rejected(self) -> None:
+        with self.assertRaises(AssertionError):
+            get_xml_document([XmlElement(name="a", value=1)])
+
+    def test_write_to_file(self) -> None:
+        tree = make_tracker_tree(3, blob_size=10)
+        f = io.StringIO()
+        write_xml_document(f, tree)
+        self.assertEqual(f.getvalue(), get_xml_document(tree))
+        self.assertTrue(f.getvalue().startswith(xml_header()))
+
+
+class XmlBase64Tests(TestCase):
+    def test_chunks_concatenate_to_whole(self) -> None:
+        data = os.urandom(1000)
+        value = XmlBase64Value(data)
+        whole = base64.b64encode(data).decode("ascii")
+        self.assertEqual(str(value), whole)
+        for chunk_size in (3, 300, 999, 3000):
+            chunks = list(value.gen_base64(chunk_size))
+            self.assertEqual("".join(chunks), whole)
+        self.assertEqual(len(list(value.gen_base64(300))), 4)
+
+    def test_chunk_size_must_be_multiple_of_three(self) -> None:
+        with self.assertRaises(AssertionError):
+            list(XmlBase64Value(b"abcd").gen_base64(4))
+
+    def test_empty_blob_is_nil(self) -> None:
+        self.assertIsNone(get_xml_blob_element("theblob", b"").value)
+        self.assertIsNone(get_xml_blob_element("theblob", None).value)
+
+
+class XmlStreamingTests(TestCase):
+    def test_utf8_chunks(self) -> None:
+        pieces = ["é" * 10] * 10  # 20 bytes each
+        chunks = list(gen_utf8_chunks(pieces, chunk_size=50))
+        self.assertEqual([len(c) for c in chunks], [60, 60, 60, 20])
+        self.assertEqual(b"".join(chunks).decode("utf-8"), "".join(pieces))
+
+    def test_response_streams_document(self) -> None:
+        tree = make_tracker_tree(50, blob_size=1000)
+        response = XmlStreamingResponse(gen_xml_document(tree))
+        self.assertEqual(response.content_type, MimeType.XML)
+        self.assertEqual(response.charset.lower(), "utf-8")
+        self.assertEqual(response.body.decode("utf-8"), get_xml_document(tree))
+
+    @pytest.mark.benchmark
+    def test_streaming_speed(self) -> None:
+        """
+        Run with ``pytest --benchmark -k test_streaming_speed``.
+        """
+        tree = make_tracker_tree(500, blob_size=100000)
+
+        start = time.perf_counter()
+        legacy = xml_header() + legacy_get_xml_tree(tree)
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        n_bytes = 0
+        for chunk in gen_utf8_chunks(gen_xml_document(tree)):
+            n_bytes += len(chunk)
+        streaming_time = time.perf_counter() - start
+
+        self.assertEqual(n_bytes, len(legacy.encode("utf-8")))
+        log.info(
+            "{} bytes of XML. Concatenation: {:.3f} s; streaming: {:.3f} s",
+            n_bytes,
+            legacy_time,
+            streaming_time,
+        )
+        self.assertLess(streaming_time, legacy_time)
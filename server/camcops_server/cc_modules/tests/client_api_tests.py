@@ -26,9 +26,13 @@ camcops_server/cc_modules/tests/client_api_tests.py
 """
 
 import json
-
+import logging
 import string
-from typing import Dict
+import time
+from typing import Any, Dict, List
+from unittest import mock, TestCase
+
+from cardinal_pythonlib.logs import BraceStyleAdapter
 
 from cardinal_pythonlib.classes import class_attribute_names
 from cardinal_pythonlib.convert import (
@@ -39,18 +43,27 @@ from cardinal_pythonlib.nhs import generate_random_nhs_number
 from cardinal_pythonlib.sql.literals import sql_quote_string
 from cardinal_pythonlib.text import escape_newlines, unescape_newlines
 from pyramid.response import Response
+import pytest
 
 from camcops_server.cc_modules.cc_client_api_core import (
+    ExtraStringsReplyType,
     fail_server_error,
     fail_unsupported_operation,
     fail_user_error,
     ServerErrorException,
+    ServerRecord,
+    ServerRecordIndex,
     TabletParam,
     UserErrorException,
 )
+from camcops_server.cc_modules.cc_constants import ERA_NOW
 from camcops_server.cc_modules.cc_convert import decode_values
 from camcops_server.cc_modules.cc_ipuse import IpUse
+from camcops_server.cc_modules.cc_patient import Patient
 from camcops_server.cc_modules.cc_proquint import uuid_from_proquint
+from camcops_server.cc_modules.cc_string import all_extra_string_hashes
+from camcops_server.cc_modules.cc_tabletsession import TabletSession
+from camcops_server.cc_modules.cc_tasksummary import get_stored_summaries
 from camcops_server.cc_modules.cc_unittest import (
     BasicDatabaseTestCase,
     DemoDatabaseTestCase,
@@ -64,10 +77,15 @@ from camcops_server.cc_modules.client_api import (
     client_api,
     FAILURE_CODE,
     make_single_user_mode_username,
+    op_get_extra_strings,
+    op_upload_entire_database,
     Operations,
     SUCCESS_CODE,
+    UPLOAD_BATCH_SIZE,
 )
+from camcops_server.tasks.phq15 import Phq15
 
+log = BraceStyleAdapter(logging.getLogger(__name__))
 
 TEST_NHS_NUMBER = generate_random_nhs_number()
 
@@ -715,3 +733,357 @@ class GetTaskSchedulesTests(BasicDatabaseTestCase):
         # GMCPQ
         gmcpq_sched = schedule_items[3]
         self.assertTrue(gmcpq_sched[TabletParam.ANONYMOUS])
+
+
+class ServerRecordIndexTests(TestCase):
+    def test_lookup_and_deletion(self) -> None:
+        index = ServerRecordIndex(
+            [
+                ServerRecord(client_pk=1, exists_on_server=True, server_pk=10),
+                ServerRecord(client_pk=2, exists_on_server=True, server_pk=20),
+                ServerRecord(client_pk=3, exists_on_server=True, server_pk=30),
+            ]
+        )
+        self.assertEqual(index.get(2).server_pk, 20)
+        missing = index.get(99)
+        self.assertFalse(missing.exists)
+        self.assertEqual(missing.client_pk, 99)
+
+        index.note_uploaded(20)
+        index.note_uploaded(None)
+        self.assertEqual(index.server_pks_not_uploaded(), [10, 30])
+
+
+class OneStepUploadTests(BasicDatabaseTestCase):
+    """
+    Tests :func:`op_upload_entire_database`, bypassing the login process.
+    """
+
+    def upload_patients(
+        self,
+        patient_rows: List[Dict[str, Any]],
+        finalizing: bool = False,
+        other_tables: Dict[str, List[Dict[str, Any]]] = None,
+    ) -> None:
+        dbdata = {Patient.__tablename__: patient_rows}
+        dbdata.update(other_tables or {})
+        self.req.fake_request_post_from_dict(
+            {
+                TabletParam.CAMCOPS_VERSION: MINIMUM_TABLET_VERSION,
+                TabletParam.DEVICE: self.other_device.name,
+                TabletParam.USER: "tablet_user",
+                TabletParam.OPERATION: Operations.UPLOAD_ENTIRE_DATABASE,
+                TabletParam.FINALIZING: int(finalizing),
+                TabletParam.PKNAMEINFO: json.dumps(
+                    {tablename: "id" for tablename in dbdata}
+                ),
+                TabletParam.DBDATA: json.dumps(dbdata),
+            }
+        )
+        # We've set req._debugging_user, so skip the login:
+        self.req.tabletsession = TabletSession(self.req)
+        op_upload_entire_database(self.req)
+
+    @staticmethod
+    def patient_row(
+        client_pk: int,
+        surname: str = "SMITH",
+        modified_seconds: int = 0,
+        move_off_tablet: bool = False,
+        sex: str = "F",
+    ) -> Dict[str, Any]:
+        # Values are SQL-style literals, as the client sends them.
+        return {
+            "id": str(client_pk),
+            "when_last_modified": (
+                f"'2020-01-01T00:00:{modified_seconds:02d}.000+00:00'"
+            ),
+            "_move_off_tablet": str(int(move_off_tablet)),
+            "surname": f"'{surname}'",
+            "sex": f"'{sex}'",
+        }
+
+    def current_patients(self) -> Dict[int, Patient]:
+        # noinspection PyProtectedMember
+        patients = (
+            self.dbsession.query(Patient)
+            .filter(Patient._device_id == self.other_device.id)
+            .filter(Patient._era == ERA_NOW)
+            .filter(Patient._current == True)  # noqa: E712
+            .all()
+        )
+        return {p.id: p for p in patients}
+
+    def test_new_modified_identical_deleted(self) -> None:
+        self.upload_patients([self.patient_row(i) for i in (1, 2, 3)])
+        first = self.current_patients()
+        self.assertEqual(sorted(first.keys()), [1, 2, 3])
+
+        # 1: modified; 2: identical; 3: deleted; 4: new
+        self.upload_patients(
+            [
+                self.patient_row(1, surname="JONES", modified_seconds=1),
+                self.patient_row(2),
+                self.patient_row(4),
+            ]
+        )
+        second = self.current_patients()
+        self.assertEqual(sorted(second.keys()), [1, 2, 4])
+        # noinspection PyProtectedMember
+        self.assertNotEqual(second[1]._pk, first[1]._pk)
+        self.assertEqual(second[1].surname, "JONES")
+        # noinspection PyProtectedMember
+        self.assertEqual(second[1]._predecessor_pk, first[1]._pk)
+        # noinspection PyProtectedMember
+        self.assertEqual(second[2]._pk, first[2]._pk)
+
+    def test_modifications_across_several_batches(self) -> None:
+        n = UPLOAD_BATCH_SIZE * 2 + 1
+        self.upload_patients([self.patient_row(i) for i in range(1, n + 1)])
+        first = self.current_patients()
+        self.upload_patients(
+            [
+                self.patient_row(i, surname="JONES", modified_seconds=1)
+                for i in range(1, n + 1)
+            ]
+        )
+        # The upload changes old records via SQLAlchemy Core:
+        self.dbsession.expire_all()
+        second = self.current_patients()
+        self.assertEqual(sorted(second.keys()), list(range(1, n + 1)))
+        old_by_pk = {
+            p._pk: p
+            for p in self.dbsession.query(Patient).filter(
+                Patient._pk.in_([p._pk for p in first.values()])
+            )
+        }
+        for client_pk, new in second.items():
+            self.assertEqual(new.surname, "JONES")
+            # noinspection PyProtectedMember
+            old = old_by_pk[first[client_pk]._pk]
+            # noinspection PyProtectedMember
+            self.assertEqual(new._predecessor_pk, old._pk)
+            # noinspection PyProtectedMember
+            self.assertEqual(old._successor_pk, new._pk)
+            # noinspection PyProtectedMember
+            self.assertFalse(old._current)
+
+    def test_move_off_tablet_preserves_predecessors(self) -> None:
+        self.upload_patients([self.patient_row(1), self.patient_row(2)])
+        self.upload_patients(
+            [
+                self.patient_row(1, modified_seconds=1, move_off_tablet=True),
+                self.patient_row(2),
+            ]
+        )
+        self.assertEqual(sorted(self.current_patients().keys()), [2])
+        # noinspection PyProtectedMember
+        versions = (
+            self.dbsession.query(Patient)
+            .filter(Patient._device_id == self.other_device.id)
+            .filter(Patient.id == 1)
+            .all()
+        )
+        self.assertEqual(len(versions), 2)
+        for p in versions:
+            # noinspection PyProtectedMember
+            self.assertNotEqual(p._era, ERA_NOW)
+
+    def test_patient_upload_updates_task_summaries(self) -> None:
+        # A PHQ-15 with question 4 unanswered, which is only complete for a
+        # male patient:
+        phq15_row = {
+            "id": "1",
+            "when_last_modified": "'2020-01-01T00:00:00.000+00:00'",
+            "_move_off_tablet": "0",
+            "when_created": "'2020-01-01T00:00:00.000+00:00'",
+            "patient_id": "1",
+        }
+        for q in range(1, Phq15.NQUESTIONS + 1):
+            phq15_row[f"q{q}"] = "NULL" if q == 4 else "0"
+        tasks = {Phq15.__tablename__: [phq15_row]}
+
+        def stored_is_complete() -> bool:
+            # noinspection PyProtectedMember
+            task_pk = (
+                self.dbsession.query(Phq15._pk)
+                .filter(Phq15._device_id == self.other_device.id)
+                .filter(Phq15._current == True)  # noqa: E712
+                .scalar()
+            )
+            return get_stored_summaries(
+                self.dbsession,
+                Phq15.__tablename__,
+                [task_pk],
+                self.req.language,
+            )[task_pk]["is_complete"]
+
+        self.upload_patients(
+            [self.patient_row(1, sex="M")], other_tables=tasks
+        )
+        self.assertTrue(stored_is_complete())
+
+        # Change the patient only; the task is uploaded unchanged:
+        self.upload_patients(
+            [self.patient_row(1, sex="F", modified_seconds=1)],
+            other_tables=tasks,
+        )
+        self.assertFalse(stored_is_complete())
+
+    @pytest.mark.benchmark
+    def test_upload_time_is_linear(self) -> None:
+        """
+        Times one-step uploads of increasing size. Upload time per row should
+        be roughly constant; it used to be O(n) per row (so O(n^2) overall)
+        when re-uploading existing records.
+
+        Run with ``pytest --benchmark -k test_upload_time_is_linear``.
+        """
+        n_values = (1000, 10000, 100000)
+        seconds_per_row = []  # type: List[float]
+        first_pk = 1
+        for n in n_values:
+            # Upload n new records, then re-upload with all records
+            # identical, which exercises the record lookup. (Records from
+            # the previous size are deleted by the first upload.)
+            rows = [self.patient_row(i) for i in range(first_pk, first_pk + n)]
+            first_pk += n
+            self.upload_patients(rows)
+            start = time.perf_counter()
+            self.upload_patients(rows)
+            elapsed = time.perf_counter() - start
+            log.info(
+                "Re-uploading {} records took {:.3f} s ({:.1f} us/row)",
+                n,
+                elapsed,
+                1e6 * elapsed / n,
+            )
+            seconds_per_row.append(elapsed / n)
+        # Generous allowance for noise, but a quadratic algorithm would be
+        # ~100 times slower per row for the largest size.
+        self.assertLess(seconds_per_row[-1], 5 * seconds_per_row[0])
+
+
+class GetExtraStringsTests(BasicDatabaseTestCase):
+    """
+    Tests :func:`op_get_extra_strings`, bypassing the login process.
+    """
+
+    def get_extra_strings(self, client_version: str = None) -> Dict[str, Any]:
+        post = {
+            TabletParam.CAMCOPS_VERSION: MINIMUM_TABLET_VERSION,
+            TabletParam.DEVICE: self.other_device.name,
+            TabletParam.USER: "tablet_user",
+            TabletParam.OPERATION: Operations.GET_EXTRA_STRINGS,
+        }
+        if client_version is not None:
+            post[TabletParam.EXTRA_STRINGS_VERSION] = client_version
+        self.req.fake_request_post_from_dict(post)
+        # We've set req._debugging_user, so skip the login:
+        self.req.tabletsession = TabletSession(self.req)
+        return op_get_extra_strings(self.req)
+
+    def test_full_then_not_modified(self) -> None:
+        reply = self.get_extra_strings()
+        self.assertEqual(
+            reply[TabletParam.EXTRA_STRINGS_REPLY_TYPE],
+            ExtraStringsReplyType.FULL,
+        )
+        self.assertEqual(
+            reply[TabletParam.NRECORDS], len(self.req.get_all_extra_strings())
+        )
+        version = reply[TabletParam.EXTRA_STRINGS_VERSION]
+
+        reply = self.get_extra_strings(version)
+        self.assertEqual(
+            reply[TabletParam.EXTRA_STRINGS_REPLY_TYPE],
+            ExtraStringsReplyType.NOT_MODIFIED,
+        )
+        self.assertEqual(reply[TabletParam.NRECORDS], 0)
+        self.assertEqual(reply[TabletParam.EXTRA_STRINGS_VERSION], version)
+
+    def test_audit(self) -> None:
+        with mock.patch(
+            "camcops_server.cc_modules.client_api.audit"
+        ) as mock_audit:
+            version = self.get_extra_strings()[
+                TabletParam.EXTRA_STRINGS_VERSION
+            ]
+            self.get_extra_strings(version)
+            self.get_extra_strings("abc123_0")
+        self.assertEqual(
+            [c[0][1] for c in mock_audit.call_args_list],
+            ["get_extra_strings", "get_extra_strings (full)"],
+        )
+
+    def test_unknown_version_gets_everything(self) -> None:
+        reply = self.get_extra_strings("abc123_0")
+        self.assertEqual(
+            reply[TabletParam.EXTRA_STRINGS_REPLY_TYPE],
+            ExtraStringsReplyType.FULL,
+        )
+        with self.assertRaises(UserErrorException):
+            self.get_extra_strings("../not_valid")
+
+    def test_delta(self) -> None:
+        version = self.req.extra_strings_version
+        _, hashes = all_extra_string_hashes(self.req.config_filename)
+        old_hashes = dict(hashes)
+        changed_key = ("phq9", "q1", "")
+        new_key = ("phq9", "q2", "")
+        deleted_key = ("phq9", "no_such_string", "")
+        old_hashes[changed_key] = "old"
+        del old_hashes[new_key]
+        old_hashes[deleted_key] = "old"
+
+        with mock.patch(
+            "camcops_server.cc_modules.client_api."
+            "get_extra_string_hashes_for_version",
+            return_value=old_hashes,
+        ) as mock_get_hashes:
+            reply = self.get_extra_strings("abc123_" + version.split("_")[1])
+        mock_get_hashes.assert_called_once_with(
+            self.req.config_filename, "abc123"
+        )
+
+        self.assertEqual(
+            reply[TabletParam.EXTRA_STRINGS_REPLY_TYPE],
+            ExtraStringsReplyType.DELTA,
+        )
+        self.assertEqual(reply[TabletParam.EXTRA_STRINGS_VERSION], version)
+        self.assertEqual(reply[TabletParam.NRECORDS], 2)
+        records = sorted(
+            decode_values(reply[f"{TabletParam.RECORD_PREFIX}{i}"])
+            for i in range(2)
+        )
+        self.assertEqual(
+            records,
+            [
+                list(changed_key) + [self.req.xstring("phq9", "q1")],
+                list(new_key) + [self.req.xstring("phq9", "q2")],
+            ],
+        )
+        self.assertEqual(
+            json.loads(reply[TabletParam.EXTRA_STRINGS_DELETED]),
+            [list(deleted_key)],
+        )
+
+    def test_restricted_task_changes_version(self) -> None:
+        version = self.req.extra_strings_version
+        self.assertNotIn("phq9", self.req.extra_string_tasks_not_permitted)
+        self.req.config.restricted_tasks = {"phq9": ["some_other_group"]}
+        del self.req.extra_string_tasks_not_permitted  # reset reify cache
+        del self.req.extra_strings_version
+        self.assertIn("phq9", self.req.extra_string_tasks_not_permitted)
+
+        reply = self.get_extra_strings(version)
+        self.assertEqual(
+            reply[TabletParam.EXTRA_STRINGS_REPLY_TYPE],
+            ExtraStringsReplyType.FULL,
+        )
+        self.assertNotEqual(reply[TabletParam.EXTRA_STRINGS_VERSION], version)
+        tasks = set(
+            decode_values(reply[f"{TabletParam.RECORD_PREFIX}{i}"])[0]
+            for i in range(reply[TabletParam.NRECORDS])
+        )
+        self.assertNotIn("phq9", tasks)
@@ -0,0 +1,251 @@
+"""
+camcops_server/cc_modules/tests/merge_db_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012, University of Cambridge, Department of Psychiatry.
+    Created by Rudolf Cardinal (rnc1001@cam.ac.uk).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <https://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+import os
+import tempfile
+from typing import Any, List
+from unittest import mock, TestCase
+
+from cardinal_pythonlib.sqlalchemy.session import make_sqlite_url
+import pendulum
+from sqlalchemy.orm import sessionmaker
+
+from camcops_server.cc_modules.cc_db import GenericTabletRecordMixin
+from camcops_server.cc_modules.cc_device import Device
+from camcops_server.cc_modules.cc_group import Group
+from camcops_server.cc_modules.cc_idnumdef import IdNumDefinition
+from camcops_server.cc_modules.cc_patient import Patient
+from camcops_server.cc_modules.cc_patientidnum import PatientIdNum
+from camcops_server.cc_modules.cc_sqlalchemy import (
+    Base,
+    make_file_sqlite_engine,
+)
+from camcops_server.cc_modules.cc_user import User
+from camcops_server.cc_modules.merge_db import (
+    get_bulk_tables,
+    merge_camcops_db,
+    MergeCheckpoint,
+)
+from camcops_server.tasks.bmi import Bmi
+from camcops_server.tasks.phq9 import Phq9
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+
+class MergeDbTests(TestCase):
+    """
+    Merges between two on-disk SQLite databases. (The merge needs a
+    destination session bound to an engine, not a connection, so we don't use
+    the usual test database.)
+    """
+
+    ERA = "2010-07-07T12:40:00.000000+00:00"
+    WHEN_CREATED = pendulum.parse("2010-07-07T13:40+0100")
+    DST_GROUP_ID = 5
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.checkpoint_dir = os.path.join(self.tmpdir.name, "checkpoints")
+        src_filename = os.path.join(self.tmpdir.name, "src.sqlite")
+        self.src_url = make_sqlite_url(src_filename)
+        self.src_engine = make_file_sqlite_engine(src_filename)
+        self.dst_engine = make_file_sqlite_engine(
+            os.path.join(self.tmpdir.name, "dst.sqlite")
+        )
+        Base.metadata.create_all(self.src_engine)
+        Base.metadata.create_all(self.dst_engine)
+        self.dst_session = sessionmaker(bind=self.dst_engine)()
+        self.dst_session.add(Group(id=self.DST_GROUP_ID, name="new_group"))
+        self.dst_session.add(self.make_iddef())
+        self.dst_session.commit()
+
+        src_session = sessionmaker(bind=self.src_engine)()
+        src_session.add(Device(id=1, name="old_tablet"))
+        src_session.add(User(id=1, username="old_user", hashedpw=""))
+        src_session.add(Group(id=1, name="old_group"))
+        src_session.add(self.make_iddef())
+        patient = Patient(id=1, forename="Jo", surname="Patient")
+        self.apply_src_fields(patient)
+        src_session.add(patient)
+        idnum = PatientIdNum(
+            id=1, patient_id=1, which_idnum=1, idnum_value=1234567890
+        )
+        self.apply_src_fields(idnum)
+        src_session.add(idnum)
+        for task_id in range(1, 8):
+            task = Phq9() if task_id <= 5 else Bmi()
+            task.id = task_id
+            task.patient_id = 1
+            task.when_created = self.WHEN_CREATED
+            self.apply_src_fields(task)
+            src_session.add(task)
+        src_session.commit()
+        src_session.close()
+
+    def tearDown(self) -> None:
+        self.dst_session.close()
+        self.src_engine.dispose()
+        self.dst_engine.dispose()
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    @staticmethod
+    def make_iddef() -> IdNumDefinition:
+        return IdNumDefinition(
+            which_idnum=1, description="NHS number", short_description="NHS#"
+        )
+
+    def apply_src_fields(self, obj: GenericTabletRecordMixin) -> None:
+        obj._device_id = 1
+        obj._era = self.ERA
+        obj._group_id = 1
+        obj._current = True
+        obj._adding_user_id = 1
+        obj._when_added_batch_utc = self.WHEN_CREATED
+
+    def merge(self, dummy_run: bool = False, **kwargs: Any) -> None:
+        req = mock.Mock(engine=self.dst_engine, dbsession=self.dst_session)
+        with mock.patch(
+            "camcops_server.cc_modules.merge_db.get_command_line_request",
+            return_value=req,
+        ):
+            merge_camcops_db(
+                src=self.src_url,
+                echo=False,
+                report_every=1000,
+                dummy_run=dummy_run,
+                info_only=False,
+                default_group_id=None,
+                default_group_name=None,
+                groupnum_map={1: self.DST_GROUP_ID},
+                whichidnum_map={1: 1},
+                **kwargs,
+            )
+
+    def dst_tasks(self, task_class: type) -> List[Any]:
+        return (
+            self.dst_session.query(task_class)
+            .filter(task_class._device_id == self.dst_device_id())
+            .order_by(task_class.id)
+            .all()
+        )
+
+    def dst_device_id(self) -> int:
+        return (
+            self.dst_session.query(Device.id)
+            .filter(Device.name == "old_tablet")
+            .scalar()
+        )
+
+    def assert_merged(self) -> None:
+        user_id = (
+            self.dst_session.query(User.id)
+            .filter(User.username == "old_user")
+            .scalar()
+        )
+        phq9s = self.dst_tasks(Phq9)
+        self.assertEqual([t.id for t in phq9s], [1, 2, 3, 4, 5])
+        self.assertEqual(len(self.dst_tasks(Bmi)), 2)
+        for task in phq9s:
+            self.assertEqual(task._group_id, self.DST_GROUP_ID)
+            self.assertEqual(task._adding_user_id, user_id)
+            self.assertEqual(task._era, self.ERA)
+            self.assertEqual(task.when_created, self.WHEN_CREATED)
+            self.assertEqual(task.patient.surname, "Patient")
+            self.assertEqual(task.patient.get_idnum_value(1), 1234567890)
+
+    def test_only_task_tables_copied_in_bulk(self) -> None:
+        tablenames = [
+            t.name
+            for t in get_bulk_tables(
+                skip_table_names=[], src_tables=list(Base.metadata.tables)
+            )
+        ]
+        self.assertIn(Phq9.__tablename__, tablenames)
+        self.assertNotIn(Patient.__tablename__, tablenames)
+        self.assertNotIn(PatientIdNum.__tablename__, tablenames)
+        self.assertNotIn(User.__tablename__, tablenames)
+
+    def test_record_by_record_merge(self) -> None:
+        self.merge()
+        self.assert_merged()
+
+    def test_bulk_merge(self) -> None:
+        self.merge(bulk=True, bulk_chunk_size=2)
+        self.assert_merged()
+
+    def test_parallel_bulk_merge(self) -> None:
+        self.merge(bulk=True, bulk_chunk_size=2, bulk_workers=3)
+        self.assert_merged()
+
+    def test_dummy_bulk_merge(self) -> None:
+        self.merge(bulk=True, bulk_chunk_size=2, dummy_run=True)
+        self.assertIsNone(self.dst_device_id())
+        self.assertEqual(self.dst_session.query(Phq9).count(), 0)
+
+        self.merge(bulk=True, bulk_chunk_size=2)
+        self.assert_merged()
+
+    def test_interrupted_bulk_merge_resumes(self) -> None:
+        real_save = MergeCheckpoint.save
+
+        def interrupting_save(checkpoint: MergeCheckpoint, *args) -> None:
+            if checkpoint.tablename == Phq9.__tablename__ and (
+                checkpoint.n_rows == 4
+            ):
+                # Interrupted after the second chunk was committed, but before
+                # the checkpoint was saved.
+                raise RuntimeError("interrupted")
+            real_save(checkpoint, *args)
+
+        with mock.patch.object(MergeCheckpoint, "save", interrupting_save):
+            with self.assertRaises(RuntimeError):
+                self.merge(
+                    bulk=True,
+                    bulk_chunk_size=2,
+                    checkpoint_dir=self.checkpoint_dir,
+                )
+        self.assertEqual(len(self.dst_tasks(Phq9)), 4)
+        checkpoint = MergeCheckpoint.load(
+            self.checkpoint_dir, Phq9.__tablename__
+        )
+        self.assertEqual(checkpoint.n_rows, 2)
+
+        self.merge(
+            bulk=True, bulk_chunk_size=2, checkpoint_dir=self.checkpoint_dir
+        )
+        self.assert_merged()
+        self.assertEqual(os.listdir(self.checkpoint_dir), [])
+
+    def test_merging_twice_fails(self) -> None:
+        self.merge(bulk=True)
+        with self.assertRaises(ValueError):
+            self.merge(bulk=True)
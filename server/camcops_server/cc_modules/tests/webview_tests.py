@@ -32,6 +32,7 @@ import time
 from typing import cast
 import unittest
 from unittest import mock
+from urllib.parse import parse_qsl, urlsplit
 
 from cardinal_pythonlib.classes import class_attribute_names
 from cardinal_pythonlib.httpconst import MimeType
@@ -42,6 +43,7 @@ import pyotp
 from pyramid.httpexceptions import HTTPBadRequest, HTTPFound
 from webob.multidict import MultiDict
 
+from camcops_server.cc_modules.cc_audit import audit
 from camcops_server.cc_modules.cc_constants import (
     ERA_NOW,
     MfaMethod,
@@ -55,17 +57,27 @@ from camcops_server.cc_modules.cc_patientidnum import PatientIdNum
 from camcops_server.cc_modules.cc_pyramid import (
     FlashQueue,
     FormAction,
+    KeysetPage,
     Routes,
     ViewArg,
     ViewParam,
 )
 from camcops_server.cc_modules.cc_sms import ConsoleSmsBackend, get_sms_backend
-from camcops_server.cc_modules.cc_taskindex import PatientIdNumIndexEntry
+from camcops_server.cc_modules.cc_taskcollection import TaskCollection
+from camcops_server.cc_modules.cc_taskfilter import TaskFilter
+from camcops_server.cc_modules.cc_taskindex import (
+    PatientIdNumIndexEntry,
+    TaskIndexEntry,
+)
 from camcops_server.cc_modules.cc_taskschedule import (
     PatientTaskSchedule,
     TaskSchedule,
     TaskScheduleItem,
 )
+from camcops_server.cc_modules.cc_tasksummary import (
+    get_stored_summaries,
+    TaskSummaryEntry,
+)
 from camcops_server.cc_modules.cc_unittest import (
     BasicDatabaseTestCase,
     DemoDatabaseTestCase,
@@ -112,7 +124,10 @@ from camcops_server.cc_modules.webview import (
     LoginView,
     MfaMixin,
     SendEmailFromPatientTaskScheduleView,
+    view_audit_trail,
+    view_tasks,
 )
+from camcops_server.tasks.phq15 import Phq15
 
 log = logging.getLogger(__name__)
 
@@ -171,6 +186,41 @@ class WebviewTests(DemoDatabaseTestCase):
             except ValueError:
                 self.fail(f"Operations.{x} fails validate_alphanum_underscore")
 
+    def test_view_tasks_pages_through_index_by_keyset(self) -> None:
+        self.announce("test_view_tasks_pages_through_index_by_keyset")
+        now = self.req.now_utc
+        for task in TaskCollection(
+            self.req, taskfilter=TaskFilter(), via_index=False
+        ).all_tasks:
+            TaskIndexEntry.index_task(task, self.dbsession, now)
+        self.dbsession.flush()
+        self.req.set_get_params({ViewParam.ROWS_PER_PAGE: "2"})
+        page1 = view_tasks(self.req)["page"]
+        self.assertIsInstance(page1, KeysetPage)
+        self.assertEqual(len(page1), 2)
+        self.assertGreater(page1.item_count, 2)
+
+        query = urlsplit(page1.next_url).query
+        self.req.set_get_params(dict(parse_qsl(query)))
+        page2 = view_tasks(self.req)["page"]
+        self.assertEqual(len(page2), 2)
+        seen = [i.index_entry_pk for i in list(page1) + list(page2)]
+        self.assertEqual(len(set(seen)), 4)
+        self.assertGreaterEqual(
+            page1[-1].when_created_utc, page2[0].when_created_utc
+        )
+
+    def test_view_audit_trail_pages_by_keyset(self) -> None:
+        self.announce("test_view_audit_trail_pages_by_keyset")
+        for i in range(3):
+            audit(self.req, f"test entry {i}")
+        self.dbsession.flush()
+        self.req.set_get_params({ViewParam.ROWS_PER_PAGE: "2"})
+        response = view_audit_trail(self.req)
+        self.assertIn("test entry 2", response.text)
+        self.assertNotIn("test entry 0", response.text)
+        self.assertIn(f"{ViewParam.AFTER}=", response.text)
+
 
 class AddTaskScheduleViewTests(DemoDatabaseTestCase):
     """
@@ -899,6 +949,77 @@ class EditFinalizedPatientViewTests(BasicDatabaseTestCase):
         self.assertIn("idnum1", messages[0])
         self.assertIn(str(TEST_NHS_NUMBER_1), messages[0])
 
+    def test_task_summaries_updated(self) -> None:
+        patient = self.create_patient(
+            id=1, forename="Jo", surname="Patient", sex="M"
+        )
+        self.create_patient_idnum(
+            patient_id=patient.id,
+            which_idnum=self.nhs_iddef.which_idnum,
+            idnum_value=TEST_NHS_NUMBER_1,
+        )
+        phq15 = Phq15()
+        self.apply_standard_task_fields(phq15)
+        phq15.id = 1
+        phq15.patient_id = patient.id
+        for q in range(1, Phq15.NQUESTIONS + 1):
+            setattr(phq15, f"q{q}", 0)
+        phq15.q4 = None  # only required for female patients
+        self.dbsession.add(phq15)
+        self.dbsession.commit()
+        TaskSummaryEntry.store_for_tasks(self.req, [phq15], local(2020, 1, 1))
+
+        def stored_is_complete() -> bool:
+            return get_stored_summaries(
+                self.dbsession,
+                Phq15.__tablename__,
+                [phq15.pk],
+                self.req.language,
+            )[phq15.pk]["is_complete"]
+
+        self.assertTrue(stored_is_complete())
+
+        self.req.add_get_params(
+            {ViewParam.SERVER_PK: str(patient.pk)}, set_method_get=False
+        )
+        multidict = MultiDict(
+            [
+                ("_charset_", UTF8),
+                ("__formid__", "deform"),
+                (ViewParam.CSRF_TOKEN, self.req.session.get_csrf_token()),
+                (ViewParam.SERVER_PK, str(patient.pk)),
+                (ViewParam.GROUP_ID, str(patient.group.id)),
+                (ViewParam.FORENAME, patient.forename),
+                (ViewParam.SURNAME, patient.surname),
+                ("__start__", "dob:mapping"),
+                ("date", ""),
+                ("__end__", "dob:mapping"),
+                ("__start__", "sex:rename"),
+                ("deformField7", "F"),
+                ("__end__", "sex:rename"),
+                ("__start__", "id_references:sequence"),
+                ("__start__", "idnum_sequence:mapping"),
+                (ViewParam.WHICH_IDNUM, self.nhs_iddef.which_idnum),
+                (ViewParam.IDNUM_VALUE, str(TEST_NHS_NUMBER_1)),
+                ("__end__", "idnum_sequence:mapping"),
+                ("__end__", "id_references:sequence"),
+                ("__start__", "danger:mapping"),
+                ("target", "7836"),
+                ("user_entry", "7836"),
+                ("__end__", "danger:mapping"),
+                (FormAction.SUBMIT, "submit"),
+            ]
+        )
+        self.req.fake_request_post_from_dict(multidict)
+
+        with self.assertRaises(HTTPFound):
+            edit_finalized_patient(self.req)
+
+        self.dbsession.commit()
+
+        self.assertEqual(patient.sex, "F")
+        self.assertFalse(stored_is_complete())
+
     def test_message_when_no_changes(self) -> None:
         patient = self.create_patient(
             forename="Jo",
@@ -147,7 +147,6 @@ from cardinal_pythonlib.pyramid.responses import (
     BinaryResponse,
     JsonResponse,
     PdfResponse,
-    XmlResponse,
 )
 from cardinal_pythonlib.sqlalchemy.dialect import (
     get_dialect_name,
@@ -174,7 +173,7 @@ import pygments.lexers
 import pygments.lexers.sql
 import pygments.lexers.web
 import pygments.formatters
-from sqlalchemy.orm import joinedload, Query
+from sqlalchemy.orm import joinedload, Query, selectinload
 from sqlalchemy.sql.functions import func
 from sqlalchemy.sql.expression import desc, or_, select, update
 
@@ -292,6 +291,7 @@ from camcops_server.cc_modules.cc_pyramid import (
     FormAction,
     HTTPFoundDebugVersion,
     Icons,
+    KeysetPage,
     PageUrl,
     Permission,
     Routes,
@@ -301,13 +301,17 @@ from camcops_server.cc_modules.cc_pyramid import (
 )
 from camcops_server.cc_modules.cc_report import get_report_instance
 from camcops_server.cc_modules.cc_request import CamcopsRequest
+from camcops_server.cc_modules.cc_response import XmlStreamingResponse
 from camcops_server.cc_modules.cc_simpleobjects import (
     IdNumReference,
     TaskExportOptions,
 )
 from camcops_server.cc_modules.cc_specialnote import SpecialNote
 from camcops_server.cc_modules.cc_session import CamcopsSession
-from camcops_server.cc_modules.cc_sqlalchemy import get_all_ddl
+from camcops_server.cc_modules.cc_sqlalchemy import (
+    estimate_table_row_count,
+    get_all_ddl,
+)
 from camcops_server.cc_modules.cc_task import (
     tablename_to_task_class_dict,
     Task,
@@ -334,6 +338,7 @@ from camcops_server.cc_modules.cc_taskschedule import (
     TaskScheduleItem,
     task_schedule_item_sort_order,
 )
+from camcops_server.cc_modules.cc_tasksummary import TaskSummaryEntry
 from camcops_server.cc_modules.cc_text import SS
 from camcops_server.cc_modules.cc_tracker import ClinicalTextView, Tracker
 from camcops_server.cc_modules.cc_user import (
@@ -2052,11 +2057,10 @@ def view_tasks(req: "CamcopsRequest") -> Dict[str, Any]:
     rendered_refresh_form = refresh_form.render()
 
     # Get tasks, unless there have been form errors.
-    # In principle, for some filter settings (single task, no "complete"
-    # preference...) we could produce an ORM query and use SqlalchemyOrmPage,
-    # which would apply LIMIT/OFFSET (or equivalent) to the query, and be
-    # very nippy. In practice, this is probably an unusual setting, so we'll
-    # simplify things here with a Python list regardless of the settings.
+    # When using the index, and not filtering on text contents, we get an
+    # ORM query for index entries, and page through it by keyset (newest
+    # first, with the index PK to break ties), so that any page is quick to
+    # fetch. Otherwise, we have a Python list of tasks or index entries.
     if errors:
         collection = []
     else:
@@ -2069,16 +2073,31 @@ def view_tasks(req: "CamcopsRequest") -> Dict[str, Any]:
             ).all_tasks_or_indexes_or_query
             or []
         )
-    paginator = (
-        SqlalchemyOrmPage if isinstance(collection, Query) else CamcopsPage
-    )
-    page = paginator(
-        collection,
-        page=page_num,
-        items_per_page=rows_per_page,
-        url_maker=PageUrl(req),
-        request=req,
-    )
+    if isinstance(collection, Query):
+        # The table shows index entries (which mimic tasks), so we never
+        # fetch the tasks themselves; we fetch the patients and users for
+        # the page's entries in bulk, rather than one by one.
+        collection = collection.options(
+            selectinload(TaskIndexEntry.patient),
+            selectinload(TaskIndexEntry._adding_user),
+        )
+        page = KeysetPage(
+            collection,
+            key_columns=[
+                TaskIndexEntry.when_created_utc,
+                TaskIndexEntry.index_entry_pk,
+            ],
+            items_per_page=rows_per_page,
+            request=req,
+        )
+    else:
+        page = CamcopsPage(
+            collection,
+            page=page_num,
+            items_per_page=rows_per_page,
+            url_maker=PageUrl(req),
+            request=req,
+        )
     return dict(
         page=page,
         head_form_html=get_head_form_html(req, [tpp_form, refresh_form]),
@@ -2144,7 +2163,7 @@ def serve_task(req: "CamcopsRequest") -> Response:
             ),
             xml_with_header_comments=True,
         )
-        return XmlResponse(task.get_xml(req=req, options=options))
+        return XmlStreamingResponse(task.gen_xml(req=req, options=options))
     elif viewtype == ViewArg.FHIRJSON:  # debugging option
         dummy_recipient = ExportRecipient()
         bundle = task.get_fhir_bundle(
@@ -2331,7 +2350,9 @@ def serve_tracker_or_ctv(req: "CamcopsRequest", as_ctv: bool) -> Response:
         return Response(tracker.get_pdf_html())
     elif viewtype == ViewArg.XML:
         include_comments = req.get_bool_param(ViewParam.INCLUDE_COMMENTS, True)
-        return XmlResponse(tracker.get_xml(include_comments=include_comments))
+        return XmlStreamingResponse(
+            tracker.gen_xml(include_comments=include_comments)
+        )
     else:
         permissible = [ViewArg.HTML, ViewArg.PDF, ViewArg.PDFHTML, ViewArg.XML]
         raise HTTPBadRequest(
@@ -2896,7 +2917,6 @@ def view_audit_trail(req: "CamcopsRequest") -> Response:
     )
     server_pk = req.get_int_param(ViewParam.SERVER_PK, None)
     truncate = req.get_bool_param(ViewParam.TRUNCATE, True)
-    page_num = req.get_int_param(ViewParam.PAGE, 1)
 
     conditions = []  # type: List[str]
 
@@ -2928,17 +2948,24 @@ def view_audit_trail(req: "CamcopsRequest") -> Response:
         q = q.filter(AuditEntry.server_pk == server_pk)
         add_condition(ViewParam.SERVER_PK, server_pk)
 
-    q = q.order_by(desc(AuditEntry.id))
-
     # audit_entries = dbsession.execute(q).fetchall()
     # ... no! That executes to give you row-type results.
     # audit_entries = q.all()
-    # ... yes! But let's paginate, too:
-    page = SqlalchemyOrmPage(
-        query=q,
-        page=page_num,
+    # ... yes! But let's paginate, too. The audit table can be enormous, so
+    # we page by keyset (newest first) rather than by LIMIT/OFFSET, and if
+    # there are no conditions, we estimate the total from the table
+    # statistics rather than counting.
+    if conditions:
+        item_count = None
+    else:
+        item_count = estimate_table_row_count(
+            dbsession, AuditEntry.__tablename__
+        )
+    page = KeysetPage(
+        q,
+        key_columns=[AuditEntry.id],
         items_per_page=rows_per_page,
-        url_maker=PageUrl(req),
+        item_count=item_count,
         request=req,
     )
     return render_to_response(
@@ -4655,6 +4682,9 @@ class EraseTaskLeavingPlaceholderView(EraseTaskBaseView):
         task = cast(Task, self.object)
 
         task.manually_erase(self.request)
+        TaskSummaryEntry.delete_for_tasks(
+            self.request.dbsession, task.tablename, [task.pk]
+        )
 
     def get_success_url(self) -> str:
         return self.request.route_url(
@@ -4678,6 +4708,9 @@ class EraseTaskEntirelyView(EraseTaskBaseView):
         task = cast(Task, self.object)
 
         TaskIndexEntry.unindex_task(task, self.request.dbsession)
+        TaskSummaryEntry.delete_for_tasks(
+            self.request.dbsession, task.tablename, [task.pk]
+        )
         task.delete_entirely(self.request)
 
         _ = self.request.gettext
@@ -4810,6 +4843,9 @@ def delete_patient(req: "CamcopsRequest") -> Response:
             # -----------------------------------------------------------------
             for task in tasks:
                 TaskIndexEntry.unindex_task(task, req.dbsession)
+                TaskSummaryEntry.delete_for_tasks(
+                    req.dbsession, task.tablename, [task.pk]
+                )
                 task.delete_entirely(req)
             # Then patients:
             for p in patient_lineage_instances:
@@ -5421,6 +5457,25 @@ class EditFinalizedPatientView(EditPatientBaseView):
             # Likely in a testing environment!
             return self.request.route_url(Routes.HOME)
 
+    def save_changes(
+        self, appstruct: Dict[str, Any], changes: OrderedDict
+    ) -> None:
+        super().save_changes(appstruct, changes)
+        if changes:
+            # Some task summaries (e.g. whether a task is complete) depend on
+            # patient details.
+            self._store_task_summaries()
+
+    def _store_task_summaries(self) -> None:
+        tasks_by_tablename = {}  # type: Dict[str, List[Task]]
+        for task in self.get_affected_tasks():
+            # noinspection PyProtectedMember
+            if task._current:
+                tasks_by_tablename.setdefault(task.tablename, []).append(task)
+        now = Pendulum.utcnow()
+        for tasks in tasks_by_tablename.values():
+            TaskSummaryEntry.store_for_tasks(self.request, tasks, now)
+
     def get_object(self) -> Any:
         patient = cast(Patient, super().get_object())
 
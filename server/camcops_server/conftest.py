@@ -33,7 +33,7 @@ import configparser
 from io import StringIO
 import os
 import tempfile
-from typing import Generator, TYPE_CHECKING
+from typing import Generator, List, TYPE_CHECKING
 
 import pytest
 from sqlalchemy import event
@@ -57,8 +57,10 @@ if TYPE_CHECKING:
 
     # Should not need to import from _pytest in later versions of pytest
     # https://github.com/pytest-dev/pytest/issues/7469
+    from _pytest.config import Config
     from _pytest.config.argparsing import Parser
     from _pytest.fixtures import FixtureRequest
+    from _pytest.nodes import Item
 
 
 TEST_DATABASE_FILENAME = os.path.join(
@@ -110,6 +112,25 @@ def pytest_addoption(parser: "Parser"):
         help="Log all SQL statments to the default log handler",
     )
 
+    parser.addoption(
+        "--benchmark",
+        action="store_true",
+        dest="benchmark",
+        default=False,
+        help="Run (slow) benchmark tests, marked with @pytest.mark.benchmark",
+    )
+
+
+def pytest_collection_modifyitems(
+    config: "Config", items: List["Item"]
+) -> None:
+    if config.getvalue("benchmark"):
+        return
+    skip_benchmark = pytest.mark.skip(reason="Needs --benchmark to run")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip_benchmark)
+
 
 # noinspection PyUnusedLocal
 def set_sqlite_pragma(dbapi_connection, connection_record):
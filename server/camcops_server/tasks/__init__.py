@@ -23,165 +23,338 @@ camcops_server/tasks/__init__.py
 
 ===============================================================================
 
+**All CamCOPS tasks, imported lazily.**
+
+Importing every task module (with its SQLAlchemy mappings, and libraries such
+as numpy) takes a few seconds. So this package doesn't import its task modules
+itself. Instead, :data:`TASK_MANIFEST` lists every task, by base table name,
+and:
+
+- ``from camcops_server.tasks import Phq9`` (or ``camcops_server.tasks.Phq9``)
+  imports just the module for that task;
+- :func:`get_task_class` does the same, by table name;
+- ``from camcops_server.tasks import *`` (as in
+  :mod:`camcops_server.cc_modules.cc_all_models`) and
+  :func:`import_all_tasks` import all of them.
+
+Importing a single task module (e.g. ``camcops_server.tasks.phq9``) imports
+only that module, too. Anything that needs the list of all tasks (e.g.
+:meth:`camcops_server.cc_modules.cc_task.Task.all_subclasses_by_tablename`)
+imports them all first.
+
+When you add a task, add it to :data:`TASK_MANIFEST`; a unit test checks that
+this is complete.
+
 """
 
-from camcops_server.tasks.ace3 import Ace3, MiniAce
-from camcops_server.tasks.aims import Aims
-from camcops_server.tasks.apeq_cpft_perinatal import APEQCPFTPerinatal
-from camcops_server.tasks.apeqpt import Apeqpt
-from camcops_server.tasks.aq import Aq
-from camcops_server.tasks.asdas import Asdas
-from camcops_server.tasks.audit import Audit, AuditC
-
-from camcops_server.tasks.badls import Badls
-from camcops_server.tasks.basdai import Basdai
-from camcops_server.tasks.bdi import Bdi
-from camcops_server.tasks.bmi import Bmi
-from camcops_server.tasks.bprs import Bprs
-from camcops_server.tasks.bprse import Bprse
-
-from camcops_server.tasks.cage import Cage
-from camcops_server.tasks.cape42 import Cape42
-from camcops_server.tasks.caps import Caps
-from camcops_server.tasks.cardinal_expdetthreshold import (
-    CardinalExpDetThreshold,
-)
-from camcops_server.tasks.cardinal_expectationdetection import (
-    CardinalExpectationDetection,
-)
-from camcops_server.tasks.cbir import CbiR
-from camcops_server.tasks.ceca import CecaQ3
-from camcops_server.tasks.cesd import Cesd
-from camcops_server.tasks.cesdr import Cesdr
-from camcops_server.tasks.cet import Cet
-from camcops_server.tasks.cgi_task import Cgi
-from camcops_server.tasks.cgisch import CgiSch
-from camcops_server.tasks.chit import Chit
-from camcops_server.tasks.cia import Cia
-from camcops_server.tasks.cisr import Cisr
-from camcops_server.tasks.ciwa import Ciwa
-from camcops_server.tasks.contactlog import ContactLog
-from camcops_server.tasks.cope import CopeBrief
-from camcops_server.tasks.core10 import Core10
-from camcops_server.tasks.cpft_lps import (
-    CPFTLPSReferral,
-    CPFTLPSResetResponseClock,
-    CPFTLPSDischarge,
-)
-from camcops_server.tasks.cpft_covid_medical import CpftCovidMedical
-from camcops_server.tasks.cpft_research_preferences import (
-    CpftResearchPreferences,
-)
-
-# todo: # from camcops_server.tasks.ctqsf import Ctqsf
-
-from camcops_server.tasks.dad import Dad
-from camcops_server.tasks.das28 import Das28
-from camcops_server.tasks.dast import Dast
-from camcops_server.tasks.deakin_s1_healthreview import DeakinS1HealthReview
-from camcops_server.tasks.demoquestionnaire import DemoQuestionnaire
-from camcops_server.tasks.demqol import Demqol
-from camcops_server.tasks.diagnosis import DiagnosisIcd9CM, DiagnosisIcd10
-from camcops_server.tasks.distressthermometer import DistressThermometer
-
-from camcops_server.tasks.edeq import Edeq
-from camcops_server.tasks.elixhauserci import ElixhauserCI
-from camcops_server.tasks.epds import Epds
-from camcops_server.tasks.eq5d5l import Eq5d5l
-from camcops_server.tasks.esspri import Esspri
-
-from camcops_server.tasks.factg import Factg
-from camcops_server.tasks.fast import Fast
-from camcops_server.tasks.fft import Fft
-from camcops_server.tasks.frs import Frs
-
-from camcops_server.tasks.gad7 import Gad7
-from camcops_server.tasks.gaf import Gaf
-from camcops_server.tasks.gbo import Gbogres, Gbogpc
-from camcops_server.tasks.gds import Gds15
-from camcops_server.tasks.gmcpq import GMCPQ
-
-from camcops_server.tasks.hads import Hads
-from camcops_server.tasks.hama import Hama
-from camcops_server.tasks.hamd import Hamd
-from camcops_server.tasks.hamd7 import Hamd7
-from camcops_server.tasks.honos import Honos, Honos65, Honosca
-
-from camcops_server.tasks.icd10depressive import Icd10Depressive
-from camcops_server.tasks.icd10manic import Icd10Manic
-from camcops_server.tasks.icd10mixed import Icd10Mixed
-from camcops_server.tasks.icd10schizophrenia import Icd10Schizophrenia
-from camcops_server.tasks.icd10schizotypal import Icd10Schizotypal
-from camcops_server.tasks.icd10specpd import Icd10SpecPD
-from camcops_server.tasks.ided3d import IDED3D
-from camcops_server.tasks.iesr import Iesr
-from camcops_server.tasks.ifs import Ifs
-from camcops_server.tasks.irac import Irac
-from camcops_server.tasks.isaaq10 import Isaaq10
-from camcops_server.tasks.isaaqed import IsaaqEd
-
-from camcops_server.tasks.khandaker_insight_medical import (
-    KhandakerInsightMedical,
-)
-from camcops_server.tasks.khandaker_mojo_medical import KhandakerMojoMedical
-from camcops_server.tasks.khandaker_mojo_medicationtherapy import (
-    KhandakerMojoMedicationTherapy,
-)
-from camcops_server.tasks.kirby_mcq import Kirby
-from camcops_server.tasks.khandaker_mojo_sociodemographics import (
-    KhandakerMojoSociodemographics,
-)
-
-from camcops_server.tasks.lynall_iam_medical import LynallIamMedicalHistory
-from camcops_server.tasks.lynall_iam_life import LynallIamLifeEvents
-
-from camcops_server.tasks.maas import Maas
-from camcops_server.tasks.mast import Mast
-from camcops_server.tasks.mds_updrs import MdsUpdrs
-from camcops_server.tasks.mfi20 import Mfi20
-from camcops_server.tasks.moca import Moca
-
-from camcops_server.tasks.nart import Nart
-from camcops_server.tasks.npiq import NpiQ
-
-from camcops_server.tasks.ors import Ors
-
-from camcops_server.tasks.panss import Panss
-from camcops_server.tasks.paradise24 import Paradise24
-from camcops_server.tasks.pbq import Pbq
-from camcops_server.tasks.pcl5 import Pcl5
-from camcops_server.tasks.pcl import PclC, PclM, PclS
-from camcops_server.tasks.pdss import Pdss
-from camcops_server.tasks.perinatalpoem import PerinatalPoem
-from camcops_server.tasks.photo import Photo, PhotoSequence
-from camcops_server.tasks.phq8 import Phq8
-from camcops_server.tasks.phq9 import Phq9
-from camcops_server.tasks.phq15 import Phq15
-from camcops_server.tasks.progressnote import ProgressNote
-from camcops_server.tasks.pswq import Pswq
-from camcops_server.tasks.psychiatricclerking import PsychiatricClerking
-
-from camcops_server.tasks.qolbasic import QolBasic
-from camcops_server.tasks.qolsg import QolSG
-
-from camcops_server.tasks.rand36 import Rand36
-from camcops_server.tasks.rapid3 import Rapid3
-
-from camcops_server.tasks.service_satisfaction import (
-    PatientSatisfaction,
-    ReferrerSatisfactionGen,
-    ReferrerSatisfactionSpec,
-)
-from camcops_server.tasks.sfmpq2 import Sfmpq2
-from camcops_server.tasks.shaps import Shaps
-from camcops_server.tasks.slums import Slums
-from camcops_server.tasks.smast import Smast
-from camcops_server.tasks.srs import Srs
-from camcops_server.tasks.suppsp import Suppsp
-
-from camcops_server.tasks.wemwbs import Swemwbs, Wemwbs
-from camcops_server.tasks.wsas import Wsas
-
-from camcops_server.tasks.ybocs import Ybocs, YbocsSc
-
-from camcops_server.tasks.zbi import Zbi12
+import sys
+from types import ModuleType
+from typing import Any, Dict, List, NamedTuple, Type, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from camcops_server.cc_modules.cc_task import Task
+
+
+# =============================================================================
+# Task manifest
+# =============================================================================
+
+
+class TaskManifestEntry(NamedTuple):
+    """
+    Where to find a task class, plus some basic information about it that is
+    available without importing it.
+    """
+
+    module: str  # within this package
+    classname: str
+    shortname: str
+
+
+# todo: # "ctqsf": TaskManifestEntry("ctqsf", "Ctqsf", "CTQ-SF"),
+
+TASK_MANIFEST = {
+    # base table name: TaskManifestEntry(...)
+    "ace3": TaskManifestEntry("ace3", "Ace3", "ACE-III"),
+    "aims": TaskManifestEntry("aims", "Aims", "AIMS"),
+    "apeq_cpft_perinatal": TaskManifestEntry(
+        "apeq_cpft_perinatal", "APEQCPFTPerinatal", "APEQ-CPFT-Perinatal"
+    ),
+    "apeqpt": TaskManifestEntry("apeqpt", "Apeqpt", "APEQPT"),
+    "aq": TaskManifestEntry("aq", "Aq", "AQ"),
+    "asdas": TaskManifestEntry("asdas", "Asdas", "ASDAS"),
+    "audit": TaskManifestEntry("audit", "Audit", "AUDIT"),
+    "audit_c": TaskManifestEntry("audit", "AuditC", "AUDIT-C"),
+    "badls": TaskManifestEntry("badls", "Badls", "BADLS"),
+    "basdai": TaskManifestEntry("basdai", "Basdai", "BASDAI"),
+    "bdi": TaskManifestEntry("bdi", "Bdi", "BDI"),
+    "bmi": TaskManifestEntry("bmi", "Bmi", "BMI"),
+    "bprs": TaskManifestEntry("bprs", "Bprs", "BPRS"),
+    "bprse": TaskManifestEntry("bprse", "Bprse", "BPRS-E"),
+    "cage": TaskManifestEntry("cage", "Cage", "CAGE"),
+    "cape42": TaskManifestEntry("cape42", "Cape42", "CAPE-42"),
+    "caps": TaskManifestEntry("caps", "Caps", "CAPS"),
+    "cardinal_expdet": TaskManifestEntry(
+        "cardinal_expectationdetection",
+        "CardinalExpectationDetection",
+        "Cardinal_ExpDet",
+    ),
+    "cardinal_expdetthreshold": TaskManifestEntry(
+        "cardinal_expdetthreshold",
+        "CardinalExpDetThreshold",
+        "Cardinal_ExpDetThreshold",
+    ),
+    "cbir": TaskManifestEntry("cbir", "CbiR", "CBI-R"),
+    "cecaq3": TaskManifestEntry("ceca", "CecaQ3", "CECA-Q3"),
+    "cesd": TaskManifestEntry("cesd", "Cesd", "CESD"),
+    "cesdr": TaskManifestEntry("cesdr", "Cesdr", "CESD-R"),
+    "cet": TaskManifestEntry("cet", "Cet", "CET"),
+    "cgi": TaskManifestEntry("cgi_task", "Cgi", "CGI"),
+    "cgi_i": TaskManifestEntry("cgi_task", "CgiI", "CGI-I"),
+    "cgisch": TaskManifestEntry("cgisch", "CgiSch", "CGI-SCH"),
+    "chit": TaskManifestEntry("chit", "Chit", "CHI-T"),
+    "cia": TaskManifestEntry("cia", "Cia", "CIA"),
+    "cisr": TaskManifestEntry("cisr", "Cisr", "CIS-R"),
+    "ciwa": TaskManifestEntry("ciwa", "Ciwa", "CIWA-Ar"),
+    "contactlog": TaskManifestEntry("contactlog", "ContactLog", "ContactLog"),
+    "cope_brief": TaskManifestEntry("cope", "CopeBrief", "COPE-Brief"),
+    "core10": TaskManifestEntry("core10", "Core10", "CORE-10"),
+    "cpft_covid_medical": TaskManifestEntry(
+        "cpft_covid_medical", "CpftCovidMedical", "CPFT_Covid_Medical"
+    ),
+    "cpft_lps_discharge": TaskManifestEntry(
+        "cpft_lps", "CPFTLPSDischarge", "CPFT_LPS_Discharge"
+    ),
+    "cpft_lps_referral": TaskManifestEntry(
+        "cpft_lps", "CPFTLPSReferral", "CPFT_LPS_Referral"
+    ),
+    "cpft_lps_resetresponseclock": TaskManifestEntry(
+        "cpft_lps", "CPFTLPSResetResponseClock", "CPFT_LPS_ResetResponseClock"
+    ),
+    "cpft_research_preferences": TaskManifestEntry(
+        "cpft_research_preferences",
+        "CpftResearchPreferences",
+        "CPFT_Research_Preferences",
+    ),
+    "dad": TaskManifestEntry("dad", "Dad", "DAD"),
+    "das28": TaskManifestEntry("das28", "Das28", "DAS28"),
+    "dast": TaskManifestEntry("dast", "Dast", "DAST"),
+    "deakin_1_healthreview": TaskManifestEntry(
+        "deakin_s1_healthreview",
+        "DeakinS1HealthReview",
+        "Deakin_S1_HealthReview",
+    ),
+    "demoquestionnaire": TaskManifestEntry(
+        "demoquestionnaire", "DemoQuestionnaire", "Demo"
+    ),
+    "demqol": TaskManifestEntry("demqol", "Demqol", "DEMQOL"),
+    "demqolproxy": TaskManifestEntry("demqol", "DemqolProxy", "DEMQOL-Proxy"),
+    "diagnosis_icd10": TaskManifestEntry(
+        "diagnosis", "DiagnosisIcd10", "Diagnosis_ICD10"
+    ),
+    "diagnosis_icd9cm": TaskManifestEntry(
+        "diagnosis", "DiagnosisIcd9CM", "Diagnosis_ICD9CM"
+    ),
+    "distressthermometer": TaskManifestEntry(
+        "distressthermometer", "DistressThermometer", "Distress Thermometer"
+    ),
+    "edeq": TaskManifestEntry("edeq", "Edeq", "EDE-Q"),
+    "elixhauserci": TaskManifestEntry(
+        "elixhauserci", "ElixhauserCI", "ElixhauserCI"
+    ),
+    "epds": TaskManifestEntry("epds", "Epds", "EPDS"),
+    "eq5d5l": TaskManifestEntry("eq5d5l", "Eq5d5l", "EQ-5D-5L"),
+    "esspri": TaskManifestEntry("esspri", "Esspri", "ESSPRI"),
+    "factg": TaskManifestEntry("factg", "Factg", "FACT-G"),
+    "fast": TaskManifestEntry("fast", "Fast", "FAST"),
+    "fft": TaskManifestEntry("fft", "Fft", "FFT"),
+    "frs": TaskManifestEntry("frs", "Frs", "FRS"),
+    "gad7": TaskManifestEntry("gad7", "Gad7", "GAD-7"),
+    "gaf": TaskManifestEntry("gaf", "Gaf", "GAF"),
+    "gbogpc": TaskManifestEntry("gbo", "Gbogpc", "GBO-GPC"),
+    "gbogras": TaskManifestEntry("gbo", "Gbogras", "GBO-GRaS"),
+    "gbogres": TaskManifestEntry("gbo", "Gbogres", "GBO-GReS"),
+    "gds15": TaskManifestEntry("gds", "Gds15", "GDS-15"),
+    "gmcpq": TaskManifestEntry("gmcpq", "GMCPQ", "GMC-PQ"),
+    "hads": TaskManifestEntry("hads", "Hads", "HADS"),
+    "hads_respondent": TaskManifestEntry(
+        "hads", "HadsRespondent", "HADS-Respondent"
+    ),
+    "hama": TaskManifestEntry("hama", "Hama", "HAM-A"),
+    "hamd": TaskManifestEntry("hamd", "Hamd", "HAM-D"),
+    "hamd7": TaskManifestEntry("hamd7", "Hamd7", "HAMD-7"),
+    "honos": TaskManifestEntry("honos", "Honos", "HoNOS"),
+    "honos65": TaskManifestEntry("honos", "Honos65", "HoNOS 65+"),
+    "honosca": TaskManifestEntry("honos", "Honosca", "HoNOSCA"),
+    "icd10depressive": TaskManifestEntry(
+        "icd10depressive", "Icd10Depressive", "ICD10-DEPR"
+    ),
+    "icd10manic": TaskManifestEntry("icd10manic", "Icd10Manic", "ICD10-MANIC"),
+    "icd10mixed": TaskManifestEntry("icd10mixed", "Icd10Mixed", "ICD10-MIXED"),
+    "icd10schizophrenia": TaskManifestEntry(
+        "icd10schizophrenia", "Icd10Schizophrenia", "ICD10-SZ"
+    ),
+    "icd10schizotypal": TaskManifestEntry(
+        "icd10schizotypal", "Icd10Schizotypal", "ICD10-SZTYP"
+    ),
+    "icd10specpd": TaskManifestEntry("icd10specpd", "Icd10SpecPD", "ICD10-PD"),
+    "ided3d": TaskManifestEntry("ided3d", "IDED3D", "ID/ED-3D"),
+    "iesr": TaskManifestEntry("iesr", "Iesr", "IES-R"),
+    "ifs": TaskManifestEntry("ifs", "Ifs", "IFS"),
+    "irac": TaskManifestEntry("irac", "Irac", "IRAC"),
+    "isaaq10": TaskManifestEntry("isaaq10", "Isaaq10", "ISAAQ-10"),
+    "isaaqed": TaskManifestEntry("isaaqed", "IsaaqEd", "ISAAQ-ED"),
+    "khandaker_1_medicalhistory": TaskManifestEntry(
+        "khandaker_insight_medical",
+        "KhandakerInsightMedical",
+        "Khandaker_Insight_Medical",
+    ),
+    "khandaker_mojo_medical": TaskManifestEntry(
+        "khandaker_mojo_medical",
+        "KhandakerMojoMedical",
+        "Khandaker_MOJO_Medical",
+    ),
+    "khandaker_mojo_medicationtherapy": TaskManifestEntry(
+        "khandaker_mojo_medicationtherapy",
+        "KhandakerMojoMedicationTherapy",
+        "Khandaker_MOJO_MedicationTherapy",
+    ),
+    "khandaker_mojo_sociodemographics": TaskManifestEntry(
+        "khandaker_mojo_sociodemographics",
+        "KhandakerMojoSociodemographics",
+        "Khandaker_MOJO_Sociodemographics",
+    ),
+    "kirby_mcq": TaskManifestEntry("kirby_mcq", "Kirby", "KirbyMCQ"),
+    "lynall_1_iam_medical": TaskManifestEntry(
+        "lynall_iam_medical", "LynallIamMedicalHistory", "Lynall_IAM_Medical"
+    ),
+    "lynall_iam_life": TaskManifestEntry(
+        "lynall_iam_life", "LynallIamLifeEvents", "Lynall_IAM_Life"
+    ),
+    "maas": TaskManifestEntry("maas", "Maas", "MAAS"),
+    "mast": TaskManifestEntry("mast", "Mast", "MAST"),
+    "mds_updrs": TaskManifestEntry("mds_updrs", "MdsUpdrs", "MDS-UPDRS"),
+    "mfi20": TaskManifestEntry("mfi20", "Mfi20", "MFI-20"),
+    "miniace": TaskManifestEntry("ace3", "MiniAce", "Mini-ACE"),
+    "moca": TaskManifestEntry("moca", "Moca", "MoCA"),
+    "nart": TaskManifestEntry("nart", "Nart", "NART"),
+    "npiq": TaskManifestEntry("npiq", "NpiQ", "NPI-Q"),
+    "ors": TaskManifestEntry("ors", "Ors", "ORS"),
+    "panss": TaskManifestEntry("panss", "Panss", "PANSS"),
+    "paradise24": TaskManifestEntry("paradise24", "Paradise24", "PARADISE 24"),
+    "pbq": TaskManifestEntry("pbq", "Pbq", "PBQ"),
+    "pcl5": TaskManifestEntry("pcl5", "Pcl5", "PCL-5"),
+    "pclc": TaskManifestEntry("pcl", "PclC", "PCL-C"),
+    "pclm": TaskManifestEntry("pcl", "PclM", "PCL-M"),
+    "pcls": TaskManifestEntry("pcl", "PclS", "PCL-S"),
+    "pdss": TaskManifestEntry("pdss", "Pdss", "PDSS"),
+    "perinatal_poem": TaskManifestEntry(
+        "perinatalpoem", "PerinatalPoem", "Perinatal-POEM"
+    ),
+    "photo": TaskManifestEntry("photo", "Photo", "Photo"),
+    "photosequence": TaskManifestEntry(
+        "photo", "PhotoSequence", "PhotoSequence"
+    ),
+    "phq15": TaskManifestEntry("phq15", "Phq15", "PHQ-15"),
+    "phq8": TaskManifestEntry("phq8", "Phq8", "PHQ-8"),
+    "phq9": TaskManifestEntry("phq9", "Phq9", "PHQ-9"),
+    "progressnote": TaskManifestEntry(
+        "progressnote", "ProgressNote", "ProgressNote"
+    ),
+    "pswq": TaskManifestEntry("pswq", "Pswq", "PSWQ"),
+    "psychiatricclerking": TaskManifestEntry(
+        "psychiatricclerking", "PsychiatricClerking", "Clerking"
+    ),
+    "pt_satis": TaskManifestEntry(
+        "service_satisfaction", "PatientSatisfaction", "PatientSatisfaction"
+    ),
+    "qolbasic": TaskManifestEntry("qolbasic", "QolBasic", "QoL-Basic"),
+    "qolsg": TaskManifestEntry("qolsg", "QolSG", "QoL-SG"),
+    "rand36": TaskManifestEntry("rand36", "Rand36", "RAND-36"),
+    "rapid3": TaskManifestEntry("rapid3", "Rapid3", "RAPID3"),
+    "ref_satis_gen": TaskManifestEntry(
+        "service_satisfaction",
+        "ReferrerSatisfactionGen",
+        "ReferrerSatisfactionSurvey",
+    ),
+    "ref_satis_spec": TaskManifestEntry(
+        "service_satisfaction",
+        "ReferrerSatisfactionSpec",
+        "ReferrerSatisfactionSpecific",
+    ),
+    "sfmpq2": TaskManifestEntry("sfmpq2", "Sfmpq2", "SF-MPQ2"),
+    "shaps": TaskManifestEntry("shaps", "Shaps", "SHAPS"),
+    "slums": TaskManifestEntry("slums", "Slums", "SLUMS"),
+    "smast": TaskManifestEntry("smast", "Smast", "SMAST"),
+    "srs": TaskManifestEntry("srs", "Srs", "SRS"),
+    "suppsp": TaskManifestEntry("suppsp", "Suppsp", "SUPPS-P"),
+    "swemwbs": TaskManifestEntry("wemwbs", "Swemwbs", "SWEMWBS"),
+    "wemwbs": TaskManifestEntry("wemwbs", "Wemwbs", "WEMWBS"),
+    "wsas": TaskManifestEntry("wsas", "Wsas", "WSAS"),
+    "ybocs": TaskManifestEntry("ybocs", "Ybocs", "Y-BOCS"),
+    "ybocssc": TaskManifestEntry("ybocs", "YbocsSc", "Y-BOCS-SC"),
+    "zbi12": TaskManifestEntry("zbi", "Zbi12", "ZBI-12"),
+}  # type: Dict[str, TaskManifestEntry]
+
+_MODULE_BY_CLASSNAME = {
+    entry.classname: entry.module for entry in TASK_MANIFEST.values()
+}  # type: Dict[str, str]
+
+__all__ = sorted(_MODULE_BY_CLASSNAME.keys())
+
+
+# =============================================================================
+# Lazy imports
+# =============================================================================
+
+
+def _import_task_module(module: str) -> ModuleType:
+    """
+    Imports a task module (by its name within this package), and returns it.
+    """
+    fullname = f"{__name__}.{module}"
+    # Via __import__ rather than importlib.import_module(), so that the import
+    # is shown by "python -X importtime" (and "camcops_server
+    # dev_import_times").
+    __import__(fullname)
+    return sys.modules[fullname]
+
+
+def __getattr__(name: str) -> Any:
+    """
+    Imports task classes on first use (PEP 562).
+    """
+    try:
+        module = _MODULE_BY_CLASSNAME[name]
+    except KeyError:
+        raise AttributeError(
+            f"module {__name__!r} has no attribute {name!r}"
+        ) from None
+    cls = getattr(_import_task_module(module), name)
+    globals()[name] = cls  # so we are not called again for this name
+    return cls
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals().keys()) | set(__all__))
+
+
+def get_task_class(tablename: str) -> Type["Task"]:
+    """
+    Returns the task class with the specified base table name, importing only
+    its own module.
+
+    Raises:
+        :exc:`KeyError` if there is no such task
+    """
+    return __getattr__(TASK_MANIFEST[tablename].classname)
+
+
+def import_all_tasks() -> None:
+    """
+    Imports all task modules, so that all task classes are registered with
+    SQLAlchemy and can be found as subclasses of
+    :class:`camcops_server.cc_modules.cc_task.Task`.
+    """
+    for module in sorted(set(_MODULE_BY_CLASSNAME.values())):
+        _import_task_module(module)
@@ -26,12 +26,19 @@ camcops_server/tasks/cardinal_expectationdetection.py
 """
 
 import logging
-from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TYPE_CHECKING,
+)
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
-from matplotlib.axes import Axes
 import numpy
-import scipy.stats  # http://docs.scipy.org/doc/scipy/reference/stats.html
 from sqlalchemy.sql.schema import Column, ForeignKey
 from sqlalchemy.sql.sqltypes import Float, Integer
 
@@ -66,6 +73,9 @@ from camcops_server.cc_modules.cc_summaryelement import (
 )
 from camcops_server.cc_modules.cc_task import Task, TaskHasPatientMixin
 
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+
 log = BraceStyleAdapter(logging.getLogger(__name__))
 
 
@@ -578,6 +588,8 @@ class CardinalExpectationDetection(TaskHasPatientMixin, Task):
             h = CONVERT_0_P_TO
         if h == 1:
             h = CONVERT_1_P_TO
+        import scipy.stats  # delayed import; slow to import
+
         z_fa = scipy.stats.norm.ppf(fa)
         z_h = scipy.stats.norm.ppf(h)
         if two_alternative_forced_choice:
@@ -620,6 +632,8 @@ class CardinalExpectationDetection(TaskHasPatientMixin, Task):
             fa[fa == 1] = CONVERT_1_P_TO
             h[h == 0] = CONVERT_0_P_TO
             h[h == 1] = CONVERT_1_P_TO
+            import scipy.stats  # delayed import; slow to import
+
             z_fa = scipy.stats.norm.ppf(fa)
             z_h = scipy.stats.norm.ppf(h)
 
@@ -637,7 +651,7 @@ class CardinalExpectationDetection(TaskHasPatientMixin, Task):
     def plot_roc(
         self,
         req: CamcopsRequest,
-        ax: Axes,
+        ax: "Axes",
         count_stimulus: Sequence[int],
         count_nostimulus: Sequence[int],
         show_x_label: bool,
@@ -324,5 +324,6 @@ class Core10Report(AverageScoreReport):
                 minimum=0,
                 maximum=Core10.MAX_SCORE,
                 higher_score_is_better=False,
+                summary_name="clinical_score",
             )
         ]
@@ -27,18 +27,12 @@ camcops_server/tasks/kirby.py
 
 import logging
 import math
-from typing import Dict, List, Optional, Type
+from typing import Dict, List, Optional, Type, TYPE_CHECKING
 
 import numpy as np
 from numpy.linalg.linalg import LinAlgError
-from scipy.stats.mstats import gmean
 from sqlalchemy.sql.schema import Column
 from sqlalchemy.sql.sqltypes import Float, Integer
-import statsmodels.api as sm
-
-# noinspection PyProtectedMember
-from statsmodels.discrete.discrete_model import BinaryResultsWrapper
-from statsmodels.tools.sm_exceptions import PerfectSeparationError
 
 from camcops_server.cc_modules.cc_constants import CssClass
 from camcops_server.cc_modules.cc_db import (
@@ -56,6 +50,10 @@ from camcops_server.cc_modules.cc_sqla_coltypes import (
 from camcops_server.cc_modules.cc_summaryelement import SummaryElement
 from camcops_server.cc_modules.cc_task import Task, TaskHasPatientMixin
 
+if TYPE_CHECKING:
+    # noinspection PyProtectedMember
+    from statsmodels.discrete.discrete_model import BinaryResultsWrapper
+
 log = logging.getLogger(__name__)
 
 
@@ -314,6 +312,8 @@ class Kirby(TaskHasPatientMixin, Task):
         ]
 
         # 3. Take the geometric mean of those good k values.
+        from scipy.stats.mstats import gmean  # delayed import; slow to import
+
         # noinspection PyTypeChecker
         subject_k = gmean(good_k_values)  # type: np.float64
 
@@ -327,6 +327,10 @@ class Kirby(TaskHasPatientMixin, Task):
         """
         if not results:
             return None
+        # Delayed imports; slow to import:
+        import statsmodels.api as sm
+        from statsmodels.tools.sm_exceptions import PerfectSeparationError
+
         n_predictors = 2
         n_observations = len(results)
         x = np.zeros((n_observations, n_predictors))
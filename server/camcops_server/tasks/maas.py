@@ -316,6 +316,7 @@ class MaasReport(AverageScoreReport):
                 minimum=Maas.MIN_GLOBAL,
                 maximum=Maas.MAX_GLOBAL,
                 higher_score_is_better=True,
+                summary_name="global_attachment_score",
             ),
             ScoreDetails(
                 name=_("Quality of attachment score"),
@@ -323,6 +324,7 @@ class MaasReport(AverageScoreReport):
                 minimum=Maas.MIN_QUALITY,
                 maximum=Maas.MAX_QUALITY,
                 higher_score_is_better=True,
+                summary_name="quality_of_attachment_score",
             ),
             ScoreDetails(
                 name=_("Time spent in attachment mode"),
@@ -330,5 +332,6 @@ class MaasReport(AverageScoreReport):
                 minimum=Maas.MIN_TIME,
                 maximum=Maas.MAX_TIME,
                 higher_score_is_better=True,
+                summary_name="time_in_attachment_mode_score",
             ),
         ]
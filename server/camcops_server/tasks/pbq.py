@@ -362,6 +362,7 @@ class PBQReport(AverageScoreReport):
                 minimum=0,
                 maximum=Pbq.MAX_TOTAL,
                 higher_score_is_better=False,
+                summary_name="total_score",
             ),
             ScoreDetails(
                 name=_("Factor 1 score"),
@@ -369,6 +370,7 @@ class PBQReport(AverageScoreReport):
                 minimum=0,
                 maximum=Pbq.FACTOR_1_MAX,
                 higher_score_is_better=False,
+                summary_name="factor_1_score",
             ),
             ScoreDetails(
                 name=_("Factor 2 score"),
@@ -376,6 +378,7 @@ class PBQReport(AverageScoreReport):
                 minimum=0,
                 maximum=Pbq.FACTOR_2_MAX,
                 higher_score_is_better=False,
+                summary_name="factor_2_score",
             ),
             ScoreDetails(
                 name=_("Factor 3 score"),
@@ -383,6 +386,7 @@ class PBQReport(AverageScoreReport):
                 minimum=0,
                 maximum=Pbq.FACTOR_3_MAX,
                 higher_score_is_better=False,
+                summary_name="factor_3_score",
             ),
             ScoreDetails(
                 name=_("Factor 4 score"),
@@ -390,5 +394,6 @@ class PBQReport(AverageScoreReport):
                 minimum=0,
                 maximum=Pbq.FACTOR_4_MAX,
                 higher_score_is_better=False,
+                summary_name="factor_4_score",
             ),
         ]
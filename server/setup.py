@@ -100,6 +100,7 @@ INSTALL_REQUIRES = [
     "pexpect==4.8.0",  # for open_sqlcipher.py
     "pdfkit==1.0.0",  # wkhtmltopdf interface, for PDF generation from HTML
     "phonenumbers==8.12.30",  # phone number parsing, storing and validating
+    "pyarrow==14.0.2",  # Parquet export
     "pycap==1.1.1",  # REDCap integration
     "Pillow==10.3.0",  # used by a dependency; pin for security warnings
     "Pygments==2.15.0",  # Syntax highlighting for introspection/DDL